@@ -49,6 +49,10 @@ architecture Behavioral of ram_data_logger is
     signal data_valid     : std_logic  := '0';
     signal start_write_d1 : std_logic  := '0';
     signal start_write    : std_logic  := '0';
+    
+    signal read_status_d1 : std_logic  := '0';
+    signal read_status_d2 : std_logic  := '0';
+    signal logger_status  : std_logic_vector (32-1 downto 0) := (others => '0');
 begin
 
 
@@ -117,6 +121,12 @@ begin
 
     is_writing <= bWriting;
 
+    -- status word, so that the cpu can poll for the end of an acquisition instead of waiting for a fixed time:
+    -- bits 31..24: x"A5" signature (ram reads are sign-extended 16 bits values, so they can never show this pattern)
+    -- bit 23: writing in progress
+    -- bits 22..0: write address, which is also the number of samples already written during an acquisition
+    logger_status <= x"A5" & bWriting & std_logic_vector(resize(unsigned(write_address), 23));
+
     -- process which handles reading the ram and sending the results to the cpu
     -- also handles the registers reads and writes
     ibus_manager : process (clk) is
@@ -130,6 +140,8 @@ begin
             -- small delay line to match ram latency
             sys_ren_d1 <= sys_ren;
             data_valid <= sys_ren_d1;
+            read_status_d1 <= not sys_addr(20-1);   -- the ram occupies the upper half of the address space
+            read_status_d2 <= read_status_d1;
 
             -- default values:
             start_write <= '0';
@@ -146,8 +158,14 @@ begin
             end if;
 
             -- Read
-            -- we use the full 20 bits address-space for the ram, hence no read registers.
-            sys_ack <= data_valid or sys_wen; sys_rdata <= std_logic_vector(resize(  signed(read_data), 32));
+            -- the ram is read from the upper half of the address space (sys_addr(19) = '1'),
+            -- and the lower half returns the status word, with the same latency as the ram reads.
+            sys_ack <= data_valid or sys_wen;
+            if read_status_d2 = '1' then
+                sys_rdata <= logger_status;
+            else
+                sys_rdata <= std_logic_vector(resize(  signed(read_data), 32));
+            end if;
             ---- read specific registers
             --if sys_addr(20-1 downto 0) = x"000" then
             --    sys_ack <= sys_en; sys_rdata <= std_logic_vector(resize(unsigned(write_address), 32));
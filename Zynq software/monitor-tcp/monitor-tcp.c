@@ -16,6 +16,7 @@
 #include <stdio.h>
 #include <stdlib.h>
 #include <stdbool.h>
+#include <stdint.h>
 #include <string.h>
 
 #include <netinet/in.h>
@@ -42,6 +43,8 @@
 #include <sys/types.h>
 // for waitpid()
 #include <sys/wait.h>
+// for stat() and fchmod()
+#include <sys/stat.h>
 
 
 //#include "scpi-commands.h"
@@ -122,6 +125,129 @@ typedef struct binary_packet_reboot_monitor_t {
 	uint32_t reserved2;	
 } binary_packet_reboot_monitor_t;
 
+// A multi-op packet is this header, followed by number_of_ops register write (binary_packet_write_reg_t)
+// and/or register read (binary_packet_read_reg_t) packets.  The values of all the reads are sent back in a single reply, in order.
+// At most MAX_OPS_MULTI_OP ops are taken as part of the packet: any op beyond that is parsed as a standalone packet,
+// which gives the same register accesses and the same replies, in the same order.
+#define MAX_OPS_MULTI_OP 1024	// should be equal to RP_PLL_device.MAX_OPS_MULTI_OP
+uint32_t magic_bytes_multi_op = 0xABCD123A;
+typedef struct binary_packet_multi_op_t {
+	uint32_t magic_bytes;	// 0xABCD123A
+	uint32_t number_of_ops;
+	uint32_t reserved;
+} binary_packet_multi_op_t;
+
+// Reads number_of_registers consecutive 32 bits registers, starting at start_address.  The values are sent back in a single reply.
+#define MAX_REGISTERS_READ_BLOCK 4096	// should be equal to RP_PLL_device.MAX_REGISTERS_READ_BLOCK
+uint32_t magic_bytes_read_reg_block = 0xABCD123B;
+typedef struct binary_packet_read_reg_block_t {
+	uint32_t magic_bytes;	// 0xABCD123B
+	uint32_t start_address;
+	uint32_t number_of_registers;
+} binary_packet_read_reg_block_t;
+
+// Reads number_of_samples successive 64 bits values from a pair of registers (lsb at lsb_address, msb at lsb_address+4).
+// The two halves are read as close together as possible and the value is re-read if the msb changed in between, so that it can't tear.
+#define MAX_SAMPLES_READ_REG_64 (MAX_REGISTERS_READ_BLOCK/2)	// should be equal to RP_PLL_device.MAX_SAMPLES_READ_REG_64
+uint32_t magic_bytes_read_reg_64 = 0xABCD123C;
+typedef struct binary_packet_read_reg_64_t {
+	uint32_t magic_bytes;	// 0xABCD123C
+	uint32_t lsb_address;
+	uint32_t number_of_samples;
+} binary_packet_read_reg_64_t;
+
+// Starts streaming the content of the FIFO logger on this connection, in blocks of samples_per_block samples.
+// Streaming stops after number_of_blocks blocks (or never if number_of_blocks is 0), or when the client closes the connection,
+// so the client should use a connection dedicated to this.  Each block is a binary_packet_fifo_block_header_t followed by the samples (uint32 each).
+#define MAX_SAMPLES_STREAM_FIFO_BLOCK (1U<<16)	// should be equal to RP_PLL_device.MAX_SAMPLES_STREAM_FIFO_BLOCK
+uint32_t magic_bytes_stream_fifo = 0xABCD123D;
+typedef struct binary_packet_stream_fifo_t {
+	uint32_t magic_bytes;	// 0xABCD123D
+	uint32_t samples_per_block;
+	uint32_t number_of_blocks;
+} binary_packet_stream_fifo_t;
+
+// When the FPGA's fifo fills up, the samples which come in while it is full are dropped.  This is checked after each block:
+// number_of_overflows is then incremented, and the fifo is reset so that the next overflow can be detected too.
+// So when number_of_overflows increases, samples were lost before or within this block, and between this block and the next one (by the reset).
+#define FIFO_LOGGER_DEPTH 2048	// depth of fifo_generator_0 in registers_read.vhd, should be equal to SimulatedMonitorTCPServer.FIFO_DEPTH
+typedef struct binary_packet_fifo_block_header_t {
+	uint32_t magic_bytes;	// 0xABCD123D
+	uint32_t sequence_number;	// increments by one for each block, so that the client can detect missing blocks
+	uint32_t number_of_samples;
+	uint32_t max_fifo_count;	// maximum number of samples that were waiting in the FPGA's fifo since the last reset of the fifo
+	uint32_t number_of_overflows;	// number of times the fifo filled up since the start of the stream
+} binary_packet_fifo_block_header_t;
+
+// Captures samples_per_source samples from each of number_of_sources logger inputs, back-to-back, and sends all the buffers in a single reply.
+// This header is followed by number_of_sources selectors (uint32 each, same values as the mux selector register, see LOGGER_MUX in SuperLaserLand_JD_RP.py).
+// The reply is a binary_packet_snapshot_t with the actual number of sources and samples, followed by the logger status word at the end of each capture
+// (uint32 each, the writing flag is still set if the capture timed out), followed by the samples of each source in turn (int16 each).
+#define MAX_SOURCES_SNAPSHOT 16	// should be equal to RP_PLL_device.MAX_SOURCES_SNAPSHOT
+uint32_t magic_bytes_snapshot = 0xABCD123E;
+typedef struct binary_packet_snapshot_t {
+	uint32_t magic_bytes;	// 0xABCD123E
+	uint32_t number_of_sources;
+	uint32_t samples_per_source;
+} binary_packet_snapshot_t;
+
+// Captures first_sample+number_of_samples samples from one logger input and sends back only statistics of the last number_of_samples,
+// as a binary_packet_capture_stats_reply_t, instead of the samples themselves.
+// first_sample skips the side information at the start of the ADC captures. The samples are read as uint16 if bUnsigned is not 0 (DAC 2), int16 otherwise.
+uint32_t magic_bytes_capture_stats = 0xABCD123F;
+typedef struct binary_packet_capture_stats_t {
+	uint32_t magic_bytes;	// 0xABCD123F
+	uint32_t selector;
+	uint32_t first_sample;
+	uint32_t number_of_samples;
+	uint32_t bUnsigned;
+} binary_packet_capture_stats_t;
+
+typedef struct binary_packet_capture_stats_reply_t {
+	uint32_t magic_bytes;	// 0xABCD123F
+	uint32_t logger_status;	// status word at the end of the capture, the writing flag is still set if the capture timed out
+	uint32_t number_of_samples;	// actual number of samples in the statistics
+	int32_t min;
+	int32_t max;
+	uint32_t max_abs;
+	int64_t sum;
+	uint64_t sum_of_squares;
+} binary_packet_capture_stats_reply_t;
+
+// Same as a write_file packet (binary_packet_write_file_t, then the filename, then the file contents), followed by the CRC-32 of the contents.
+// The contents are written to disk as they are received instead of being buffered, into <filename>.part which is renamed to <filename>
+// only if the CRC-32 matches. The result is sent back as a binary_packet_write_file_reply_t once the file has been synced to disk.
+uint32_t magic_bytes_write_file_acked = 0xABCD1240;
+
+#define WRITE_FILE_OK 0
+#define WRITE_FILE_OPEN_FAILED 1
+#define WRITE_FILE_WRITE_FAILED 2
+#define WRITE_FILE_CHECKSUM_MISMATCH 3
+#define WRITE_FILE_RENAME_FAILED 4
+#define WRITE_FILE_CONNECTION_LOST 5
+typedef struct binary_packet_write_file_reply_t {
+	uint32_t magic_bytes;	// 0xABCD1240
+	uint32_t status;	// one of the WRITE_FILE_xxx values
+	uint32_t bytes_received;
+	uint32_t crc32;	// CRC-32 of the received contents
+} binary_packet_write_file_reply_t;
+
+// Asks for the size and the CRC-32 of a file, so that the client can skip sending a file which is already there.
+// The header is followed by the filename. The reply is a binary_packet_file_info_reply_t.
+uint32_t magic_bytes_file_info = 0xABCD1241;
+typedef struct binary_packet_file_info_t {
+	uint32_t magic_bytes;	// 0xABCD1241
+	uint32_t filename_length;
+	uint32_t reserved;
+} binary_packet_file_info_t;
+
+typedef struct binary_packet_file_info_reply_t {
+	uint32_t magic_bytes;	// 0xABCD1241
+	uint32_t bExists;
+	uint32_t file_size;
+	uint32_t crc32;
+} binary_packet_file_info_reply_t;
+
 
 
 #pragma pack(pop)
@@ -236,6 +362,13 @@ void write_value(unsigned long a_addr, int a_type, unsigned long a_value) {
 #define LOGGER_BASE_ADDR 0x00100000UL
 #define LOGGER_DATA_OFFSET  (1UL<<19)
 #define LOGGER_START_WRITE_OFFSET  0x1004UL
+// status word of ram_data_logger.vhd: signature in bits 31..24, writing flag in bit 23, write address in bits 22..0
+#define LOGGER_STATUS_OFFSET  0x1008UL
+#define LOGGER_STATUS_SIGNATURE  0xA5U
+#define LOGGER_STATUS_WRITING  (1UL<<23)
+#define LOGGER_TIMEOUT_MARGIN_US  100000L	// added to twice the expected duration of a capture before giving up on waiting
+// bus address of the logger's input mux selector, should be equal to SuperLaserLand_JD_RP.BUS_ADDR_MUX_SELECTORS
+#define BUS_ADDR_MUX_SELECTORS  0x3UL
 
 int16_t data_buffer[LOGGER_BUFFER_SIZE];
 
@@ -272,6 +405,37 @@ void acq_GetDataFromLogger(uint32_t* size, int16_t* buffer_in)
     	printf("buffer_in[0] = %hd\n", buffer_in[0]);
 }
 
+// Waits until the logger has written number_of_samples samples, or stopped writing, like SuperLaserLand_JD_RP.wait_for_logger() does.
+// Returns the last status word read. With firmwares which do not provide the status word, we simply sleep for the expected duration of the capture.
+uint32_t acq_WaitForLogger(uint32_t number_of_samples)
+{
+	// the logger writes on data_in_clk_enable, at fs/2 = 62.5 samples per us, plus a 10% margin,
+	// rounded up to the next 1024 samples like wait_for_write() does
+	long expected_us = 1 + (long)(1024*(number_of_samples/1024 + 1))*11*2/(125*10);
+	struct timespec time_start, time_now;
+	uint32_t status = read_value(LOGGER_BASE_ADDR + LOGGER_STATUS_OFFSET);
+
+	if ((status >> 24) != LOGGER_STATUS_SIGNATURE)
+	{
+		usleep(expected_us);
+		return status;
+	}
+
+	clock_gettime(CLOCK_MONOTONIC, &time_start);
+	while ((status & LOGGER_STATUS_WRITING) && (status & (LOGGER_STATUS_WRITING-1)) < number_of_samples)
+	{
+		clock_gettime(CLOCK_MONOTONIC, &time_now);
+		long elapsed_us = (time_now.tv_sec-time_start.tv_sec)*1000000L + (time_now.tv_nsec-time_start.tv_nsec)/1000L;
+		if (elapsed_us > 2*expected_us + LOGGER_TIMEOUT_MARGIN_US)
+		{
+			printf("acq_WaitForLogger(): timed out, %u of %u samples written\n", (uint32_t)(status & (LOGGER_STATUS_WRITING-1)), number_of_samples);
+			break;
+		}
+		status = read_value(LOGGER_BASE_ADDR + LOGGER_STATUS_OFFSET);
+	}
+	return status;
+}
+
 
 // based off acq_GetDataRawV2 in file acq_handler.c
 #define ADC_BUFFER_SIZE             (16*1024)
@@ -521,6 +685,415 @@ skip_control_loop:
 }
 
 
+// Executes all the register writes/reads contained in a multi-op packet, in order.
+// The values of the reads are accumulated and sent back in a single reply.
+void handle_multi_op_packet(int connfd, char * message_buff)
+{
+	struct binary_packet_multi_op_t * pPacketMultiOp = (binary_packet_multi_op_t*) message_buff;
+	uint32_t number_of_ops = MIN(MAX_OPS_MULTI_OP, pPacketMultiOp->number_of_ops);
+	uint32_t number_of_reads = 0;
+	uint32_t read_values[MAX_OPS_MULTI_OP];
+
+	for (uint32_t k = 0; k < number_of_ops; k++)
+	{
+		// write and read packets have the same layout, so we can look at the magic bytes through either type
+		struct binary_packet_write_reg_t * pPacketOp;
+		pPacketOp = (binary_packet_write_reg_t*) (message_buff + sizeof(binary_packet_multi_op_t) + k*sizeof(binary_packet_write_reg_t));
+
+		if (pPacketOp->magic_bytes == magic_bytes_write_reg)
+		{
+			write_value(pPacketOp->write_address, 'w', pPacketOp->write_value);
+		} else if (pPacketOp->magic_bytes == magic_bytes_read_reg) {
+			read_values[number_of_reads++] = read_value(pPacketOp->write_address);
+		} else {
+			if (bVerbose)
+				printf("handle_multi_op_packet(): unknown op 0x%X at index %u, skipped.\n", pPacketOp->magic_bytes, k);
+		}
+	}
+
+	if (bVerbose)
+		printf("handle_multi_op_packet(): executed %u ops, %u reads.\n", number_of_ops, number_of_reads);
+
+	if (number_of_reads > 0)
+		send(connfd, read_values, (size_t)number_of_reads*sizeof(uint32_t), 0);
+}
+
+
+// Reads a block of consecutive registers and sends all the values back in a single reply.
+void handle_read_reg_block_packet(int connfd, char * message_buff)
+{
+	struct binary_packet_read_reg_block_t * pPacketReadRegBlock = (binary_packet_read_reg_block_t*) message_buff;
+	uint32_t number_of_registers = MIN(MAX_REGISTERS_READ_BLOCK, pPacketReadRegBlock->number_of_registers);
+	uint32_t read_values[MAX_REGISTERS_READ_BLOCK];
+
+	for (uint32_t k = 0; k < number_of_registers; k++)
+		read_values[k] = read_value(pPacketReadRegBlock->start_address + 4*k);
+
+	if (bVerbose)
+		printf("handle_read_reg_block_packet(): read %u registers starting at 0x%X.\n", number_of_registers, pPacketReadRegBlock->start_address);
+
+	if (number_of_registers > 0)
+		send(connfd, read_values, (size_t)number_of_registers*sizeof(uint32_t), 0);
+}
+
+
+// Reads a 64 bits value split over two registers, without tearing:
+// reading the lsb latches the matching msb at lsb_address+4 (see registers_read.vhd), so the lsb has to be read first.
+uint64_t read_value_64(uint32_t lsb_address)
+{
+	uint32_t lsb = read_value(lsb_address);
+	uint32_t msb = read_value(lsb_address + 4);
+	return (((uint64_t) msb) << 32) | lsb;
+}
+
+// Reads a number of successive 64 bits samples and sends them all back in a single reply.
+void handle_read_reg_64_packet(int connfd, char * message_buff)
+{
+	struct binary_packet_read_reg_64_t * pPacketReadReg64 = (binary_packet_read_reg_64_t*) message_buff;
+	uint32_t number_of_samples = MIN(MAX_SAMPLES_READ_REG_64, pPacketReadReg64->number_of_samples);
+	uint64_t read_values[MAX_SAMPLES_READ_REG_64];
+
+	for (uint32_t k = 0; k < number_of_samples; k++)
+		read_values[k] = read_value_64(pPacketReadReg64->lsb_address);
+
+	if (bVerbose)
+		printf("handle_read_reg_64_packet(): read %u samples at 0x%X.\n", number_of_samples, pPacketReadReg64->lsb_address);
+
+	if (number_of_samples > 0)
+		send(connfd, read_values, (size_t)number_of_samples*sizeof(uint64_t), 0);
+}
+
+
+// Runs one logger capture per selector, back-to-back, and sends all the buffers back in a single reply (see binary_packet_snapshot_t).
+// The mux selector is left on the last source.
+void handle_snapshot_packet(int connfd, char * message_buff)
+{
+	struct binary_packet_snapshot_t * pPacketSnapshot = (binary_packet_snapshot_t*) message_buff;
+	uint32_t * selectors = (uint32_t*) (message_buff + sizeof(binary_packet_snapshot_t));
+	uint32_t number_of_sources = MIN(MAX_SOURCES_SNAPSHOT, pPacketSnapshot->number_of_sources);
+	uint32_t samples_per_source = MIN(LOGGER_BUFFER_SIZE, pPacketSnapshot->samples_per_source);
+
+	size_t reply_size = sizeof(binary_packet_snapshot_t) + (size_t)number_of_sources*sizeof(uint32_t) + (size_t)number_of_sources*samples_per_source*sizeof(int16_t);
+	char * reply = (char*) malloc(reply_size);
+	if (!reply)
+	{
+		printf("handle_snapshot_packet(): malloc failed to allocate %u bytes\n", (uint32_t)reply_size);
+		return;
+	}
+	struct binary_packet_snapshot_t * pHeader = (binary_packet_snapshot_t*) reply;
+	uint32_t * status = (uint32_t*) (reply + sizeof(binary_packet_snapshot_t));
+	int16_t * samples = (int16_t*) (reply + sizeof(binary_packet_snapshot_t) + (size_t)number_of_sources*sizeof(uint32_t));
+
+	pHeader->magic_bytes = magic_bytes_snapshot;
+	pHeader->number_of_sources = number_of_sources;
+	pHeader->samples_per_source = samples_per_source;
+
+	for (uint32_t k = 0; k < number_of_sources; k++)
+	{
+		uint32_t acq_size = samples_per_source;
+		write_value(FPGA_MEMORY_START + BUS_ADDR_MUX_SELECTORS*4, 'w', selectors[k]);
+		acq_LoggerStartWrite();
+		status[k] = acq_WaitForLogger(samples_per_source);
+		acq_GetDataFromLogger(&acq_size, samples + (size_t)k*samples_per_source);
+	}
+
+	if (bVerbose)
+		printf("handle_snapshot_packet(): captured %u sources, %u samples each.\n", number_of_sources, samples_per_source);
+
+	send(connfd, reply, reply_size, 0);
+	free(reply);
+}
+
+
+// Runs one logger capture and sends back the statistics of the samples (see binary_packet_capture_stats_t).
+// The mux selector is left on this input.
+void handle_capture_stats_packet(int connfd, char * message_buff)
+{
+	struct binary_packet_capture_stats_t * pPacketCaptureStats = (binary_packet_capture_stats_t*) message_buff;
+	struct binary_packet_capture_stats_reply_t reply;
+	uint32_t first_sample = MIN(LOGGER_BUFFER_SIZE, pPacketCaptureStats->first_sample);
+	uint32_t acq_size = MIN(LOGGER_BUFFER_SIZE, first_sample + MIN(LOGGER_BUFFER_SIZE, pPacketCaptureStats->number_of_samples));
+
+	write_value(FPGA_MEMORY_START + BUS_ADDR_MUX_SELECTORS*4, 'w', pPacketCaptureStats->selector);
+	acq_LoggerStartWrite();
+	reply.logger_status = acq_WaitForLogger(acq_size);
+	acq_GetDataFromLogger(&acq_size, data_buffer);
+
+	reply.magic_bytes = magic_bytes_capture_stats;
+	reply.number_of_samples = acq_size - first_sample;
+	reply.min = INT32_MAX;
+	reply.max = INT32_MIN;
+	reply.max_abs = 0;
+	reply.sum = 0;
+	reply.sum_of_squares = 0;
+	for (uint32_t k = first_sample; k < acq_size; k++)
+	{
+		int32_t sample = pPacketCaptureStats->bUnsigned ? (int32_t)(uint16_t)data_buffer[k] : (int32_t)data_buffer[k];
+		reply.min = MIN(reply.min, sample);
+		reply.max = MAX(reply.max, sample);
+		reply.max_abs = MAX(reply.max_abs, (uint32_t)(sample < 0 ? -sample : sample));
+		reply.sum += sample;
+		reply.sum_of_squares += (uint64_t)((int64_t)sample*sample);
+	}
+
+	if (bVerbose)
+		printf("handle_capture_stats_packet(): %u samples from selector %u, sum = %lld\n", reply.number_of_samples, pPacketCaptureStats->selector, (long long)reply.sum);
+
+	send(connfd, &reply, sizeof(reply), 0);
+}
+
+
+// CRC-32 (IEEE 802.3 polynomial, same as zlib's crc32() and Python's zlib.crc32()), used to check the files sent by the client.
+// Start with crc = 0, and pass the previous result to continue over the next chunk of data.
+uint32_t crc32_table[256];
+bool bCrc32TableReady = false;
+uint32_t crc32_update(uint32_t crc, const void * data, size_t length)
+{
+	const uint8_t * bytes = (const uint8_t *) data;
+	if (!bCrc32TableReady)
+	{
+		for (uint32_t k = 0; k < 256; k++)
+		{
+			uint32_t c = k;
+			for (int bit = 0; bit < 8; bit++)
+				c = (c & 1) ? (0xEDB88320U ^ (c >> 1)) : (c >> 1);
+			crc32_table[k] = c;
+		}
+		bCrc32TableReady = true;
+	}
+	crc = ~crc;
+	for (size_t k = 0; k < length; k++)
+		crc = crc32_table[(crc ^ bytes[k]) & 0xFF] ^ (crc >> 8);
+	return ~crc;
+}
+
+// Copies the filename which follows a packet header into a new \0-terminated string, which must be freed by the caller
+char * copy_filename(char * message_buff, size_t header_size, uint32_t filename_length)
+{
+	char * strFileName = (char*) malloc((filename_length+1)*sizeof(char));	// the +1 is for the \0 character
+	if (strFileName)
+	{
+		memcpy((void*) strFileName, (void*)(message_buff+header_size), filename_length);
+		strFileName[filename_length] = '\0';
+	}
+	return strFileName;
+}
+
+// Sends back the size and the CRC-32 of a file, see binary_packet_file_info_t. The whole packet (header and filename) must be in message_buff.
+void handle_file_info_packet(int connfd, char * message_buff)
+{
+	struct binary_packet_file_info_t * pPacketFileInfo = (binary_packet_file_info_t*) message_buff;
+	struct binary_packet_file_info_reply_t reply;
+	char chunk[64*1024];
+	size_t chunk_size;
+
+	reply.magic_bytes = magic_bytes_file_info;
+	reply.bExists = 0;
+	reply.file_size = 0;
+	reply.crc32 = 0;
+
+	char * strFileName = copy_filename(message_buff, sizeof(binary_packet_file_info_t), pPacketFileInfo->filename_length);
+	FILE * file_pointer = strFileName ? fopen(strFileName, "rb") : NULL;
+	if (file_pointer)
+	{
+		reply.bExists = 1;
+		while ((chunk_size = fread(chunk, 1, sizeof(chunk), file_pointer)) > 0)
+		{
+			reply.crc32 = crc32_update(reply.crc32, chunk, chunk_size);
+			reply.file_size += chunk_size;
+		}
+		fclose(file_pointer);
+	}
+
+	if (bVerbose)
+		printf("handle_file_info_packet(): %s: bExists = %u, file_size = %u, crc32 = 0x%08x\n", strFileName ? strFileName : "", reply.bExists, reply.file_size, reply.crc32);
+
+	free(strFileName);
+	send(connfd, &reply, sizeof(reply), 0);
+}
+
+// Receives the contents of a write_file_acked packet (see magic_bytes_write_file_acked) and writes them to disk as they arrive.
+// message_buff must contain the header and the filename. The first buffered_bytes bytes which follow them in message_buff
+// have already been received, the rest of the contents and the CRC-32 are received directly from the socket.
+// Returns the number of buffered bytes which belonged to this packet.
+size_t receive_file(int connfd, char * message_buff, size_t buffered_bytes)
+{
+	struct binary_packet_write_file_t * pPacketWriteFile = (binary_packet_write_file_t*) message_buff;
+	struct binary_packet_write_file_reply_t reply;
+	char * buffered = message_buff + sizeof(binary_packet_write_file_t) + pPacketWriteFile->filename_length;
+	char chunk[64*1024];
+	size_t used = 0;
+	uint32_t remaining = pPacketWriteFile->file_size;
+	uint32_t expected_crc32 = 0;
+	size_t crc32_bytes = 0;
+	ssize_t read_size;
+
+	reply.magic_bytes = magic_bytes_write_file_acked;
+	reply.status = WRITE_FILE_OK;
+	reply.bytes_received = 0;
+	reply.crc32 = 0;
+
+	char * strFileName = copy_filename(message_buff, sizeof(binary_packet_write_file_t), pPacketWriteFile->filename_length);
+	char * strTempFileName = strFileName ? (char*) malloc(strlen(strFileName) + strlen(".part") + 1) : NULL;
+	FILE * file_pointer = NULL;
+	if (strTempFileName)
+	{
+		sprintf(strTempFileName, "%s.part", strFileName);
+		file_pointer = fopen(strTempFileName, "wb");
+	}
+	if (!file_pointer)
+	{
+		// we still have to drain the contents from the socket
+		reply.status = WRITE_FILE_OPEN_FAILED;
+		if (bVerbose)
+			printf("receive_file(): Error opening file %s.part. No contents written.\n", strFileName ? strFileName : "");
+	}
+
+	// contents:
+	while (remaining > 0)
+	{
+		char * data;
+		size_t data_size;
+		if (used < buffered_bytes)
+		{
+			data = buffered + used;
+			data_size = MIN(remaining, buffered_bytes - used);
+			used += data_size;
+		} else {
+			read_size = recv(connfd, chunk, MIN(remaining, sizeof(chunk)), 0);
+			if (read_size <= 0)
+			{
+				reply.status = WRITE_FILE_CONNECTION_LOST;
+				break;
+			}
+			data = chunk;
+			data_size = (size_t) read_size;
+		}
+		reply.crc32 = crc32_update(reply.crc32, data, data_size);
+		reply.bytes_received += data_size;
+		remaining -= data_size;
+		if (file_pointer && reply.status == WRITE_FILE_OK && fwrite(data, 1, data_size, file_pointer) != data_size)
+			reply.status = WRITE_FILE_WRITE_FAILED;
+	}
+
+	// CRC-32 of the contents, computed by the client:
+	while (reply.status != WRITE_FILE_CONNECTION_LOST && crc32_bytes < sizeof(expected_crc32))
+	{
+		if (used < buffered_bytes)
+		{
+			size_t data_size = MIN(sizeof(expected_crc32) - crc32_bytes, buffered_bytes - used);
+			memcpy((char*) &expected_crc32 + crc32_bytes, buffered + used, data_size);
+			used += data_size;
+			crc32_bytes += data_size;
+		} else {
+			read_size = recv(connfd, (char*) &expected_crc32 + crc32_bytes, sizeof(expected_crc32) - crc32_bytes, 0);
+			if (read_size <= 0)
+				reply.status = WRITE_FILE_CONNECTION_LOST;
+			else
+				crc32_bytes += (size_t) read_size;
+		}
+	}
+
+	if (file_pointer)
+	{
+		// the file replaces strFileName with its permissions, otherwise an executable like /opt/monitor-tcp would lose its x bits
+		struct stat target_stat;
+		if (reply.status == WRITE_FILE_OK && stat(strFileName, &target_stat) == 0 && fchmod(fileno(file_pointer), target_stat.st_mode & 07777) != 0)
+			reply.status = WRITE_FILE_WRITE_FAILED;
+
+		// make sure that the contents are on disk before we acknowledge them
+		if (fflush(file_pointer) != 0 || fsync(fileno(file_pointer)) != 0)
+			reply.status = (reply.status == WRITE_FILE_OK) ? WRITE_FILE_WRITE_FAILED : reply.status;
+		fclose(file_pointer);
+
+		if (reply.status == WRITE_FILE_OK && reply.crc32 != expected_crc32)
+			reply.status = WRITE_FILE_CHECKSUM_MISMATCH;
+		if (reply.status == WRITE_FILE_OK && rename(strTempFileName, strFileName) != 0)
+			reply.status = WRITE_FILE_RENAME_FAILED;
+		if (reply.status != WRITE_FILE_OK)
+			remove(strTempFileName);
+	}
+
+	if (bVerbose)
+		printf("receive_file(): %s: %u bytes received, crc32 = 0x%08x (expected 0x%08x), status = %u\n", strFileName ? strFileName : "", reply.bytes_received, reply.crc32, expected_crc32, reply.status);
+
+	free(strTempFileName);
+	free(strFileName);
+	if (reply.status != WRITE_FILE_CONNECTION_LOST)
+		send(connfd, &reply, sizeof(reply), 0);
+	return used;
+}
+
+
+// Same fifo reading logic as continuous_fifo_read(), except that the samples are sent to the client block by block instead of being accumulated.
+void stream_fifo(int connfd, uint32_t samples_per_block, uint32_t number_of_blocks)
+{
+	const volatile uint32_t* fifo_buffer = (uint32_t*)((char*)map_base + 4*0x00039U);
+	uint32_t iChunk, iOut;
+	uint32_t sequence_number;
+	uint32_t number_of_overflows = 0;
+
+	// we read the fifo 10 samples at a time, so the block size has to be a multiple of 10:
+	samples_per_block = MIN(MAX_SAMPLES_STREAM_FIFO_BLOCK, samples_per_block);
+	samples_per_block = MAX(10, samples_per_block - samples_per_block % 10);
+
+	size_t block_size = sizeof(binary_packet_fifo_block_header_t) + (size_t)samples_per_block*sizeof(uint32_t);
+	char * block = (char*) malloc(block_size);
+	if (!block)
+	{
+		printf("stream_fifo(): malloc failed to allocate %u samples\n", samples_per_block);
+		return;
+	}
+	struct binary_packet_fifo_block_header_t * pHeader = (binary_packet_fifo_block_header_t*) block;
+	uint32_t * samples = (uint32_t*) (block + sizeof(binary_packet_fifo_block_header_t));
+
+	if (bVerbose)
+		printf("stream_fifo(): starting, samples_per_block = %u, number_of_blocks = %u\n", samples_per_block, number_of_blocks);
+
+	// start the reading process by setting a few registers:
+	write_value(FPGA_MEMORY_START + 0x42*4, 'w', 1);	//    assert fifo synchronous reset (and also resets max_fifo_count)
+	write_value(FPGA_MEMORY_START + 0x42*4, 'w', 0);	// de-assert fifo synchronous reset
+	write_value(FPGA_MEMORY_START + 0x41*4, 'w', 1);	// bWritesEnabled = 1
+
+	for (sequence_number = 0; number_of_blocks == 0 || sequence_number < number_of_blocks; sequence_number++)
+	{
+		iOut = 0;
+		while (iOut < samples_per_block) {
+			// wait until fifo is not empty
+			while (read_value(FPGA_MEMORY_START + 0x38*4)) ;
+			// "not empty" in this case means at least 10 samples in the fifo
+			for (iChunk=0; iChunk<10; iChunk++)
+				samples[iOut++] = (*fifo_buffer);
+		}
+
+		pHeader->magic_bytes = magic_bytes_stream_fifo;
+		pHeader->sequence_number = sequence_number;
+		pHeader->number_of_samples = samples_per_block;
+		pHeader->max_fifo_count = read_value(FPGA_MEMORY_START + 0x40*4);
+		// data_count is only 11 bits wide, so it can't show a full fifo: reaching FIFO_LOGGER_DEPTH-1 is taken as an overflow
+		if (pHeader->max_fifo_count >= FIFO_LOGGER_DEPTH-1)
+		{
+			number_of_overflows++;
+			write_value(FPGA_MEMORY_START + 0x42*4, 'w', 1);	//    assert fifo synchronous reset (and also resets max_fifo_count)
+			write_value(FPGA_MEMORY_START + 0x42*4, 'w', 0);	// de-assert fifo synchronous reset
+			if (bVerbose)
+				printf("stream_fifo(): fifo overflow, samples dropped up to block %u\n", sequence_number);
+		}
+		pHeader->number_of_overflows = number_of_overflows;
+
+		// this fails as soon as the client closes the connection, which is how it normally stops the stream:
+		if (send(connfd, block, block_size, MSG_NOSIGNAL) < 0)
+			break;
+	}
+	write_value(FPGA_MEMORY_START + 0x41*4, 'w', 0);	// bWritesEnabled = 0
+
+	if (bVerbose)
+		printf("stream_fifo(): stopped after %u blocks, %u fifo overflows\n", sequence_number, number_of_overflows);
+
+	free(block);
+}
+
+
 /////////////////////////////////////////////////////
 // Starting here is the code for the tcp server
 /////////////////////////////////////////////////////
@@ -748,6 +1321,12 @@ static int handleConnection(int connfd) {
     struct binary_packet_shell_command_t * pPacketShellCommand;
     // Variables for the "reboot" message
     bool bReboot = false;
+    // Variables for the "multi-op" message
+    bool bHaveMultiOpHeader = false;
+    struct binary_packet_multi_op_t * pPacketMultiOp;
+    // Variables for the "snapshot" message
+    bool bHaveSnapshotHeader = false;
+    struct binary_packet_snapshot_t * pPacketSnapshot;
 
     
 
@@ -866,6 +1445,126 @@ static int handleConnection(int connfd) {
 
 		        	}
 	        	////////////////////////////////////////////////////////////
+	        	// Read a block of consecutive 32 bits FPGA registers
+	        	} else if (message_magic_bytes == magic_bytes_read_reg_block)
+	        	{
+	        		iRequiredBytes = sizeof(binary_packet_read_reg_block_t);
+	        		if (msg_end >= iRequiredBytes)
+	        		{
+		        		if (bVerbose)
+		        			printf("Received a register block read packet.\n");
+
+		        		handle_read_reg_block_packet(connfd, message_buff);
+
+		        		// reset our message parsing state variables
+		        		bytes_consumed = sizeof(binary_packet_read_reg_block_t);
+		        		bHaveMagicBytes = false;
+		        		iRequiredBytes = sizeof(message_magic_bytes);
+
+		        	} else {
+		        		if (bVerbose)
+		        			printf("Received a register block read packet, but we have not received the full packet yet.\n");
+
+		        	}
+	        	////////////////////////////////////////////////////////////
+	        	// Read 64 bits values split over a pair of FPGA registers
+	        	} else if (message_magic_bytes == magic_bytes_read_reg_64)
+	        	{
+	        		iRequiredBytes = sizeof(binary_packet_read_reg_64_t);
+	        		if (msg_end >= iRequiredBytes)
+	        		{
+		        		if (bVerbose)
+		        			printf("Received a 64 bits register read packet.\n");
+
+		        		handle_read_reg_64_packet(connfd, message_buff);
+
+		        		// reset our message parsing state variables
+		        		bytes_consumed = sizeof(binary_packet_read_reg_64_t);
+		        		bHaveMagicBytes = false;
+		        		iRequiredBytes = sizeof(message_magic_bytes);
+
+		        	} else {
+		        		if (bVerbose)
+		        			printf("Received a 64 bits register read packet, but we have not received the full packet yet.\n");
+
+		        	}
+	        	////////////////////////////////////////////////////////////
+	        	// Stream the FIFO logger's content, this only returns when the stream is over
+	        	} else if (message_magic_bytes == magic_bytes_stream_fifo)
+	        	{
+	        		iRequiredBytes = sizeof(binary_packet_stream_fifo_t);
+	        		if (msg_end >= iRequiredBytes)
+	        		{
+		        		struct binary_packet_stream_fifo_t * pPacketStreamFifo;
+		        		pPacketStreamFifo = (binary_packet_stream_fifo_t*) message_buff;
+
+		        		if (bVerbose)
+		        			printf("Received a fifo stream packet.\n");
+
+		        		stream_fifo(connfd, pPacketStreamFifo->samples_per_block, pPacketStreamFifo->number_of_blocks);
+
+		        		// reset our message parsing state variables
+		        		bytes_consumed = sizeof(binary_packet_stream_fifo_t);
+		        		bHaveMagicBytes = false;
+		        		iRequiredBytes = sizeof(message_magic_bytes);
+
+		        	} else {
+		        		if (bVerbose)
+		        			printf("Received a fifo stream packet, but we have not received the full packet yet.\n");
+
+		        	}
+	        	////////////////////////////////////////////////////////////
+	        	// Capture several logger inputs back-to-back and send all the buffers in a single reply
+	        	} else if (message_magic_bytes == magic_bytes_snapshot)
+	        	{
+	        		// we need the header before we can figure out the size of this message.
+	        		if (!bHaveSnapshotHeader)
+	        		{
+	        			iRequiredBytes = sizeof(binary_packet_snapshot_t);
+	        			if (msg_end >= iRequiredBytes) {
+	        				bHaveSnapshotHeader = true;
+			        		pPacketSnapshot = (binary_packet_snapshot_t*) message_buff;
+			        		if (bVerbose)
+			        			printf("pPacketSnapshot->number_of_sources = %u\n", pPacketSnapshot->number_of_sources);
+			        		// handle_snapshot_packet() only uses MAX_SOURCES_SNAPSHOT selectors, the rest are parsed as standalone packets:
+			        		iRequiredBytes = sizeof(binary_packet_snapshot_t) + MIN(MAX_SOURCES_SNAPSHOT, pPacketSnapshot->number_of_sources)*sizeof(uint32_t);
+	        			}
+	        		}
+	        		if (bHaveSnapshotHeader) {
+	        			// we know how long the total message needs to be, so we just wait to have received everything.
+	        			if (msg_end >= iRequiredBytes) {
+	        				handle_snapshot_packet(connfd, message_buff);
+
+			        		// reset our message parsing state variables
+			        		bHaveSnapshotHeader = false;
+			        		bytes_consumed = iRequiredBytes;
+			        		bHaveMagicBytes = false;
+			        		iRequiredBytes = sizeof(message_magic_bytes);
+	        			}
+	        		}
+	        	////////////////////////////////////////////////////////////
+	        	// Capture one logger input and send back only the statistics of the samples
+	        	} else if (message_magic_bytes == magic_bytes_capture_stats)
+	        	{
+	        		iRequiredBytes = sizeof(binary_packet_capture_stats_t);
+	        		if (msg_end >= iRequiredBytes)
+	        		{
+		        		if (bVerbose)
+		        			printf("Received a capture stats packet.\n");
+
+		        		handle_capture_stats_packet(connfd, message_buff);
+
+		        		// reset our message parsing state variables
+		        		bytes_consumed = sizeof(binary_packet_capture_stats_t);
+		        		bHaveMagicBytes = false;
+		        		iRequiredBytes = sizeof(message_magic_bytes);
+
+		        	} else {
+		        		if (bVerbose)
+		        			printf("Received a capture stats packet, but we have not received the full packet yet.\n");
+
+		        	}
+	        	////////////////////////////////////////////////////////////
 	        	// Read a buffer of continuous value from an ADC input
 	        	} else if (message_magic_bytes == magic_bytes_read_buffer) {
 
@@ -1061,7 +1760,56 @@ static int handleConnection(int connfd) {
 
 
 
-	        	}	// else if (message_magic_bytes == magic_bytes_write_file) 
+	        	}	// else if (message_magic_bytes == magic_bytes_write_file)
+
+
+	        	////////////////////////////////////////////////////////////
+	        	// Write a file to the filesystem, streaming it to disk, and acknowledge it once its CRC-32 has been checked
+	        	else if (message_magic_bytes == magic_bytes_write_file_acked)
+	        	{
+	        		iRequiredBytes = sizeof(binary_packet_write_file_t);
+	        		if (msg_end >= iRequiredBytes)
+	        		{
+		        		pPacketWriteFile = (binary_packet_write_file_t*) message_buff;
+		        		iRequiredBytes = sizeof(binary_packet_write_file_t) + pPacketWriteFile->filename_length;
+		        		if (msg_end >= iRequiredBytes)
+		        		{
+			        		if (bVerbose)
+			        			printf("Received a write file (acked) header, file_size = %u.\n", pPacketWriteFile->file_size);
+
+			        		// the contents don't go through message_buff: whatever was already received is passed along, and the rest is read from the socket
+			        		bytes_consumed = iRequiredBytes + receive_file(connfd, message_buff, msg_end - iRequiredBytes);
+
+			        		// reset our message parsing state variables
+			        		bHaveMagicBytes = false;
+			        		iRequiredBytes = sizeof(message_magic_bytes);
+			        	}
+		        	}
+
+	        	}
+	        	////////////////////////////////////////////////////////////
+	        	// Send back the size and CRC-32 of a file
+	        	else if (message_magic_bytes == magic_bytes_file_info)
+	        	{
+	        		iRequiredBytes = sizeof(binary_packet_file_info_t);
+	        		if (msg_end >= iRequiredBytes)
+	        		{
+		        		iRequiredBytes = sizeof(binary_packet_file_info_t) + ((binary_packet_file_info_t*) message_buff)->filename_length;
+		        		if (msg_end >= iRequiredBytes)
+		        		{
+			        		if (bVerbose)
+			        			printf("Received a file info packet.\n");
+
+			        		handle_file_info_packet(connfd, message_buff);
+
+			        		// reset our message parsing state variables
+			        		bytes_consumed = iRequiredBytes;
+			        		bHaveMagicBytes = false;
+			        		iRequiredBytes = sizeof(message_magic_bytes);
+			        	}
+		        	}
+
+	        	}
 
 
 	        	////////////////////////////////////////////////////////////
@@ -1165,6 +1913,36 @@ static int handleConnection(int connfd) {
 
 		        } // else if (message_magic_bytes == magic_bytes_reboot_monitor)
 
+	        	////////////////////////////////////////////////////////////
+	        	// Execute a batch of register writes/reads, sent as a single packet
+	        	else if (message_magic_bytes == magic_bytes_multi_op)
+	        	{
+	        		// we need the header before we can figure out the size of this message.
+	        		if (!bHaveMultiOpHeader)
+	        		{
+	        			iRequiredBytes = sizeof(binary_packet_multi_op_t);
+	        			if (msg_end >= iRequiredBytes) {
+	        				bHaveMultiOpHeader = true;
+			        		pPacketMultiOp = (binary_packet_multi_op_t*) message_buff;
+			        		if (bVerbose)
+			        			printf("pPacketMultiOp->number_of_ops = %u\n", pPacketMultiOp->number_of_ops);
+			        		iRequiredBytes = sizeof(binary_packet_multi_op_t) + MIN(MAX_OPS_MULTI_OP, pPacketMultiOp->number_of_ops)*sizeof(binary_packet_write_reg_t);
+	        			}
+	        		}
+	        		if (bHaveMultiOpHeader) {
+	        			// we know how long the total message needs to be, so we just wait to have received everything.
+	        			if (msg_end >= iRequiredBytes) {
+	        				handle_multi_op_packet(connfd, message_buff);
+
+			        		// reset our message parsing state variables
+			        		bHaveMultiOpHeader = false;
+			        		bytes_consumed = iRequiredBytes;
+			        		bHaveMagicBytes = false;
+			        		iRequiredBytes = sizeof(message_magic_bytes);
+	        			}
+	        		}
+	        	} // else if (message_magic_bytes == magic_bytes_multi_op)
+
 	        	else {	// magic bytes didn't match any known packet type
 
 	        		if (bVerbose)
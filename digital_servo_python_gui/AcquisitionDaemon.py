@@ -0,0 +1,454 @@
+# -*- coding: utf-8 -*-
+"""
+Headless acquisition daemon: owns the connection to one Red Pitaya and publishes its data to any number of local subscribers,
+so that analysis scripts don't have to stop the GUI, or open a second connection which fights over the logger.
+
+Each datum is read from the box once, serialized once, and sent to every subscriber which asked for it:
+    counters    the zero-deadtime counter samples (only when the box has a new one)
+    dacs        the current values of the three DACs, in counts
+    status      the status flags and the state of each lock, or the connection error when the box is unreachable
+    captures    the logger captures, as they are taken on behalf of any subscriber
+The box is polled every period seconds (see DeviceManager.ManagedDevice), and reconnected in the background if it goes away.
+Logger captures are requested with the 'capture' op: identical requests which arrive before the capture is taken are served by a single capture.
+The GUI can be one more subscriber: see controller.strAcquisitionDaemon in XEM_GUI3.py and SuperLaserLand_JD_RP.use_acquisition_daemon().
+
+Protocol: each message in either direction is a frame made of the lengths of its header and payload ('=II'), a JSON header (utf-8),
+and an optional binary payload. The requests are {'op': 'subscribe', 'topics': [...]}, {'op': 'unsubscribe', 'topics': [...]},
+{'op': 'capture', 'id': ..., 'input': 'ADC0', 'N': 4096} and {'op': 'info'}. Every message from the daemon has a 'topic' field;
+the reply to a capture request has topic 'capture', the id of the request, and the samples as a float64 payload.
+A capture request with 'bRaw': True gets the raw int16 samples of the logger instead, for subscribers which decode them with their own settings.
+AcquisitionClient implements the subscriber side.
+
+    python AcquisitionDaemon.py 192.168.0.150             # then connect the subscribers to 127.0.0.1:5100
+    python AcquisitionDaemon.py --mock                    # against a local MonitorTCPMockServer
+
+"""
+from __future__ import print_function
+import sys
+import time
+import json
+import queue
+import socket
+import struct
+import argparse
+import threading
+import collections
+import logging
+
+import numpy as np
+
+from RP_PLL import RP_PLL_device, CommsError, sock_recvall_into
+from DeviceManager import ManagedDevice, get_lock_state, parse_target
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 5100
+TOPICS = ('counters', 'dacs', 'status', 'captures')
+
+FRAME_HEADER_FORMAT = '=II'     # lengths of the JSON header and of the payload
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_HEADER_FORMAT)
+
+
+#######################################################
+# Framing, shared by the daemon and the client
+#######################################################
+
+def encode_message(header, payload=b''):
+    header_bytes = json.dumps(header).encode('utf-8')
+    return struct.pack(FRAME_HEADER_FORMAT, len(header_bytes), len(payload)) + header_bytes + payload
+
+# Returns (header, payload), or None if the connection was closed
+def receive_message(sock):
+    frame_header = bytearray(FRAME_HEADER_SIZE)
+    if sock_recvall_into(sock, memoryview(frame_header)) is None:
+        return None
+    (header_length, payload_length) = struct.unpack(FRAME_HEADER_FORMAT, frame_header)
+    data = bytearray(header_length + payload_length)
+    if sock_recvall_into(sock, memoryview(data)) is None:
+        return None
+    return (json.loads(data[:header_length].decode('utf-8')), bytes(data[header_length:]))
+
+
+#######################################################
+# Daemon
+#######################################################
+
+# One connected subscriber. Its messages go through a bounded queue, emptied by a thread of its own,
+# so that a slow subscriber loses messages (counted in number_of_dropped_messages) instead of holding up the acquisition.
+class Subscriber():
+
+    MAX_QUEUED_MESSAGES = 1000
+
+    def __init__(self, daemon, sock, address):
+        self.daemon = daemon
+        self.sock = sock
+        self.address = address
+        self.topics = set()
+        self.queue = queue.Queue(maxsize=self.MAX_QUEUED_MESSAGES)
+        self.number_of_dropped_messages = 0
+        self.bClosed = False
+        threading.Thread(target=self.run_reader, daemon=True).start()
+        threading.Thread(target=self.run_writer, daemon=True).start()
+
+    def post(self, frame):
+        try:
+            self.queue.put_nowait(frame)
+        except queue.Full:
+            self.number_of_dropped_messages += 1
+
+    def run_reader(self):
+        try:
+            while True:
+                message = receive_message(self.sock)
+                if message is None:
+                    break
+                self.daemon.handle_request(self, message[0])
+        except (OSError, ValueError) as e:
+            logger.warning('Red_Pitaya_GUI:AcquisitionDaemon: dropping subscriber %s:%d (%s)' % (self.address[0], self.address[1], e))
+        self.close()
+
+    def run_writer(self):
+        while not self.bClosed:
+            frame = self.queue.get()
+            if frame is None:
+                break
+            try:
+                self.sock.sendall(frame)
+            except OSError:
+                break
+        self.close()
+
+    def close(self):
+        if self.bClosed:
+            return
+        self.bClosed = True
+        try:
+            self.queue.put_nowait(None)   # wakes up the writer
+        except queue.Full:
+            pass
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        self.daemon.remove_subscriber(self)
+
+
+class AcquisitionDaemon():
+
+    def __init__(self, BOX_HOST, BOX_PORT=5000, HOST='127.0.0.1', PORT=DEFAULT_PORT, period=0.1):
+        self.device = ManagedDevice(BOX_HOST, BOX_PORT)
+        self.period = period
+
+        self.lock = threading.Lock()    # protects the subscribers and the pending captures
+        self.subscribers = []
+        self.pending_captures = collections.OrderedDict()   # (input, N) -> list of (subscriber, request id)
+        self.number_of_polls = 0
+        self.number_of_captures = 0
+
+        self.server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_sock.bind((HOST, PORT))
+        self.server_sock.listen(8)
+        (self.HOST, self.PORT) = self.server_sock.getsockname()
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+
+        self.acquisition_thread = None
+        self.stop_event = threading.Event()
+
+    # Starts the acquisition thread. Without it, run_cycle() has to be called explicitly.
+    def start(self):
+        self.stop_event.clear()
+        self.acquisition_thread = threading.Thread(target=self.run_acquisition, daemon=True)
+        self.acquisition_thread.start()
+
+    def close(self):
+        self.stop_event.set()
+        if self.acquisition_thread is not None:
+            self.acquisition_thread.join()
+            self.acquisition_thread = None
+        try:
+            # wakes up accept_loop()
+            self.server_sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.server_sock.close()
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.close()
+        self.device.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def accept_loop(self):
+        while True:
+            try:
+                (sock, address) = self.server_sock.accept()
+            except OSError:
+                return  # closed
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self.lock:
+                self.subscribers.append(Subscriber(self, sock, address))
+            logger.info('Red_Pitaya_GUI:AcquisitionDaemon: new subscriber %s:%d' % address)
+
+    def remove_subscriber(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+            for requesters in self.pending_captures.values():
+                requesters[:] = [(other, request_id) for (other, request_id) in requesters if other is not subscriber]
+
+    # Sends a message to all the subscribers of topic. The message is only serialized once.
+    def publish(self, topic, header, payload=b''):
+        header['topic'] = topic
+        frame = encode_message(header, payload)
+        with self.lock:
+            subscribers = [subscriber for subscriber in self.subscribers if topic in subscriber.topics]
+        for subscriber in subscribers:
+            subscriber.post(frame)
+
+    # Called from the reader thread of each subscriber
+    def handle_request(self, subscriber, request):
+        op = request.get('op')
+        if op in ('subscribe', 'unsubscribe'):
+            topics = set(request.get('topics', ()))
+            unknown_topics = topics - set(TOPICS)
+            if unknown_topics:
+                subscriber.post(encode_message({'topic': 'error', 'strError': 'unknown topic(s) %s, must be in %s' % (sorted(unknown_topics), TOPICS)}))
+                return
+            with self.lock:
+                if op == 'subscribe':
+                    subscriber.topics |= topics
+                else:
+                    subscriber.topics -= topics
+        elif op == 'capture':
+            key = (request.get('input'), request.get('N'), bool(request.get('bRaw', False)))
+            if key[0] not in self.device.sl.LOGGER_MUX or not isinstance(key[1], int) or not 0 < key[1] <= RP_PLL_device.MAX_SAMPLES_READ_BUFFER:
+                subscriber.post(encode_message({'topic': 'capture', 'id': request.get('id'), 'input': key[0], 'N': key[1],
+                    'strError': 'invalid capture request, input must be in %s and N in 1..%d' % (sorted(self.device.sl.LOGGER_MUX), RP_PLL_device.MAX_SAMPLES_READ_BUFFER)}))
+                return
+            with self.lock:
+                self.pending_captures.setdefault(key, []).append((subscriber, request.get('id')))
+        elif op == 'info':
+            subscriber.post(encode_message({'topic': 'info', 'HOST': self.device.HOST, 'PORT': self.device.PORT, 'bConnected': self.device.isConnected(),
+                                            'period': self.period, 'topics': TOPICS, 'number_of_subscribers': len(self.subscribers)}))
+        else:
+            subscriber.post(encode_message({'topic': 'error', 'strError': 'unknown op %r' % op}))
+
+    def run_acquisition(self):
+        next_cycle_time = time.perf_counter()
+        while not self.stop_event.is_set():
+            self.run_cycle()
+            next_cycle_time += self.period
+            if next_cycle_time < time.perf_counter():
+                next_cycle_time = time.perf_counter()
+            self.stop_event.wait(next_cycle_time - time.perf_counter())
+
+    # One poll of the box, published to the subscribers, then the captures requested since the previous cycle
+    def run_cycle(self):
+        status = self.device.poll()
+        self.number_of_polls += 1
+        self.publish_status(status)
+        self.run_pending_captures()
+
+    def publish_status(self, status):
+        if not status.bConnected:
+            self.publish('status', {'timestamp': status.timestamp, 'bConnected': False, 'strError': status.strError})
+            return
+        if status.counter0 is not None:
+            self.publish('counters', {'timestamp': status.timestamp, 'samples_number': status.samples_number, 'counter0': status.counter0, 'counter1': status.counter1})
+        self.publish('dacs', {'timestamp': status.timestamp, 'dac0': status.dac0, 'dac1': status.dac1, 'dac2': status.dac2})
+        self.publish('status', {'timestamp': status.timestamp, 'bConnected': True, 'status_flags': status.status_flags, 'leds': status.leds,
+                                'locks': [get_lock_state(status.leds, k) for k in range(3)]})
+
+    def run_pending_captures(self):
+        with self.lock:
+            (pending_captures, self.pending_captures) = (self.pending_captures, collections.OrderedDict())
+        for ((input_select, N_samples, bRaw), requesters) in pending_captures.items():
+            if not requesters:
+                continue    # all the requesters went away
+            (header, payload) = self.capture(input_select, N_samples, bRaw)
+            for (subscriber, request_id) in requesters:
+                subscriber.post(encode_message(dict(header, topic='capture', id=request_id), payload))
+            # the other subscribers of 'captures' get it as well
+            frame = encode_message(dict(header, topic='captures'), payload)
+            with self.lock:
+                subscribers = [subscriber for subscriber in self.subscribers if 'captures' in subscriber.topics and all(subscriber is not requester for (requester, _) in requesters)]
+            for subscriber in subscribers:
+                subscriber.post(frame)
+
+    # Takes one logger capture. Returns (header, payload), the payload being the samples as float64, in the same units as acquire_logger_samples(),
+    # or the raw int16 samples, side information included, if bRaw is True.
+    def capture(self, input_select, N_samples, bRaw=False):
+        header = {'input': input_select, 'N': N_samples, 'bRaw': bRaw, 'timestamp': time.time()}
+        if not self.device.isConnected():
+            header['strError'] = 'not connected to the box (%s)' % self.device.strError
+            return (header, b'')
+        sl = self.device.sl
+        # this arbiter only orders the captures of the subscribers, and of the scripts which share this instance:
+        # a GUI which doesn't go through the daemon, and the VNA and transfer function windows of any GUI, use the logger over their own connection
+        if not sl.ddr2_arbiter.acquire('AcquisitionDaemon', timeout=1.):
+            header['strError'] = 'the logger is in use'
+            return (header, b'')
+        try:
+            if bRaw:
+                samples = sl.acquire_logger_raw_samples(input_select, N_samples)
+            elif input_select in ('DDC0', 'DDC1'):
+                samples = sl.acquire_logger_samples(input_select, N_samples, bReadAsDDC=True)
+            else:
+                (samples, ref_exp) = sl.acquire_logger_samples(input_select, N_samples)
+                header['ref_exp'] = [float(np.real(ref_exp)), float(np.imag(ref_exp))]
+        except (CommsError, OSError) as e:
+            sl.dev.CloseTCPConnection()
+            self.device.strError = str(e)
+            header['strError'] = str(e)
+            return (header, b'')
+        finally:
+            sl.ddr2_arbiter.release('AcquisitionDaemon')
+        self.number_of_captures += 1
+        header['dtype'] = 'int16' if bRaw else 'float64'
+        return (header, np.ascontiguousarray(samples, dtype=header['dtype']).tobytes())
+
+
+#######################################################
+# Client
+#######################################################
+
+# Subscriber side of the protocol.
+# The published messages are passed to callback(header) from a background thread, or, without a callback, queued for get().
+# The samples of the captures are decoded into header['samples'].
+class AcquisitionClient():
+
+    def __init__(self, HOST='127.0.0.1', PORT=DEFAULT_PORT, callback=None, timeout=5.):
+        self.sock = socket.create_connection((HOST, PORT), timeout)
+        self.sock.settimeout(None)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.callback = callback
+        self.messages = queue.Queue()
+        self.send_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.pending_requests = {}     # request id -> [threading.Event, header]
+        self.next_request_id = 0
+        self.reader_thread = threading.Thread(target=self.run_reader, daemon=True)
+        self.reader_thread.start()
+
+    def send_request(self, request):
+        with self.send_lock:
+            self.sock.sendall(encode_message(request))
+
+    def subscribe(self, topics):
+        self.send_request({'op': 'subscribe', 'topics': list(topics)})
+
+    def unsubscribe(self, topics):
+        self.send_request({'op': 'unsubscribe', 'topics': list(topics)})
+
+    def request(self, request, timeout):
+        with self.lock:
+            request_id = self.next_request_id
+            self.next_request_id += 1
+            pending_request = [threading.Event(), None]
+            self.pending_requests[request_id] = pending_request
+        self.send_request(dict(request, id=request_id))
+        bReceived = pending_request[0].wait(timeout)
+        with self.lock:
+            self.pending_requests.pop(request_id, None)
+        if not bReceived:
+            raise CommsError('AcquisitionClient: no reply from the daemon within %g s' % timeout)
+        return pending_request[1]
+
+    # Returns (samples, header) of a new capture of N_samples from the logger input input_select (see SuperLaserLand_JD_RP.LOGGER_MUX).
+    # header['ref_exp'] is the reference phasor (as [real, imag]) for the ADC inputs.
+    # With bRaw, the samples are the raw int16 samples of the logger, to be decoded by the caller (see SuperLaserLand_JD_RP.decode_logger_samples()).
+    def capture(self, input_select, N_samples, timeout=10., bRaw=False):
+        header = self.request({'op': 'capture', 'input': input_select, 'N': int(N_samples), 'bRaw': bRaw}, timeout)
+        if 'strError' in header:
+            raise CommsError('AcquisitionClient: capture of %s failed: %s' % (input_select, header['strError']))
+        return (header.pop('samples'), header)
+
+    # False once the daemon has closed the connection
+    def isConnected(self):
+        return self.reader_thread.is_alive()
+
+    # Returns the next published message, or None after timeout seconds
+    def get(self, timeout=None):
+        try:
+            return self.messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def run_reader(self):
+        while True:
+            try:
+                message = receive_message(self.sock)
+            except (OSError, ValueError):
+                message = None
+            if message is None:
+                return
+            (header, payload) = message
+            if 'dtype' in header:
+                header['samples'] = np.frombuffer(payload, dtype=header['dtype'])
+            if header.get('topic') == 'capture':
+                with self.lock:
+                    pending_request = self.pending_requests.get(header.get('id'))
+                if pending_request is not None:
+                    pending_request[1] = header
+                    pending_request[0].set()
+            elif self.callback is not None:
+                self.callback(header)
+            else:
+                self.messages.put(header)
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        self.reader_thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Owns the connection to a Red Pitaya, and publishes its counters, DAC values, lock status and captures to local subscribers.')
+    parser.add_argument('box', nargs='?', help='the Red Pitaya, as IP or IP:PORT (port 5000 by default)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='port on which the subscribers connect (default: %(default)s)')
+    parser.add_argument('--bind', default='127.0.0.1', help='interface on which the subscribers connect (default: %(default)s, local subscribers only)')
+    parser.add_argument('--period', type=float, default=0.1, help='seconds between two polls of the box')
+    parser.add_argument('--mock', action='store_true', help='connect to a local MonitorTCPMockServer instead of a box')
+    args = parser.parse_args(argv)
+
+    server = None
+    if args.mock:
+        from MonitorTCPMockServer import MonitorTCPMockServer
+        server = MonitorTCPMockServer()
+        (BOX_HOST, BOX_PORT) = (server.HOST, server.PORT)
+    elif args.box:
+        (BOX_HOST, BOX_PORT, _) = parse_target(args.box)
+    else:
+        parser.error('no box to connect to')
+
+    try:
+        with AcquisitionDaemon(BOX_HOST, BOX_PORT, args.bind, args.port, args.period) as daemon:
+            daemon.start()
+            print('Publishing %s:%d on %s:%d, press Ctrl-C to stop' % (BOX_HOST, BOX_PORT, daemon.HOST, daemon.PORT))
+            while True:
+                time.sleep(1.)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server is not None:
+            server.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
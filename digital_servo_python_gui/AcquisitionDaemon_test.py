@@ -0,0 +1,102 @@
+import time
+
+import numpy as np
+
+from AcquisitionDaemon import AcquisitionDaemon, AcquisitionClient
+from DeviceManager_test import set_counters
+from MonitorTCPMockServer import MonitorTCPMockServer
+from SuperLaserLand_JD_RP import SuperLaserLand_JD_RP
+
+
+def wait_until(condition, timeout=2.):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        assert time.perf_counter() < deadline
+        time.sleep(0.01)
+
+def test_fan_out(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    server = MonitorTCPMockServer()
+    # raw DAC0 samples, which have no side information
+    server.logger_buffer = np.arange(100, dtype=np.int16).tobytes()
+    set_counters(server, 3, 5 * 2**10, -2 * 2**10, (10, 20, 30), 1 << 6)
+    try:
+        # the acquisition thread isn't started: the cycles are run explicitly below
+        with AcquisitionDaemon(server.HOST, server.PORT, PORT=0) as daemon, \
+             AcquisitionClient(daemon.HOST, daemon.PORT) as client0, AcquisitionClient(daemon.HOST, daemon.PORT) as client1:
+            client0.subscribe(['counters', 'status'])
+            client1.subscribe(['counters', 'dacs', 'captures'])
+            wait_until(lambda: len(daemon.subscribers) == 2 and all(subscriber.topics for subscriber in daemon.subscribers))
+            daemon.run_cycle()
+
+            # both subscribers get the counter sample which was read once:
+            for client in (client0, client1):
+                message = client.get(timeout=2.)
+                assert message['topic'] == 'counters'
+                assert (message['samples_number'], message['counter0'], message['counter1']) == (3, 5., -2.)
+            assert client0.get(timeout=2.)['locks'] == ['idle', 'locked', 'idle']
+            message = client1.get(timeout=2.)
+            assert [message[key] for key in ('dac0', 'dac1', 'dac2')] == [10, 20, 30]
+            assert client0.get(timeout=0.1) is None and client1.get(timeout=0.1) is None
+
+            # no new counter sample on the next cycle:
+            daemon.run_cycle()
+            assert client0.get(timeout=2.)['topic'] == 'status'
+            assert client1.get(timeout=2.)['topic'] == 'dacs'
+            assert daemon.number_of_polls == 2
+
+            # identical capture requests from two subscribers are served by a single capture, which client1 also gets as a subscriber of 'captures':
+            requester_client = AcquisitionClient(daemon.HOST, daemon.PORT)
+            try:
+                replies = []
+                for client in (client0, requester_client):
+                    client.send_request({'op': 'capture', 'id': 7, 'input': 'DAC0', 'N': 100})
+                wait_until(lambda: sum(len(requesters) for requesters in daemon.pending_captures.values()) == 2)
+                daemon.run_pending_captures()
+                assert daemon.number_of_captures == 1
+            finally:
+                requester_client.close()
+            message = client1.get(timeout=2.)
+            assert message['topic'] == 'captures' and message['input'] == 'DAC0'
+            assert np.array_equal(message['samples'], np.arange(100))
+
+            # the blocking API:
+            daemon.start()
+            (samples, header) = client1.capture('DAC0', 50)
+            assert np.array_equal(samples, np.arange(50)) and header['ref_exp'] == [1., 0.]
+    finally:
+        server.close()
+
+def test_gui_as_subscriber(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    server = MonitorTCPMockServer()
+    # raw ADC0 samples: the side information, then the samples
+    side_information = [0, 0, 0, 0, 0, 0, 1000, 0, int(np.array(0b1010100010001111, np.uint16).view(np.int16))]
+    server.logger_buffer = np.array(side_information + list(range(100)), dtype=np.int16).tobytes()
+    set_counters(server, 3, 5 * 2**10, -2 * 2**10, (10, 20, 30), 0)
+    try:
+        with AcquisitionDaemon(server.HOST, server.PORT, PORT=0, period=0.02) as daemon:
+            # the GUI's instance never connects to the box itself:
+            sl = SuperLaserLand_JD_RP()
+            sl.use_acquisition_daemon('%s:%d' % (daemon.HOST, daemon.PORT))
+            try:
+                # the counter sample is only published once:
+                wait_until(lambda: len(daemon.subscribers) == 1 and daemon.subscribers[0].topics)
+                daemon.start()
+                wait_until(lambda: sl.read_dual_mode_counter(1)[0] is not None)
+                assert sl.read_dual_mode_counter(0)[0] == [5.]
+                (freq_counter_sample, time_axis, dac0, dac1, dac2) = sl.read_dual_mode_counter(0)
+                assert freq_counter_sample is None and (dac0, dac1, dac2) == ([10], [20], [30])
+                assert sl.read_DAC_current_values() == (10, 20, 30)
+
+                # decoded here, with the DDC reference frequency of this instance:
+                sl.ddc0_frequency_in_int = 2**45
+                (samples, ref_exp) = sl.acquire_logger_samples('ADC0', 109)
+                assert np.array_equal(samples, np.arange(100))
+                assert np.isclose(ref_exp, -1000)
+                assert sl.acquire_logger_samples('DDC0', 109, bReadAsDDC=True)[6] == 1000/2**10 * sl.fs/4
+                assert daemon.number_of_captures == 2 and not sl.dev.valid_socket
+            finally:
+                sl.stop_using_acquisition_daemon()
+    finally:
+        server.close()
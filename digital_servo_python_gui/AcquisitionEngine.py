@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Background acquisition engine: runs the logger acquisitions (ADC, DDC, DAC, VNA) and the counter reads
+on a worker thread, and hands the decoded numpy frames back to the GUI thread through Qt signals,
+so that a slow read doesn't freeze every window.
+
+"""
+from __future__ import print_function
+import threading
+import collections
+import time
+import logging
+import traceback
+import weakref
+
+from PyQt5 import QtCore
+
+import RP_PLL # for CommsError
+
+class LoggerBusyError(Exception):
+    pass
+
+# One acquisition, as queued in the AcquisitionEngine.
+# owner is the object which queued the job (typically a window): the receivers of the engine's signals use it to pick their own frames.
+# Only a weak reference to it is kept, so that the worker thread never holds the last reference to a Qt object
+# (PyQt crashes if a widget gets deleted on another thread than the GUI's).
+# name identifies the kind of acquisition for this owner: a job is not queued again while an identical (owner, name) job is still waiting.
+# function is called on the worker thread, and its return value is the frame.
+# parameters is whatever the owner needs to remember about this job to display its frame (input select, number of samples, etc).
+class AcquisitionJob():
+    def __init__(self, owner, name, function, bUsesLogger=True, parameters=None):
+        self.owner_ref = weakref.ref(owner)
+        self.name = name
+        self.function = function
+        self.bUsesLogger = bUsesLogger
+        self.parameters = parameters
+        self.time_queued = time.perf_counter()
+        self.time_started = None
+        self.time_finished = None
+
+    # None if the owner has been deleted since the job was queued
+    @property
+    def owner(self):
+        return self.owner_ref()
+
+class AcquisitionEngine(QtCore.QObject):
+    frameReady          = QtCore.pyqtSignal(object, object)    # (job, frame)
+    acquisitionFailed   = QtCore.pyqtSignal(object, object)    # (job, exception)
+    commsError          = QtCore.pyqtSignal(object)            # exception, emitted in addition to acquisitionFailed when the connection was lost
+
+    LOGGER_TIMEOUT = 2. # seconds that a job waits for the logger to be released by the other users before giving up
+
+    def __init__(self, sl, parent=None):
+        super(AcquisitionEngine, self).__init__(parent)
+        self.sl = sl
+
+        self.logger = logging.getLogger(__name__)
+        self.logger_name = ':AcquisitionEngine'
+
+        self.jobs = collections.deque()
+        self.condition = threading.Condition()
+        self.bStop = False
+        self.thread = None
+
+        self.number_of_jobs_run = 0
+        self.number_of_jobs_failed = 0
+        self.number_of_jobs_coalesced = 0   # jobs which were not queued because an identical one was already waiting
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.bStop = False
+        self.thread = threading.Thread(target=self.run, name='AcquisitionEngine')
+        self.thread.daemon = True   # don't keep the process alive if the GUI is closed in the middle of an acquisition
+        self.thread.start()
+
+    # Stops the worker after the current job, dropping the jobs which are still queued
+    def stop(self, timeout=None):
+        if self.thread is None:
+            return
+        with self.condition:
+            self.bStop = True
+            self.jobs.clear()
+            self.condition.notify()
+        self.thread.join(timeout)
+        self.thread = None
+
+    def queue_job(self, job):
+        with self.condition:
+            for queued_job in self.jobs:
+                if queued_job.owner_ref == job.owner_ref and queued_job.name == job.name:
+                    self.number_of_jobs_coalesced += 1
+                    return False
+            self.jobs.append(job)
+            self.condition.notify()
+        return True
+
+    # The frame is (samples_out, ref_exp0) for the ADC and DAC inputs, or inst_freq when bReadAsDDC is True, see SuperLaserLand_JD_RP.acquire_logger_samples()
+    def queue_logger_acquisition(self, owner, name, input_select, N_samples, bReadAsDDC=False):
+        function = lambda: self.sl.acquire_logger_samples(input_select, N_samples, bReadAsDDC)
+        parameters = {'input_select': input_select, 'N_samples': N_samples, 'bReadAsDDC': bReadAsDDC}
+        return self.queue_job(AcquisitionJob(owner, name, function, True, parameters))
+
+    # Captures several logger inputs with a single request to the server.
+    # The frame is a dict which maps each input select to its frame, see SuperLaserLand_JD_RP.acquire_logger_snapshot()
+    def queue_logger_snapshot(self, owner, name, input_selects, N_samples):
+        input_selects = list(input_selects)
+        function = lambda: self.sl.acquire_logger_snapshot(input_selects, N_samples)
+        parameters = {'input_selects': input_selects, 'N_samples': N_samples}
+        return self.queue_job(AcquisitionJob(owner, name, function, True, parameters))
+
+    # The frame is the return value of SuperLaserLand_JD_RP.read_dual_mode_counter()
+    def queue_counters_read(self, owner, name, output_number):
+        function = lambda: self.sl.read_dual_mode_counter(output_number)
+        parameters = {'output_number': output_number}
+        return self.queue_job(AcquisitionJob(owner, name, function, False, parameters))
+
+    # The frame is the return value of SuperLaserLand_JD_RP.read_DAC_current_values(), which doesn't need the logger
+    def queue_DAC_values_read(self, owner, name):
+        function = lambda: self.sl.read_DAC_current_values()
+        return self.queue_job(AcquisitionJob(owner, name, function, False))
+
+    # Runs a complete system identification, the frame is (transfer_function_complex, frequency_axis).
+    # setup_args are the arguments of SuperLaserLand_JD_RP.setup_system_identification()
+    def queue_system_identification(self, owner, name, *setup_args):
+        def function():
+            self.sl.setup_system_identification(*setup_args)
+            self.sl.trigger_system_identification()
+            self.sl.wait_for_system_identification()
+            return self.sl.read_VNA_samples_from_DDR2()
+        return self.queue_job(AcquisitionJob(owner, name, function, True, {'setup_args': setup_args}))
+
+    def run(self):
+        while True:
+            with self.condition:
+                while len(self.jobs) == 0 and not self.bStop:
+                    self.condition.wait()
+                if self.bStop:
+                    return
+                job = self.jobs.popleft()
+            self.run_job(job)
+
+    def run_job(self, job):
+        job.time_started = time.perf_counter()
+        try:
+            if job.bUsesLogger:
+                if not self.sl.ddr2_arbiter.acquire(self, self.LOGGER_TIMEOUT):
+                    raise LoggerBusyError('DDR2 logger in use by %s' % self.sl.ddr2_arbiter.owner)
+                try:
+                    frame = job.function()
+                finally:
+                    self.sl.ddr2_arbiter.release(self)
+            else:
+                frame = job.function()
+
+        except RP_PLL.CommsError as e:
+            if isinstance(e, RP_PLL.CommsLoggeableError):
+                # log exception
+                logging.error(traceback.format_exc())
+                self.commsError.emit(e)
+            # otherwise do not log the exception (because it's simply an obvious follow-up to a previous one)
+            self.jobFailed(job, e)
+            return
+
+        except Exception as e:
+            self.logger.warning('Red_Pitaya_GUI{}: job {} failed: {}'.format(self.logger_name, job.name, traceback.format_exc()))
+            self.jobFailed(job, e)
+            return
+
+        job.time_finished = time.perf_counter()
+        self.number_of_jobs_run += 1
+        self.frameReady.emit(job, frame)
+
+    def jobFailed(self, job, e):
+        job.time_finished = time.perf_counter()
+        self.number_of_jobs_failed += 1
+        self.acquisitionFailed.emit(job, e)
+
+    def __str__(self):
+        return 'AcquisitionEngine'
+
+    def get_stats(self):
+        with self.condition:
+            number_of_jobs_queued = len(self.jobs)
+        return {'jobs_run': self.number_of_jobs_run,
+                'jobs_failed': self.number_of_jobs_failed,
+                'jobs_coalesced': self.number_of_jobs_coalesced,
+                'jobs_queued': number_of_jobs_queued,
+                'logger': self.sl.ddr2_arbiter.get_stats()}
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Binary trace of the communication with monitor-tcp: every packet sent and every reply received by RP_PLL_device,
+with its timestamp and connection, cheap enough to be left on (see RP_PLL_device.start_trace()).
+
+The records go into a preallocated ring buffer, which a background thread flushes to disk every flush_period seconds.
+If the writer can't keep up, the new records are dropped (and counted) rather than slowing down the communication.
+Packets and replies longer than max_payload_bytes are stored truncated, with their original length.
+
+A recorded session can be replayed against any server, real or mock, to reproduce an issue or to benchmark a change:
+    python CommsTrace.py dump trace.bin
+    python CommsTrace.py replay trace.bin --host 192.168.0.150
+    python CommsTrace.py replay trace.bin --mock           # against a local MonitorTCPMockServer
+replay_trace() takes any send()/read() pair, for example those of MonitorTCP_mock from RP_PLL_test.py.
+
+File format: TRACE_MAGIC, the wall-clock time of the start of the trace ('=d'), then one record after another:
+a RECORD_HEADER_FORMAT header (timestamp in seconds since the start, kind, channel, original length, stored length), then the stored bytes.
+The channel is 0 for the control connection, and k+1 for bulk connection k.
+
+"""
+from __future__ import print_function
+import sys
+import time
+import struct
+import argparse
+import threading
+import collections
+
+TRACE_MAGIC = b'RPTRACE1'
+RECORD_HEADER_FORMAT = '=dBBII'
+RECORD_HEADER_SIZE = struct.calcsize(RECORD_HEADER_FORMAT)
+
+KIND_SEND = 0
+KIND_REPLY = 1
+
+# One record of a trace. data holds the stored bytes, which are the first bytes of the packet or reply if it was longer than max_payload_bytes.
+TraceRecord = collections.namedtuple('TraceRecord', ['timestamp', 'kind', 'channel', 'length', 'data'])
+
+# Outcome of replay_trace(). latencies maps the name of each request type to the list of its latencies (from sending it to receiving its reply), in seconds.
+ReplayResult = collections.namedtuple('ReplayResult', ['number_of_packets', 'number_of_replies', 'number_of_mismatched_replies',
+                                                       'number_of_skipped_packets', 'duration', 'recorded_duration', 'latencies'])
+
+
+class CommsTraceRecorder():
+
+    def __init__(self, strFilename, capacity=16*1024*1024, max_payload_bytes=4096, flush_period=0.2):
+        self.capacity = capacity
+        self.max_payload_bytes = max_payload_bytes
+        self.flush_period = flush_period
+
+        self.buffer = bytearray(capacity)
+        self.write_position = 0     # total number of bytes written into the ring buffer
+        self.read_position = 0      # total number of bytes flushed to disk
+        self.lock = threading.Lock()
+        self.file_lock = threading.Lock()   # keeps the chunks in order when flush() is also called from outside the writer thread
+        self.number_of_records = 0
+        self.number_of_dropped_records = 0
+
+        self.file = open(strFilename, 'wb')
+        self.start_time = time.perf_counter()
+        self.file.write(TRACE_MAGIC + struct.pack('=d', time.time()))
+
+        self.stop_event = threading.Event()
+        self.writer_thread = threading.Thread(target=self.run_writer, daemon=True)
+        self.writer_thread.start()
+
+    # data is the packet (or the start of it, original_length being its actual length), and may be any bytes-like object
+    def record(self, kind, channel, data, original_length=None):
+        data = memoryview(data).cast('B')
+        if original_length is None:
+            original_length = len(data)
+        data = data[:self.max_payload_bytes]
+        header = struct.pack(RECORD_HEADER_FORMAT, time.perf_counter() - self.start_time, kind, channel, original_length, len(data))
+        with self.lock:
+            if self.write_position - self.read_position + len(header) + len(data) > self.capacity:
+                self.number_of_dropped_records += 1
+                return
+            self.copy_in(header)
+            self.copy_in(data)
+            self.number_of_records += 1
+
+    def record_send(self, channel, data, original_length=None):
+        self.record(KIND_SEND, channel, data, original_length)
+
+    def record_reply(self, channel, data):
+        self.record(KIND_REPLY, channel, data)
+
+    # Copies data at the write position, wrapping around the end of the ring buffer. Called with self.lock held.
+    def copy_in(self, data):
+        position = self.write_position % self.capacity
+        first_part = min(len(data), self.capacity - position)
+        self.buffer[position:position+first_part] = data[:first_part]
+        self.buffer[:len(data)-first_part] = data[first_part:]
+        self.write_position += len(data)
+
+    # Writes everything recorded so far to disk. Safe to call from any thread, and after close().
+    def flush(self):
+        with self.file_lock:
+            if self.file.closed:
+                return
+            with self.lock:
+                (start, end) = (self.read_position, self.write_position)
+                position = start % self.capacity
+                first_part = min(end - start, self.capacity - position)
+                chunk = bytes(self.buffer[position:position+first_part]) + bytes(self.buffer[:end-start-first_part])
+                self.read_position = end
+            # the disk write doesn't hold up the recording
+            if chunk:
+                self.file.write(chunk)
+                self.file.flush()
+
+    def run_writer(self):
+        while not self.stop_event.wait(self.flush_period):
+            self.flush()
+
+    # Flushes the last records and closes the file. Calling it again does nothing.
+    def close(self):
+        self.stop_event.set()
+        if self.writer_thread is not threading.current_thread():
+            self.writer_thread.join()
+        self.flush()
+        with self.file_lock:
+            self.file.close()
+
+
+# Returns (start time, list of TraceRecord)
+def read_trace(strFilename):
+    with open(strFilename, 'rb') as f:
+        data = f.read()
+    if data[:len(TRACE_MAGIC)] != TRACE_MAGIC:
+        raise ValueError('%s is not a communication trace' % strFilename)
+    position = len(TRACE_MAGIC)
+    (start_time,) = struct.unpack_from('=d', data, position)
+    position += 8
+    records = []
+    while position + RECORD_HEADER_SIZE <= len(data):
+        (timestamp, kind, channel, length, stored_length) = struct.unpack_from(RECORD_HEADER_FORMAT, data, position)
+        position += RECORD_HEADER_SIZE
+        records.append(TraceRecord(timestamp, kind, channel, length, data[position:position+stored_length]))
+        position += stored_length
+    return (start_time, records)
+
+# Name of the request type of a packet, from its magic bytes (see RP_PLL_device.MAGIC_BYTES_xxx)
+def get_op_name(data):
+    from RP_PLL import RP_PLL_device
+    if len(data) < 4:
+        return 'unknown'
+    (magic_bytes,) = struct.unpack_from('=I', data)
+    for strName in dir(RP_PLL_device):
+        if strName.startswith('MAGIC_BYTES_') and getattr(RP_PLL_device, strName) == magic_bytes:
+            return strName[len('MAGIC_BYTES_'):].lower()
+    return '0x%08x' % magic_bytes
+
+def format_record(record):
+    if record.kind == KIND_SEND:
+        fields = struct.unpack_from('=III', record.data) if len(record.data) >= 12 else ()
+        strDetails = '%-16s %s' % (get_op_name(record.data), ' '.join('0x%08x' % field for field in fields[1:]))
+    else:
+        strDetails = 'reply            %s' % record.data[:16].hex()
+    strTruncated = ' (truncated from %d bytes)' % record.length if record.length > len(record.data) else ''
+    return '%12.6f  ch%d  %6d B  %s%s' % (record.timestamp, record.channel, len(record.data), strDetails, strTruncated)
+
+# Sends the packets of a trace again through send(packet), and reads each reply through read(number_of_bytes),
+# in the recorded order (all the channels go through the same send()/read()).
+# Packets which were stored truncated can't be sent again: they are skipped along with their replies.
+# With bRealTime, the recorded delays between the packets are kept, otherwise the packets are sent as fast as possible.
+# Returns a ReplayResult. The replies are compared to the recorded ones (as far as they were stored).
+def replay_trace(records, send, read, bRealTime=False):
+    number_of_packets = 0
+    number_of_replies = 0
+    number_of_mismatched_replies = 0
+    number_of_skipped_packets = 0
+    latencies = collections.defaultdict(list)
+    last_request = {}           # channel -> (op name, time sent), or None if that packet was skipped
+    start_time = time.perf_counter()
+    for record in records:
+        if bRealTime:
+            time.sleep(max(0., record.timestamp - (time.perf_counter() - start_time)))
+        if record.kind == KIND_SEND:
+            if record.length > len(record.data):
+                number_of_skipped_packets += 1
+                last_request[record.channel] = None
+                continue
+            send(record.data)
+            number_of_packets += 1
+            last_request[record.channel] = (get_op_name(record.data), time.perf_counter())
+        else:
+            if last_request.get(record.channel) is None:
+                continue    # reply to a skipped packet
+            reply = read(record.length)
+            number_of_replies += 1
+            (strOp, time_sent) = last_request[record.channel]
+            latencies[strOp].append(time.perf_counter() - time_sent)
+            if bytes(reply[:len(record.data)]) != bytes(record.data):
+                number_of_mismatched_replies += 1
+    recorded_duration = records[-1].timestamp - records[0].timestamp if records else 0.
+    return ReplayResult(number_of_packets, number_of_replies, number_of_mismatched_replies, number_of_skipped_packets,
+                        time.perf_counter() - start_time, recorded_duration, dict(latencies))
+
+def format_replay_result(result):
+    lines = ['%d packets and %d replies replayed in %.3f s (recorded: %.3f s), %d packets skipped, %d replies differ from the recording' % (
+        result.number_of_packets, result.number_of_replies, result.duration, result.recorded_duration, result.number_of_skipped_packets, result.number_of_mismatched_replies)]
+    for (strOp, op_latencies) in sorted(result.latencies.items()):
+        op_latencies = sorted(op_latencies)
+        lines.append('%-16s %6d replies, median %8.3f ms, max %8.3f ms' % (strOp, len(op_latencies), 1e3*op_latencies[len(op_latencies)//2], 1e3*op_latencies[-1]))
+    return '\n'.join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Shows or replays a binary trace of the communication with a Red Pitaya.')
+    parser.add_argument('command', choices=('dump', 'replay'))
+    parser.add_argument('filename')
+    parser.add_argument('--host', help='replay against this server')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--mock', action='store_true', help='replay against a local MonitorTCPMockServer')
+    parser.add_argument('--real-time', action='store_true', dest='bRealTime', help='keep the recorded delays between the packets')
+    args = parser.parse_args(argv)
+
+    (start_time, records) = read_trace(args.filename)
+    if args.command == 'dump':
+        print('Trace started on %s, %d records' % (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start_time)), len(records)))
+        for record in records:
+            print(format_record(record))
+        return 0
+
+    from RP_PLL import RP_PLL_device
+    server = None
+    if args.mock:
+        from MonitorTCPMockServer import MonitorTCPMockServer
+        server = MonitorTCPMockServer()
+        (args.host, args.port) = (server.HOST, server.PORT)
+    if args.host is None:
+        parser.error('replay needs --host or --mock')
+    dev = RP_PLL_device()
+    try:
+        dev.OpenTCPConnection(args.host, args.port, number_of_bulk_connections=0)
+        if not dev.valid_socket:
+            print('Could not connect to %s:%d' % (args.host, args.port))
+            return 1
+        print(format_replay_result(replay_trace(records, dev.send, dev.read, args.bRealTime)))
+    finally:
+        dev.CloseTCPConnection()
+        if server is not None:
+            server.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+import sys
+import struct
+import subprocess
+
+import CommsTrace
+import RP_PLL
+from MonitorTCPMockServer import MonitorTCPMockServer
+from RP_PLL_test import MonitorTCP_mock
+
+
+def test_ring_buffer(tmp_path):
+    strFilename = str(tmp_path / 'trace.bin')
+    # the writer thread is kept from running, so that the ring buffer fills up and wraps around
+    trace = CommsTrace.CommsTraceRecorder(strFilename, capacity=80, max_payload_bytes=16, flush_period=1000.)
+    trace.record_send(0, bytes(range(12)))
+    trace.record_reply(2, bytes(40))
+    assert (trace.number_of_records, trace.number_of_dropped_records) == (2, 0)
+    trace.record_send(0, bytes(12))
+    assert trace.number_of_dropped_records == 1
+    trace.flush()
+    trace.record_send(1, b'abcd' * 10)
+    trace.record_send(1, b'efgh', original_length=1000)
+    trace.close()
+
+    (start_time, records) = CommsTrace.read_trace(strFilename)
+    assert [(record.kind, record.channel, record.length, record.data) for record in records] == [
+        (CommsTrace.KIND_SEND, 0, 12, bytes(range(12))),
+        (CommsTrace.KIND_REPLY, 2, 40, bytes(16)),
+        (CommsTrace.KIND_SEND, 1, 40, b'abcd' * 4),
+        (CommsTrace.KIND_SEND, 1, 1000, b'efgh')]
+    assert records[0].timestamp <= records[-1].timestamp
+
+def test_trace_flushed_at_exit(tmp_path):
+    strFilename = str(tmp_path / 'trace.bin')
+    # the writer thread never runs before exit, and stop_trace() is never called
+    script = ('import RP_PLL\n'
+              'dev = RP_PLL.RP_PLL_device()\n'
+              'dev.start_trace(%r, flush_period=1000.)\n'
+              'dev.trace.record_send(0, b"abcd")\n'
+              'dev.flush_trace()\n'
+              'dev.trace.record_reply(0, b"efgh")\n') % strFilename
+    subprocess.check_call([sys.executable, '-c', script])
+    (start_time, records) = CommsTrace.read_trace(strFilename)
+    assert [record.data for record in records] == [b'abcd', b'efgh']
+
+def test_record_and_replay(tmp_path):
+    strFilename = str(tmp_path / 'trace.bin')
+    server = MonitorTCPMockServer()
+    dev = RP_PLL.RP_PLL_device()
+    dev.OpenTCPConnection(server.HOST, server.PORT, number_of_bulk_connections=0)
+    try:
+        dev.start_trace(strFilename, max_payload_bytes=64)
+        for k in range(20):
+            dev.write_Zynq_register_uint32(4*k, 100+k)
+        for k in range(5):
+            assert dev.read_Zynq_register_uint32(4*k) == 100+k
+        with dev.transaction() as t:
+            dev.write_Zynq_register_uint32(4*6, 7)
+            t.queue_read(dev.FPGA_BASE_ADDR + 4*6)
+        dev.read_Zynq_registers_block(0, 20)
+        # too long to be stored entirely: can't be replayed
+        dev.send_shell_command('echo ' + 'x' * 100)
+        dev.stop_trace()
+    finally:
+        dev.CloseTCPConnection()
+        server.close()
+
+    (start_time, records) = CommsTrace.read_trace(strFilename)
+    ops = [CommsTrace.get_op_name(record.data) for record in records if record.kind == CommsTrace.KIND_SEND]
+    assert ops == ['write_reg'] * 20 + ['read_reg'] * 5 + ['multi_op', 'read_reg_block', 'shell_command']
+    (block_reply,) = [record for record in records if record.kind == CommsTrace.KIND_REPLY and record.length == 4*20]
+    assert len(block_reply.data) == 64 and block_reply.data[:8] == struct.pack('=II', 100, 101)
+    assert all(CommsTrace.format_record(record) for record in records)
+
+    # the recorded session gives the same replies from the in-process mock:
+    monitor_tcp = MonitorTCP_mock()
+    result = CommsTrace.replay_trace(records, monitor_tcp.send_mock, monitor_tcp.read_mock)
+    assert (result.number_of_packets, result.number_of_replies, result.number_of_skipped_packets) == (27, 7, 1)
+    assert result.number_of_mismatched_replies == 0
+    assert len(result.latencies['read_reg']) == 5
+    assert 'read_reg_block' in CommsTrace.format_replay_result(result)
+
+    # against a different register state, the replies differ:
+    monitor_tcp = MonitorTCP_mock()
+    records = [record for record in records if CommsTrace.get_op_name(record.data) != 'write_reg' or record.kind != CommsTrace.KIND_SEND]
+    result = CommsTrace.replay_trace(records, monitor_tcp.send_mock, monitor_tcp.read_mock)
+    assert result.number_of_mismatched_replies == 6
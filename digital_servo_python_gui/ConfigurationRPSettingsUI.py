@@ -19,6 +19,7 @@ import traceback
 from user_friendly_QLineEdit import user_friendly_QLineEdit
 
 from SuperLaserLand_JD_RP import SuperLaserLand_JD_RP
+import RP_PLL
 from SocketErrorLogger import logCommsErrorsAndBreakoutOfFunction
 import DataLoggingDisplayWidget
 
@@ -145,10 +146,12 @@ class ConfigRPSettingsUI(Qt.QWidget):
 	def startTimers(self):
 	# This gets called when we have a valid connection to a device.
 		self.timerXADC.start(1000)
+		self.timerCommsStats.start(1000)
 
 	def killTimers(self):
 	# This gets called by the controller object in XEM_GUI3.py when we lose connection to a device.
 		self.timerXADC.stop()
+		# (the statistics are still shown: they are most interesting after a loss of connection)
 
 
 	def initUI(self):
@@ -313,6 +316,31 @@ class ConfigRPSettingsUI(Qt.QWidget):
 		self.qbtn_reconnect = QtGui.QPushButton('Open communication menu')
 		self.qbtn_reconnect.clicked.connect(self.communication_menu)
 
+		###################################################################################
+
+		# where the refresh time goes: per-op statistics of the communication with the RP, see RP_PLL_stats
+		self.qgroupbox_comms_stats = Qt.QGroupBox('Communication statistics')
+		self.qgroupbox_comms_stats.setAutoFillBackground(True)
+		comms_stats = Qt.QGridLayout()
+
+		self.qtable_comms_stats = Qt.QTableWidget(len(RP_PLL.RP_PLL_stats.OPS), 6)
+		self.qtable_comms_stats.setHorizontalHeaderLabels(['count', 'kB', 'mean [ms]', 'p50 [ms]', 'p99 [ms]', 'max [ms]'])
+		self.qtable_comms_stats.setVerticalHeaderLabels(RP_PLL.RP_PLL_stats.OPS)
+		self.qtable_comms_stats.setEditTriggers(Qt.QAbstractItemView.NoEditTriggers)
+		self.qlbl_comms_stats = Qt.QLabel('')
+		self.qbtn_reset_comms_stats = Qt.QPushButton('Reset')
+		self.qbtn_reset_comms_stats.clicked.connect(self.resetCommsStats)
+
+		comms_stats.addWidget(self.qtable_comms_stats,     0, 0, 1, 2)
+		comms_stats.addWidget(self.qlbl_comms_stats,       1, 0)
+		comms_stats.addWidget(self.qbtn_reset_comms_stats, 1, 1)
+
+		self.qgroupbox_comms_stats.setLayout(comms_stats)
+
+		# refresh timer for the statistics, which doesn't communicate with the RP:
+		self.timerCommsStats = Qt.QTimer(self)
+		self.timerCommsStats.timeout.connect(self.timerCommsStatsEvent)
+
 
 		###################################################################################
 			
@@ -327,6 +355,7 @@ class ConfigRPSettingsUI(Qt.QWidget):
 		group.addWidget(self.qgroupbox_read_data, 3, 0, 1, 3)
 		group.addWidget(self.qgroupbox_fanUI,     4, 0, 1, 1)
 		group.addWidget(self.qbtn_reconnect,      4, 1, 1, 1)
+		group.addWidget(self.qgroupbox_comms_stats, 5, 0, 1, 3)
 
 		#vbox = Qt.QVBoxLayout()
 		#vbox.addStretch(1)
@@ -374,6 +403,22 @@ class ConfigRPSettingsUI(Qt.QWidget):
 			self.lblExtClkFreq.setText('Ext clk freq = N/A MHz')
 
 
+	def timerCommsStatsEvent(self):
+		if not self.isVisible():
+			return
+		stats = self.sl.dev.get_stats()
+		for (row, op) in enumerate(RP_PLL.RP_PLL_stats.OPS):
+			op_stats = stats[op]
+			values = ['%d' % op_stats['count'], '%.1f' % (op_stats['bytes']/1e3)] + ['%.3f' % (1e3*op_stats[key]) for key in ('mean', 'p50', 'p99', 'max')]
+			for (column, strValue) in enumerate(values):
+				self.qtable_comms_stats.setItem(row, column, Qt.QTableWidgetItem(strValue))
+		self.qlbl_comms_stats.setText('Timeouts: %d, socket errors: %d, reconnects: %d, writes skipped: %d, over %.0f s' % (
+			stats['timeouts'], stats['socket_errors'], stats['reconnects'], stats['writes_skipped'], stats['duration']))
+
+	def resetCommsStats(self, checked=False):
+		self.sl.dev.reset_stats()
+		self.timerCommsStatsEvent()
+
 	#Function to read the value in the RAM Block (channel 2) to an address
 	#The data we should read are the data sent to dpll_wrapper module (channel 0)
 	@logCommsErrorsAndBreakoutOfFunction()
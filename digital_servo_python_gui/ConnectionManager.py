@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Reconnection to the Red Pitaya without blocking the GUI: drives an RP_PLL_connector (non-blocking connect(),
+exponential backoff with jitter between the attempts) from single-shot QTimers, and reports its progress through Qt signals.
+
+The connected socket is handed over with the connected signal, typically to RP_PLL_device.OpenTCPConnection(HOST, PORT, sock=sock).
+
+"""
+from __future__ import print_function
+import logging
+
+from PyQt5 import QtCore
+
+from RP_PLL import RP_PLL_connector
+
+
+class ConnectionManager(QtCore.QObject):
+    stateChanged    = QtCore.pyqtSignal(str)            # one of the RP_PLL_connector states
+    attemptFailed   = QtCore.pyqtSignal(int, str)       # (attempt number, reason)
+    connected       = QtCore.pyqtSignal(object)         # the connected socket, which now belongs to the receiver
+
+    POLL_PERIOD = 0.02  # seconds between two checks of a connect() in progress
+
+    # connector_options are passed to RP_PLL_connector (min_delay, max_delay, jitter, connect_timeout)
+    def __init__(self, parent=None, **connector_options):
+        super(ConnectionManager, self).__init__(parent)
+        self.logger = logging.getLogger(__name__)
+        self.logger_name = ':ConnectionManager'
+
+        self.connector_options = connector_options
+        self.connector = None
+        self.state = RP_PLL_connector.DISCONNECTED
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.poll)
+
+    # True while we are trying to connect
+    def isActive(self):
+        return self.connector is not None
+
+    # Starts connecting to HOST:PORT, with a fresh backoff
+    def start(self, HOST, PORT=5000):
+        self.cancel()
+        self.connector = RP_PLL_connector(HOST, PORT, **self.connector_options)
+        self.connector.start()
+        self.poll()
+
+    def cancel(self):
+        self.timer.stop()
+        if self.connector is not None:
+            self.connector.cancel()
+            self.connector = None
+        self.setState(RP_PLL_connector.DISCONNECTED)
+
+    def setState(self, state):
+        if state != self.state:
+            self.state = state
+            self.stateChanged.emit(state)
+
+    def poll(self):
+        if self.connector is None:
+            return
+        number_of_attempts = self.connector.number_of_attempts
+        state = self.connector.poll()
+        if state == RP_PLL_connector.WAITING and (self.state != RP_PLL_connector.WAITING or self.connector.number_of_attempts != number_of_attempts):
+            # also covers an attempt which failed right away, without going through CONNECTING
+            self.logger.info('Red_Pitaya_GUI{}: connection attempt #{} to {}:{} failed ({}), next attempt in {:.1f} s'.format(
+                self.logger_name, self.connector.number_of_attempts, self.connector.HOST, self.connector.PORT,
+                self.connector.strLastError, self.connector.get_time_to_next_event()))
+            self.attemptFailed.emit(self.connector.number_of_attempts, self.connector.strLastError)
+
+        if state == RP_PLL_connector.CONNECTED:
+            sock = self.connector.take_socket()
+            self.connector = None
+            self.setState(RP_PLL_connector.CONNECTED)
+            self.connected.emit(sock)
+            return
+        self.setState(state)
+        if state == RP_PLL_connector.WAITING:
+            self.timer.start(int(1000*self.connector.get_time_to_next_event()))
+        else:
+            self.timer.start(int(1000*self.POLL_PERIOD))
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Placeholder for a rarely used part of the GUI (typically a tab), whose contents are only built the first time it is shown,
+or when build() is called because something else needs them. This keeps the startup of the GUI fast.
+
+"""
+from __future__ import print_function
+
+from PyQt5 import QtWidgets
+
+
+class DeferredWidget(QtWidgets.QWidget):
+
+    # build_function() creates and returns the actual widget, which then fills the placeholder
+    def __init__(self, build_function, parent=None):
+        super(DeferredWidget, self).__init__(parent)
+        self.build_function = build_function
+        self.widget = None
+
+        self.box = QtWidgets.QVBoxLayout()
+        self.box.setContentsMargins(0, 0, 0, 0)
+        self.setLayout(self.box)
+
+    def isBuilt(self):
+        return self.widget is not None
+
+    # Builds the contents if they weren't built yet, and returns them
+    def build(self):
+        if self.widget is None:
+            self.widget = self.build_function()
+            self.box.addWidget(self.widget)
+        return self.widget
+
+    def showEvent(self, event):
+        self.build()
+        super(DeferredWidget, self).showEvent(event)
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Window showing the counters, DAC outputs and lock status of several Red Pitayas at once, one row per box (see DeviceManager.py).
+The boxes are polled from DeviceManager's background thread, so a slow or unreachable box never freezes the window.
+
+    python DeviceDashboard.py 192.168.0.150 192.168.0.151:5001=comb2
+    python DeviceDashboard.py --mock 4
+
+"""
+from __future__ import print_function
+import sys
+import argparse
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+import DeviceManager
+
+
+class DeviceDashboard(QtWidgets.QWidget):
+    statusesReceived = QtCore.pyqtSignal(object)   # list of DeviceManager.DeviceStatus, emitted from the polling thread
+
+    COLUMNS = ('device', 'state', 'counter0 [Hz]', 'counter1 [Hz]', 'DAC0', 'DAC1', 'DAC2', 'lock 0', 'lock 1', 'lock 2', 'latency [ms]', 'error')
+    # same colors as the lock status display of XEM_GUI_MainWindow.py
+    LOCK_STATE_COLORS = {'locked': 'green', 'railed': 'orange', 'residuals>threshold': 'red', 'idle': None}
+
+    def __init__(self, manager, period=0.5, parent=None):
+        super(DeviceDashboard, self).__init__(parent)
+        self.manager = manager
+        self.period = period
+
+        self.table = QtWidgets.QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.table.verticalHeader().setVisible(False)
+        self.qlbl_cycle = QtWidgets.QLabel('')
+
+        vbox = QtWidgets.QVBoxLayout()
+        vbox.addWidget(self.table)
+        vbox.addWidget(self.qlbl_cycle)
+        self.setLayout(vbox)
+        self.setWindowTitle('Red Pitaya dashboard')
+        self.resize(1100, 300)
+
+        # queued connection: the table is only touched from the GUI thread
+        self.statusesReceived.connect(self.updateTable)
+
+    def start(self):
+        self.manager.start_polling(self.period, self.statusesReceived.emit)
+
+    def stop(self):
+        self.manager.stop_polling()
+
+    def closeEvent(self, event):
+        self.stop()
+        super(DeviceDashboard, self).closeEvent(event)
+
+    def setCell(self, row, column, strText, strColor=None):
+        item = QtWidgets.QTableWidgetItem(strText)
+        if strColor is not None:
+            item.setBackground(QtGui.QColor(strColor))
+            item.setForeground(QtGui.QColor('white'))
+        self.table.setItem(row, column, item)
+
+    def updateTable(self, statuses):
+        self.table.setRowCount(len(statuses))
+        for (row, status) in enumerate(statuses):
+            self.setCell(row, 0, status.name)
+            self.setCell(row, 1, 'ok' if status.bConnected else 'DOWN', None if status.bConnected else 'red')
+            if status.bConnected:
+                values = [DeviceManager.format_frequency(status.counter0), DeviceManager.format_frequency(status.counter1), str(status.dac0), str(status.dac1), str(status.dac2)]
+            else:
+                values = ['-'] * 5
+            for (k, strValue) in enumerate(values):
+                self.setCell(row, 2+k, strValue)
+            for k in range(3):
+                if status.bConnected:
+                    strLockState = DeviceManager.get_lock_state(status.leds, k)
+                    self.setCell(row, 7+k, strLockState, self.LOCK_STATE_COLORS[strLockState])
+                else:
+                    self.setCell(row, 7+k, '-')
+            self.setCell(row, 10, '%.1f' % (1e3*status.latency))
+            self.setCell(row, 11, status.strError)
+        if statuses:
+            self.qlbl_cycle.setText('%d device(s), slowest poll: %.1f ms' % (len(statuses), 1e3*max(status.latency for status in statuses)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Shows the counters, DAC outputs and lock status of several Red Pitayas at once.')
+    parser.add_argument('targets', nargs='*', help='devices as IP, IP:PORT, IP=name or IP:PORT=name (port 5000 by default)')
+    parser.add_argument('--period', type=float, default=0.5, help='seconds between two polls of all the devices')
+    parser.add_argument('--mock', type=int, default=0, metavar='N', help='also monitor N local mock servers')
+    args = parser.parse_args(argv)
+
+    fleet = None
+    targets = [DeviceManager.parse_target(strTarget) for strTarget in args.targets]
+    if args.mock:
+        import MonitorTCPMockServer
+        fleet = MonitorTCPMockServer.MonitorTCPMockFleet(args.mock)
+        targets += [(HOST, PORT, None) for (HOST, PORT) in fleet.targets]
+    if not targets:
+        parser.error('no devices to monitor')
+
+    app = QtWidgets.QApplication.instance()
+    if app is None:
+        app = QtWidgets.QApplication(sys.argv)
+    try:
+        with DeviceManager.DeviceManager() as manager:
+            for (HOST, PORT, name) in targets:
+                manager.add_device(HOST, PORT, name)
+            dashboard = DeviceDashboard(manager, args.period)
+            dashboard.show()
+            dashboard.start()
+            return app.exec_()
+    finally:
+        if fleet is not None:
+            fleet.close()
+
+if __name__ == '__main__':
+    sys.exit(main())
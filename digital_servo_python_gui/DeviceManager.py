@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Monitoring of several Red Pitayas from a single process: one SuperLaserLand_JD_RP per box, all polled concurrently from a thread pool,
+so that a polling cycle takes as long as the slowest box instead of the sum of all of them.
+
+Each poll reads the zero-deadtime counters, the current DAC values and the status flags (lock LEDs) of a box in a single round trip
+(see SuperLaserLand_JD_RP.read_counters_and_status()). A box which doesn't answer doesn't hold up the others:
+its error is reported in its DeviceStatus, and it is reconnected in the background, with backoff (see RP_PLL_connector).
+
+The boxes are only read, never configured: this runs alongside the GUIs which control them, or on its own as a dashboard:
+    python DeviceManager.py 192.168.0.150 192.168.0.151:5001=comb2
+    python DeviceManager.py --mock 4                    # against 4 local mock servers, see MonitorTCPMockServer.py
+DeviceDashboard.py shows the same information in a window.
+
+"""
+from __future__ import print_function
+import sys
+import time
+import argparse
+import threading
+import collections
+import concurrent.futures
+import logging
+
+from RP_PLL import RP_PLL_connector, CommsError
+from SuperLaserLand_JD_RP import SuperLaserLand_JD_RP
+
+logger = logging.getLogger(__name__)
+
+# Result of one poll of one device. The values are None when the device is not connected,
+# and counter0/counter1 (in Hz) are also None when the box has no new counter sample since the previous poll.
+# leds is (LED_G0, LED_R0, LED_G1, LED_R1, LED_G2, LED_R2), like SuperLaserLand_JD_RP.readLEDs(). latency is the duration of the poll, in seconds.
+DeviceStatus = collections.namedtuple('DeviceStatus', ['name', 'HOST', 'PORT', 'bConnected', 'timestamp', 'latency',
+                                                       'samples_number', 'counter0', 'counter1', 'dac0', 'dac1', 'dac2', 'status_flags', 'leds', 'strError'])
+
+
+# One box and its connection. poll() is only called from one thread at a time.
+class ManagedDevice():
+
+    def __init__(self, HOST, PORT=5000, name=None, reconnect_min_delay=0.5, reconnect_max_delay=10.):
+        self.HOST = HOST
+        self.PORT = PORT
+        self.name = name if name is not None else '%s:%d' % (HOST, PORT)
+        self.sl = SuperLaserLand_JD_RP()
+        self.connector = RP_PLL_connector(HOST, PORT, min_delay=reconnect_min_delay, max_delay=reconnect_max_delay)
+        self.strError = ''
+
+    def isConnected(self):
+        return self.sl.dev.valid_socket
+
+    # Moves the connection along without blocking, returns True once connected
+    def try_connect(self):
+        if self.isConnected():
+            return True
+        if self.connector.state == RP_PLL_connector.DISCONNECTED:
+            self.connector.start()
+        if self.connector.poll() != RP_PLL_connector.CONNECTED:
+            self.strError = self.connector.strLastError or self.connector.state
+            return False
+        # no bulk connections: the monitoring only reads a few registers
+        self.sl.dev.OpenTCPConnection(self.HOST, self.PORT, number_of_bulk_connections=0, sock=self.connector.take_socket())
+        if not self.isConnected():
+            self.strError = 'could not connect'
+            return False
+        try:
+            # the counter scaling depends on this setting
+            self.sl.getCounterMode()
+        except CommsError as e:
+            self.strError = str(e)
+            return False
+        self.strError = ''
+        logger.info('Red_Pitaya_GUI:DeviceManager: connected to %s (%s:%d)' % (self.name, self.HOST, self.PORT))
+        return True
+
+    def poll(self):
+        start_time = time.perf_counter()
+        values = None
+        if self.try_connect():
+            try:
+                values = self.sl.read_counters_and_status()
+            except (CommsError, OSError) as e:
+                # in stand-alone mode, the connection has already been closed by RP_PLL_device.socketErrorEvent()
+                self.sl.dev.CloseTCPConnection()
+                self.strError = str(e)
+                logger.warning('Red_Pitaya_GUI:DeviceManager: lost the connection to %s (%s), reconnecting' % (self.name, self.strError))
+        if values is None:
+            values = dict.fromkeys(('samples_number', 'counter0', 'counter1', 'dac0', 'dac1', 'dac2', 'status_flags', 'leds'))
+        return DeviceStatus(self.name, self.HOST, self.PORT, self.isConnected(), time.time(), time.perf_counter() - start_time, strError=self.strError, **values)
+
+    def close(self):
+        self.connector.cancel()
+        try:
+            self.sl.dev.sock.close()
+        except (OSError, AttributeError):
+            pass    # no connection (None, or the socket_placeholder of a device which never connected)
+        self.sl.dev.CloseTCPConnection()
+
+
+class DeviceManager():
+
+    def __init__(self, max_workers=32, reconnect_min_delay=0.5, reconnect_max_delay=10.):
+        self.reconnect_min_delay = reconnect_min_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self.devices = collections.OrderedDict()    # name -> ManagedDevice
+        self.lock = threading.Lock()                # protects self.devices, and makes sure that only one poll_all() runs at a time
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self.polling_thread = None
+        self.stop_event = threading.Event()
+
+    def add_device(self, HOST, PORT=5000, name=None):
+        device = ManagedDevice(HOST, PORT, name, self.reconnect_min_delay, self.reconnect_max_delay)
+        with self.lock:
+            if device.name in self.devices:
+                raise ValueError('DeviceManager: there is already a device named %s' % device.name)
+            self.devices[device.name] = device
+        return device
+
+    def remove_device(self, name):
+        with self.lock:
+            device = self.devices.pop(name)
+        device.close()
+
+    # Waits until all the devices are connected, or until timeout. Returns the names of the devices which are still not connected.
+    def connect_all(self, timeout=2.):
+        deadline = time.perf_counter() + timeout
+        with self.lock:
+            devices = list(self.devices.values())
+        while True:
+            not_connected = [device.name for device in devices if not device.try_connect()]
+            if not not_connected or time.perf_counter() > deadline:
+                return not_connected
+            time.sleep(0.02)
+
+    # Polls all the devices concurrently, and returns the list of DeviceStatus, in the order in which the devices were added
+    def poll_all(self):
+        with self.lock:
+            futures = [self.executor.submit(device.poll) for device in self.devices.values()]
+            return [future.result() for future in futures]
+
+    # Calls callback(list of DeviceStatus) every period seconds, from a background thread, until stop_polling()
+    def start_polling(self, period, callback):
+        self.stop_polling()
+        self.stop_event.clear()
+        self.polling_thread = threading.Thread(target=self.run_polling, args=(period, callback), daemon=True)
+        self.polling_thread.start()
+
+    def stop_polling(self):
+        if self.polling_thread is not None:
+            self.stop_event.set()
+            self.polling_thread.join()
+            self.polling_thread = None
+
+    def run_polling(self, period, callback):
+        next_poll_time = time.perf_counter()
+        while not self.stop_event.is_set():
+            callback(self.poll_all())
+            next_poll_time += period
+            if next_poll_time < time.perf_counter():
+                # the devices are slower than period: don't try to catch up
+                next_poll_time = time.perf_counter()
+            self.stop_event.wait(next_poll_time - time.perf_counter())
+
+    def close(self):
+        self.stop_polling()
+        with self.lock:
+            devices = list(self.devices.values())
+            self.devices.clear()
+        for device in devices:
+            device.close()
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+# Status of lock k from its two LEDs, with the same meaning as the (commented out) status display of XEM_GUI_MainWindow.py
+def get_lock_state(leds, k):
+    (LED_G, LED_R) = leds[2*k:2*k+2]
+    if LED_G:
+        return 'railed' if LED_R else 'locked'
+    return 'residuals>threshold' if LED_R else 'idle'
+
+def format_frequency(value):
+    return '-' if value is None else '%.3f' % value
+
+def format_dashboard(statuses):
+    lines = ['%-22s %-6s %16s %16s %7s %7s %7s %-24s %8s  %s' % ('device', 'state', 'counter0 [Hz]', 'counter1 [Hz]', 'dac0', 'dac1', 'dac2', 'locks', 'latency', 'error')]
+    for status in statuses:
+        if status.bConnected:
+            strLocks = ','.join(get_lock_state(status.leds, k) for k in range(3))
+            lines.append('%-22s %-6s %16s %16s %7d %7d %7d %-24s %6.1f ms' % (status.name, 'ok', format_frequency(status.counter0), format_frequency(status.counter1),
+                status.dac0, status.dac1, status.dac2, strLocks, 1e3*status.latency))
+        else:
+            lines.append('%-22s %-6s %16s %16s %7s %7s %7s %-24s %6.1f ms  %s' % (status.name, 'DOWN', '-', '-', '-', '-', '-', '-', 1e3*status.latency, status.strError))
+    return '\n'.join(lines)
+
+# 'IP', 'IP:PORT', 'IP=name' or 'IP:PORT=name' -> (HOST, PORT, name)
+def parse_target(strTarget):
+    (strTarget, _, name) = strTarget.partition('=')
+    (HOST, _, PORT) = strTarget.partition(':')
+    return (HOST, int(PORT) if PORT else 5000, name or None)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Monitors the counters, DAC outputs and lock status of several Red Pitayas at once.')
+    parser.add_argument('targets', nargs='*', help='devices as IP, IP:PORT, IP=name or IP:PORT=name (port 5000 by default)')
+    parser.add_argument('--period', type=float, default=1., help='seconds between two polls of all the devices')
+    parser.add_argument('--count', type=int, default=0, help='number of polls, 0 to run until interrupted')
+    parser.add_argument('--mock', type=int, default=0, metavar='N', help='also monitor N local mock servers')
+    args = parser.parse_args(argv)
+
+    fleet = None
+    targets = [parse_target(strTarget) for strTarget in args.targets]
+    if args.mock:
+        import MonitorTCPMockServer
+        fleet = MonitorTCPMockServer.MonitorTCPMockFleet(args.mock)
+        targets += [(HOST, PORT, None) for (HOST, PORT) in fleet.targets]
+    if not targets:
+        parser.error('no devices to monitor')
+
+    try:
+        with DeviceManager() as manager:
+            for (HOST, PORT, name) in targets:
+                manager.add_device(HOST, PORT, name)
+            manager.connect_all()
+            number_of_polls = 0
+            while args.count == 0 or number_of_polls < args.count:
+                start_time = time.perf_counter()
+                statuses = manager.poll_all()
+                print(format_dashboard(statuses))
+                print('polled %d device(s) in %.1f ms\n' % (len(statuses), 1e3*(time.perf_counter()-start_time)))
+                number_of_polls += 1
+                time.sleep(max(0., args.period - (time.perf_counter()-start_time)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if fleet is not None:
+            fleet.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
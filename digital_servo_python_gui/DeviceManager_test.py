@@ -0,0 +1,78 @@
+import socket
+import struct
+import time
+
+from DeviceManager import DeviceManager, format_dashboard, get_lock_state, parse_target
+from MonitorTCPMockServer import MonitorTCPMockFleet
+from RP_PLL import RP_PLL_device
+from SuperLaserLand_JD_RP import SuperLaserLand_JD_RP
+
+
+def set_counters(server, samples_number, counter0, counter1, dacs, status_flags):
+    reg = lambda bus_addr: RP_PLL_device.FPGA_BASE_ADDR + bus_addr*4
+    server.write_register(reg(SuperLaserLand_JD_RP.BUS_ADDR_ZERO_DEADTIME_SAMPLES_NUMBER), samples_number)
+    for (counter, bus_addr) in [(counter0, SuperLaserLand_JD_RP.BUS_ADDR_ZERO_DEADTIME_COUNTER0_LSBS), (counter1, SuperLaserLand_JD_RP.BUS_ADDR_ZERO_DEADTIME_COUNTER1_LSBS)]:
+        (lsbs, msbs) = struct.unpack('=II', struct.pack('=q', counter))
+        server.write_register(reg(bus_addr), lsbs)
+        server.write_register(reg(bus_addr+1), msbs)
+    # sign-extended to 32 bits, like in dpll_wrapper.v
+    server.write_register(reg(SuperLaserLand_JD_RP.BUS_ADDR_DAC0_CURRENT), dacs[0] & 0xFFFFFFFF)
+    server.write_register(reg(SuperLaserLand_JD_RP.BUS_ADDR_DAC1_CURRENT), dacs[1] & 0xFFFFFFFF)
+    server.write_register(reg(SuperLaserLand_JD_RP.BUS_ADDR_DAC2_CURRENT), dacs[2])
+    server.write_register(reg(SuperLaserLand_JD_RP.BUS_ADDR_STATUS_FLAGS), status_flags)
+
+def get_unused_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def test_parse_target():
+    assert parse_target('192.168.0.150') == ('192.168.0.150', 5000, None)
+    assert parse_target('192.168.0.151:5001=comb2') == ('192.168.0.151', 5001, 'comb2')
+
+def test_instances_dont_share_state(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (sl0, sl1) = (SuperLaserLand_JD_RP(), SuperLaserLand_JD_RP())
+    sl0.last_zdtc_samples_number_counter[0] = 12
+    sl0.DACs_limit_low[2] = 100
+    assert sl1.last_zdtc_samples_number_counter[0] == 0
+    assert sl1.DACs_limit_low[2] == 0
+    assert SuperLaserLand_JD_RP.DACs_limit_low[2] == 0
+
+def test_poll_all(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    reply_delay = 0.2
+    with MonitorTCPMockFleet(4, reply_delay=reply_delay) as fleet, DeviceManager() as manager:
+        for (k, server) in enumerate(fleet.servers):
+            # the counter mode register reads 0 (rectangular averaging), so 1 Hz is 2**10 counts with the default gate time of fs samples
+            set_counters(server, 7, (k+1) * 2**10, -3 * 2**10, (-100, 200+k, 40000), (1 << 4) | (1 << 9))
+            manager.add_device(server.HOST, server.PORT, 'box%d' % k)
+        manager.add_device('127.0.0.1', get_unused_port(), 'unreachable')
+        assert manager.connect_all(timeout=1.) == ['unreachable']
+
+        start_time = time.perf_counter()
+        statuses = manager.poll_all()
+        duration = time.perf_counter() - start_time
+        # the devices are polled concurrently: a cycle takes about as long as the slowest device, not the sum of all of them
+        assert duration < 2.5*reply_delay
+
+        assert [status.name for status in statuses] == ['box0', 'box1', 'box2', 'box3', 'unreachable']
+        for (k, status) in enumerate(statuses[:4]):
+            assert status.bConnected and status.strError == ''
+            assert status.samples_number == 7
+            assert (status.counter0, status.counter1) == (k+1., -3.)
+            assert (status.dac0, status.dac1, status.dac2) == (-100, 200+k, 40000)
+            assert status.leds == (1, 0, 0, 0, 0, 1)
+            assert [get_lock_state(status.leds, n) for n in range(3)] == ['locked', 'idle', 'residuals>threshold']
+        assert not statuses[4].bConnected and statuses[4].counter0 is None and statuses[4].strError != ''
+        assert 'DOWN' in format_dashboard(statuses).splitlines()[-1]
+
+        # no new counter sample since the last poll:
+        statuses = manager.poll_all()
+        assert statuses[0].counter0 is None and statuses[0].dac0 == -100
+
+        # a device which goes away is reported, and doesn't stop the polling of the others:
+        fleet.servers[1].close()
+        manager.devices['box1'].sl.dev.sock.shutdown(socket.SHUT_RDWR)
+        statuses = manager.poll_all()
+        assert [status.bConnected for status in statuses] == [True, False, True, True, False]
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+Non-blocking discovery of the Red Pitayas on all the local IPv4 networks at once, with a cache of the previous results.
+
+Same protocol as UDPRedPitayaDiscovery: an empty UDP packet is broadcast on port 1952, and each Red Pitaya answers
+with its MAC address (as ascii) on port 1952+1 of the sender. The broadcast is sent from every local IPv4 interface,
+to the broadcast address of its network and to 255.255.255.255 (see get_local_IPv4_interfaces()), and the answers are read with a selector as they arrive, so nothing ever sleeps.
+
+DiscoveryCache remembers the last IP address of each MAC address in discovery_cache.xml, in the per-user settings folder
+(see DEFAULT_CACHE_FILENAME), so that a known box can be listed (and reconnected to) before any answer comes back.
+Only its owner saves it: DiscoveryEngine.run() doesn't, so the command-line discovery and the fleet deployment leave it alone.
+
+"""
+from __future__ import print_function
+import os
+import sys
+import socket
+import struct
+import selectors
+import time
+import collections
+import logging
+import xml.etree.ElementTree as ET
+
+logger = logging.getLogger(__name__)
+
+# %APPDATA%\SuperLaserLand on Windows, ~/.SuperLaserLand elsewhere
+if 'APPDATA' in os.environ:
+    SETTINGS_FOLDER = os.path.join(os.environ['APPDATA'], 'SuperLaserLand')
+else:
+    SETTINGS_FOLDER = os.path.join(os.path.expanduser('~'), '.SuperLaserLand')
+DEFAULT_CACHE_FILENAME = os.path.join(SETTINGS_FOLDER, 'discovery_cache.xml')
+
+
+# One IPv4 address of a local network interface, with the broadcast address of its network.
+# strName is the name of the interface, or '' if it isn't known.
+LocalInterface = collections.namedtuple('LocalInterface', ['strName', 'strIP', 'strBroadcast'])
+
+# Returns the IPv4 interfaces of this computer, except the loopback ones, each with its actual broadcast address.
+# psutil lists them on every platform, but it is optional: without it, they are listed with ioctls on Linux,
+# and as a last resort, from the addresses of the host name and the address used for the default route, with a /24 guess of their broadcast address.
+def get_local_IPv4_interfaces():
+    for function in (get_interfaces_from_psutil, get_interfaces_from_ioctl):
+        try:
+            interfaces = function()
+        except (ImportError, OSError, AttributeError) as e:
+            logger.info('Red_Pitaya_GUI:DiscoveryEngine: {}() failed: {}'.format(function.__name__, e))
+            continue
+        if interfaces is not None:
+            return [interface for interface in interfaces if not interface.strIP.startswith('127.')]
+    return [LocalInterface('', strIP, guess_broadcast_address(strIP)) for strIP in get_local_IPv4_addresses()]
+
+def get_interfaces_from_psutil():
+    import psutil
+    interfaces = []
+    for (strName, addresses) in psutil.net_if_addrs().items():
+        for address in addresses:
+            if address.family != socket.AF_INET:
+                continue
+            strBroadcast = address.broadcast
+            if not strBroadcast and address.netmask:
+                strBroadcast = compute_broadcast_address(address.address, address.netmask)
+            if strBroadcast:
+                interfaces.append(LocalInterface(strName, address.address, strBroadcast))
+    return interfaces
+
+# Linux only: SIOCGIFADDR and SIOCGIFBRDADDR on each interface of socket.if_nameindex(). Returns None on the other platforms.
+def get_interfaces_from_ioctl():
+    if not sys.platform.startswith('linux'):
+        return None
+    import fcntl
+    SIOCGIFADDR = 0x8915
+    SIOCGIFBRDADDR = 0x8919
+    interfaces = []
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for (index, strName) in socket.if_nameindex():
+            ifreq = struct.pack('256s', strName.encode('ascii', 'replace')[:15])
+            try:
+                # the address is the sockaddr_in of the reply, after the 16 bytes of the interface name
+                strIP = socket.inet_ntoa(fcntl.ioctl(sock.fileno(), SIOCGIFADDR, ifreq)[20:24])
+                strBroadcast = socket.inet_ntoa(fcntl.ioctl(sock.fileno(), SIOCGIFBRDADDR, ifreq)[20:24])
+            except OSError:
+                continue    # no IPv4 address on this interface
+            if strBroadcast != '0.0.0.0':
+                interfaces.append(LocalInterface(strName, strIP, strBroadcast))
+    return interfaces
+
+# Returns the IPv4 addresses of this computer, except the loopback ones.
+# There is no portable way to list the interfaces with the standard library, so this combines the addresses of the host name
+# with the address used for the default route.
+def get_local_IPv4_addresses():
+    addresses = []
+    try:
+        for (family, _, _, _, sockaddr) in socket.getaddrinfo(socket.gethostname(), None, socket.AF_INET):
+            addresses.append(sockaddr[0])
+    except OSError:
+        pass
+    try:
+        # connecting a UDP socket sends nothing, it only picks the source address
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.connect(('8.8.8.8', 80))
+            addresses.append(sock.getsockname()[0])
+    except OSError:
+        pass
+    return [address for address in collections.OrderedDict.fromkeys(addresses) if not address.startswith('127.')]
+
+# Broadcast address of the network of an IPv4 address, given its netmask
+def compute_broadcast_address(strIP, strNetmask):
+    (ip,) = struct.unpack('!I', socket.inet_aton(strIP))
+    (netmask,) = struct.unpack('!I', socket.inet_aton(strNetmask))
+    return socket.inet_ntoa(struct.pack('!I', (ip & netmask) | (~netmask & 0xFFFFFFFF)))
+
+# Broadcast address of the /24 network of an IPv4 address
+def guess_broadcast_address(strIP):
+    return '.'.join(strIP.split('.')[:3] + ['255'])
+
+
+class DiscoveryCache():
+
+    # strFilename=None keeps the cache in memory only
+    def __init__(self, strFilename=DEFAULT_CACHE_FILENAME):
+        self.strFilename = strFilename
+        # serial (MAC address without ':', like the keys of devices_data) -> (IP, MAC, time last seen)
+        self.devices = collections.OrderedDict()
+        self.load()
+
+    def load(self):
+        if self.strFilename is None:
+            return
+        try:
+            tree = ET.parse(self.strFilename)
+        except (OSError, ET.ParseError):
+            return  # no cache yet
+        for device in tree.getroot():
+            try:
+                self.devices[device.attrib['strSerial']] = (device.attrib['IP'], device.attrib['MAC'], float(device.attrib['last_seen']))
+            except (KeyError, ValueError):
+                continue
+
+    def save(self):
+        if self.strFilename is None:
+            return
+        root = ET.Element('discovery_cache')
+        for (strSerial, (strIP, strMAC, last_seen)) in self.devices.items():
+            ET.SubElement(root, 'Device', strSerial=strSerial, IP=strIP, MAC=strMAC, last_seen='%.0f' % last_seen)
+        try:
+            strFolder = os.path.dirname(self.strFilename)
+            if strFolder:
+                os.makedirs(strFolder, exist_ok=True)
+            ET.ElementTree(root).write(self.strFilename)
+        except OSError as e:
+            logger.warning('Red_Pitaya_GUI:DiscoveryCache: could not write {}: {}'.format(self.strFilename, e))
+
+    # Returns True if this is a new device or if its IP address changed
+    def update(self, strIP, strMAC, last_seen=None):
+        strSerial = strMAC.replace(':', '')
+        previous = self.devices.get(strSerial)
+        self.devices[strSerial] = (strIP, strMAC, time.time() if last_seen is None else last_seen)
+        return previous is None or previous[0] != strIP
+
+    # Returns the last IP address of a serial number (MAC address with or without ':'), or None if it was never seen
+    def lookup(self, strSerial):
+        entry = self.devices.get(strSerial.replace(':', ''))
+        return None if entry is None else entry[0]
+
+    # Returns a list of dicts with the 'IP', 'MAC', 'serial' and 'last_seen' of every cached device, most recently seen first,
+    # merged with the entry of devices_data (name, color, shorthand, config file) for the known boxes.
+    def known_devices(self, devices_data={}):
+        devices = []
+        for (strSerial, (strIP, strMAC, last_seen)) in self.devices.items():
+            device = dict(devices_data.get(strSerial, {}))
+            device.update({'IP': strIP, 'MAC': strMAC, 'serial': strSerial, 'last_seen': last_seen})
+            devices.append(device)
+        return sorted(devices, key=lambda device: -device['last_seen'])
+
+
+class DiscoveryEngine():
+
+    def __init__(self, broadcast_addresses=(), port_number=1952, cache=None, bAllInterfaces=True):
+        self.port_number = port_number
+        self.broadcast_addresses = list(broadcast_addresses)   # always used, in addition to those of the local interfaces
+        self.bAllInterfaces = bAllInterfaces
+        self.cache = cache
+
+        self.selector = selectors.DefaultSelector()
+        # answers of the current round (since the last send_broadcast()), IP -> MAC
+        self.answers = collections.OrderedDict()
+
+        HOST_LOCALHOST = ''       # means all the local addresses
+        self.sock_server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock_server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock_server.setblocking(False)
+        self.sock_server.bind((HOST_LOCALHOST, self.port_number+1))
+        self.selector.register(self.sock_server, selectors.EVENT_READ)
+
+    def close(self):
+        self.selector.close()
+        self.sock_server.close()
+
+    # Returns the list of (interface name, local IP, broadcast address) to which the discovery packet is sent.
+    # A local IP of '' lets the OS choose, an interface name of '' leaves the choice of the interface to the routing table.
+    def get_destinations(self):
+        destinations = [('', '', strAddress) for strAddress in self.broadcast_addresses]
+        if self.bAllInterfaces:
+            destinations.append(('', '', '255.255.255.255'))
+            for interface in get_local_IPv4_interfaces():
+                destinations.append((interface.strName, interface.strIP, interface.strBroadcast))
+                # the limited broadcast only goes out of the interface the socket is bound to
+                destinations.append((interface.strName, interface.strIP, '255.255.255.255'))
+        return list(collections.OrderedDict.fromkeys(destinations))
+
+    # Starts a new round: forgets the answers of the previous one, and sends the discovery packet to all the destinations at once
+    def send_broadcast(self):
+        self.answers.clear()
+        for (strInterface, strLocalIP, strAddress) in self.get_destinations():
+            try:
+                with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+                    if strInterface and hasattr(socket, 'SO_BINDTODEVICE'):
+                        # binding to the source address alone doesn't keep 255.255.255.255 off the default route on Linux
+                        try:
+                            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BINDTODEVICE, strInterface.encode())
+                        except OSError:
+                            pass    # needs CAP_NET_RAW on older kernels, the directed broadcast still reaches that network
+                    sock.bind((strLocalIP, 0))
+                    sock.sendto(b"", (strAddress, self.port_number))
+            except OSError as e:
+                # typically a disconnected interface, the other ones are still worth trying
+                logger.info('Red_Pitaya_GUI:DiscoveryEngine: could not send the discovery packet to {} from {}: {}'.format(strAddress, strInterface or strLocalIP or 'default interface', e))
+
+    # Reads all the answers which have arrived, waiting at most timeout seconds for the first one (0 returns right away).
+    # Returns the list of (IP, MAC) which answered for the first time in this round.
+    def poll(self, timeout=0):
+        new_answers = []
+        while self.selector.select(timeout):
+            timeout = 0
+            try:
+                (mac_address_data, host_info) = self.sock_server.recvfrom(4096)
+            except BlockingIOError:
+                break
+            except OSError:
+                # Windows reports ICMP port unreachable errors on the next recvfrom()
+                continue
+            strIP = host_info[0]
+            strMAC = mac_address_data.decode('ascii', 'replace') # received data is in bytes format and we handle the mac address as an ascii string internally
+            if strIP in self.answers:
+                continue
+            self.answers[strIP] = strMAC
+            if self.cache is not None:
+                self.cache.update(strIP, strMAC)
+            new_answers.append((strIP, strMAC))
+        return new_answers
+
+    # Sends the discovery packet and collects the answers for duration seconds. callback(strIP, strMAC) is called as they arrive.
+    # Returns the list of (IP, MAC) of this round. The answers are added to the cache, but saving it is left to its owner.
+    def run(self, duration=1., callback=None):
+        self.send_broadcast()
+        deadline = time.perf_counter() + duration
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            for (strIP, strMAC) in self.poll(remaining):
+                if callback is not None:
+                    callback(strIP, strMAC)
+        return list(self.answers.items())
+
+
+def main():
+    # only read: the answers of this round are not saved
+    cache = DiscoveryCache()
+    print('Cached devices:')
+    for device in cache.known_devices():
+        print('    %s (%s), last seen %s' % (device['IP'], device['MAC'], time.ctime(device['last_seen'])))
+    engine = DiscoveryEngine(cache=cache)
+    print('Broadcasting to: %s' % ', '.join('%s (from %s)' % (strAddress, ' '.join(filter(None, (strInterface, strLocalIP))) or 'default') for (strInterface, strLocalIP, strAddress) in engine.get_destinations()))
+    engine.run(2., lambda strIP, strMAC: print('Answer from %s (%s)' % (strIP, strMAC)))
+    engine.close()
+
+if __name__ == "__main__":
+    main()
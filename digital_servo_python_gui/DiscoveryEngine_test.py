@@ -0,0 +1,107 @@
+import socket
+import threading
+import time
+
+from DiscoveryEngine import DiscoveryEngine, DiscoveryCache, guess_broadcast_address, compute_broadcast_address, get_local_IPv4_interfaces
+
+
+# stands in for the discovery service of a Red Pitaya: answers each packet with its MAC address, on port_number+1 of the sender
+class RedPitaya_discovery_mock():
+    def __init__(self, strIP, port_number, strMAC, delay=0.):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((strIP, port_number))
+        self.sock.settimeout(0.1)
+        self.port_number = port_number
+        self.strMAC = strMAC
+        self.delay = delay
+        self.bRunning = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while self.bRunning:
+            try:
+                (data, (strSenderIP, sender_port)) = self.sock.recvfrom(4096)
+            except socket.timeout:
+                continue
+            time.sleep(self.delay)
+            self.sock.sendto(self.strMAC.encode('ascii'), (strSenderIP, self.port_number+1))
+
+    def close(self):
+        self.bRunning = False
+        self.thread.join()
+        self.sock.close()
+
+def get_free_port_pair():
+    # the engine listens on port_number+1
+    while True:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.bind(('127.0.0.1', 0))
+            port_number = sock.getsockname()[1]
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+                sock.bind(('', port_number+1))
+            return port_number
+        except OSError:
+            continue
+
+def test_guess_broadcast_address():
+    assert guess_broadcast_address('192.168.2.14') == '192.168.2.255'
+
+def test_compute_broadcast_address():
+    assert compute_broadcast_address('10.0.5.14', '255.255.0.0') == '10.0.255.255'
+    assert compute_broadcast_address('192.168.2.14', '255.255.255.252') == '192.168.2.15'
+
+def test_local_interfaces():
+    for interface in get_local_IPv4_interfaces():
+        assert not interface.strIP.startswith('127.')
+        socket.inet_aton(interface.strBroadcast)
+
+def test_discovery(tmp_path):
+    port_number = get_free_port_pair()
+    devices = [RedPitaya_discovery_mock('127.0.0.1', port_number, '00:26:32:f0:16:dc'),
+               RedPitaya_discovery_mock('127.0.0.2', port_number, '00:26:32:f0:52:c6', delay=0.2)]
+    cache = DiscoveryCache(str(tmp_path / 'discovery_cache.xml'))
+    engine = DiscoveryEngine(['127.0.0.1', '127.0.0.2'], port_number=port_number, cache=cache, bAllInterfaces=False)
+    try:
+        # the answers are streamed as they arrive:
+        answers_received = []
+        start_time = time.perf_counter()
+        answers = engine.run(1., lambda strIP, strMAC: answers_received.append((strIP, strMAC, time.perf_counter()-start_time)))
+        assert answers == [('127.0.0.1', '00:26:32:f0:16:dc'), ('127.0.0.2', '00:26:32:f0:52:c6')]
+        assert [answer[:2] for answer in answers_received] == answers
+        assert answers_received[0][2] < 0.15
+
+        # a non-blocking poll returns right away:
+        engine.send_broadcast()
+        start_time = time.perf_counter()
+        engine.poll()
+        assert time.perf_counter() - start_time < 0.05
+    finally:
+        engine.close()
+        for device in devices:
+            device.close()
+
+    # run() doesn't write the cache, its owner does:
+    assert not (tmp_path / 'discovery_cache.xml').exists()
+    cache.save()
+
+    # the results are in the cache, also once reloaded from disk, merged with devices_data:
+    cache = DiscoveryCache(str(tmp_path / 'discovery_cache.xml'))
+    assert cache.lookup('002632f016dc') == '127.0.0.1'
+    assert cache.lookup('00:26:32:f0:52:c6') == '127.0.0.2'
+    assert cache.lookup('002632f03d5b') is None
+    devices_data = {'002632f052c6': {'name': 'Red Pitaya 1', 'color': '#0e2f44'}}
+    known_devices = cache.known_devices(devices_data)
+    assert sorted(device['IP'] for device in known_devices) == ['127.0.0.1', '127.0.0.2']
+    assert [device.get('name') for device in known_devices if device['IP'] == '127.0.0.2'] == ['Red Pitaya 1']
+
+    # a new IP address replaces the cached one:
+    assert not cache.update('127.0.0.1', '00:26:32:f0:16:dc')
+    assert cache.update('127.0.0.3', '00:26:32:f0:16:dc')
+    assert cache.lookup('002632f016dc') == '127.0.0.3'
+
+    # the settings folder is created if needed:
+    cache.strFilename = str(tmp_path / 'settings' / 'discovery_cache.xml')
+    cache.save()
+    assert DiscoveryCache(cache.strFilename).lookup('002632f016dc') == '127.0.0.3'
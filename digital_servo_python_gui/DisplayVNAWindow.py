@@ -41,12 +41,10 @@ class DisplayVNAWindow(QtGui.QWidget):
 
     def runSytemIdentification(self):
     
-        # Check if another function is currently using the DDR2 logger:
-        if self.sl.bDDR2InUse:
+        # Block access to the DDR2 Logger to any other function until we are done, unless another function is currently using it:
+        if not self.sl.ddr2_arbiter.acquire('VNA'):
             print('DDR2 logger in use, cannot run identification')
             return
-        # Block access to the DDR2 Logger to any other function until we are done:
-        self.sl.bDDR2InUse = True
         
         # Reset the bStop flag (which is set when the user presses the stop button)
         self.bStop = False
@@ -68,7 +66,7 @@ class DisplayVNAWindow(QtGui.QWidget):
                 'Warning! The requested identification will take %.1f minute(s), are you sure you want to continue?' % (total_wait_time/60), QtGui.QMessageBox.Yes | 
                 QtGui.QMessageBox.No, QtGui.QMessageBox.No)
             if reply == QtGui.QMessageBox.No:
-                self.sl.bDDR2InUse = False
+                self.sl.ddr2_arbiter.release('VNA')
                 return
             
         
@@ -99,7 +97,7 @@ class DisplayVNAWindow(QtGui.QWidget):
         
         if self.bStop == True:
             # Operation was cancelled by user
-            self.sl.bDDR2InUse = False
+            self.sl.ddr2_arbiter.release('VNA')
             self.bStop = False
             self.qprogress_ident.setValue(0)
             self.sl.setVNA_mode_register(0, 1, 0)
@@ -113,12 +111,12 @@ class DisplayVNAWindow(QtGui.QWidget):
             # print(np.real(transfer_function_complex))
             # print(np.imag(transfer_function_complex))
         except:
-            self.sl.bDDR2InUse = False
+            self.sl.ddr2_arbiter.release('VNA')
             print("Exception reading VNA samples from DDR2")
             raise
             
         # Signal to other functions that they can use the DDR2 logger
-        self.sl.bDDR2InUse = False
+        self.sl.ddr2_arbiter.release('VNA')
 
         #print('runSytemIdentification(): after read')
         
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+Headless deployment of the FPGA bitfile and/or the monitor-tcp executable to many Red Pitayas at once.
+
+The devices are updated concurrently, at most max_parallel at a time, and each one is retried a few times before being reported as failed.
+Files which are already on a device are not sent again (see upload_file()), so retrying or re-running is cheap.
+
+Examples:
+    python FleetDeployment.py --bitfile red_pitaya_top.bit 192.168.2.10 192.168.2.11:5001
+    python FleetDeployment.py --bitfile red_pitaya_top.bit --monitor-tcp monitor-tcp/monitor-tcp --discover 192.168.2.255
+    python FleetDeployment.py --bitfile red_pitaya_top.bit --mock 8     # against 8 local mock servers, see MonitorTCPMockServer.py
+
+"""
+from __future__ import print_function
+import sys
+import time
+import socket
+import argparse
+import collections
+import concurrent.futures
+import logging
+
+from RP_PLL import RP_PLL_device, CommsError, FileInfoNotSupportedError
+import DiscoveryEngine
+
+logger = logging.getLogger(__name__)
+
+# Result of the deployment to one device.
+# bFPGAFirmwareSent and bCPUFirmwareSent are True if the file was sent, False if the device already had it, None if it wasn't deployed (or on failure).
+DeploymentResult = collections.namedtuple('DeploymentResult', ['HOST', 'PORT', 'bSuccess', 'number_of_attempts', 'bFPGAFirmwareSent', 'bCPUFirmwareSent', 'strError', 'duration'])
+
+
+#######################################################
+# Update steps for a single device, also used by initialConfiguration_RP.py
+#######################################################
+
+# Sends a file to a connected device, unless it already has an identical copy.
+# Returns True if the file was sent and acknowledged, False if it was already there,
+# and None if the server predates the file info packet, in which case the file is sent the old way, without acknowledgement.
+# For /opt/monitor-tcp, the old way goes through /opt/monitor-tcp-new since the running executable can't be overwritten.
+def upload_file(dev, strFilenameLocal, strFilenameRemote, progress_callback=None):
+    try:
+        return dev.upload_file_if_changed(strFilenameLocal, strFilenameRemote, progress_callback)
+    except FileInfoNotSupportedError:
+        # old servers close the connection on packets they don't know
+        logger.warning('Red_Pitaya_GUI:FleetDeployment: %s:%d did not answer the file info request, sending %s without acknowledgement' % (dev.HOST, dev.PORT, strFilenameRemote))
+    dev.OpenTCPConnection(dev.HOST, dev.PORT, number_of_bulk_connections=0)
+    if strFilenameRemote == '/opt/monitor-tcp':
+        strFilenameRemote = '/opt/monitor-tcp-new'
+    dev.write_file_on_remote(strFilenameLocal=strFilenameLocal, strFilenameRemote=strFilenameRemote)
+    return None
+
+# Sends the bitfile (unless it is already there) to a connected device, and programs the FPGA with it.
+# Returns the result of upload_file().
+def program_FPGA(dev, strFPGAFirmware, progress_callback=None):
+    bSent = upload_file(dev, strFPGAFirmware, '/opt/red_pitaya_top.bit', progress_callback)
+    if bSent is None:
+        time.sleep(2) # old server: the file wasn't acknowledged, this handles slow SD cards
+    dev.send_shell_command('cat /opt/red_pitaya_top.bit > /dev/xdevcfg')
+    # the server runs the command before handling the next packet, so this reply means that the FPGA has been programmed
+    dev.read_Zynq_register_32bits(dev.SYNC_READ_ADDR)
+    return bSent
+
+# Sends a new monitor-tcp to a connected device and reboots the server with it, unless the device already has this version.
+# Returns the result of upload_file(). The connection is closed by the reboot.
+def update_CPU_software(dev, strCPUFirmware, progress_callback=None):
+    # the server only replaces /opt/monitor-tcp once the new version is complete, so it can be written there directly
+    bSent = upload_file(dev, strCPUFirmware, '/opt/monitor-tcp', progress_callback)
+    if bSent is None:
+        # old server, the file was sent to a temporary location without acknowledgement.
+        # copy over old file
+        dev.send_shell_command('mv /opt/monitor-tcp-new /opt/monitor-tcp')
+    # set executable permissions, even if the file was already there: a previous attempt might have been interrupted before this
+    dev.send_shell_command('chmod +x /opt/monitor-tcp')
+    if bSent is False:
+        return bSent
+    # send "reboot monitor-tcp" command
+    dev.send_reboot_command()
+    return bSent
+
+def disconnect(dev):
+    try:
+        dev.sock.shutdown(socket.SHUT_RDWR)
+        dev.sock.close()
+    except (OSError, AttributeError):
+        pass
+    dev.CloseTCPConnection()
+
+# Waits until the server accepts connections again, after a reboot of monitor-tcp
+def wait_for_server(HOST, PORT, timeout=10.):
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            socket.create_connection((HOST, PORT), timeout=1.).close()
+            return
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise CommsError('%s:%d did not come back within %g s' % (HOST, PORT, timeout))
+            time.sleep(0.2)
+
+
+#######################################################
+# Fleet deployment
+#######################################################
+
+# Updates one device: monitor-tcp first (so that the bitfile benefits from the new server), then the FPGA.
+# Returns (bFPGAFirmwareSent, bCPUFirmwareSent), raises CommsError or OSError on failure.
+def deploy_to_device(HOST, PORT=5000, strFPGAFirmware=None, strCPUFirmware=None, progress_callback=None, reboot_timeout=10.):
+    dev = RP_PLL_device()
+    bFPGAFirmwareSent = None
+    bCPUFirmwareSent = None
+    if strCPUFirmware:
+        connect(dev, HOST, PORT)
+        try:
+            bCPUFirmwareSent = update_CPU_software(dev, strCPUFirmware, progress_callback)
+        finally:
+            disconnect(dev)
+        if bCPUFirmwareSent is not False:
+            time.sleep(0.5) # the server only restarts once it sees the connection closing
+            wait_for_server(HOST, PORT, reboot_timeout)
+    if strFPGAFirmware:
+        connect(dev, HOST, PORT)
+        try:
+            bFPGAFirmwareSent = program_FPGA(dev, strFPGAFirmware, progress_callback)
+        finally:
+            disconnect(dev)
+    return (bFPGAFirmwareSent, bCPUFirmwareSent)
+
+def connect(dev, HOST, PORT):
+    dev.OpenTCPConnection(HOST, PORT, number_of_bulk_connections=0)
+    if not dev.valid_socket:
+        raise CommsError('could not connect to %s:%d' % (HOST, PORT))
+
+# deploy_to_device() with retries. Never raises: the outcome is in the returned DeploymentResult.
+def deploy_with_retries(HOST, PORT=5000, strFPGAFirmware=None, strCPUFirmware=None, retries=2, retry_delay=2., progress_callback=None, reboot_timeout=10.):
+    start_time = time.perf_counter()
+    strError = ''
+    for attempt in range(1, retries+2):
+        try:
+            (bFPGAFirmwareSent, bCPUFirmwareSent) = deploy_to_device(HOST, PORT, strFPGAFirmware, strCPUFirmware, progress_callback, reboot_timeout)
+            return DeploymentResult(HOST, PORT, True, attempt, bFPGAFirmwareSent, bCPUFirmwareSent, '', time.perf_counter()-start_time)
+        except (CommsError, OSError) as e:
+            strError = '%s: %s' % (type(e).__name__, e)
+            logger.warning('Red_Pitaya_GUI:FleetDeployment: %s:%d: attempt %d failed (%s)' % (HOST, PORT, attempt, strError))
+            if attempt <= retries:
+                time.sleep(retry_delay)
+    return DeploymentResult(HOST, PORT, False, retries+1, None, None, strError, time.perf_counter()-start_time)
+
+# Deploys to all the targets ((HOST, PORT) tuples, or just HOST for port 5000), max_parallel devices at a time.
+# result_callback(result) is called as each device finishes, progress_callback((HOST, PORT), bytes_sent, file_size) during the uploads.
+# Returns the list of DeploymentResult, in the same order as targets.
+def deploy(targets, strFPGAFirmware=None, strCPUFirmware=None, max_parallel=4, retries=2, retry_delay=2., result_callback=None, progress_callback=None, reboot_timeout=10.):
+    targets = [(target, 5000) if isinstance(target, str) else tuple(target) for target in targets]
+    if not targets:
+        return []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(max_parallel, len(targets)))) as executor:
+        futures = []
+        for target in targets:
+            device_progress_callback = None
+            if progress_callback is not None:
+                device_progress_callback = (lambda target: lambda bytes_sent, file_size: progress_callback(target, bytes_sent, file_size))(target)
+            future = executor.submit(deploy_with_retries, target[0], target[1], strFPGAFirmware, strCPUFirmware, retries, retry_delay, device_progress_callback, reboot_timeout)
+            if result_callback is not None:
+                future.add_done_callback(lambda future: result_callback(future.result()))
+            futures.append(future)
+        return [future.result() for future in futures]
+
+# Broadcasts a discovery packet (on broadcast_address and on all the local networks) and collects the answers for duration seconds.
+# Returns a list of (IP, MAC) tuples, in the order in which the devices answered. The GUI's discovery cache is left untouched.
+def discover_devices(broadcast_address, duration=2.):
+    engine = DiscoveryEngine.DiscoveryEngine([broadcast_address])
+    try:
+        return engine.run(duration)
+    finally:
+        engine.close()
+
+
+def format_report(results):
+    strStatus = {True: 'sent', False: 'up to date', None: '-'}
+    lines = ['%-22s %-8s %-9s %-12s %-12s %s' % ('device', 'result', 'attempts', 'monitor-tcp', 'bitfile', 'error')]
+    for result in results:
+        lines.append('%-22s %-8s %-9d %-12s %-12s %s' % ('%s:%d' % (result.HOST, result.PORT), 'ok' if result.bSuccess else 'FAILED', result.number_of_attempts,
+            strStatus[result.bCPUFirmwareSent], strStatus[result.bFPGAFirmwareSent], result.strError))
+    return '\n'.join(lines)
+
+def parse_target(strTarget):
+    if ':' in strTarget:
+        (HOST, PORT) = strTarget.rsplit(':', 1)
+        return (HOST, int(PORT))
+    return (strTarget, 5000)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Deploys a FPGA bitfile and/or a monitor-tcp executable to many Red Pitayas at once.')
+    parser.add_argument('targets', nargs='*', help='devices as IP or IP:PORT (port 5000 by default)')
+    parser.add_argument('--bitfile', help='FPGA bitfile, written to /opt/red_pitaya_top.bit and programmed')
+    parser.add_argument('--monitor-tcp', dest='monitor_tcp', help='monitor-tcp executable, written to /opt/monitor-tcp and restarted')
+    parser.add_argument('--discover', metavar='BROADCAST_ADDRESS', help='also deploy to all the devices which answer a discovery broadcast on this address')
+    parser.add_argument('--discovery-time', type=float, default=2., help='seconds to wait for answers to the discovery broadcast')
+    parser.add_argument('--parallel', type=int, default=4, help='maximum number of devices updated at the same time')
+    parser.add_argument('--retries', type=int, default=2, help='number of retries for each device')
+    parser.add_argument('--mock', type=int, default=0, metavar='N', help='deploy to N local mock servers instead of real devices')
+    args = parser.parse_args(argv)
+
+    if not args.bitfile and not args.monitor_tcp:
+        parser.error('nothing to deploy, use --bitfile and/or --monitor-tcp')
+
+    fleet = None
+    targets = [parse_target(strTarget) for strTarget in args.targets]
+    if args.mock:
+        import MonitorTCPMockServer
+        fleet = MonitorTCPMockServer.MonitorTCPMockFleet(args.mock)
+        targets += fleet.targets
+    if args.discover:
+        for (strIP, strMAC) in discover_devices(args.discover, args.discovery_time):
+            print('Discovered %s (%s)' % (strIP, strMAC))
+            if (strIP, 5000) not in targets:
+                targets.append((strIP, 5000))
+    if not targets:
+        parser.error('no devices to deploy to')
+
+    print('Deploying to %d device(s), %d at a time...' % (len(targets), args.parallel))
+    def print_result(result):
+        print('%s:%d: %s' % (result.HOST, result.PORT, 'done' if result.bSuccess else 'FAILED (%s)' % result.strError))
+    try:
+        results = deploy(targets, args.bitfile, args.monitor_tcp, max_parallel=args.parallel, retries=args.retries, result_callback=print_result)
+    finally:
+        if fleet is not None:
+            fleet.close()
+
+    print(format_report(results))
+    return 0 if all(result.bSuccess for result in results) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
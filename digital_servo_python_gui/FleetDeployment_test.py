@@ -0,0 +1,97 @@
+import zlib
+import pytest
+
+import FleetDeployment
+from MonitorTCPMockServer import MonitorTCPMockFleet, MonitorTCPMockServer
+
+
+@pytest.fixture
+def firmware_files(tmp_path):
+    bitfile = tmp_path / 'red_pitaya_top.bit'
+    bitfile.write_bytes(bytes(range(256))*1000)
+    monitor_tcp = tmp_path / 'monitor-tcp'
+    monitor_tcp.write_bytes(b'\x7fELF' + bytes(70000))
+    return (str(bitfile), str(monitor_tcp))
+
+def test_deploy_fleet(firmware_files):
+    (bitfile, monitor_tcp) = firmware_files
+    with MonitorTCPMockFleet(5) as fleet:
+        # one server is already up to date, one corrupts its first transfer:
+        with open(bitfile, 'rb') as f:
+            fleet.servers[1].files['/opt/red_pitaya_top.bit'] = f.read()
+        fleet.servers[2].transfers_to_corrupt = 1
+
+        results_reported = []
+        results = FleetDeployment.deploy(fleet.targets, strFPGAFirmware=bitfile, max_parallel=3, retry_delay=0.,
+                                         result_callback=results_reported.append)
+
+        assert [(result.HOST, result.PORT) for result in results] == fleet.targets
+        assert sorted(results_reported) == sorted(results)
+        assert all(result.bSuccess for result in results)
+        assert [result.bFPGAFirmwareSent for result in results] == [True, False, True, True, True]
+        assert [result.number_of_attempts for result in results] == [1, 1, 2, 1, 1]
+        for server in fleet.servers:
+            assert server.fpga_bitfile == server.files['/opt/red_pitaya_top.bit']
+            assert zlib.crc32(server.fpga_bitfile) == zlib.crc32(open(bitfile, 'rb').read())
+            assert server.number_of_reboots == 0
+
+def test_deploy_monitor_tcp(firmware_files):
+    (bitfile, monitor_tcp) = firmware_files
+    with MonitorTCPMockFleet(2) as fleet:
+        results = FleetDeployment.deploy(fleet.targets, strFPGAFirmware=bitfile, strCPUFirmware=monitor_tcp, retry_delay=0.)
+        assert all(result.bSuccess and result.bCPUFirmwareSent and result.bFPGAFirmwareSent for result in results)
+        for server in fleet.servers:
+            assert '/opt/monitor-tcp' in server.executables
+            assert server.number_of_reboots == 1
+            assert server.fpga_bitfile is not None
+
+        # nothing to send the second time, and no reboot:
+        results = FleetDeployment.deploy(fleet.targets, strFPGAFirmware=bitfile, strCPUFirmware=monitor_tcp, retry_delay=0.)
+        assert all(result.bSuccess and result.bCPUFirmwareSent is False and result.bFPGAFirmwareSent is False for result in results)
+        assert all(server.number_of_reboots == 1 for server in fleet.servers)
+
+def test_deploy_monitor_tcp_after_interrupted_chmod(firmware_files):
+    (bitfile, monitor_tcp) = firmware_files
+    server = MonitorTCPMockServer()
+    try:
+        # a previous deployment sent the file, but lost the connection before making it executable:
+        with open(monitor_tcp, 'rb') as f:
+            server.files['/opt/monitor-tcp'] = f.read()
+        [result] = FleetDeployment.deploy([(server.HOST, server.PORT)], strCPUFirmware=monitor_tcp, retry_delay=0.)
+        assert result.bSuccess and result.bCPUFirmwareSent is False
+        assert '/opt/monitor-tcp' in server.executables
+        assert server.number_of_reboots == 0
+
+        # and a new version stays executable from the moment it replaces the old one:
+        with open(monitor_tcp, 'ab') as f:
+            f.write(b'new version')
+        server.shell_commands = []
+        server.run_shell_command = lambda strCommand: server.shell_commands.append(strCommand)     # the chmod gets lost
+        [result] = FleetDeployment.deploy([(server.HOST, server.PORT)], strCPUFirmware=monitor_tcp, retry_delay=0.)
+        assert result.bSuccess and result.bCPUFirmwareSent
+        assert server.shell_commands == ['chmod +x /opt/monitor-tcp']
+        assert '/opt/monitor-tcp' in server.executables
+    finally:
+        server.close()
+
+def test_deploy_to_old_server(firmware_files):
+    (bitfile, monitor_tcp) = firmware_files
+    server = MonitorTCPMockServer(bSupportsFileInfo=False)
+    try:
+        [result] = FleetDeployment.deploy([(server.HOST, server.PORT)], strCPUFirmware=monitor_tcp, retry_delay=0.)
+        # the file goes through /opt/monitor-tcp-new, without acknowledgement:
+        assert result.bSuccess and result.bCPUFirmwareSent is None
+        assert open(monitor_tcp, 'rb').read() == server.files['/opt/monitor-tcp']
+        assert server.shell_commands == ['mv /opt/monitor-tcp-new /opt/monitor-tcp', 'chmod +x /opt/monitor-tcp']
+    finally:
+        server.close()
+
+def test_deploy_failure(firmware_files):
+    (bitfile, monitor_tcp) = firmware_files
+    server = MonitorTCPMockServer()
+    server.close()
+    [result] = FleetDeployment.deploy([(server.HOST, server.PORT)], strFPGAFirmware=bitfile, retries=1, retry_delay=0.)
+    assert not result.bSuccess
+    assert result.number_of_attempts == 2
+    assert result.strError
+    assert 'FAILED' in FleetDeployment.format_report([result])
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# Arbitrates the access to the ram data logger (called the "DDR2 logger" in most of the GUI, a name inherited from the Opal Kelly version).
+# The logger can only run one acquisition at a time: setup_write(), trigger_write(), wait_for_write() and the read of the samples
+# have to be done by the same client, without anybody else changing the logger settings in between.
+# This replaces the bDDR2InUse flag, which wasn't safe to use from several threads, and counts how often the logger was found busy.
+
+from __future__ import print_function
+import threading
+import time
+import collections
+import contextlib
+
+class LoggerArbiter():
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.owner = None
+
+        # statistics, see get_stats()
+        self.stats_lock = threading.Lock()
+        self.number_of_acquisitions = 0
+        self.number_of_contentions = 0      # number of times the logger was already in use when a client asked for it
+        self.number_of_failures = 0         # number of times a client gave up because the logger was in use
+        self.contentions_per_client = collections.Counter()
+        self.total_wait_time = 0.
+
+    # Returns True if client now owns the logger, False otherwise.
+    # With timeout=0 (the default), gives up right away if the logger is in use, like the old bDDR2InUse check did.
+    # With timeout > 0, waits at most that many seconds for the logger to be released, and timeout=None waits as long as it takes.
+    # client is only used for the statistics and for error messages: any object with a meaningful str() will do.
+    def acquire(self, client, timeout=0):
+        if self.lock.acquire(False):
+            bAcquired = True
+            wait_time = 0.
+            bContention = False
+        else:
+            bContention = True
+            time_start = time.perf_counter()
+            if timeout == 0:
+                bAcquired = False
+            elif timeout is None:
+                bAcquired = self.lock.acquire(True)
+            else:
+                bAcquired = self.lock.acquire(True, timeout)
+            wait_time = time.perf_counter() - time_start
+
+        with self.stats_lock:
+            if bContention:
+                self.number_of_contentions += 1
+                self.contentions_per_client[str(client)] += 1
+                self.total_wait_time += wait_time
+            if bAcquired:
+                self.number_of_acquisitions += 1
+                self.owner = client
+            else:
+                self.number_of_failures += 1
+
+        return bAcquired
+
+    # client has to be the one given to acquire(): releasing a logger owned by somebody else (or by nobody) raises RuntimeError,
+    # rather than letting a stray release drop the ownership of another client in the middle of its acquisition.
+    def release(self, client):
+        with self.stats_lock:
+            if self.owner is None or self.owner != client:
+                raise RuntimeError('%s tried to release the DDR2 logger, which is owned by %s' % (client, self.owner))
+            self.owner = None
+        self.lock.release()
+
+    def in_use(self):
+        return self.lock.locked()
+
+    # Context manager version of acquire()/release(), which yields the return value of acquire():
+    #   with sl.ddr2_arbiter.use('my window') as bAcquired:
+    #       if not bAcquired:
+    #           return
+    #       ...
+    @contextlib.contextmanager
+    def use(self, client, timeout=0):
+        bAcquired = self.acquire(client, timeout)
+        try:
+            yield bAcquired
+        finally:
+            if bAcquired:
+                self.release(client)
+
+    def get_stats(self):
+        with self.stats_lock:
+            return {'acquisitions': self.number_of_acquisitions,
+                    'contentions': self.number_of_contentions,
+                    'failures': self.number_of_failures,
+                    'contentions_per_client': dict(self.contentions_per_client),
+                    'total_wait_time': self.total_wait_time,
+                    'owner': None if self.owner is None else str(self.owner)}
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.number_of_acquisitions = 0
+            self.number_of_contentions = 0
+            self.number_of_failures = 0
+            self.contentions_per_client.clear()
+            self.total_wait_time = 0.
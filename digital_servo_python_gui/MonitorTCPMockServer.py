@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for monitor-tcp, to exercise the deployment code (FleetDeployment.py, initialConfiguration_RP.py) without hardware.
+
+Each MonitorTCPMockServer listens on its own port of 127.0.0.1 and implements the packets used to update a Red Pitaya:
+register reads/writes, write_file (with and without acknowledgement), file_info, shell_command and reboot_monitor,
+as well as the register block reads and the multi-op packets, so that the GUI can connect to it (see StartupProfiler.py),
+and the logger buffer reads, which return logger_buffer (zero-padded).
+Like addr_packed.vhd, the writes to dpll_wrapper are mirrored in its RAM, at (2 << 20).
+Its filesystem is a dict, and the few shell commands that the deployment sends (cat ... > /dev/xdevcfg, chmod, mv) are emulated.
+MonitorTCPMockFleet starts several of them at once.
+Subclasses can model the hardware behind the registers and the logger (see SimulatedMonitorTCPServer.py) by overriding
+read_register(), read_register_64(), read_logger_buffer() and handle_other_packet().
+
+"""
+from __future__ import print_function
+import socket
+import struct
+import threading
+import time
+import zlib
+import shlex
+
+from RP_PLL import RP_PLL_device, sock_recvall_into
+
+
+def recvall(sock, count):
+    buf = bytearray(count)
+    if sock_recvall_into(sock, memoryview(buf)) is None:
+        return None
+    return bytes(buf)
+
+
+class MonitorTCPMockServer():
+
+    def __init__(self, HOST='127.0.0.1', PORT=0, bSupportsFileInfo=True, reboot_duration=0.2, reply_delay=0.):
+        self.HOST = HOST
+        self.bSupportsFileInfo = bSupportsFileInfo  # False behaves like the servers which predate the file_info and write_file_acked packets
+        self.reboot_duration = reboot_duration      # seconds during which connections are refused after a reboot_monitor packet
+        self.reply_delay = reply_delay              # seconds before each reply is sent, to simulate a slow network or a busy box
+
+        self.lock = threading.Lock()
+        self.files = {}             # remote filename -> contents
+        self.executables = set()    # remote filenames which were made executable
+        self.registers = {}         # absolute address -> uint32
+        self.fpga_bitfile = None    # contents of the last bitfile written to /dev/xdevcfg
+        self.shell_commands = []
+        self.number_of_reboots = 0
+        self.transfers_to_corrupt = 0   # the next write_file_acked packets fail with a checksum mismatch, to simulate a flaky network
+        self.logger_buffer = b''        # raw int16 samples returned by the logger buffer reads, whatever the selected input
+
+        self.server_sock = None
+        self.bClosed = False
+        self.listen(PORT)
+        self.PORT = self.server_sock.getsockname()[1]
+
+    def listen(self, PORT):
+        server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server_sock.bind((self.HOST, PORT))
+        server_sock.listen(8)
+        self.server_sock = server_sock
+        threading.Thread(target=self.accept_loop, args=(server_sock,), daemon=True).start()
+
+    def accept_loop(self, server_sock):
+        while True:
+            try:
+                (conn, addr) = server_sock.accept()
+            except OSError:
+                return  # closed
+            # monitor-tcp forks a child per connection, a thread does the same job here
+            threading.Thread(target=self.handle_connection, args=(conn,), daemon=True).start()
+
+    def stop_listening(self):
+        try:
+            # wakes up accept_loop(), otherwise the port stays bound until the next connection
+            self.server_sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.server_sock.close()
+
+    def close(self):
+        self.bClosed = True
+        self.stop_listening()
+
+    def reboot(self):
+        # like the real server, stop listening while the new monitor-tcp starts
+        self.stop_listening()
+        with self.lock:
+            self.number_of_reboots += 1
+        time.sleep(self.reboot_duration)
+        if not self.bClosed:
+            self.listen(self.PORT)
+
+    def handle_connection(self, conn):
+        bReboot = False
+        try:
+            while True:
+                header = recvall(conn, 12)
+                if header is None:
+                    break
+                (magic_bytes, arg1, arg2) = struct.unpack('=III', header)
+                if magic_bytes == RP_PLL_device.MAGIC_BYTES_WRITE_REG:
+                    self.write_register(arg1, arg2)
+                elif magic_bytes == RP_PLL_device.MAGIC_BYTES_READ_REG:
+                    self.reply(conn, struct.pack('=I', self.read_register(arg1)))
+                elif magic_bytes == RP_PLL_device.MAGIC_BYTES_READ_REG_BLOCK:
+                    self.reply(conn, struct.pack('=%dI' % arg2, *[self.read_register(arg1 + 4*k) for k in range(arg2)]))
+                elif magic_bytes == RP_PLL_device.MAGIC_BYTES_READ_REG_64:
+                    # the same (lsbs, msbs) pair, sampled arg2 times
+                    self.reply(conn, b''.join(struct.pack('=Q', self.read_register_64(arg1)) for k in range(arg2)))
+                elif magic_bytes == RP_PLL_device.MAGIC_BYTES_READ_BUFFER:
+                    self.reply(conn, self.read_logger_buffer(arg2))
+                elif magic_bytes == RP_PLL_device.MAGIC_BYTES_MULTI_OP:
+                    replies = []
+                    # like monitor-tcp, the ops beyond MAX_OPS_MULTI_OP are parsed as standalone packets
+                    for k in range(min(arg1, RP_PLL_device.MAX_OPS_MULTI_OP)):
+                        (op_magic_bytes, addr, value) = struct.unpack('=III', recvall(conn, 12))
+                        if op_magic_bytes == RP_PLL_device.MAGIC_BYTES_WRITE_REG:
+                            self.write_register(addr, value)
+                        else:
+                            replies.append(struct.pack('=I', self.read_register(addr)))
+                    if replies:
+                        self.reply(conn, b''.join(replies))
+                elif magic_bytes == RP_PLL_device.MAGIC_BYTES_WRITE_FILE:
+                    filename = recvall(conn, arg1).decode('ascii')
+                    data = recvall(conn, arg2)
+                    with self.lock:
+                        self.files[filename] = data
+                elif magic_bytes == RP_PLL_device.MAGIC_BYTES_WRITE_FILE_ACKED and self.bSupportsFileInfo:
+                    filename = recvall(conn, arg1).decode('ascii')
+                    data = recvall(conn, arg2)
+                    (expected_crc32,) = struct.unpack('=I', recvall(conn, 4))
+                    crc32 = zlib.crc32(data) & 0xFFFFFFFF
+                    with self.lock:
+                        if self.transfers_to_corrupt > 0:
+                            self.transfers_to_corrupt -= 1
+                            crc32 ^= 1
+                    status = 0 if crc32 == expected_crc32 else 3    # WRITE_FILE_OK or WRITE_FILE_CHECKSUM_MISMATCH
+                    if status == 0:
+                        with self.lock:
+                            # like monitor-tcp, the new file keeps the permissions of the one it replaces
+                            self.files[filename] = data
+                    self.reply(conn, struct.pack('=IIII', magic_bytes, status, len(data), crc32))
+                elif magic_bytes == RP_PLL_device.MAGIC_BYTES_FILE_INFO and self.bSupportsFileInfo:
+                    filename = recvall(conn, arg1).decode('ascii')
+                    with self.lock:
+                        data = self.files.get(filename)
+                    if data is None:
+                        self.reply(conn, struct.pack('=IIII', magic_bytes, 0, 0, 0))
+                    else:
+                        self.reply(conn, struct.pack('=IIII', magic_bytes, 1, len(data), zlib.crc32(data) & 0xFFFFFFFF))
+                elif magic_bytes == RP_PLL_device.MAGIC_BYTES_SHELL_COMMAND:
+                    self.run_shell_command(recvall(conn, arg1).decode('ascii'))
+                elif magic_bytes == RP_PLL_device.MAGIC_BYTES_REBOOT_MONITOR:
+                    bReboot = True
+                elif not self.handle_other_packet(conn, magic_bytes, arg1, arg2):
+                    # same as monitor-tcp: an unknown packet ends the connection
+                    print("MonitorTCPMockServer: unrecognized magic_bytes 0x%x, closing connection" % magic_bytes)
+                    break
+        except OSError:
+            pass
+        finally:
+            conn.close()
+        if bReboot:
+            self.reboot()
+
+    def reply(self, conn, data):
+        if self.reply_delay:
+            time.sleep(self.reply_delay)
+        conn.sendall(data)
+
+    def write_register(self, absolute_addr, value):
+        with self.lock:
+            self.registers[absolute_addr] = value
+            if 0 <= absolute_addr - RP_PLL_device.FPGA_BASE_ADDR < (1 << 20):
+                self.registers[absolute_addr + (2 << 20)] = value
+
+    def read_register(self, absolute_addr):
+        with self.lock:
+            return self.registers.get(absolute_addr, 0)
+
+    # 64 bits value of the (lsb, msb) register pair at absolute_addr, as read by the read_reg_64 packets
+    def read_register_64(self, absolute_addr):
+        return self.read_register(absolute_addr) | (self.read_register(absolute_addr + 4) << 32)
+
+    # Reply to a logger buffer read of number_of_points samples
+    def read_logger_buffer(self, number_of_points):
+        with self.lock:
+            data = self.logger_buffer[:2*number_of_points]
+        return data + bytes(2*number_of_points - len(data))
+
+    # Called for the packets which aren't handled above, after their 12 bytes header has been received.
+    # Returns False if the packet isn't supported either, which closes the connection.
+    def handle_other_packet(self, conn, magic_bytes, arg1, arg2):
+        return False
+
+    # Emulates the shell commands sent by the deployment code
+    def run_shell_command(self, strCommand):
+        with self.lock:
+            self.shell_commands.append(strCommand)
+            args = shlex.split(strCommand)
+            if len(args) == 4 and args[0] == 'cat' and args[2] == '>' and args[3] == '/dev/xdevcfg':
+                self.fpga_bitfile = self.files.get(args[1])
+            elif len(args) == 3 and args[:2] == ['chmod', '+x'] and args[2] in self.files:
+                self.executables.add(args[2])
+            elif len(args) == 3 and args[0] == 'mv' and args[1] in self.files:
+                self.files[args[2]] = self.files.pop(args[1])
+                # mv keeps the permissions of the moved file
+                self.executables.discard(args[2])
+                if args[1] in self.executables:
+                    self.executables.discard(args[1])
+                    self.executables.add(args[2])
+
+
+# Several independent mock servers, each on its own port
+class MonitorTCPMockFleet():
+
+    def __init__(self, number_of_servers, **kwargs):
+        self.servers = [MonitorTCPMockServer(**kwargs) for k in range(number_of_servers)]
+
+    # (HOST, PORT) of each server, for FleetDeployment.deploy()
+    @property
+    def targets(self):
+        return [(server.HOST, server.PORT) for server in self.servers]
+
+    def close(self):
+        for server in self.servers:
+            server.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
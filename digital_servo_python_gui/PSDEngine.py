@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Power spectral density estimation for the DDC display (and anything else which needs a PSD),
+in pure NumPy so that it can be used and tested without Qt.
+
+"""
+from __future__ import print_function
+import numpy as np
+
+# Single-sided power spectral density of real signals, using Welch's method:
+# records longer than max_segment_length are cut into overlapping segments whose spectra are averaged,
+# so that the memory used only depends on the segment length, not on the record length.
+# Shorter records are processed as a single segment, zero-padded to a power of two, like the DDC display always did.
+# The window and its noise-equivalent bandwidth (NEB) are cached for each segment length.
+# Successive PSDs can be accumulated across refreshes with an exponential moving average, see accumulate().
+class PSDEngine():
+    def __init__(self, window_function=np.blackman, max_segment_length=2**16, overlap=0.5):
+        self.window_function = window_function
+        self.max_segment_length = int(max_segment_length)
+        self.overlap = overlap
+
+        self.windows = {}   # segment length -> (window, sum of the window squared, sum of the window)
+
+        # state of accumulate():
+        self.spc_running_average = None
+        self.number_of_averages = 0
+
+    def get_window(self, N):
+        entry = self.windows.get(N)
+        if entry is None:
+            window = self.window_function(N)
+            entry = (window, np.sum(window**2), np.sum(window))
+            self.windows[N] = entry
+        return entry
+
+    # Noise-equivalent bandwidth of the window used for segments of N points, in Hz
+    def get_window_NEB(self, N, fs):
+        (window, sum_window_squared, sum_window) = self.get_window(N)
+        return sum_window_squared / sum_window**2 * fs
+
+    def get_segment_length(self, N):
+        return min(N, self.max_segment_length)
+
+    # Returns (frequency_axis, spc, window_NEB, N_fft).
+    # spc is the single-sided PSD in units of x^2/Hz, for the len(frequency_axis) = N_fft/2+1 frequencies from 0 to fs/2,
+    # window_NEB is the resolution bandwidth in Hz.
+    def psd(self, x, fs):
+        N = len(x)
+        N_segment = self.get_segment_length(N)
+        N_fft = 2**(int(np.ceil(np.log2(N_segment))))
+        (window, sum_window_squared, sum_window) = self.get_window(N_segment)
+        step = max(1, int(round(N_segment*(1.-self.overlap))))
+
+        # accumulate |X|^2 one segment at a time:
+        spc = np.zeros(N_fft//2+1)
+        number_of_segments = 0
+        for start in range(0, N-N_segment+1, step):
+            spc_segment = np.fft.rfft(x[start:start+N_segment] * window, N_fft)
+            spc += spc_segment.real**2 + spc_segment.imag**2
+            number_of_segments += 1
+
+        # scale to a single-sided power spectral density: the power in each bin is |X|^2/sum(window)^2,
+        # divided by the NEB to get a density, and doubled for all frequencies except DC and Nyquist (which have no negative counterpart)
+        spc *= 1. / (number_of_segments * fs * sum_window_squared)
+        if N_fft % 2 == 0:
+            spc[1:-1] *= 2
+        else:
+            spc[1:] *= 2
+
+        frequency_axis = np.arange(N_fft//2+1) * (fs/N_fft)
+        window_NEB = sum_window_squared / sum_window**2 * fs
+        return (frequency_axis, spc, window_NEB, N_fft)
+
+    # Exponential moving average of the successive PSDs, with a time constant of N_average PSDs.
+    # The average restarts whenever the shape of the PSD changes (different record length or segment length), or after reset().
+    def accumulate(self, spc, N_average):
+        if self.spc_running_average is None or self.spc_running_average.shape != spc.shape:
+            self.spc_running_average = np.array(spc, dtype=float)
+            self.number_of_averages = 1
+        else:
+            filter_alpha = np.exp(-1./N_average)
+            self.spc_running_average *= filter_alpha
+            self.spc_running_average += (1-filter_alpha)*spc
+            self.number_of_averages += 1
+        return self.spc_running_average
+
+    def reset(self):
+        self.spc_running_average = None
+        self.number_of_averages = 0
@@ -0,0 +1,65 @@
+import pytest
+import numpy as np
+
+from PSDEngine import PSDEngine
+
+# the spectrum computation that displayDDC() used before PSDEngine
+def psd_reference(x, fs):
+    N_fft = 2**(int(np.ceil(np.log2(len(x)))))
+    last_index_shown = int(np.round(N_fft/2))
+    window_function = np.blackman(len(x))
+    window_NEB = np.sum((window_function/np.sum(window_function))**2) * fs
+    spc = np.fft.fft(x * window_function, N_fft)
+    spc = np.real(spc*np.conj(spc))/(sum(window_function)**2)
+    spc[1:last_index_shown] = 2*spc[1:last_index_shown] / window_NEB
+    return (spc[1:last_index_shown], window_NEB)
+
+def test_single_segment_matches_reference():
+    np.random.seed(0)
+    fs = 12.5e6
+    x = np.random.randn(10000)
+    psd_engine = PSDEngine()
+    (frequency_axis, spc, window_NEB, N_fft) = psd_engine.psd(x, fs)
+    (spc_expected, window_NEB_expected) = psd_reference(x, fs)
+
+    assert(N_fft == 2**14)
+    assert(len(frequency_axis) == len(spc) == N_fft//2+1)
+    assert(frequency_axis[1] == pytest.approx(fs/N_fft))
+    assert(window_NEB == pytest.approx(window_NEB_expected))
+    assert(np.allclose(spc[1:N_fft//2], spc_expected))
+
+def test_welch_white_noise_level():
+    np.random.seed(1)
+    fs = 1e6
+    sigma = 3.
+    x = sigma*np.random.randn(2**18)
+    psd_engine = PSDEngine(max_segment_length=2**12)
+    (frequency_axis, spc, window_NEB, N_fft) = psd_engine.psd(x, fs)
+
+    # long records are cut into segments: the resolution is set by the segment length, not the record length
+    assert(N_fft == 2**12)
+    assert(window_NEB == pytest.approx(psd_engine.get_window_NEB(2**12, fs)))
+    # the single-sided PSD of white noise is 2*sigma^2/fs, and averaging the segments reduces the variance of the estimate
+    assert(np.mean(spc[1:-1]) == pytest.approx(2*sigma**2/fs, rel=0.02))
+    assert(np.std(spc[1:-1])/np.mean(spc[1:-1]) < 0.2)
+
+    # the window is computed only once per segment length
+    psd_engine.psd(x, fs)
+    assert(list(psd_engine.windows.keys()) == [2**12])
+
+def test_accumulate():
+    psd_engine = PSDEngine()
+    spc1 = np.ones(5)
+    spc2 = 3*np.ones(5)
+
+    assert(np.all(psd_engine.accumulate(spc1, 10) == spc1))
+    filter_alpha = np.exp(-1./10)
+    assert(np.allclose(psd_engine.accumulate(spc2, 10), filter_alpha*spc1 + (1-filter_alpha)*spc2))
+    assert(psd_engine.number_of_averages == 2)
+
+    # a change of shape restarts the average:
+    assert(np.all(psd_engine.accumulate(np.ones(7), 10) == 1.))
+    assert(psd_engine.number_of_averages == 1)
+
+    psd_engine.reset()
+    assert(np.all(psd_engine.accumulate(spc2, 10) == spc2))
@@ -3,10 +3,21 @@
 from __future__ import print_function
 import socket
 import struct
+import os
+import zlib
+import errno
+import select
+import random
 import traceback    # for print_stack, for debugging purposes: traceback.print_stack()
 import time
 
 import sys
+import collections
+import threading
+import functools
+import contextlib
+import bisect
+import atexit
 
 import numpy as np
 import logging
@@ -18,6 +29,10 @@ class CommsError(Exception):
 class CommsLoggeableError(CommsError):
     pass
 
+# Raised by get_remote_file_info() when the server doesn't answer the file info request, like the servers which predate this packet
+class FileInfoNotSupportedError(CommsLoggeableError):
+    pass
+
 
 class socket_placeholder():
     def __init__(self):
@@ -29,6 +44,445 @@ class socket_placeholder():
     def recv(*args):
         print("socket_placeholder::recv(): No active socket")
         return []
+    def recv_into(*args):
+        print("socket_placeholder::recv_into(): No active socket")
+        return 0
+
+# Fills the (writable, byte-sized) memoryview with data from the socket, without any intermediate copy.
+# Returns None if the connection was closed before the view could be filled.
+def sock_recvall_into(sock, view):
+    bytes_received = 0
+    while bytes_received < len(view):
+        count = sock.recv_into(view[bytes_received:])
+        if not count: return None
+        bytes_received += count
+
+    return view
+
+# Returns (file_size, crc32) of a local file, read in chunks of chunk_size bytes.
+# crc32 is zlib.crc32() of the contents, which is also what monitor-tcp computes for the files on the Red Pitaya.
+def file_crc32(strFilename, chunk_size=64*1024):
+    file_size = 0
+    crc32 = 0
+    with open(strFilename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            crc32 = zlib.crc32(chunk, crc32)
+            file_size += len(chunk)
+    return (file_size, crc32 & 0xFFFFFFFF)
+
+# Enables TCP keepalive on a socket, so that a box which disappears (unplugged cable, power cut) is noticed after
+# about idle + interval*count seconds even when we are not sending anything, instead of only at the next request.
+# The per-socket timing options don't exist on every OS: where they are missing, only the OS defaults apply (typically 2 hours).
+def set_tcp_keepalive(sock, idle=5, interval=1, count=3):
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    try:
+        if hasattr(socket, 'SIO_KEEPALIVE_VALS'):
+            # Windows: the number of probes is fixed (10 on Vista and later)
+            sock.ioctl(socket.SIO_KEEPALIVE_VALS, (1, idle*1000, interval*1000))
+        elif hasattr(socket, 'TCP_KEEPIDLE'):
+            # Linux
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, count)
+        elif hasattr(socket, 'TCP_KEEPALIVE'):
+            # macOS
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, idle)
+    except OSError:
+        pass
+
+# Makes the decorated RP_PLL_device method hold the device lock, so that the requests and replies of several threads
+# (for example the GUI and the acquisition engine) don't get interleaved on the socket.
+def with_device_lock(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+# Per-operation statistics of the communication with monitor-tcp: number of requests, bytes sent plus received,
+# and a histogram of the latencies (from sending the request to receiving the whole reply, or just sending it for the ops without reply).
+# Also counts the timeouts, the other socket errors, and the reconnections. See RP_PLL_device.get_stats().
+class RP_PLL_stats():
+
+    OPS = ('write_reg', 'read_reg', 'read_block', 'multi_op', 'read_buffer', 'write_file', 'shell_command')
+    # upper edges of the latency bins, in seconds: 10 us to ~10 s in factors of 2. The last bin holds the slower ones.
+    LATENCY_BIN_EDGES = tuple(10e-6 * 2**k for k in range(21))
+
+    def __init__(self):
+        # the bulk connections record their ops without holding the device lock
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counts = dict.fromkeys(self.OPS, 0)
+            self.bytes = dict.fromkeys(self.OPS, 0)
+            self.total_latency = dict.fromkeys(self.OPS, 0.)
+            self.max_latency = dict.fromkeys(self.OPS, 0.)
+            self.histograms = dict((op, [0] * (len(self.LATENCY_BIN_EDGES)+1)) for op in self.OPS)
+            self.number_of_timeouts = 0
+            self.number_of_socket_errors = 0     # including the timeouts
+            self.number_of_reconnects = 0
+            self.start_time = time.perf_counter()
+
+    def record(self, op, number_of_bytes, latency):
+        with self.lock:
+            self.counts[op] += 1
+            self.bytes[op] += number_of_bytes
+            self.total_latency[op] += latency
+            self.max_latency[op] = max(self.max_latency[op], latency)
+            self.histograms[op][bisect.bisect_left(self.LATENCY_BIN_EDGES, latency)] += 1
+
+    # Upper edge of the latency bin which contains the given fraction of the ops (inf if it is the last bin)
+    def get_percentile(self, op, fraction):
+        histogram = self.histograms[op]
+        threshold = fraction * sum(histogram)
+        cumulative_count = 0
+        for (k, count) in enumerate(histogram):
+            cumulative_count += count
+            if count and cumulative_count >= threshold:
+                return self.LATENCY_BIN_EDGES[k] if k < len(self.LATENCY_BIN_EDGES) else float('inf')
+        return 0.
+
+    # Returns a snapshot of the statistics, as a dict: for each op in OPS, a dict with count, bytes, mean/p50/p99/max latencies (in seconds),
+    # and the latency histogram (see LATENCY_BIN_EDGES), plus the number of timeouts, socket_errors and reconnects,
+    # and the duration over which all this was collected.
+    def get(self):
+        with self.lock:
+            stats = {}
+            for op in self.OPS:
+                stats[op] = {'count':       self.counts[op],
+                             'bytes':       self.bytes[op],
+                             'mean':        self.total_latency[op]/self.counts[op] if self.counts[op] else 0.,
+                             'p50':         self.get_percentile(op, 0.5),
+                             'p99':         self.get_percentile(op, 0.99),
+                             'max':         self.max_latency[op],
+                             'histogram':   list(self.histograms[op])}
+            stats['timeouts'] = self.number_of_timeouts
+            stats['socket_errors'] = self.number_of_socket_errors
+            stats['reconnects'] = self.number_of_reconnects
+            stats['duration'] = time.perf_counter() - self.start_time
+            return stats
+
+# Text table of the statistics returned by RP_PLL_stats.get()
+def format_stats(stats):
+    lines = ['%-14s %9s %12s %10s %10s %10s %10s' % ('op', 'count', 'bytes', 'mean [ms]', 'p50 [ms]', 'p99 [ms]', 'max [ms]')]
+    for op in RP_PLL_stats.OPS:
+        op_stats = stats[op]
+        lines.append('%-14s %9d %12d %10.3f %10.3f %10.3f %10.3f' % (op, op_stats['count'], op_stats['bytes'],
+            1e3*op_stats['mean'], 1e3*op_stats['p50'], 1e3*op_stats['p99'], 1e3*op_stats['max']))
+    lines.append('timeouts: %d, socket errors: %d, reconnects: %d, over %.1f s' % (stats['timeouts'], stats['socket_errors'], stats['reconnects'], stats['duration']))
+    return '\n'.join(lines)
+
+# Queues register writes and reads so that they can be sent to monitor-tcp as a single multi-op packet.
+# Each queued op is a standard 12-bytes register write/read packet, and the values of all the queued reads
+# come back in a single reply (4 bytes per read, in the order they were queued).
+# Typical use is through RP_PLL_device.transaction():
+#   with dev.transaction() as t:
+#       dev.write_Zynq_register_uint32(addr1, value1)      # queued instead of sent right away
+#       index = t.queue_read(dev.FPGA_BASE_ADDR+addr2)     # deferred read
+#   value2 = t.get_uint32(index)
+class RP_PLL_transaction():
+    def __init__(self, dev):
+        self.dev = dev
+        self.nesting_level = 0
+        self.clear()
+
+    def clear(self):
+        self.packets = []
+        self.number_of_reads = 0
+        self.replies = []
+        self.written_addresses = []     # the shadow values of these addresses are only valid once the transaction is committed
+
+    # The device lock is held for the whole 'with' block, so that the writes of other threads don't end up in this transaction
+    def __enter__(self):
+        self.dev.lock.acquire()
+        if self.dev.current_transaction is None:
+            # another thread committed this transaction while we were waiting for the lock
+            self.dev.current_transaction = self
+        self.nesting_level += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        try:
+            self.nesting_level -= 1
+            if self.nesting_level > 0:
+                # nested transactions are simply merged into the outermost one
+                return False
+            self.dev.current_transaction = None
+            if exc_type is None:
+                self.commit()
+            else:
+                # don't push half of a configuration to the FPGA, and forget the values that were never sent
+                self.packets = []
+                self.dev.forget_shadow_registers(self.written_addresses)
+                self.written_addresses = []
+            return False
+        finally:
+            self.dev.lock.release()
+
+    def queue_write(self, absolute_addr, data_32bits, bSigned=False):
+        self.dev.validate_address(absolute_addr)
+        self.packets.append(struct.pack(self.dev.type_to_format_string[bSigned], self.dev.MAGIC_BYTES_WRITE_REG, absolute_addr, int(data_32bits) & 0xFFFFFFFF))
+        self.written_addresses.append(absolute_addr)
+
+    # returns the index of this read in the list of replies, which is valid once commit() has been called
+    def queue_read(self, absolute_addr):
+        self.dev.validate_address(absolute_addr)
+        self.packets.append(struct.pack('=III', self.dev.MAGIC_BYTES_READ_REG, absolute_addr, 0))
+        self.number_of_reads += 1
+        return len(self.replies) + self.number_of_reads - 1
+
+    # Sends all the queued ops as multi-op packets of at most MAX_OPS_MULTI_OP ops each, in a single send(),
+    # then waits for the values of the queued reads, if any.
+    def commit(self):
+        with self.dev.lock:
+            if len(self.packets) == 0:
+                return
+            max_ops = self.dev.MAX_OPS_MULTI_OP
+            packet_to_send = b''.join(struct.pack('=III', self.dev.MAGIC_BYTES_MULTI_OP, len(self.packets[k:k+max_ops]), 0) + b''.join(self.packets[k:k+max_ops])
+                                      for k in range(0, len(self.packets), max_ops))
+            number_of_reads = self.number_of_reads
+            self.packets = []
+            self.number_of_reads = 0
+            self.written_addresses = []
+
+            start_time = time.perf_counter()
+            self.dev.send(packet_to_send)
+            if number_of_reads > 0:
+                data_buffer = self.dev.read(4*number_of_reads)
+                self.replies.extend([bytes(data_buffer[4*k:4*(k+1)]) for k in range(number_of_reads)])
+            self.dev.stats.record('multi_op', len(packet_to_send) + 4*number_of_reads, time.perf_counter() - start_time)
+
+    def get_uint32(self, index):
+        return struct.unpack('I', self.replies[index])[0]
+
+    def get_int32(self, index):
+        return struct.unpack('i', self.replies[index])[0]
+
+# Reply to a read request which was sent without waiting for its reply (see RP_PLL_device.read_Zynq_register_32bits_async()).
+# result() only blocks until this particular reply has been received, so that several reads can be in flight at the same time.
+class RP_PLL_pending_read():
+    def __init__(self, dev, request_id):
+        self.dev = dev
+        self.request_id = request_id
+        self.data_buffer = None
+        self.exception = None                   # set if the connection was lost before the reply was received
+        self.time_sent = time.perf_counter()   # for RP_PLL_stats
+
+    def set_reply(self, data_buffer):
+        self.data_buffer = bytes(data_buffer)
+
+    def set_exception(self, exception):
+        self.exception = exception
+
+    def done(self):
+        return self.data_buffer is not None or self.exception is not None
+
+    def result(self):
+        if not self.done():
+            self.dev.collect_pending_reads(self.request_id)
+        if self.exception is not None:
+            raise self.exception
+        return self.data_buffer
+
+    def result_uint32(self):
+        return struct.unpack('I', self.result())[0]
+
+    def result_int32(self):
+        return struct.unpack('i', self.result())[0]
+
+# Continuous stream of the FIFO logger's samples, see stream_fifo() in monitor-tcp.c.
+# The stream uses its own connection to monitor-tcp, since the server does nothing else on that connection until it is closed.
+# Iterating over it gives a (sequence_number, samples, bDropped) tuple for each block, where samples is a numpy uint32 array
+# and bDropped is True if some samples were lost between the previous block and this one, or within this block.
+# The server reports the overflows of the FPGA's fifo, and resets the fifo after each of them: so both the block with the overflow
+# and the next one are flagged as dropped.
+class RP_PLL_fifo_stream():
+    def __init__(self, HOST, PORT, samples_per_block, number_of_blocks=0, timeout=2):
+        self.next_sequence_number = 0
+        self.max_fifo_count = 0
+        self.number_of_overflows = 0
+        self.bFifoReset = False
+        self.number_of_drops = 0
+
+        self.sock = socket.create_connection((HOST, PORT), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.sendall(struct.pack('=III', RP_PLL_device.MAGIC_BYTES_STREAM_FIFO, samples_per_block, number_of_blocks))
+        self.header = bytearray(5*4)
+
+    # Returns the next block, or None once the server has ended the stream
+    def read_block(self):
+        if sock_recvall_into(self.sock, memoryview(self.header)) is None:
+            return None
+        (magic_bytes, sequence_number, number_of_samples, max_fifo_count, number_of_overflows) = struct.unpack('=IIIII', self.header)
+        if magic_bytes != RP_PLL_device.MAGIC_BYTES_STREAM_FIFO:
+            raise CommsLoggeableError('RP_PLL_fifo_stream: lost synchronization with the server, received 0x%08x as magic bytes' % magic_bytes)
+
+        # each block gets its own array since the caller is likely to keep them all
+        samples = np.empty(number_of_samples, dtype=np.uint32)
+        if sock_recvall_into(self.sock, memoryview(samples).cast('B')) is None:
+            return None
+
+        bOverflow = (number_of_overflows != self.number_of_overflows)
+        bDropped = (sequence_number != self.next_sequence_number) or bOverflow or self.bFifoReset
+        if bDropped:
+            self.number_of_drops += 1
+        self.next_sequence_number = sequence_number + 1
+        self.max_fifo_count = max_fifo_count
+        self.number_of_overflows = number_of_overflows
+        self.bFifoReset = bOverflow
+
+        return (sequence_number, samples, bDropped)
+
+    def __iter__(self):
+        while True:
+            block = self.read_block()
+            if block is None:
+                return
+            yield block
+
+    # the server stops streaming when the connection is closed
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+# One of the bulk-data connections of RP_PLL_device (see RP_PLL_device.OpenTCPConnection()).
+# monitor-tcp serves each connection in its own process, so a large read on a bulk connection doesn't delay the register ops
+# which are sent on the control connection in the meantime.
+# Each connection has its own lock and its own receive buffer, so that several threads can use different bulk connections at the same time.
+class RP_PLL_bulk_connection():
+    def __init__(self, HOST, PORT, timeout=2, channel=1):
+        self.lock = threading.Lock()
+        self.channel = channel  # identifies the connection in the communication trace (0 being the control connection), see CommsTrace.py
+        self.sock = socket.create_connection((HOST, PORT), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        set_tcp_keepalive(self.sock, RP_PLL_device.KEEPALIVE_IDLE, RP_PLL_device.KEEPALIVE_INTERVAL, RP_PLL_device.KEEPALIVE_COUNT)
+        # see RP_PLL_device.read_Zynq_buffer_int16_view()
+        self.read_buffer_int16 = np.zeros(RP_PLL_device.MAX_SAMPLES_READ_BUFFER, dtype=np.int16)
+        self.number_of_requests = 0
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+# Non-blocking connection attempts to monitor-tcp, retried with exponential backoff and jitter.
+# Nothing here ever blocks: poll() is called periodically (typically from a QTimer, see ConnectionManager.py) and moves the state machine along:
+#   DISCONNECTED -> CONNECTING (connect() in progress) -> CONNECTED
+#                        |  refused or timed out
+#                        v
+#                    WAITING (until the next attempt, min_delay*2**n seconds, +/- jitter) -> CONNECTING -> ...
+# Once CONNECTED, the socket is handed over to RP_PLL_device.OpenTCPConnection(HOST, PORT, sock=connector.take_socket()).
+# The jitter keeps several GUIs (or several devices) which lost the network at the same time from all retrying in lock step.
+# HOST should be an IP address: a host name would be resolved with a blocking call.
+class RP_PLL_connector():
+
+    DISCONNECTED    = 'disconnected'
+    CONNECTING      = 'connecting'
+    WAITING         = 'waiting'
+    CONNECTED       = 'connected'
+
+    # connect_ex() codes which mean that the connection is in progress (10035 is WSAEWOULDBLOCK)
+    CONNECT_IN_PROGRESS = (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY, 10035)
+
+    def __init__(self, HOST, PORT=5000, min_delay=0.5, max_delay=30., jitter=0.2, connect_timeout=2.):
+        self.HOST = HOST
+        self.PORT = PORT
+        self.min_delay = min_delay              # seconds between the first failed attempt and the second one
+        self.max_delay = max_delay              # the delay doubles after each failed attempt, up to this
+        self.jitter = jitter                    # relative random variation of each delay
+        self.connect_timeout = connect_timeout  # seconds before an attempt which got no answer is given up
+
+        self.state = self.DISCONNECTED
+        self.sock = None
+        self.number_of_attempts = 0     # since start()
+        self.attempt_deadline = 0.
+        self.next_attempt_time = 0.
+        self.strLastError = ''
+
+    # Starts connecting right away, and resets the backoff
+    def start(self):
+        self.cancel()
+        self.number_of_attempts = 0
+        self.start_attempt()
+        return self.state
+
+    # Stops trying and closes the socket if it wasn't taken
+    def cancel(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        self.state = self.DISCONNECTED
+
+    # Delay before the next attempt, after number_of_attempts failed ones
+    def get_retry_delay(self):
+        delay = min(self.max_delay, self.min_delay * 2**max(0, self.number_of_attempts-1))
+        return delay * (1. + self.jitter * (2.*random.random() - 1.))
+
+    # Seconds until poll() has something to do
+    def get_time_to_next_event(self):
+        if self.state == self.WAITING:
+            return max(0., self.next_attempt_time - time.perf_counter())
+        return 0.
+
+    def start_attempt(self):
+        self.number_of_attempts += 1
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setblocking(False)
+        try:
+            err = self.sock.connect_ex((self.HOST, self.PORT))
+        except OSError as e:
+            # e.g. unreachable network, or a host name which doesn't resolve
+            self.attempt_failed(str(e))
+            return
+        if err not in self.CONNECT_IN_PROGRESS:
+            self.attempt_failed(os.strerror(err))
+            return
+        self.state = self.CONNECTING
+        self.attempt_deadline = time.perf_counter() + self.connect_timeout
+
+    def attempt_failed(self, strError):
+        self.strLastError = strError
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        self.state = self.WAITING
+        self.next_attempt_time = time.perf_counter() + self.get_retry_delay()
+
+    # Moves the state machine along without blocking, and returns the new state
+    def poll(self):
+        if self.state == self.CONNECTING:
+            # Windows reports a refused connection in the exceptional set, the other OSes in the writable one
+            (_, writable, exceptional) = select.select([], [self.sock], [self.sock], 0)
+            if writable or exceptional:
+                err = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err == 0 and not exceptional:
+                    self.state = self.CONNECTED
+                else:
+                    self.attempt_failed(os.strerror(err) if err else 'connection failed')
+            elif time.perf_counter() > self.attempt_deadline:
+                self.attempt_failed('timed out')
+        elif self.state == self.WAITING:
+            if time.perf_counter() >= self.next_attempt_time:
+                self.start_attempt()
+        return self.state
+
+    # Returns the connected socket, which then belongs to the caller. The connector goes back to DISCONNECTED.
+    def take_socket(self):
+        if self.state != self.CONNECTED:
+            return None
+        sock = self.sock
+        self.sock = None
+        self.state = self.DISCONNECTED
+        return sock
 
 class RP_PLL_device():
 
@@ -39,11 +493,43 @@ class RP_PLL_device():
     MAGIC_BYTES_WRITE_FILE      = 0xABCD1237
     MAGIC_BYTES_SHELL_COMMAND   = 0xABCD1238
     MAGIC_BYTES_REBOOT_MONITOR  = 0xABCD1239
-    
+    MAGIC_BYTES_MULTI_OP        = 0xABCD123A
+    MAGIC_BYTES_READ_REG_BLOCK  = 0xABCD123B
+    MAGIC_BYTES_READ_REG_64     = 0xABCD123C
+    MAGIC_BYTES_STREAM_FIFO     = 0xABCD123D
+    MAGIC_BYTES_SNAPSHOT        = 0xABCD123E
+    MAGIC_BYTES_CAPTURE_STATS   = 0xABCD123F
+    MAGIC_BYTES_WRITE_FILE_ACKED = 0xABCD1240
+    MAGIC_BYTES_FILE_INFO       = 0xABCD1241
+
     FPGA_BASE_ADDR              = 0x40000000    # address of the main PS <-> PL memory map (GP 0 AXI master on PS)
     FPGA_BASE_ADDR_XADC         = 0x80000000    # address of the XADC PS <-> PL memory map (GP 1 AXI master on PS)
 
     MAX_SAMPLES_READ_BUFFER = 2**15 # should be equal to 2**ADDRESS_WIDTH from ram_data_logger.vhd
+    MAX_REGISTERS_READ_BLOCK = 4096 # should be equal to MAX_REGISTERS_READ_BLOCK from monitor-tcp.c
+    MAX_SAMPLES_READ_REG_64 = 2048  # should be equal to MAX_SAMPLES_READ_REG_64 from monitor-tcp.c
+    MAX_SAMPLES_STREAM_FIFO_BLOCK = 2**16   # should be equal to MAX_SAMPLES_STREAM_FIFO_BLOCK from monitor-tcp.c
+    MAX_SOURCES_SNAPSHOT = 16       # should be equal to MAX_SOURCES_SNAPSHOT from monitor-tcp.c
+    MAX_OPS_MULTI_OP = 1024         # should be equal to MAX_OPS_MULTI_OP from monitor-tcp.c
+
+    # status of the write_file_acked reply, should be equal to the WRITE_FILE_xxx values from monitor-tcp.c
+    WRITE_FILE_STATUS = {0: 'ok',
+                         1: 'could not open the file',
+                         2: 'could not write the file',
+                         3: 'checksum mismatch',
+                         4: 'could not rename the file',
+                         5: 'connection lost'}
+    FILE_CHUNK_SIZE = 64*1024       # files are read from disk and sent in chunks of this size
+    FILE_ACK_TIMEOUT = 30           # seconds to wait for the server to sync a file to disk and acknowledge it
+
+    NUMBER_OF_BULK_CONNECTIONS = 1      # default number of bulk-data connections opened alongside the control connection
+    MIN_BYTES_BULK_READ = 16*1024       # register block reads at least this big go through a bulk connection
+    SYNC_READ_ADDR = FPGA_BASE_ADDR     # register read to make sure that the server has handled all the packets sent on the control connection (address 0 of dpll_wrapper has no read side effect)
+
+    # TCP keepalive of every connection to the server, see set_tcp_keepalive(): a dead link is detected after about 8 s of silence
+    KEEPALIVE_IDLE = 5
+    KEEPALIVE_INTERVAL = 1
+    KEEPALIVE_COUNT = 3
 
 
     def __init__(self, controller=None):
@@ -54,12 +540,56 @@ class RP_PLL_device():
         self.controller = controller
         self.valid_socket = False
 
+        # held during each request/reply exchange, see with_device_lock()
+        self.lock = threading.RLock()
+
+        # when not None, register writes are queued into this transaction instead of being sent right away
+        self.current_transaction = None
+
+        # reads which were sent, but whose replies haven't been received yet, oldest first
+        self.pending_reads = collections.deque()
+        self.next_request_id = 0
+
         self.type_to_format_string = {False: '=III',
                                       True: '=IIi'}
 
+        # buffer reused by every call to read_Zynq_buffer_int16_view(), so that we don't allocate and copy at each logger read
+        # (only when there is no bulk connection: each bulk connection has its own buffer)
+        self.read_buffer_int16 = np.zeros(self.MAX_SAMPLES_READ_BUFFER, dtype=np.int16)
+
+        # Bulk-data connections, see bulk_connection(). The logger reads and the large block reads go through these,
+        # while self.sock (the control connection) only carries the register ops, so that they are never stuck behind megabytes of samples.
+        # When the list is empty, everything goes through the control connection.
+        self.bulk_connections = []
+        self.next_bulk_connection = 0
+        # True when packets were sent on the control connection since the last reply, see sync_control_connection()
+        self.bControlPacketsUnacknowledged = False
+
+        # Shadow register file: last value written to each register (absolute address -> uint32), see write_Zynq_register_32bits_if_changed().
+        # It is emptied every time the connection is opened, since the FPGA may have been reprogrammed or power-cycled in the meantime.
+        self.shadow_registers = {}
+        # Values read back from the registers by the clients (absolute address -> uint32), to serve the next reads of settings without a round trip.
+        # They are never used to skip writes: only the values which were written through this connection are in shadow_registers.
+        # They are emptied and forgotten along with the shadow register file.
+        self.readback_registers = {}
+        # registers set with SetWireInValue() but not yet sent by UpdateWireIns() (absolute address -> (value, bSigned)), in the order they were set
+        self.dirty_registers = collections.OrderedDict()
+        self.number_of_writes_skipped = 0
+
+        # see get_stats()
+        self.stats = RP_PLL_stats()
+        self.bConnectionLost = False    # a connection opened after a socket error counts as a reconnect
+        # binary trace of every packet and reply, see start_trace()
+        self.trace = None
+
     def socketErrorEvent(self, e):
         # disconnect from socket, and start reconnection timer:
         print("RP_PLL::socketErrorEvent()")
+        with self.stats.lock:
+            self.stats.number_of_socket_errors += 1
+            if isinstance(e, socket.timeout):
+                self.stats.number_of_timeouts += 1
+        self.bConnectionLost = True
         if self.controller is not None:
             self.controller.socketErrorEvent(e)
         else:
@@ -67,43 +597,124 @@ class RP_PLL_device():
             self.CloseTCPConnection()
             raise CommsLoggeableError(e)
 
+    @with_device_lock
     def CloseTCPConnection(self):
         print("RP_PLL_device::CloseTCPConnection()")
         self.sock = None # socket_placeholder()
         self.valid_socket = False
+        self.close_bulk_connections()
+        self.drop_connection_state()
+
+    # The pipelined reads and the queued transaction belong to the connection they were sent on:
+    # their replies will never come on another one.
+    def drop_connection_state(self):
+        self.current_transaction = None
+        pending_reads = self.pending_reads
+        self.pending_reads = collections.deque()
+        for pending_read in pending_reads:
+            pending_read.set_exception(CommsError('RP_PLL::read_Zynq_register_32bits_async(): the connection was closed before the reply was received'))
 
-    def OpenTCPConnection(self, HOST, PORT=5000, valid_socket_for_general_comms=True):
+    # Opens the control connection, then number_of_bulk_connections bulk-data connections (NUMBER_OF_BULK_CONNECTIONS by default).
+    # If a bulk connection can't be opened, the bulk transfers simply share the remaining connections (or the control connection).
+    # sock is an already connected socket to use as the control connection (see RP_PLL_connector), instead of a blocking connect().
+    @with_device_lock
+    def OpenTCPConnection(self, HOST, PORT=5000, valid_socket_for_general_comms=True, number_of_bulk_connections=None, sock=None):
         print("RP_PLL_device::OpenTCPConnection(): HOST = '%s', PORT = %d" % (HOST, PORT))
+        self.close_bulk_connections()
+        self.drop_connection_state()
         self.HOST = HOST
         self.PORT = PORT
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.invalidate_shadow_registers()
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            bConnected = False
+        else:
+            bConnected = True
+        self.sock = sock
         self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) # this avoids a ~33 ms on Windows before our request packets are sent (!!)
+        set_tcp_keepalive(self.sock, self.KEEPALIVE_IDLE, self.KEEPALIVE_INTERVAL, self.KEEPALIVE_COUNT)
         # self.sock.setblocking(1)
         self.sock.settimeout(2)
         try:
-            self.sock.connect((self.HOST, self.PORT))
+            if not bConnected:
+                self.sock.connect((self.HOST, self.PORT))
             self.valid_socket = valid_socket_for_general_comms
         except Exception as e:
             logging.error(traceback.format_exc())
             self.valid_socket = False
+        self.bControlPacketsUnacknowledged = False
+        if self.valid_socket and self.bConnectionLost:
+            self.bConnectionLost = False
+            with self.stats.lock:
+                self.stats.number_of_reconnects += 1
+
+        if number_of_bulk_connections is None:
+            number_of_bulk_connections = self.NUMBER_OF_BULK_CONNECTIONS
+        if not self.valid_socket:
+            return
+        bulk_connections = []
+        for k in range(number_of_bulk_connections):
+            try:
+                bulk_connections.append(RP_PLL_bulk_connection(self.HOST, self.PORT, channel=k+1))
+            except OSError:
+                self.logger.warning('Red_Pitaya_GUI{}: OpenTCPConnection(): could not open bulk connection {}, {} bulk connection(s) will be used'.format(self.logger_name, k, len(bulk_connections)))
+                break
+        self.bulk_connections = bulk_connections
+
+    @with_device_lock
+    def close_bulk_connections(self):
+        bulk_connections = self.bulk_connections
+        self.bulk_connections = []
+        for connection in bulk_connections:
+            connection.close()
+
+    # Context manager which yields a bulk connection for the duration of the 'with' block, or None if there is no bulk connection.
+    # A free connection is used if there is one, otherwise we wait for one of them, in turn.
+    @contextlib.contextmanager
+    def bulk_connection(self):
+        bulk_connections = self.bulk_connections
+        if len(bulk_connections) == 0:
+            yield None
+            return
+        for connection in bulk_connections:
+            if connection.lock.acquire(False):
+                break
+        else:
+            connection = bulk_connections[self.next_bulk_connection % len(bulk_connections)]
+            self.next_bulk_connection += 1
+            connection.lock.acquire()
+        try:
+            yield connection
+        finally:
+            connection.lock.release()
+
+    # Makes sure that the server has handled all the packets sent so far on the control connection,
+    # so that a bulk read sees the effect of the register writes (e.g. a logger trigger) which were sent before it.
+    # Costs a round trip only if something was sent on the control connection since the last reply.
+    @with_device_lock
+    def sync_control_connection(self):
+        if self.current_transaction is not None and len(self.current_transaction.packets) > 0:
+            self.current_transaction.commit()
+        if self.bControlPacketsUnacknowledged:
+            self.read_Zynq_register_32bits(self.SYNC_READ_ADDR)
 
     # from http://stupidpythonideas.blogspot.ca/2013/05/sockets-are-byte-streams-not-message.html
     def recvall(self, count):
-        buf = b''
-        
-        while count:
-            newbuf = self.sock.recv(count)
-            if not newbuf: return None
-            buf += newbuf
-            count -= len(newbuf)
-            
+        buf = bytearray(count)
+        if self.recvall_into(memoryview(buf)) is None:
+            return None
         return buf
 
+    def recvall_into(self, view):
+        return sock_recvall_into(self.sock, view)
+
     # Function used to send a file write command:
+    @with_device_lock
     def write_file_on_remote(self, strFilenameLocal, strFilenameRemote):
         # open local file and load into memory:
         file_data = np.fromfile(strFilenameLocal, dtype=np.uint8)
         try:
+            start_time = time.perf_counter()
             # send header
             packet_to_send = struct.pack('=III', self.MAGIC_BYTES_WRITE_FILE, len(strFilenameRemote), len(file_data))
             self.sock.sendall(packet_to_send)
@@ -111,30 +722,127 @@ class RP_PLL_device():
             self.sock.sendall(strFilenameRemote.encode('ascii'))
             # send actual file
             self.sock.sendall(file_data.tobytes())
+            if self.trace is not None:
+                self.trace.record_send(0, packet_to_send + strFilenameRemote.encode('ascii') + file_data[:self.trace.max_payload_bytes].tobytes(),
+                    len(packet_to_send) + len(strFilenameRemote) + len(file_data))
+            self.stats.record('write_file', len(packet_to_send) + len(strFilenameRemote) + len(file_data), time.perf_counter() - start_time)
         except OSError as e:
             print("RP_PLL.py: write_file_on_remote(): exception while sending file!")
             self.logger.warning('Red_Pitaya_GUI{}: write_file_on_remote(): exception while sending file!'.format(self.logger_name))
             self.socketErrorEvent(e)
 
+    # Returns (bExists, file_size, crc32) for a file on the Red Pitaya, crc32 being zlib.crc32() of its contents.
+    # Servers which predate this packet close the connection instead of replying, in which case this raises FileInfoNotSupportedError.
+    @with_device_lock
+    def get_remote_file_info(self, strFilenameRemote):
+        filename = strFilenameRemote.encode('ascii')
+        try:
+            self.send(struct.pack('=III', self.MAGIC_BYTES_FILE_INFO, len(filename), 0) + filename)
+            (magic_bytes, bExists, file_size, crc32) = struct.unpack('=IIII', self.read(16))
+        except CommsError as e:
+            raise FileInfoNotSupportedError('RP_PLL::get_remote_file_info(): no reply from the server (%s)' % e)
+        if magic_bytes != self.MAGIC_BYTES_FILE_INFO:
+            raise FileInfoNotSupportedError('RP_PLL::get_remote_file_info(): lost synchronization with the server, received 0x%08x as magic bytes' % magic_bytes)
+        return (bool(bExists), file_size, crc32)
+
+    # Same as write_file_on_remote(), except that the file is read from disk and sent in chunks instead of being loaded into memory,
+    # followed by its CRC-32, and that this waits until the server has checked the CRC-32 and synced the file to disk.
+    # The server writes to strFilenameRemote + '.part' and only replaces strFilenameRemote once the file is complete and correct.
+    # progress_callback(bytes_sent, file_size) is called after each chunk. Returns the CRC-32 of the file.
+    @with_device_lock
+    def write_file_on_remote_acked(self, strFilenameLocal, strFilenameRemote, progress_callback=None):
+        filename = strFilenameRemote.encode('ascii')
+        file_size = os.path.getsize(strFilenameLocal)
+        if self.valid_socket == False:
+            raise CommsError
+        if len(self.pending_reads) > 0:
+            # the replies to the pipelined reads are ahead of the acknowledgement in the stream
+            self.collect_pending_reads()
+
+        sock = self.sock
+        crc32 = 0
+        bytes_sent = 0
+        start_time = time.perf_counter()
+        try:
+            sock.sendall(struct.pack('=III', self.MAGIC_BYTES_WRITE_FILE_ACKED, len(filename), file_size) + filename)
+            with open(strFilenameLocal, 'rb') as f:
+                while bytes_sent < file_size:
+                    chunk = f.read(min(self.FILE_CHUNK_SIZE, file_size - bytes_sent))
+                    if len(chunk) == 0:
+                        # the server is waiting for file_size bytes, the connection can't be used anymore
+                        raise OSError('%s changed size while it was being sent' % strFilenameLocal)
+                    sock.sendall(chunk)
+                    crc32 = zlib.crc32(chunk, crc32)
+                    bytes_sent += len(chunk)
+                    if progress_callback is not None:
+                        progress_callback(bytes_sent, file_size)
+            crc32 &= 0xFFFFFFFF
+            sock.sendall(struct.pack('=I', crc32))
+            if self.trace is not None:
+                # only the header and filename are kept: the trace can't be replayed past this packet anyway
+                self.trace.record_send(0, struct.pack('=III', self.MAGIC_BYTES_WRITE_FILE_ACKED, len(filename), file_size) + filename,
+                    12 + len(filename) + file_size + 4)
+        except OSError as e:
+            print("RP_PLL.py: write_file_on_remote_acked(): exception while sending file!")
+            self.logger.warning('Red_Pitaya_GUI{}: write_file_on_remote_acked(): exception while sending file!'.format(self.logger_name))
+            self.socketErrorEvent(e)
+            raise CommsLoggeableError('RP_PLL::write_file_on_remote_acked(): could not send %s' % strFilenameLocal)
+
+        # syncing a large file to a slow SD card can take much longer than the usual replies
+        timeout = sock.gettimeout()
+        sock.settimeout(self.FILE_ACK_TIMEOUT)
+        try:
+            (magic_bytes, status, bytes_received, remote_crc32) = struct.unpack('=IIII', self.read(16))
+        finally:
+            sock.settimeout(timeout)
+        if magic_bytes != self.MAGIC_BYTES_WRITE_FILE_ACKED:
+            raise CommsLoggeableError('RP_PLL::write_file_on_remote_acked(): lost synchronization with the server, received 0x%08x as magic bytes' % magic_bytes)
+        self.stats.record('write_file', 12 + len(filename) + file_size + 4 + 16, time.perf_counter() - start_time)
+        if status != 0:
+            raise CommsLoggeableError('RP_PLL::write_file_on_remote_acked(): %s: %s (%d of %d bytes received, crc32 = 0x%08x instead of 0x%08x)'
+                % (strFilenameRemote, self.WRITE_FILE_STATUS.get(status, 'error %d' % status), bytes_received, file_size, remote_crc32, crc32))
+        return crc32
+
+    # Sends a local file to the Red Pitaya with write_file_on_remote_acked(), unless the remote file already has the same size and CRC-32.
+    # Returns True if the file was sent, False if it was already there.
+    @with_device_lock
+    def upload_file_if_changed(self, strFilenameLocal, strFilenameRemote, progress_callback=None):
+        (bExists, remote_file_size, remote_crc32) = self.get_remote_file_info(strFilenameRemote)
+        if bExists and (remote_file_size, remote_crc32) == file_crc32(strFilenameLocal, self.FILE_CHUNK_SIZE):
+            self.logger.info('Red_Pitaya_GUI{}: upload_file_if_changed(): {} is already up to date.'.format(self.logger_name, strFilenameRemote))
+            return False
+        self.write_file_on_remote_acked(strFilenameLocal, strFilenameRemote, progress_callback)
+        return True
+
     # Function used to send a shell command to the Red Pitaya:
+    @with_device_lock
     def send_shell_command(self, strCommand):
+        # the command might reprogram the FPGA (cat red_pitaya_top.bit > /dev/xdevcfg), after which the shadow register file would be wrong
+        self.invalidate_shadow_registers()
         try:
+            start_time = time.perf_counter()
             # send header
             packet_to_send = struct.pack('=III', self.MAGIC_BYTES_SHELL_COMMAND, len(strCommand), 0)
             self.sock.sendall(packet_to_send)
             # send command
             self.sock.sendall(strCommand.encode('ascii'))
+            if self.trace is not None:
+                self.trace.record_send(0, packet_to_send + strCommand.encode('ascii'))
+            self.stats.record('shell_command', len(packet_to_send) + len(strCommand), time.perf_counter() - start_time)
         except OSError as e:
             print("RP_PLL.py: send_shell_command(): exception while sending command!")
             self.logger.warning('Red_Pitaya_GUI{}: send_shell_command(): exception while sending command!'.format(self.logger_name))
             self.socketErrorEvent(e)
 
     # Function used to reboot the monitor-tcp program
+    @with_device_lock
     def send_reboot_command(self):
         try:
             # send header
             packet_to_send = struct.pack('=III', self.MAGIC_BYTES_REBOOT_MONITOR, 0, 0)
             self.sock.sendall(packet_to_send)
+            if self.trace is not None:
+                self.trace.record_send(0, packet_to_send)
         except OSError as e:
             print("RP_PLL.py: send_reboot_command(): exception while sending command!")
             self.logger.warning('Red_Pitaya_GUI{}: send_reboot_command(): exception while sending command!'.format(self.logger_name))
@@ -156,6 +864,9 @@ class RP_PLL_device():
 
         try:
             self.sock.sendall(packet_to_send)
+            self.bControlPacketsUnacknowledged = True
+            if self.trace is not None:
+                self.trace.record_send(0, packet_to_send)
         except OSError as e:
             print("RP_PLL::send(): caught exception")
             logging.error(traceback.format_exc())
@@ -167,9 +878,17 @@ class RP_PLL_device():
         if self.valid_socket == False:
             raise CommsError
 
+        if len(self.pending_reads) > 0:
+            # the replies to the pipelined reads are ahead of this one in the stream
+            self.collect_pending_reads()
+
         data_buffer = None
         try:
             data_buffer = self.recvall(bytes_to_read)
+            # the server handles the packets of a connection in order, so all the packets sent before this reply have been handled
+            self.bControlPacketsUnacknowledged = False
+            if self.trace is not None and data_buffer is not None:
+                self.trace.record_reply(0, data_buffer)
         except OSError as e:
             print("RP_PLL::read(): caught exception")
             logging.error(traceback.format_exc())
@@ -182,25 +901,368 @@ class RP_PLL_device():
         else:
             return data_buffer
 
+    # Same as read(), but the data is received directly into view, which must be a writable, byte-sized memoryview
+    def read_into(self, view):
+        if self.valid_socket == False:
+            raise CommsError
+
+        if len(self.pending_reads) > 0:
+            # the replies to the pipelined reads are ahead of this one in the stream
+            self.collect_pending_reads()
+
+        result = None
+        try:
+            result = self.recvall_into(view)
+            self.bControlPacketsUnacknowledged = False
+            if self.trace is not None and result is not None:
+                self.trace.record_reply(0, view)
+        except OSError as e:
+            print("RP_PLL::read_into(): caught exception")
+            logging.error(traceback.format_exc())
+            self.socketErrorEvent(e)
+        except:
+            print("RP_PLL::read_into(): unhandled exception")
+
+        if result is None:
+            view[:] = bytes(len(view))
+        return view
+
+    # Same as send() and read_into(), on a bulk connection. Errors go through socketErrorEvent() as well, which closes all the connections.
+    def send_bulk(self, connection, packet_to_send):
+        if self.valid_socket == False:
+            raise CommsError
+        try:
+            connection.sock.sendall(packet_to_send)
+            connection.number_of_requests += 1
+            if self.trace is not None:
+                self.trace.record_send(connection.channel, packet_to_send)
+        except OSError as e:
+            print("RP_PLL::send_bulk(): caught exception")
+            logging.error(traceback.format_exc())
+            self.socketErrorEvent(e)
+
+    def read_into_bulk(self, connection, view):
+        if self.valid_socket == False:
+            raise CommsError
+        result = None
+        try:
+            result = sock_recvall_into(connection.sock, view)
+            if self.trace is not None and result is not None:
+                self.trace.record_reply(connection.channel, view)
+        except OSError as e:
+            print("RP_PLL::read_into_bulk(): caught exception")
+            logging.error(traceback.format_exc())
+            self.socketErrorEvent(e)
+        if result is None:
+            view[:] = bytes(len(view))
+        return view
+
+    # Sends packet_to_send on a bulk connection, and receives the reply directly into the buffer returned by get_buffer(connection).
+    # Returns this buffer, or None if there is no bulk connection, in which case the caller uses the control connection instead.
+    # op is the name under which the request is counted in self.stats.
+    def bulk_request(self, packet_to_send, get_buffer, op):
+        if len(self.bulk_connections) == 0:
+            return None
+        # this has to be done before taking the bulk connection: the device lock is always taken first
+        self.sync_control_connection()
+        with self.bulk_connection() as connection:
+            if connection is None:
+                return None
+            data_buffer = get_buffer(connection)
+            start_time = time.perf_counter()
+            self.send_bulk(connection, packet_to_send)
+            self.read_into_bulk(connection, memoryview(data_buffer).cast('B'))
+            self.stats.record(op, len(packet_to_send) + memoryview(data_buffer).nbytes, time.perf_counter() - start_time)
+            return data_buffer
+
+    # Statistics of the communication since the creation of this object or the last reset_stats(), see RP_PLL_stats.get().
+    # Also includes the number of register writes skipped thanks to the shadow register file.
+    def get_stats(self):
+        stats = self.stats.get()
+        stats['writes_skipped'] = self.number_of_writes_skipped
+        return stats
+
+    def reset_stats(self):
+        self.stats.reset()
+        self.number_of_writes_skipped = 0
+
+    # Starts recording every packet sent and every reply received into strFilename, see CommsTrace.CommsTraceRecorder for the options.
+    # The recording costs a copy into a ring buffer: the file itself is written from a background thread.
+    # The trace is closed at exit if stop_trace() wasn't called, so that the last records aren't lost with the writer thread.
+    def start_trace(self, strFilename, **options):
+        import CommsTrace
+        self.stop_trace()
+        self.trace = CommsTrace.CommsTraceRecorder(strFilename, **options)
+        atexit.register(self.trace.close)
+
+    def stop_trace(self):
+        trace = self.trace
+        self.trace = None
+        if trace is not None:
+            atexit.unregister(trace.close)
+            trace.close()
+
+    # Writes the records of the trace to disk right away, instead of at the next flush period
+    def flush_trace(self):
+        trace = self.trace
+        if trace is not None:
+            trace.flush()
+
+    # Returns a transaction object to be used in a 'with' statement.
+    # All the register writes done inside the 'with' block are sent as a single multi-op packet when the block exits.
+    # A register read inside the block flushes the queued writes along with the read itself, so that the value is still returned immediately.
+    @with_device_lock
+    def transaction(self):
+        if self.current_transaction is None:
+            self.current_transaction = RP_PLL_transaction(self)
+        return self.current_transaction
+
+    @with_device_lock
     def write_Zynq_register_32bits(self, absolute_addr, data_32bits, bSigned=False):
+        if self.current_transaction is not None:
+            self.current_transaction.queue_write(absolute_addr, data_32bits, bSigned)
+            self.shadow_registers[absolute_addr] = int(data_32bits) & 0xFFFFFFFF
+            return
         self.validate_address(absolute_addr)
         packet_to_send = struct.pack(self.type_to_format_string[bSigned], self.MAGIC_BYTES_WRITE_REG, absolute_addr, int(data_32bits) & 0xFFFFFFFF)
+        start_time = time.perf_counter()
         self.send(packet_to_send)
+        self.stats.record('write_reg', len(packet_to_send), time.perf_counter() - start_time)
+        self.shadow_registers[absolute_addr] = int(data_32bits) & 0xFFFFFFFF
+
+    # Same as write_Zynq_register_32bits(), but the write is skipped if the register already holds this value according to the shadow register file.
+    # Only use this for registers which are plain levels: registers whose write strobe is used by the firmware
+    # (triggers, msbs of the 64 bits registers) must always be written with write_Zynq_register_32bits().
+    # Returns True if the write was sent (or queued), False if it was skipped.
+    @with_device_lock
+    def write_Zynq_register_32bits_if_changed(self, absolute_addr, data_32bits, bSigned=False):
+        if self.shadow_registers.get(absolute_addr) == int(data_32bits) & 0xFFFFFFFF:
+            self.number_of_writes_skipped += 1
+            return False
+        self.write_Zynq_register_32bits(absolute_addr, data_32bits, bSigned)
+        return True
+
+    # Forgets the values of all the registers, so that the next write to each of them is actually sent
+    @with_device_lock
+    def invalidate_shadow_registers(self):
+        self.shadow_registers.clear()
+        self.readback_registers.clear()
+        self.dirty_registers.clear()
+
+    @with_device_lock
+    def forget_shadow_registers(self, absolute_addresses):
+        for absolute_addr in absolute_addresses:
+            self.shadow_registers.pop(absolute_addr, None)
+            self.readback_registers.pop(absolute_addr, None)
 
+    @with_device_lock
     def read_Zynq_register_32bits(self, absolute_addr, bIsAXI=False):
+        if self.current_transaction is not None and len(self.current_transaction.packets) > 0:
+            index = self.current_transaction.queue_read(absolute_addr)
+            self.current_transaction.commit()
+            return self.current_transaction.replies[index]
+        self.validate_address(absolute_addr)
+        packet_to_send = struct.pack('=III', self.MAGIC_BYTES_READ_REG, absolute_addr, 0)  # last value is reserved
+        start_time = time.perf_counter()
+        self.send(packet_to_send)
+        data_buffer = self.read(4)
+        self.stats.record('read_reg', len(packet_to_send) + 4, time.perf_counter() - start_time)
+        return data_buffer
+
+    # Pipelined version of read_Zynq_register_32bits(): the request is sent right away but the reply is only received
+    # when the result of the returned RP_PLL_pending_read is needed, so that several reads can share a single round trip.
+    # monitor-tcp handles the packets of a connection in order, which means that the replies come back in the same
+    # order as the requests, so we match them using a sequence number (the request id).
+    @with_device_lock
+    def read_Zynq_register_32bits_async(self, absolute_addr):
+        if self.current_transaction is not None and len(self.current_transaction.packets) > 0:
+            # the queued writes have to reach the FPGA before this read
+            self.current_transaction.commit()
         self.validate_address(absolute_addr)
         packet_to_send = struct.pack('=III', self.MAGIC_BYTES_READ_REG, absolute_addr, 0)  # last value is reserved
+        pending_read = RP_PLL_pending_read(self, self.next_request_id)
+        self.next_request_id += 1
         self.send(packet_to_send)
-        return self.read(4)
+        self.pending_reads.append(pending_read)
+        return pending_read
+
+    # Receives the replies of the pending reads, oldest first, up to and including request_id (or all of them if request_id is None)
+    @with_device_lock
+    def collect_pending_reads(self, request_id=None):
+        reads_to_collect = []
+        while len(self.pending_reads) > 0 and (request_id is None or self.pending_reads[0].request_id <= request_id):
+            reads_to_collect.append(self.pending_reads.popleft())
+        if len(reads_to_collect) == 0:
+            return
+        # the reads that come after these ones stay pending, but read() must not try to collect them now
+        reads_still_pending = self.pending_reads
+        self.pending_reads = collections.deque()
+        sock = self.sock
+        try:
+            data_buffer = self.read(4*len(reads_to_collect))
+        except CommsError as e:
+            for pending_read in reads_to_collect:
+                pending_read.set_exception(e)
+            raise
+        finally:
+            # unless the connection was dropped meanwhile, in which case their replies are lost too
+            self.pending_reads.extendleft(reversed(reads_still_pending))
+            if self.sock is not sock:
+                self.drop_connection_state()
+            if len(self.pending_reads) > 0:
+                self.bControlPacketsUnacknowledged = True
+        time_received = time.perf_counter()
+        for k, pending_read in enumerate(reads_to_collect):
+            pending_read.set_reply(data_buffer[4*k:4*(k+1)])
+            self.stats.record('read_reg', 16, time_received - pending_read.time_sent)
 
+    # Sends a read request for number_of_items items. The server caps the number of items in a single request,
+    # so bigger reads are split into several requests, which are all sent before reading the replies.
+    # Reads of at least MIN_BYTES_BULK_READ bytes go through a bulk connection if there is one.
+    def read_items(self, magic_bytes, absolute_addr, number_of_items, max_items_per_request, bytes_per_item, address_increment_per_item):
+        packets_to_send = []
+        bytes_to_read = 0
+        while number_of_items > 0:
+            self.validate_address(absolute_addr)
+            items_in_this_request = min(number_of_items, max_items_per_request)
+            packets_to_send.append(struct.pack('=III', magic_bytes, absolute_addr, items_in_this_request))
+            bytes_to_read += bytes_per_item*items_in_this_request
+            absolute_addr += address_increment_per_item*items_in_this_request
+            number_of_items -= items_in_this_request
+
+        if bytes_to_read >= self.MIN_BYTES_BULK_READ:
+            data_buffer = self.bulk_request(b''.join(packets_to_send), lambda connection: bytearray(bytes_to_read), 'read_block')
+            if data_buffer is not None:
+                return data_buffer
+
+        with self.lock:
+            if self.current_transaction is not None and len(self.current_transaction.packets) > 0:
+                # the queued writes have to reach the FPGA before this read
+                self.current_transaction.commit()
+            start_time = time.perf_counter()
+            for packet_to_send in packets_to_send:
+                self.send(packet_to_send)
+            if bytes_to_read == 0:
+                return bytes()
+            data_buffer = self.read(bytes_to_read)
+            self.stats.record('read_block', 12*len(packets_to_send) + bytes_to_read, time.perf_counter() - start_time)
+            return data_buffer
+
+    # Reads number_of_registers consecutive 32 bits registers in a single request. Returns the raw bytes (4 per register).
+    def read_Zynq_register_block_32bits(self, absolute_addr, number_of_registers):
+        return self.read_items(self.MAGIC_BYTES_READ_REG_BLOCK, absolute_addr, number_of_registers, self.MAX_REGISTERS_READ_BLOCK, 4, 4)
+
+    # Reads number_of_samples successive values of the 64 bits register whose lsb is at absolute_addr_lsb and msb at absolute_addr_lsb+4,
+    # in a single request. The server reads the lsb first, which latches the msb, so the two halves of each sample are consistent.
+    # Returns the raw bytes (8 per sample).
+    def read_Zynq_register_64bits(self, absolute_addr_lsb, number_of_samples=1):
+        return self.read_items(self.MAGIC_BYTES_READ_REG_64, absolute_addr_lsb, number_of_samples, self.MAX_SAMPLES_READ_REG_64, 8, 0)
+
+    # The logger reads go through a bulk connection if there is one, see bulk_connection()
     def read_Zynq_buffer_int16(self, number_of_points):
         if number_of_points > self.MAX_SAMPLES_READ_BUFFER:
             number_of_points = self.MAX_SAMPLES_READ_BUFFER
             print("number of points clamped to %d." % number_of_points)
 
         packet_to_send = struct.pack('=III', self.MAGIC_BYTES_READ_BUFFER, self.FPGA_BASE_ADDR, number_of_points)    # last value is reserved
-        self.send(packet_to_send)
-        return self.read(int(2*number_of_points))
+        data_buffer = self.bulk_request(packet_to_send, lambda connection: bytearray(int(2*number_of_points)), 'read_buffer')
+        if data_buffer is not None:
+            return data_buffer
+
+        with self.lock:
+            start_time = time.perf_counter()
+            self.send(packet_to_send)
+            data_buffer = self.read(int(2*number_of_points))
+            self.stats.record('read_buffer', len(packet_to_send) + len(data_buffer), time.perf_counter() - start_time)
+            return data_buffer
+
+    # Same as read_Zynq_buffer_int16(), but the samples are received directly into a pre-allocated buffer, and returned as a numpy int16 array.
+    # The returned array is a view into this buffer, so it is only valid until the next call: make a copy if the samples need to be kept.
+    def read_Zynq_buffer_int16_view(self, number_of_points):
+        number_of_points = int(number_of_points)
+        if number_of_points > self.MAX_SAMPLES_READ_BUFFER:
+            number_of_points = self.MAX_SAMPLES_READ_BUFFER
+            print("number of points clamped to %d." % number_of_points)
+
+        packet_to_send = struct.pack('=III', self.MAGIC_BYTES_READ_BUFFER, self.FPGA_BASE_ADDR, number_of_points)    # last value is reserved
+        samples = self.bulk_request(packet_to_send, lambda connection: connection.read_buffer_int16[:number_of_points], 'read_buffer')
+        if samples is not None:
+            return samples
+
+        with self.lock:
+            start_time = time.perf_counter()
+            self.send(packet_to_send)
+            samples = self.read_buffer_int16[:number_of_points]
+            self.read_into(memoryview(samples).cast('B'))
+            self.stats.record('read_buffer', len(packet_to_send) + samples.nbytes, time.perf_counter() - start_time)
+            return samples
+
+    # Captures number_of_points samples from each of the logger inputs in selectors (values of the mux selector register), back-to-back,
+    # with a single request. This replaces one mux write/trigger/wait/read cycle per input.
+    # Returns (status, samples): status is a numpy uint32 array with the logger status word at the end of each capture
+    # (see SuperLaserLand_JD_RP.readLoggerStatus()), and samples is a numpy int16 array of shape (len(selectors), number_of_points).
+    # The server leaves the mux selector on the last input.
+    def read_logger_snapshot(self, selectors, number_of_points):
+        selectors = [int(selector) for selector in selectors]
+        if len(selectors) > self.MAX_SOURCES_SNAPSHOT:
+            raise ValueError('at most %d sources per snapshot, got %d' % (self.MAX_SOURCES_SNAPSHOT, len(selectors)))
+        number_of_points = int(number_of_points)
+        if number_of_points > self.MAX_SAMPLES_READ_BUFFER:
+            number_of_points = self.MAX_SAMPLES_READ_BUFFER
+            print("number of points clamped to %d." % number_of_points)
+
+        packet_to_send = struct.pack('=III', self.MAGIC_BYTES_SNAPSHOT, len(selectors), number_of_points) + struct.pack('=%dI' % len(selectors), *selectors)
+        header_bytes = 12
+        bytes_to_read = header_bytes + 4*len(selectors) + 2*len(selectors)*number_of_points
+        data_buffer = self.bulk_request(packet_to_send, lambda connection: bytearray(bytes_to_read), 'read_buffer')
+        if data_buffer is None:
+            with self.lock:
+                if self.current_transaction is not None and len(self.current_transaction.packets) > 0:
+                    # the queued writes have to reach the FPGA before the captures
+                    self.current_transaction.commit()
+                start_time = time.perf_counter()
+                self.send(packet_to_send)
+                data_buffer = self.read(bytes_to_read)
+                self.stats.record('read_buffer', len(packet_to_send) + bytes_to_read, time.perf_counter() - start_time)
+
+        (magic_bytes, number_of_sources, samples_per_source) = struct.unpack('=III', data_buffer[:header_bytes])
+        if (magic_bytes, number_of_sources, samples_per_source) != (self.MAGIC_BYTES_SNAPSHOT, len(selectors), number_of_points):
+            raise CommsLoggeableError('RP_PLL::read_logger_snapshot(): lost synchronization with the server, received (0x%08x, %d, %d) as header' % (magic_bytes, number_of_sources, samples_per_source))
+        status = np.frombuffer(data_buffer, np.uint32, len(selectors), header_bytes)
+        samples = np.frombuffer(data_buffer, np.int16, len(selectors)*number_of_points, header_bytes + 4*len(selectors))
+        return (status, samples.reshape((len(selectors), number_of_points)))
+
+    # Captures first_sample+number_of_points samples from the logger input selected by selector, and receives only statistics of the last number_of_points.
+    # The samples are taken as uint16 if bUnsigned is True, int16 otherwise. The server leaves the mux selector on this input.
+    # Returns a dict with the keys 'logger_status', 'number_of_samples', 'min', 'max', 'max_abs', 'sum' and 'sum_of_squares', in counts.
+    def read_logger_stats(self, selector, first_sample, number_of_points, bUnsigned=False):
+        packet_to_send = struct.pack('=IIIII', self.MAGIC_BYTES_CAPTURE_STATS, int(selector), int(first_sample), int(number_of_points), int(bUnsigned))
+        reply_format = '=IIIiiIqQ'
+        with self.lock:
+            if self.current_transaction is not None and len(self.current_transaction.packets) > 0:
+                # the queued writes have to reach the FPGA before the capture
+                self.current_transaction.commit()
+            start_time = time.perf_counter()
+            self.send(packet_to_send)
+            data_buffer = self.read(struct.calcsize(reply_format))
+            self.stats.record('read_buffer', len(packet_to_send) + len(data_buffer), time.perf_counter() - start_time)
+
+        (magic_bytes, logger_status, number_of_samples, min_value, max_value, max_abs, sum_value, sum_of_squares) = struct.unpack(reply_format, data_buffer)
+        if magic_bytes != self.MAGIC_BYTES_CAPTURE_STATS:
+            raise CommsLoggeableError('RP_PLL::read_logger_stats(): lost synchronization with the server, received 0x%08x as magic bytes' % magic_bytes)
+        return {'logger_status': logger_status,
+                'number_of_samples': number_of_samples,
+                'min': min_value,
+                'max': max_value,
+                'max_abs': max_abs,
+                'sum': sum_value,
+                'sum_of_squares': sum_of_squares}
+
+    # Opens a new connection to the same server, on which the content of the FIFO logger is continuously streamed.
+    # samples_per_block is rounded down to a multiple of 10 by the server. number_of_blocks = 0 streams until the stream is closed.
+    def open_fifo_stream(self, samples_per_block, number_of_blocks=0):
+        samples_per_block = min(int(samples_per_block), self.MAX_SAMPLES_STREAM_FIFO_BLOCK)
+        return RP_PLL_fifo_stream(self.HOST, self.PORT, samples_per_block, number_of_blocks)
 
     #######################################################
     # Functions used to access Zynq registers, but which do not interact directly with the socket,
@@ -216,6 +1278,12 @@ class RP_PLL_device():
     def write_Zynq_AXI_register_uint32(self, address_uint32, data_uint32):
         self.write_Zynq_register_32bits(self.FPGA_BASE_ADDR_XADC+address_uint32, data_uint32, bSigned=False)
 
+    def write_Zynq_register_uint32_if_changed(self, address_uint32, data_uint32):
+        return self.write_Zynq_register_32bits_if_changed(self.FPGA_BASE_ADDR+address_uint32, data_uint32, bSigned=False)
+
+    def write_Zynq_register_int32_if_changed(self, address_uint32, data_int32):
+        return self.write_Zynq_register_32bits_if_changed(self.FPGA_BASE_ADDR+address_uint32, data_int32, bSigned=True)
+
     def read_Zynq_register_uint32(self, address_uint32):
         data_buffer = self.read_Zynq_register_32bits(self.FPGA_BASE_ADDR+address_uint32)
         register_value_as_tuple = struct.unpack('I', data_buffer)
@@ -231,10 +1299,28 @@ class RP_PLL_device():
         register_value_as_tuple = struct.unpack('I', data_buffer)
         return register_value_as_tuple[0]
 
+    # Reads number_of_registers consecutive registers in a single request. Returns a numpy uint32 array.
+    def read_Zynq_registers_block(self, address_uint32, number_of_registers):
+        data_buffer = self.read_Zynq_register_block_32bits(self.FPGA_BASE_ADDR+address_uint32, number_of_registers)
+        return np.frombuffer(data_buffer, np.dtype(np.uint32))
+
+    def read_Zynq_AXI_registers_block(self, address_uint32, number_of_registers):
+        data_buffer = self.read_Zynq_register_block_32bits(self.FPGA_BASE_ADDR_XADC+address_uint32, number_of_registers)
+        return np.frombuffer(data_buffer, np.dtype(np.uint32))
+
+    def read_Zynq_register_uint32_async(self, address_uint32):
+        return self.read_Zynq_register_32bits_async(self.FPGA_BASE_ADDR+address_uint32)
+
     def read_Zynq_register_uint64(self, address_uint32_lsb, address_uint32_msb):
         print("read_Zynq_register_uint64()")
-        results_lsb = self.read_Zynq_register_uint32(address_uint32_lsb)
-        results_msb = self.read_Zynq_register_uint32(address_uint32_msb)
+        if address_uint32_msb == address_uint32_lsb+4:
+            # both halves are read by the server in a single request, which also makes sure that they don't tear
+            return np.frombuffer(self.read_Zynq_register_64bits(self.FPGA_BASE_ADDR+address_uint32_lsb), np.dtype(np.uint64))
+
+        pending_lsb = self.read_Zynq_register_uint32_async(address_uint32_lsb)
+        pending_msb = self.read_Zynq_register_uint32_async(address_uint32_msb)
+        results_lsb = pending_lsb.result_uint32()
+        results_msb = pending_msb.result_uint32()
 
         # convert to 64 bits using numpy's casts
         results = np.array((results_lsb, results_msb), np.dtype(np.uint32))
@@ -244,8 +1330,14 @@ class RP_PLL_device():
 
     def read_Zynq_register_int64(self, address_uint32_lsb, address_uint32_msb):
         # print "read_Zynq_register_uint64()"
-        results_lsb = self.read_Zynq_register_uint32(address_uint32_lsb)
-        results_msb = self.read_Zynq_register_uint32(address_uint32_msb)
+        if address_uint32_msb == address_uint32_lsb+4:
+            # both halves are read by the server in a single request, which also makes sure that they don't tear
+            return np.frombuffer(self.read_Zynq_register_64bits(self.FPGA_BASE_ADDR+address_uint32_lsb), np.dtype(np.int64))
+
+        pending_lsb = self.read_Zynq_register_uint32_async(address_uint32_lsb)
+        pending_msb = self.read_Zynq_register_uint32_async(address_uint32_msb)
+        results_lsb = pending_lsb.result_uint32()
+        results_msb = pending_msb.result_uint32()
 
         # convert to 64 bits using numpy's casts
         results = np.array((results_lsb, results_msb), np.dtype(np.uint32))
@@ -253,6 +1345,10 @@ class RP_PLL_device():
 
         return results
 
+    # Reads number_of_samples successive values of a 64 bits register with a single request. Returns a numpy int64 array.
+    def read_Zynq_register_int64_samples(self, address_uint32_lsb, number_of_samples):
+        return np.frombuffer(self.read_Zynq_register_64bits(self.FPGA_BASE_ADDR+address_uint32_lsb, number_of_samples), np.dtype(np.int64))
+
     #######################################################
     # Functions to emulate the Opal Kelly API:
     #######################################################
@@ -264,25 +1360,28 @@ class RP_PLL_device():
     #   #print('ActivateTriggerIn(): TODO')
     #   self.write_Zynq_register_uint32((endpoint+value)*4+value*4, 0)
 
+    @with_device_lock
     def SetWireInValue(self, endpoint, value_16bits):
-        # this only needs to update the internal state
-        # for this, there would need to be two versions of the internal state, so that we can diff them and commit only the addresses that have changed
-        # but its much simpler for now to just commit the change directly
+        # this only updates the internal state: the value is sent by the next UpdateWireIns() call, and only if it differs from the shadow register file
         # the multiply by 4 is because right now the zynq code doesn't work unless reading on a 32-bits boundary, so we map the addresses to different values
-        if value_16bits < 0:
-            # write as a signed value
-            self.write_Zynq_register_int32(endpoint*4, value_16bits)
-        else:
-            # write as an unsigned value
-            self.write_Zynq_register_uint32(endpoint*4, value_16bits)
-
+        absolute_addr = self.FPGA_BASE_ADDR + endpoint*4
+        bSigned = (value_16bits < 0)    # negative values are written as signed values
+        self.dirty_registers.pop(absolute_addr, None)
+        if self.shadow_registers.get(absolute_addr) != int(value_16bits) & 0xFFFFFFFF:
+            self.dirty_registers[absolute_addr] = (value_16bits, bSigned)
 
+    @with_device_lock
     def UpdateWireIns(self):
         # commit changes to the fpga
         # Wire ins are from the PC to the FPGA
-        # for now we don't do anything since every SetWireInValue() call actually commits the changes to the fpga...
-        #print('UpdateWireIns(): TODO')
-        return
+        # all the registers that changed since the last call are sent in a single multi-op packet
+        if len(self.dirty_registers) == 0:
+            return
+        dirty_registers = self.dirty_registers
+        self.dirty_registers = collections.OrderedDict()
+        with self.transaction():
+            for absolute_addr, (value, bSigned) in dirty_registers.items():
+                self.write_Zynq_register_32bits_if_changed(absolute_addr, value, bSigned)
 
     def GetWireOutValue(self, endpoint):
         # print('GetWireOutValue(): TODO')
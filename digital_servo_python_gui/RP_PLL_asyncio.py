@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# asyncio-compatible wrapper around RP_PLL_device.
+# This lives in its own file so that RP_PLL.py stays importable without the async/await syntax.
+
+import asyncio
+import concurrent.futures
+
+import numpy as np
+
+class RP_PLL_device_asyncio():
+    # dev is a connected RP_PLL.RP_PLL_device.
+    # All the socket accesses are done from a single worker thread, so that the requests keep their order on the
+    # socket, and the replies are matched to the requests by the pipelining logic of RP_PLL_device.
+    def __init__(self, dev, loop=None):
+        self.dev = dev
+        self.loop = loop
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def run_in_worker(self, function, *args):
+        loop = self.loop
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self.executor, function, *args)
+
+    async def read_Zynq_register_uint32(self, address_uint32):
+        pending_read = await self.run_in_worker(self.dev.read_Zynq_register_uint32_async, address_uint32)
+        return await self.run_in_worker(pending_read.result_uint32)
+
+    async def read_Zynq_register_int32(self, address_uint32):
+        pending_read = await self.run_in_worker(self.dev.read_Zynq_register_uint32_async, address_uint32)
+        return await self.run_in_worker(pending_read.result_int32)
+
+    # Reads several registers with a single round trip. Returns a numpy uint32 array.
+    async def read_Zynq_registers_uint32(self, list_of_addresses_uint32):
+        def send_and_collect():
+            pending_reads = [self.dev.read_Zynq_register_uint32_async(address_uint32) for address_uint32 in list_of_addresses_uint32]
+            return np.array([x.result_uint32() for x in pending_reads], np.dtype(np.uint32))
+        return await self.run_in_worker(send_and_collect)
+
+    async def write_Zynq_register_uint32(self, address_uint32, data_uint32):
+        return await self.run_in_worker(self.dev.write_Zynq_register_uint32, address_uint32, data_uint32)
+
+    async def write_Zynq_register_int32(self, address_uint32, data_int32):
+        return await self.run_in_worker(self.dev.write_Zynq_register_int32, address_uint32, data_int32)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
@@ -65,6 +65,9 @@ class MonitorTCP_mock():
             RP_PLL.RP_PLL_device.MAGIC_BYTES_WRITE_REG: self.write_reg_handler,
             RP_PLL.RP_PLL_device.MAGIC_BYTES_READ_REG: self.read_reg_handler,
             RP_PLL.RP_PLL_device.MAGIC_BYTES_READ_BUFFER: self.read_buf_handler,
+            RP_PLL.RP_PLL_device.MAGIC_BYTES_MULTI_OP: self.multi_op_handler,
+            RP_PLL.RP_PLL_device.MAGIC_BYTES_READ_REG_BLOCK: self.read_reg_block_handler,
+            RP_PLL.RP_PLL_device.MAGIC_BYTES_READ_REG_64: self.read_reg_64_handler,
         }
 
     def parse_buffer(self, data_buffer):
@@ -132,7 +135,7 @@ class MonitorTCP_mock():
         except KeyError:
             data = self.invalid_read
 
-        bytes_to_send = struct.pack('=i', data)  # signed or unsigned doesn't matter here
+        bytes_to_send = struct.pack('=I', data & 0xFFFFFFFF)  # signed or unsigned doesn't matter here
 
 
         return (bytes_to_send, bytes_consumed)
@@ -148,12 +151,84 @@ class MonitorTCP_mock():
 
         return (self.memory_buffer, bytes_consumed)
 
+    def read_reg_block_handler(self, data_buffer):
+        words_consumed = 3
+        bytes_per_word = 4
+        bytes_consumed = words_consumed*bytes_per_word
+
+        # Do we have all the required information yet to handle the request?
+        if len(data_buffer) < bytes_consumed:
+            return (None, 0)
+
+        (magic_bytes, addr, number_of_registers) = struct.unpack('=III', data_buffer[:bytes_consumed])
+
+        # same thing as number_of_registers consecutive register reads:
+        bytes_to_send = bytearray()
+        for k in range(number_of_registers):
+            (data_to_send_back, _) = self.read_reg_handler(struct.pack('=III', RP_PLL.RP_PLL_device.MAGIC_BYTES_READ_REG, addr+4*k, 0))
+            bytes_to_send += data_to_send_back
+
+        return (bytes_to_send, bytes_consumed)
+
+    def read_reg_64_handler(self, data_buffer):
+        words_consumed = 3
+        bytes_per_word = 4
+        bytes_consumed = words_consumed*bytes_per_word
+
+        # Do we have all the required information yet to handle the request?
+        if len(data_buffer) < bytes_consumed:
+            return (None, 0)
+
+        (magic_bytes, addr, number_of_samples) = struct.unpack('=III', data_buffer[:bytes_consumed])
+
+        # each sample is the lsb followed by the msb:
+        bytes_to_send = bytearray()
+        for k in range(number_of_samples):
+            for addr_half in (addr, addr+4):
+                (data_to_send_back, _) = self.read_reg_handler(struct.pack('=III', RP_PLL.RP_PLL_device.MAGIC_BYTES_READ_REG, addr_half, 0))
+                bytes_to_send += data_to_send_back
+
+        return (bytes_to_send, bytes_consumed)
+
+    def multi_op_handler(self, data_buffer):
+        words_consumed = 3
+        bytes_per_word = 4
+        bytes_per_op = 3*bytes_per_word
+        header_bytes = words_consumed*bytes_per_word
+
+        # Do we have all the required information yet to handle the request?
+        if len(data_buffer) < header_bytes:
+            return (None, 0)
+        (magic_bytes, number_of_ops, reserved) = struct.unpack('=III', data_buffer[:header_bytes])
+        # like monitor-tcp, the ops beyond MAX_OPS_MULTI_OP are parsed as standalone packets
+        number_of_ops = min(number_of_ops, RP_PLL.RP_PLL_device.MAX_OPS_MULTI_OP)
+        bytes_consumed = header_bytes + number_of_ops*bytes_per_op
+        if len(data_buffer) < bytes_consumed:
+            return (None, 0)
+
+        # each op is a regular register write/read packet, so we simply dispatch them to the corresponding handlers
+        bytes_to_send = bytearray()
+        for k in range(number_of_ops):
+            op_buffer = data_buffer[header_bytes+k*bytes_per_op:header_bytes+(k+1)*bytes_per_op]
+            (op_magic_bytes,) = struct.unpack('I', op_buffer[:4])
+            if op_magic_bytes == RP_PLL.RP_PLL_device.MAGIC_BYTES_WRITE_REG:
+                self.write_reg_handler(op_buffer)
+            elif op_magic_bytes == RP_PLL.RP_PLL_device.MAGIC_BYTES_READ_REG:
+                (data_to_send_back, _) = self.read_reg_handler(op_buffer)
+                bytes_to_send += data_to_send_back
+            else:
+                print("Error: unrecognized op 0x%x in multi-op packet" % op_magic_bytes)
+
+        if len(bytes_to_send) == 0:
+            return (None, bytes_consumed)
+        return (bytes_to_send, bytes_consumed)
+
     # Removes data from the start of a bytearray and returns it
     def remove_from_queue(self, data_array, bytes_to_remove):
         if len(data_array) < bytes_to_remove:
             raise Exception("Not enough bytes in buffer.")
         data = data_array[:bytes_to_remove]
-        data_array[:] = bytearray()
+        del data_array[:bytes_to_remove]
         return data
 
     # Add data to the end of a bytearray:
@@ -165,11 +240,16 @@ class MonitorTCP_mock():
     def send_mock(self, packet_to_send):
         packet_to_send = bytearray(packet_to_send) # need bytearray since it is mutable, as opposed to bytes()
         print("packet_to_send=%s, type=%s" % (repr(packet_to_send), type(packet_to_send)))
-        data_to_send_back = self.parse_buffer(packet_to_send)
-        len2 = lambda x: 0 if x is None else len(x)
-        print("send_mock(), before: size=%d, to add: %d" % (len2(self.data_to_send_back), len2(data_to_send_back)))
-        self.add_to_queue(self.data_to_send_back, data_to_send_back)
-        print("send_mock(), after: size=%d" % len2(self.data_to_send_back))
+        # a single send can hold several packets
+        while len(packet_to_send) > 0:
+            length_before = len(packet_to_send)
+            data_to_send_back = self.parse_buffer(packet_to_send)
+            len2 = lambda x: 0 if x is None else len(x)
+            print("send_mock(), before: size=%d, to add: %d" % (len2(self.data_to_send_back), len2(data_to_send_back)))
+            self.add_to_queue(self.data_to_send_back, data_to_send_back)
+            print("send_mock(), after: size=%d" % len2(self.data_to_send_back))
+            if len(packet_to_send) == length_before:
+                break
 
     def read_mock(self, bytes_to_read):
         return self.remove_from_queue(self.data_to_send_back, bytes_to_read)
@@ -301,6 +381,586 @@ def test_monitorTCP_mock():
     # actual test
     check_readreg(dev)
 
+def test_transaction():
+    dev = RP_PLL.RP_PLL_device()
+    # connect mocks
+    monitor_tcp = MonitorTCP_mock()
+    packets_sent = []
+    def send_mock(packet_to_send):
+        packets_sent.append(packet_to_send)
+        monitor_tcp.send_mock(packet_to_send)
+    dev.send = send_mock
+    dev.read = monitor_tcp.read_mock
+
+    # writes and deferred reads all go out in a single packet:
+    with dev.transaction() as t:
+        for k in range(10):
+            dev.write_Zynq_register_uint32(address_uint32=4*k, data_uint32=k+100)
+        index_first = t.queue_read(dev.FPGA_BASE_ADDR+4*3)
+        index_second = t.queue_read(dev.FPGA_BASE_ADDR+4*7)
+    assert len(packets_sent) == 1
+    assert t.get_uint32(index_first) == 103
+    assert t.get_uint32(index_second) == 107
+    assert dev.current_transaction is None
+
+    # an immediate read inside a transaction flushes the queued writes along with it:
+    packets_sent.clear()
+    with dev.transaction():
+        dev.write_Zynq_register_uint32(address_uint32=4*20, data_uint32=55)
+        assert dev.read_Zynq_register_uint32(address_uint32=4*20) == 55
+        dev.write_Zynq_register_uint32(address_uint32=4*21, data_uint32=56)
+    assert len(packets_sent) == 2
+    assert dev.read_Zynq_register_uint32(address_uint32=4*21) == 56
+
+    # big transactions are split into several multi-op packets, sent together:
+    packets_sent.clear()
+    with dev.transaction() as t:
+        for k in range(dev.MAX_OPS_MULTI_OP + 10):
+            dev.write_Zynq_register_uint32(address_uint32=4*(k % 40), data_uint32=k)
+        index = t.queue_read(dev.FPGA_BASE_ADDR+4*((dev.MAX_OPS_MULTI_OP + 9) % 40))
+    assert len(packets_sent) == 1
+    assert struct.unpack('=III', packets_sent[0][:12]) == (dev.MAGIC_BYTES_MULTI_OP, dev.MAX_OPS_MULTI_OP, 0)
+    assert struct.unpack_from('=III', packets_sent[0], 12*(dev.MAX_OPS_MULTI_OP+1)) == (dev.MAGIC_BYTES_MULTI_OP, 11, 0)
+    assert t.get_uint32(index) == dev.MAX_OPS_MULTI_OP + 9
+
+    # nothing gets sent if the block raises:
+    packets_sent.clear()
+    with pytest.raises(ValueError):
+        with dev.transaction():
+            dev.write_Zynq_register_uint32(address_uint32=4*30, data_uint32=1)
+            raise ValueError()
+    assert len(packets_sent) == 0
+
+def test_shadow_registers():
+    dev = RP_PLL.RP_PLL_device()
+    # connect mocks
+    monitor_tcp = MonitorTCP_mock()
+    packets_sent = []
+    def send_mock(packet_to_send):
+        packets_sent.append(packet_to_send)
+        monitor_tcp.send_mock(packet_to_send)
+    dev.send = send_mock
+    dev.read = monitor_tcp.read_mock
+
+    # writing the same value again is free, signed or not:
+    assert dev.write_Zynq_register_uint32_if_changed(4*1, 0xFFFFFFFF)
+    assert not dev.write_Zynq_register_uint32_if_changed(4*1, 0xFFFFFFFF)
+    assert not dev.write_Zynq_register_int32_if_changed(4*1, -1)
+    assert dev.write_Zynq_register_uint32_if_changed(4*1, 5)
+    assert len(packets_sent) == 2
+    assert dev.number_of_writes_skipped == 2
+    # plain writes are always sent, but update the shadow:
+    dev.write_Zynq_register_uint32(4*1, 5)
+    dev.write_Zynq_register_uint32(4*2, 6)
+    assert len(packets_sent) == 4
+    assert not dev.write_Zynq_register_uint32_if_changed(4*2, 6)
+
+    # UpdateWireIns() sends only the registers that changed, in a single packet:
+    packets_sent.clear()
+    for k in range(1, 5):
+        dev.SetWireInValue(k, k+4)
+    assert len(packets_sent) == 0
+    dev.UpdateWireIns()
+    assert len(packets_sent) == 1
+    assert struct.unpack('=III', packets_sent[0][:12]) == (dev.MAGIC_BYTES_MULTI_OP, 2, 0)
+    assert dev.read_Zynq_register_uint32(4*3) == 7
+    assert dev.read_Zynq_register_uint32(4*4) == 8
+    packets_sent.clear()
+    dev.SetWireInValue(3, 7)
+    dev.UpdateWireIns()
+    assert len(packets_sent) == 0
+
+    # the values of an aborted transaction were never sent, so they must not be trusted:
+    with pytest.raises(ValueError):
+        with dev.transaction():
+            dev.write_Zynq_register_uint32_if_changed(4*3, 9)
+            raise ValueError()
+    assert dev.write_Zynq_register_uint32_if_changed(4*3, 7)
+
+    # everything is sent again after a reconnection:
+    dev.invalidate_shadow_registers()
+    packets_sent.clear()
+    assert dev.write_Zynq_register_uint32_if_changed(4*4, 8)
+    assert len(packets_sent) == 1
+
+def test_pipelined_reads():
+    dev = RP_PLL.RP_PLL_device()
+    dev.valid_socket = True
+    # connect mocks. We mock recvall() instead of read() here since read() is the one which has to wait for the pending replies
+    monitor_tcp = MonitorTCP_mock()
+    dev.send = monitor_tcp.send_mock
+    dev.recvall = monitor_tcp.read_mock
+    for k in range(8):
+        dev.write_Zynq_register_uint32(address_uint32=4*k, data_uint32=k+200)
+
+    # all the requests go out before any reply is received:
+    pending_reads = [dev.read_Zynq_register_uint32_async(4*k) for k in range(8)]
+    assert len(dev.pending_reads) == 8
+    # collecting a reply also collects the ones before it, but not the ones after it:
+    assert pending_reads[2].result_uint32() == 202
+    assert pending_reads[1].done()
+    assert not pending_reads[3].done()
+    assert len(dev.pending_reads) == 5
+    # a synchronous read has to wait for the pending replies first:
+    assert dev.read_Zynq_register_uint32(4*6) == 206
+    assert len(dev.pending_reads) == 0
+    assert [x.result_uint32() for x in pending_reads] == [k+200 for k in range(8)]
+
+def test_pipelined_reads_connection_lost():
+    import socket
+    from MonitorTCPMockServer import MonitorTCPMockServer
+    dev = RP_PLL.RP_PLL_device()
+    (dev.sock, server_sock) = socket.socketpair()
+    dev.sock.settimeout(2)
+    dev.valid_socket = True
+    pending_reads = [dev.read_Zynq_register_uint32_async(4*k) for k in range(3)]
+    # the server drops the connection before replying:
+    server_sock.close()
+    with pytest.raises(RP_PLL.CommsError):
+        pending_reads[0].result_uint32()
+    assert len(dev.pending_reads) == 0
+    for pending_read in pending_reads[1:]:
+        assert pending_read.done()
+        with pytest.raises(RP_PLL.CommsError):
+            pending_read.result_uint32()
+
+    # the next connection doesn't wait for replies to requests which were sent on the previous one:
+    server = MonitorTCPMockServer()
+    try:
+        server.write_register(RP_PLL.RP_PLL_device.FPGA_BASE_ADDR + 4*2, 123)
+        dev.OpenTCPConnection(server.HOST, server.PORT, number_of_bulk_connections=0)
+        assert dev.valid_socket
+        assert dev.read_Zynq_register_uint32(4*2) == 123
+    finally:
+        dev.CloseTCPConnection()
+        server.close()
+
+    # same if the pipelined reads are abandoned when reconnecting:
+    (dev.sock, server_sock) = socket.socketpair()
+    dev.valid_socket = True
+    pending_read = dev.read_Zynq_register_uint32_async(0)
+    dev.CloseTCPConnection()
+    server_sock.close()
+    assert len(dev.pending_reads) == 0
+    with pytest.raises(RP_PLL.CommsError):
+        pending_read.result()
+
+def test_read_registers_block():
+    dev = RP_PLL.RP_PLL_device()
+    dev.valid_socket = True
+    # connect mocks
+    monitor_tcp = MonitorTCP_mock()
+    packets_sent = []
+    def send_mock(packet_to_send):
+        packets_sent.append(packet_to_send)
+        monitor_tcp.send_mock(packet_to_send)
+    dev.send = send_mock
+    dev.recvall = monitor_tcp.read_mock
+    dev.MAX_REGISTERS_READ_BLOCK = 16 # to check that bigger blocks get split correctly
+    for k in range(40):
+        dev.write_Zynq_register_uint32(address_uint32=4*k, data_uint32=k+400)
+
+    packets_sent.clear()
+    values = dev.read_Zynq_registers_block(4*2, 5)
+    assert values.dtype == np.uint32
+    assert list(values) == [k+400 for k in range(2, 7)]
+    assert len(packets_sent) == 1
+
+    values = dev.read_Zynq_registers_block(0, 40)
+    assert list(values) == [k+400 for k in range(40)]
+
+def test_read_register_64bits():
+    dev = RP_PLL.RP_PLL_device()
+    dev.valid_socket = True
+    # connect mocks
+    monitor_tcp = MonitorTCP_mock()
+    packets_sent = []
+    def send_mock(packet_to_send):
+        packets_sent.append(packet_to_send)
+        monitor_tcp.send_mock(packet_to_send)
+    dev.send = send_mock
+    dev.recvall = monitor_tcp.read_mock
+    dev.write_Zynq_register_uint32(address_uint32=4*0, data_uint32=400)
+    dev.write_Zynq_register_uint32(address_uint32=4*1, data_uint32=401)
+    dev.write_Zynq_register_uint32(address_uint32=4*5, data_uint32=405)
+
+    # 64 bits reads of consecutive registers use a single request:
+    packets_sent.clear()
+    value = dev.read_Zynq_register_uint64(4*0, 4*1)
+    assert value[0] == (401 << 32) + 400
+    assert len(packets_sent) == 1
+    value = dev.read_Zynq_register_int64(4*0, 4*5)
+    assert value[0] == (405 << 32) + 400
+
+    # and so do several samples of the same register:
+    packets_sent.clear()
+    dev.MAX_SAMPLES_READ_REG_64 = 16 # to check that bigger reads get split correctly
+    values = dev.read_Zynq_register_int64_samples(4*0, 10)
+    assert values.dtype == np.int64
+    assert list(values) == 10*[(401 << 32) + 400]
+    assert len(packets_sent) == 1
+    values = dev.read_Zynq_register_int64_samples(4*0, 40)
+    assert list(values) == 40*[(401 << 32) + 400]
+
+def test_read_buffer_view():
+    import socket
+    dev = RP_PLL.RP_PLL_device()
+    (dev.sock, server_sock) = socket.socketpair()
+    dev.valid_socket = True
+    number_of_points = 5000
+    samples_expected = (np.arange(number_of_points) - number_of_points//2).astype(np.int16)
+    # the reply is sent in several chunks to exercise the receive loop:
+    for chunk in np.array_split(samples_expected, 7):
+        server_sock.sendall(chunk.tobytes())
+
+    samples = dev.read_Zynq_buffer_int16_view(number_of_points)
+    assert samples.dtype == np.int16
+    assert np.array_equal(samples, samples_expected)
+    # the samples are received in place, into the device's buffer:
+    assert np.shares_memory(samples, dev.read_buffer_int16)
+    request = server_sock.recv(12)
+    assert struct.unpack('=III', request) == (RP_PLL.RP_PLL_device.MAGIC_BYTES_READ_BUFFER, RP_PLL.RP_PLL_device.FPGA_BASE_ADDR, number_of_points)
+    dev.sock.close()
+    server_sock.close()
+
+def test_logger_snapshot():
+    import socket
+    dev = RP_PLL.RP_PLL_device()
+    (dev.sock, server_sock) = socket.socketpair()
+    dev.valid_socket = True
+    selectors = [6, 7, 8]
+    number_of_points = 256
+    status_expected = np.array(len(selectors)*[(0xA5 << 24) | number_of_points], dtype=np.uint32)
+    samples_expected = (np.arange(len(selectors)*number_of_points) - 300).astype(np.int16).reshape((len(selectors), number_of_points))
+    server_sock.sendall(struct.pack('=III', RP_PLL.RP_PLL_device.MAGIC_BYTES_SNAPSHOT, len(selectors), number_of_points) + status_expected.tobytes() + samples_expected.tobytes())
+
+    (status, samples) = dev.read_logger_snapshot(selectors, number_of_points)
+    assert np.array_equal(status, status_expected)
+    assert samples.shape == (len(selectors), number_of_points)
+    assert np.array_equal(samples, samples_expected)
+    # a single request, with all the selectors:
+    request = server_sock.recv(12+4*len(selectors))
+    assert struct.unpack('=6I', request) == (RP_PLL.RP_PLL_device.MAGIC_BYTES_SNAPSHOT, len(selectors), number_of_points, 6, 7, 8)
+
+    # a reply which isn't a snapshot means that we lost synchronization with the server:
+    server_sock.sendall(struct.pack('=III', RP_PLL.RP_PLL_device.MAGIC_BYTES_READ_BUFFER, 1, 10) + bytes(4+2*10))
+    with pytest.raises(RP_PLL.CommsLoggeableError):
+        dev.read_logger_snapshot([0], 10)
+    with pytest.raises(ValueError):
+        dev.read_logger_snapshot(range(dev.MAX_SOURCES_SNAPSHOT+1), 10)
+    dev.sock.close()
+    server_sock.close()
+
+def test_logger_stats():
+    import socket
+    dev = RP_PLL.RP_PLL_device()
+    (dev.sock, server_sock) = socket.socketpair()
+    dev.valid_socket = True
+    server_sock.sendall(struct.pack('=IIIiiIqQ', RP_PLL.RP_PLL_device.MAGIC_BYTES_CAPTURE_STATS, (0xA5 << 24) | 1009, 1000, -5, 7, 7, -1234, 5678))
+
+    sums = dev.read_logger_stats(0, 9, 1000)
+    assert sums == {'logger_status': (0xA5 << 24) | 1009, 'number_of_samples': 1000, 'min': -5, 'max': 7, 'max_abs': 7, 'sum': -1234, 'sum_of_squares': 5678}
+    request = server_sock.recv(20)
+    assert struct.unpack('=IIIII', request) == (RP_PLL.RP_PLL_device.MAGIC_BYTES_CAPTURE_STATS, 0, 9, 1000, 0)
+
+    # a reply which isn't a stats reply means that we lost synchronization with the server:
+    server_sock.sendall(bytes(40))
+    with pytest.raises(RP_PLL.CommsLoggeableError):
+        dev.read_logger_stats(8, 0, 10, bUnsigned=True)
+    dev.sock.close()
+    server_sock.close()
+
+def test_file_upload(tmp_path):
+    import socket
+    import threading
+    import zlib
+    # stands in for monitor-tcp's handle_file_info_packet() and receive_file(), with the remote files in a dict:
+    remote_files = {}
+    def recvall(sock, count):
+        data = b''
+        while len(data) < count:
+            chunk = sock.recv(count - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+    def server_func(sock):
+        while True:
+            header = recvall(sock, 12)
+            if header is None:
+                break
+            (magic_bytes, filename_length, file_size) = struct.unpack('=III', header)
+            filename = recvall(sock, filename_length).decode('ascii')
+            if magic_bytes == RP_PLL.RP_PLL_device.MAGIC_BYTES_FILE_INFO:
+                data = remote_files.get(filename)
+                if data is None:
+                    sock.sendall(struct.pack('=IIII', magic_bytes, 0, 0, 0))
+                else:
+                    sock.sendall(struct.pack('=IIII', magic_bytes, 1, len(data), zlib.crc32(data) & 0xFFFFFFFF))
+            elif magic_bytes == RP_PLL.RP_PLL_device.MAGIC_BYTES_WRITE_FILE_ACKED:
+                data = recvall(sock, file_size)
+                (expected_crc32,) = struct.unpack('=I', recvall(sock, 4))
+                crc32 = zlib.crc32(data) & 0xFFFFFFFF
+                status = 0 if crc32 == expected_crc32 else 3
+                if status == 0:
+                    remote_files[filename] = data
+                sock.sendall(struct.pack('=IIII', magic_bytes, status, len(data), crc32))
+
+    dev = RP_PLL.RP_PLL_device()
+    (dev.sock, server_sock) = socket.socketpair()
+    dev.valid_socket = True
+    server_thread = threading.Thread(target=server_func, args=(server_sock,))
+    server_thread.start()
+
+    local_file = tmp_path / 'red_pitaya_top.bit'
+    file_data = np.random.RandomState(0).bytes(3*dev.FILE_CHUNK_SIZE + 123)
+    local_file.write_bytes(file_data)
+    assert RP_PLL.file_crc32(str(local_file)) == (len(file_data), zlib.crc32(file_data) & 0xFFFFFFFF)
+
+    assert dev.get_remote_file_info('/opt/red_pitaya_top.bit') == (False, 0, 0)
+    progress = []
+    assert dev.upload_file_if_changed(str(local_file), '/opt/red_pitaya_top.bit', lambda bytes_sent, file_size: progress.append((bytes_sent, file_size)))
+    assert remote_files['/opt/red_pitaya_top.bit'] == file_data
+    assert len(progress) == 4 and progress[-1] == (len(file_data), len(file_data))
+    # the same file is not sent again:
+    assert not dev.upload_file_if_changed(str(local_file), '/opt/red_pitaya_top.bit')
+    # but a modified one is:
+    file_data = file_data[:-1] + b'\x00'
+    local_file.write_bytes(file_data)
+    assert dev.upload_file_if_changed(str(local_file), '/opt/red_pitaya_top.bit')
+    assert remote_files['/opt/red_pitaya_top.bit'] == file_data
+
+    dev.sock.close()
+    server_thread.join()
+    server_sock.close()
+
+    # an error reported by the server is raised:
+    local_file.write_bytes(b'short file')
+    (dev.sock, server_sock) = socket.socketpair()
+    server_sock.sendall(struct.pack('=IIII', RP_PLL.RP_PLL_device.MAGIC_BYTES_WRITE_FILE_ACKED, 3, 10, 0))
+    with pytest.raises(RP_PLL.CommsLoggeableError):
+        dev.write_file_on_remote_acked(str(local_file), '/opt/red_pitaya_top.bit')
+    dev.sock.close()
+    server_sock.close()
+
+    # a server which predates the file info packet closes the connection instead of replying:
+    (dev.sock, server_sock) = socket.socketpair()
+    dev.valid_socket = True
+    server_sock.close()
+    with pytest.raises(RP_PLL.FileInfoNotSupportedError):
+        dev.upload_file_if_changed(str(local_file), '/opt/red_pitaya_top.bit')
+
+def test_fifo_stream():
+    import socket
+    import threading
+    # stands in for monitor-tcp's stream_fifo(), with a missing block, then a fifo overflow:
+    server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_sock.bind(('127.0.0.1', 0))
+    server_sock.listen(1)
+    samples_per_block = 100
+    sequence_numbers_sent = [0, 1, 3, 4, 5, 6, 7]
+    number_of_overflows_sent = [0, 0, 0, 0, 1, 1, 1]
+    request_received = []
+    def server_func():
+        (conn, addr) = server_sock.accept()
+        request_received.append(conn.recv(12))
+        for (sequence_number, number_of_overflows) in zip(sequence_numbers_sent, number_of_overflows_sent):
+            samples = np.arange(samples_per_block, dtype=np.uint32) + sequence_number*samples_per_block
+            conn.sendall(struct.pack('=IIIII', RP_PLL.RP_PLL_device.MAGIC_BYTES_STREAM_FIFO, sequence_number, samples_per_block, 10, number_of_overflows) + samples.tobytes())
+        conn.close()
+    server_thread = threading.Thread(target=server_func)
+    server_thread.start()
+
+    dev = RP_PLL.RP_PLL_device()
+    dev.HOST = '127.0.0.1'
+    dev.PORT = server_sock.getsockname()[1]
+    with dev.open_fifo_stream(samples_per_block, len(sequence_numbers_sent)) as stream:
+        blocks = list(stream)
+    server_thread.join()
+    server_sock.close()
+
+    assert struct.unpack('=III', request_received[0]) == (RP_PLL.RP_PLL_device.MAGIC_BYTES_STREAM_FIFO, samples_per_block, len(sequence_numbers_sent))
+    assert [sequence_number for (sequence_number, samples, bDropped) in blocks] == sequence_numbers_sent
+    # the block with the overflow and the next one, because of the reset of the fifo:
+    assert [bDropped for (sequence_number, samples, bDropped) in blocks] == [False, False, True, False, True, True, False]
+    assert (stream.number_of_drops, stream.number_of_overflows) == (3, 1)
+    for (sequence_number, samples, bDropped) in blocks:
+        assert samples.dtype == np.uint32
+        assert np.array_equal(samples, np.arange(samples_per_block) + sequence_number*samples_per_block)
+
+def test_bulk_connection():
+    import socket
+    import threading
+    # stands in for monitor-tcp: the first connection is the control connection, the second one the bulk connection
+    server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_sock.bind(('127.0.0.1', 0))
+    server_sock.listen(2)
+    requests_received = {'control': [], 'bulk': []}
+    def handle_connection(conn, name):
+        while True:
+            request = RP_PLL.sock_recvall_into(conn, memoryview(bytearray(12)))
+            if request is None:
+                break
+            (magic_bytes, addr, value) = struct.unpack('=III', request)
+            requests_received[name].append((magic_bytes, addr, value))
+            if magic_bytes == RP_PLL.RP_PLL_device.MAGIC_BYTES_READ_REG:
+                conn.sendall(struct.pack('=I', 0))
+            elif magic_bytes == RP_PLL.RP_PLL_device.MAGIC_BYTES_READ_BUFFER:
+                conn.sendall(np.arange(value, dtype=np.int16).tobytes())
+        conn.close()
+    def server_func():
+        threads = []
+        for name in ('control', 'bulk'):
+            (conn, addr) = server_sock.accept()
+            threads.append(threading.Thread(target=handle_connection, args=(conn, name)))
+            threads[-1].start()
+        for thread in threads:
+            thread.join()
+    server_thread = threading.Thread(target=server_func)
+    server_thread.start()
+
+    dev = RP_PLL.RP_PLL_device()
+    dev.OpenTCPConnection('127.0.0.1', server_sock.getsockname()[1])
+    assert dev.valid_socket
+    assert len(dev.bulk_connections) == 1
+
+    # the logger read goes through the bulk connection, after making sure that the write before it was handled:
+    dev.write_Zynq_register_uint32(4*1, 1)
+    samples = dev.read_Zynq_buffer_int16_view(1000)
+    assert np.array_equal(samples, np.arange(1000))
+    assert np.shares_memory(samples, dev.bulk_connections[0].read_buffer_int16)
+    # without any write in between, there is no need to synchronize again:
+    dev.read_Zynq_buffer_int16_view(10)
+    dev.CloseTCPConnection()
+    server_thread.join()
+    server_sock.close()
+
+    assert requests_received['control'] == [(RP_PLL.RP_PLL_device.MAGIC_BYTES_WRITE_REG, dev.FPGA_BASE_ADDR+4*1, 1),
+                                            (RP_PLL.RP_PLL_device.MAGIC_BYTES_READ_REG, dev.SYNC_READ_ADDR, 0)]
+    assert requests_received['bulk'] == [(RP_PLL.RP_PLL_device.MAGIC_BYTES_READ_BUFFER, dev.FPGA_BASE_ADDR, 1000),
+                                         (RP_PLL.RP_PLL_device.MAGIC_BYTES_READ_BUFFER, dev.FPGA_BASE_ADDR, 10)]
+    assert len(dev.bulk_connections) == 0
+
+def test_connector():
+    import socket
+    from MonitorTCPMockServer import MonitorTCPMockServer
+    server = MonitorTCPMockServer()
+    server.close()  # nothing listens on this port for now
+
+    connector = RP_PLL.RP_PLL_connector(server.HOST, server.PORT, min_delay=0.05, max_delay=0.2, jitter=0.)
+    # the delay doubles after each failed attempt, up to max_delay:
+    delays = []
+    for number_of_attempts in range(1, 6):
+        connector.number_of_attempts = number_of_attempts
+        delays.append(connector.get_retry_delay())
+    assert delays == [0.05, 0.1, 0.2, 0.2, 0.2]
+    connector.jitter = 0.5
+    assert all(0.1 <= connector.get_retry_delay() <= 0.3 for k in range(100))
+    connector.jitter = 0.
+
+    # a refused connection never blocks, and is retried later:
+    start_time = time.perf_counter()
+    connector.start()
+    while connector.number_of_attempts < 3:
+        assert connector.poll() != connector.CONNECTED
+        time.sleep(0.005)
+    assert time.perf_counter() - start_time > 0.05 + 0.1
+    assert connector.state in (connector.CONNECTING, connector.WAITING)
+    assert connector.strLastError
+
+    # the connection goes through once the server is back:
+    server.bClosed = False
+    server.listen(server.PORT)
+    deadline = time.perf_counter() + 2.
+    while connector.poll() != connector.CONNECTED:
+        assert time.perf_counter() < deadline
+        time.sleep(0.005)
+    sock = connector.take_socket()
+    assert connector.state == connector.DISCONNECTED and connector.take_socket() is None
+    assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE) == 0
+
+    # and the device uses it as its control connection:
+    dev = RP_PLL.RP_PLL_device()
+    dev.OpenTCPConnection(server.HOST, server.PORT, sock=sock)
+    assert dev.valid_socket and dev.sock is sock
+    assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE) != 0
+    dev.write_Zynq_register_uint32(4*5, 1234)
+    assert dev.read_Zynq_register_uint32(4*5) == 1234
+    dev.CloseTCPConnection()
+    sock.close()
+    server.close()
+
+def test_stats(tmp_path):
+    from MonitorTCPMockServer import MonitorTCPMockServer
+    server = MonitorTCPMockServer(reply_delay=0.01)
+    dev = RP_PLL.RP_PLL_device()
+    dev.OpenTCPConnection(server.HOST, server.PORT, number_of_bulk_connections=0)
+    try:
+        dev.write_Zynq_register_uint32(4*5, 1234)
+        dev.write_Zynq_register_uint32_if_changed(4*5, 1234)
+        for k in range(3):
+            assert dev.read_Zynq_register_uint32(4*5) == 1234
+        dev.read_Zynq_registers_block(0, 100)
+        with dev.transaction() as t:
+            dev.write_Zynq_register_uint32(4*6, 1)
+            t.queue_read(dev.FPGA_BASE_ADDR + 4*6)
+        dev.read_Zynq_buffer_int16_view(1000)
+        dev.send_shell_command('chmod +x /opt/monitor-tcp')
+        strFilename = str(tmp_path / 'file.bin')
+        with open(strFilename, 'wb') as f:
+            f.write(bytes(1000))
+        dev.write_file_on_remote_acked(strFilename, '/opt/file.bin')
+
+        stats = dev.get_stats()
+        assert [stats[op]['count'] for op in RP_PLL.RP_PLL_stats.OPS] == [1, 3, 1, 1, 1, 1, 1]
+        assert stats['read_reg']['bytes'] == 3*16
+        assert stats['read_block']['bytes'] == 12 + 4*100
+        assert stats['read_buffer']['bytes'] == 12 + 2*1000
+        assert stats['write_file']['bytes'] > 1000
+        assert stats['writes_skipped'] == 1
+        # the replies come after the 10 ms delay of the server, but the writes don't wait for anything:
+        assert 0.01 <= stats['read_reg']['p50'] <= 0.04 and stats['read_reg']['max'] >= 0.01
+        assert stats['write_reg']['max'] < 0.01
+        assert sum(stats['read_reg']['histogram']) == 3
+        assert 'read_buffer' in RP_PLL.format_stats(stats)
+
+        # a reply which doesn't come in time, then a reconnection:
+        server.reply_delay = 0.5
+        dev.sock.settimeout(0.1)
+        with pytest.raises(RP_PLL.CommsError):
+            dev.read_Zynq_register_uint32(4*5)
+        server.reply_delay = 0.
+        dev.OpenTCPConnection(server.HOST, server.PORT, number_of_bulk_connections=0)
+        assert dev.read_Zynq_register_uint32(4*5) == 1234
+        stats = dev.get_stats()
+        assert (stats['timeouts'], stats['socket_errors'], stats['reconnects']) == (1, 1, 1)
+
+        dev.reset_stats()
+        assert dev.get_stats()['read_reg']['count'] == 0
+    finally:
+        dev.CloseTCPConnection()
+        server.close()
+
+def test_pipelined_reads_asyncio():
+    import asyncio
+    import RP_PLL_asyncio
+    dev = RP_PLL.RP_PLL_device()
+    # connect mocks
+    monitor_tcp = MonitorTCP_mock()
+    dev.send = monitor_tcp.send_mock
+    dev.read = monitor_tcp.read_mock
+    dev_asyncio = RP_PLL_asyncio.RP_PLL_device_asyncio(dev)
+
+    async def run():
+        for k in range(4):
+            await dev_asyncio.write_Zynq_register_uint32(4*k, k+300)
+        values = await asyncio.gather(*[dev_asyncio.read_Zynq_register_uint32(4*k) for k in range(4)])
+        assert list(values) == [k+300 for k in range(4)]
+        values = await dev_asyncio.read_Zynq_registers_uint32([4*k for k in range(4)])
+        assert list(values) == [k+300 for k in range(4)]
+    asyncio.get_event_loop().run_until_complete(run())
+    dev_asyncio.close()
+
 @pytest.mark.skip(reason="can only run one test at a time currently")
 def test1():
     app = start_qt()
@@ -93,28 +93,30 @@ class SLLSystemParameters():
         # DAC1_gain = int(self.getValue('Input_Output_gain', 'DAC1'))
         
        
-        # Set the DAC output limits:
-        limit_low = float(self.getValue('Output_limits_low', 'DAC0'))    # the limit is in volts
-        limit_high = float(self.getValue('Output_limits_high', 'DAC0'))    # the limit is in volts
-        sl.set_dac_limits(0, sl.convertDACVoltsToCounts(0, limit_low), sl.convertDACVoltsToCounts(0, limit_high))
-        limit_low = float(self.getValue('Output_limits_low', 'DAC1'))    # the limit is in volts
-        limit_high = float(self.getValue('Output_limits_high', 'DAC1'))    # the limit is in volts
-        sl.set_dac_limits(1, sl.convertDACVoltsToCounts(1, limit_low), sl.convertDACVoltsToCounts(1, limit_high))
-        # print('low = %d, high = %d' % (sl.convertDACVoltsToCounts(1, limit_low), sl.convertDACVoltsToCounts(1, limit_high)))
-        limit_low = float(self.getValue('Output_limits_low', 'DAC2'))    # the limit is in volts
-        limit_high = float(self.getValue('Output_limits_high', 'DAC2'))    # the limit is in volts
-        sl.set_dac_limits(2, sl.convertDACVoltsToCounts(2, limit_low), sl.convertDACVoltsToCounts(2, limit_high))
+        # All the registers are sent in a single packet to the server:
+        with sl.dev.transaction():
+            # Set the DAC output limits:
+            limit_low = float(self.getValue('Output_limits_low', 'DAC0'))    # the limit is in volts
+            limit_high = float(self.getValue('Output_limits_high', 'DAC0'))    # the limit is in volts
+            sl.set_dac_limits(0, sl.convertDACVoltsToCounts(0, limit_low), sl.convertDACVoltsToCounts(0, limit_high))
+            limit_low = float(self.getValue('Output_limits_low', 'DAC1'))    # the limit is in volts
+            limit_high = float(self.getValue('Output_limits_high', 'DAC1'))    # the limit is in volts
+            sl.set_dac_limits(1, sl.convertDACVoltsToCounts(1, limit_low), sl.convertDACVoltsToCounts(1, limit_high))
+            # print('low = %d, high = %d' % (sl.convertDACVoltsToCounts(1, limit_low), sl.convertDACVoltsToCounts(1, limit_high)))
+            limit_low = float(self.getValue('Output_limits_low', 'DAC2'))    # the limit is in volts
+            limit_high = float(self.getValue('Output_limits_high', 'DAC2'))    # the limit is in volts
+            sl.set_dac_limits(2, sl.convertDACVoltsToCounts(2, limit_low), sl.convertDACVoltsToCounts(2, limit_high))
         
-        ##
-        ## HB, 4/27/2015, Added PWM support on DOUT0
-        ##
-        PWM0_standard = float(self.getValue('PWM0_settings', 'standard'))
-        PWM0_levels   = int(self.getValue('PWM0_settings', 'levels'))
-        PWM0_default  = float(self.getValue('PWM0_settings', 'default'))
-        # Convert to counts
-        value_in_counts = sl.convertPWMVoltsToCounts(PWM0_standard, PWM0_levels, PWM0_default)
-        # Send to FPGA
-        sl.set_pwm_settings(PWM0_levels, value_in_counts, bSendToFPGA)
+            ##
+            ## HB, 4/27/2015, Added PWM support on DOUT0
+            ##
+            PWM0_standard = float(self.getValue('PWM0_settings', 'standard'))
+            PWM0_levels   = int(self.getValue('PWM0_settings', 'levels'))
+            PWM0_default  = float(self.getValue('PWM0_settings', 'default'))
+            # Convert to counts
+            value_in_counts = sl.convertPWMVoltsToCounts(PWM0_standard, PWM0_levels, PWM0_default)
+            # Send to FPGA
+            sl.set_pwm_settings(PWM0_levels, value_in_counts, bSendToFPGA)
         
         
 def main():
@@ -0,0 +1,417 @@
+# -*- coding: utf-8 -*-
+"""
+Simulated Red Pitaya: a MonitorTCPMockServer which speaks the whole monitor-tcp protocol and models the signals behind it,
+so that the GUI and the tools around it can be run and benchmarked at realistic data rates without hardware.
+
+    python SimulatedMonitorTCPServer.py --port 5000 --latency 0.5e-3 --bandwidth 10e6
+
+What is modelled:
+- two beat notes, one per ADC, at the DDC reference frequency + frequency_offsets[k], with white frequency noise (frequency_noise, in Hz rms per sample).
+  Each DAC moves the frequency of one of them (DAC_TO_ADC) by plant_gains[k] Hz per count, like a laser's current or PZT input.
+- the DAC outputs: the offset register plus the square wave of the dither, when it is enabled.
+- the logger (ram_data_logger.vhd), which writes fs/2 samples per second: reading the buffer too early gives the samples which are
+  already written, followed by zeros. Its status word can be left out (bLoggerStatusWord=False), like on the older firmware. The mux sources:
+  ADC0/1 (tone + noise, preceded by the side information: DDC reference exponential at samples 6/7 and the magic bytes of aux_data_mux.vhd at sample 8),
+  DDC0/1 (instantaneous frequency), DAC0/1/2 (output values), and VNA (the records of the system identification module).
+  The other inputs read as zeros.
+- the snapshot, capture_stats and stream_fifo packets, the latter streaming a ramp at fifo_rate samples per second through
+  a fifo of FIFO_DEPTH samples, which overflows (and is then reset, like monitor-tcp does) if the samples can't be sent fast enough.
+- the zero-deadtime counters, which give a new sample counter_rate times per second, sampled along with the DAC values when
+  BUS_ADDR_ZERO_DEADTIME_SAMPLES_NUMBER is read, like registers_read.vhd does.
+- the dither lock-ins, which measure plant_gains[k] times the dither amplitude.
+- the VNA, which measures a first-order lowpass (vna_corner_frequency) followed by a delay (vna_delay), whatever the selected input and output.
+- the network: each reply waits reply_delay seconds, then goes through a link of bandwidth bytes per second (unlimited if None),
+  shared by all the connections, the replies being sent one after the other.
+
+The loop filters are not modelled: the DAC outputs don't react to the beat notes, and the status flags (lock LEDs) are plain registers.
+
+"""
+from __future__ import print_function
+import sys
+import time
+import struct
+import argparse
+import threading
+
+import numpy as np
+
+from MonitorTCPMockServer import MonitorTCPMockServer, recvall
+from RP_PLL import RP_PLL_device
+from SuperLaserLand_JD_RP import SuperLaserLand_JD_RP as SL
+
+
+def reg(bus_addr):
+    return RP_PLL_device.FPGA_BASE_ADDR + 4*bus_addr
+
+def to_int32(value):
+    return value - (1 << 32) if value & (1 << 31) else value
+
+
+class SimulatedMonitorTCPServer(MonitorTCPMockServer):
+
+    fs = SL.fs
+    LOGGER_BUFFER_SIZE = RP_PLL_device.MAX_SAMPLES_READ_BUFFER
+    LOGGER_TRIGGER_ADDR = RP_PLL_device.FPGA_BASE_ADDR + SL.BUS_ADDR_TRIG_WRITE
+    LOGGER_STATUS_ADDR = RP_PLL_device.FPGA_BASE_ADDR + SL.BUS_ADDR_LOGGER_STATUS
+    ADC_MAGIC_BYTES = 0b1010100010001111    # from aux_data_mux.vhd
+    DAC_TO_ADC = (0, 1, 0)                  # beat note moved by each DAC
+    DEFAULT_DDC_FREQUENCY = 25e6            # DDC reference frequency until it is set
+    VNA_BYTES_PER_FREQUENCY = 20            # see SuperLaserLand_JD_RP.read_VNA_samples_from_DDR2()
+    BANDWIDTH_CHUNK_SIZE = 16*1024
+    FIFO_DEPTH = 2048                       # should be equal to FIFO_LOGGER_DEPTH from monitor-tcp.c
+
+    def __init__(self, HOST='127.0.0.1', PORT=0, reply_delay=0., bandwidth=None, seed=0,
+                 frequency_offsets=(1e5, -2e5), frequency_noise=1e4, plant_gains=(100., 100., 10.),
+                 adc_amplitude=0.5, adc_noise=30., counter_rate=1., counter_noise=1.,
+                 vna_corner_frequency=100e3, vna_delay=1e-6, vna_noise=1e-3, fifo_rate=1e6, bLoggerStatusWord=True, **kwargs):
+        self.bandwidth = bandwidth
+        self.frequency_offsets = frequency_offsets
+        self.frequency_noise = frequency_noise
+        self.plant_gains = plant_gains
+        self.adc_amplitude = adc_amplitude  # fraction of the full scale
+        self.adc_noise = adc_noise          # counts rms
+        self.counter_rate = counter_rate    # counter samples per second
+        self.counter_noise = counter_noise  # Hz rms on each counter sample
+        self.vna_corner_frequency = vna_corner_frequency
+        self.vna_delay = vna_delay
+        self.vna_noise = vna_noise          # relative to a unity transfer function
+        self.fifo_rate = fifo_rate
+        self.bLoggerStatusWord = bLoggerStatusWord
+
+        # the model is used from the threads of all the connections
+        self.model_lock = threading.Lock()
+        self.random = np.random.RandomState(seed)
+        self.start_time = time.perf_counter()
+        self.capture = None             # last logger capture: (trigger time, duration, number of samples, samples as int16)
+        self.counter_sample = None      # (samples number, counter0, counter1) of the last counter sample, in counts
+        self.latched_registers = {}     # bus address -> value, sampled when BUS_ADDR_ZERO_DEADTIME_SAMPLES_NUMBER is read
+        self.link_lock = threading.Lock()
+        self.link_busy_until = 0.       # time at which the link is done sending the replies already scheduled
+        super(SimulatedMonitorTCPServer, self).__init__(HOST, PORT, reply_delay=reply_delay, **kwargs)
+
+    def get_sample_index(self):
+        return int((time.perf_counter() - self.start_time) * self.fs)
+
+    def get_setting(self, bus_addr, default=0):
+        with self.lock:
+            return self.registers.get(reg(bus_addr), default)
+
+    #######################################################
+    # Model of the signals
+    #######################################################
+
+    def get_ddc_frequency(self, k):
+        (bus_addr_lsbs, bus_addr_msbs) = [(SL.BUS_ADDR_ref_freq0_lsbs, SL.BUS_ADDR_ref_freq0_msbs),
+                                          (SL.BUS_ADDR_nominal_ref_freq1_lsbs, SL.BUS_ADDR_nominal_ref_freq1_msbs)][k]
+        (lsbs, msbs) = (self.get_setting(bus_addr_lsbs, None), self.get_setting(bus_addr_msbs, None))
+        if lsbs is None and msbs is None:
+            return self.DEFAULT_DDC_FREQUENCY
+        frequency_in_int = (((msbs or 0) & 0xFFFF) << 32) + (lsbs or 0)
+        if frequency_in_int >= (1 << 47):
+            frequency_in_int -= (1 << 48)
+        return frequency_in_int / 2.**48 * self.fs
+
+    # (bEnable, modulation period in samples, number of periods integrated by the lock-in, amplitude in counts)
+    def get_dither_settings(self, k):
+        return (self.get_setting(SL.BUS_ADDR_dither_enable[k]) & 1,
+                4*(self.get_setting(SL.BUS_ADDR_dither_period_divided_by_4_minus_one[k]) + 1),
+                self.get_setting(SL.BUS_ADDR_dither_N_periods_minus_one[k]) + 1,
+                to_int32(self.get_setting(SL.BUS_ADDR_dither_amplitude[k])))
+
+    def get_dac_offset(self, k):
+        return to_int32(self.get_setting(SL.BUS_ADDR_DAC_offset[k]))
+
+    # Output of DAC k for the samples n_start to n_start+N-1, in counts
+    def get_dac_values(self, k, n_start, N):
+        values = np.full(N, self.get_dac_offset(k), dtype=np.int64)
+        (bEnable, period, N_periods, amplitude) = self.get_dither_settings(k)
+        if bEnable:
+            n = np.arange(n_start, n_start + N, dtype=np.int64)
+            values += np.where((n // (period//2)) % 2 == 0, amplitude, -amplitude)
+        if k == 2:
+            return np.clip(values, 0, 0xFFFF)
+        return np.clip(values, -0x8000, 0x7FFF)
+
+    # Mean frequency of beat note k, in Hz
+    def get_beat_frequency(self, k):
+        return self.get_ddc_frequency(k) + self.frequency_offsets[k] + sum(
+            self.plant_gains[n] * self.get_dac_offset(n) for n in range(3) if self.DAC_TO_ADC[n] == k)
+
+    # Instantaneous frequency of beat note k for the samples n_start to n_start+N-1, in Hz. Called with self.model_lock held.
+    def get_instantaneous_frequency(self, k, n_start, N):
+        frequency = self.get_beat_frequency(k) + self.frequency_noise * self.random.randn(N)
+        for n in range(3):
+            if self.DAC_TO_ADC[n] == k and self.get_dither_settings(n)[0]:
+                frequency += self.plant_gains[n] * (self.get_dac_values(n, n_start, N) - self.get_dac_offset(n))
+        return frequency
+
+    # Raw logger samples of ADC k, starting at sample n_start. Called with self.model_lock held.
+    def get_adc_samples(self, k, n_start, N):
+        side_information_samples = SL.LOGGER_ADC_SIDE_INFORMATION_SAMPLES
+        n_first = n_start + side_information_samples    # first sample after the side information
+        frequency = self.get_instantaneous_frequency(k, n_first, N - side_information_samples)
+        # the phase is continuous from one capture to the next, as long as the frequency doesn't change
+        phase = 2*np.pi * (np.mod(self.get_beat_frequency(k)/self.fs * n_first, 1.) + np.concatenate(([0.], np.cumsum(frequency[:-1])/self.fs)))
+        samples = np.zeros(N, dtype=np.int16)
+        samples[side_information_samples:] = np.clip(np.round(self.adc_amplitude * 0x7FFF * np.cos(phase) + self.adc_noise * self.random.randn(len(phase))), -0x8000, 0x7FFF)
+        # DDC reference exponential, 4 samples before the first sample (see SuperLaserLand_JD_RP.decode_adc_samples())
+        ref_exp = 0x7FFF * np.exp(-1j*2*np.pi*np.mod(self.get_ddc_frequency(k)/self.fs * (n_first - 4), 1.))
+        samples[6] = int(round(ref_exp.real))
+        samples[7] = int(round(ref_exp.imag))
+        samples[8] = np.array(self.ADC_MAGIC_BYTES, np.uint16).view(np.int16)
+        return samples
+
+    # Logger samples of DDC k: instantaneous frequency relative to the reference, in units of fs/2**12. Called with self.model_lock held.
+    def get_ddc_samples(self, k, n_start, N):
+        frequency = self.get_instantaneous_frequency(k, n_start, N) - self.get_ddc_frequency(k)
+        return np.clip(np.round(frequency * 2**12/self.fs), -0x8000, 0x7FFF).astype(np.int16)
+
+    # Transfer function measured by the VNA
+    def get_vna_response(self, frequency):
+        return np.exp(-1j*2*np.pi*frequency*self.vna_delay) / (1. + 1j*frequency/self.vna_corner_frequency)
+
+    # Records of the system identification module, as written to the logger (see SuperLaserLand_JD_RP.read_VNA_samples_from_DDR2()),
+    # and the duration of the measurement. Called with self.model_lock held.
+    def get_vna_records(self):
+        number_of_cycles_integration = max(1, self.get_setting(SL.BUS_ADDR_number_of_cycles_integration))
+        first_frequency = self.get_setting(SL.BUS_ADDR_first_modulation_frequency_lsbs) + ((self.get_setting(SL.BUS_ADDR_first_modulation_frequency_msbs) & 0xFFFF) << 32)
+        frequency_step = self.get_setting(SL.BUS_ADDR_modulation_frequency_step_lsbs) + ((self.get_setting(SL.BUS_ADDR_modulation_frequency_step_msbs) & 0xFFFF) << 32)
+        number_of_frequencies = min(self.get_setting(SL.BUS_ADDR_number_of_frequencies), 2*self.LOGGER_BUFFER_SIZE // self.VNA_BYTES_PER_FREQUENCY)
+        output_gain = to_int32(self.get_setting(SL.BUS_ADDR_output_gain))
+
+        frequency = (first_frequency + frequency_step * np.arange(number_of_frequencies)) / 2.**48 * self.fs
+        full_scale = 2.**(15-1) * output_gain * number_of_cycles_integration
+        integrator = full_scale * (self.get_vna_response(frequency)
+                                   + self.vna_noise * (self.random.randn(number_of_frequencies) + 1j*self.random.randn(number_of_frequencies)))
+        records = np.zeros(number_of_frequencies, dtype=[('real', '<i8'), ('imag', '<i8'), ('integration_time', '<u4')])
+        records['real'] = np.round(integrator.real)
+        records['imag'] = np.round(integrator.imag)
+        records['integration_time'] = number_of_cycles_integration
+        # each frequency is settled then integrated
+        return (records.tobytes(), 2. * number_of_cycles_integration * number_of_frequencies / self.fs)
+
+    # Starts a capture of the logger on the input selected by the mux.
+    # The samples are computed right away, but they only become available (see the status word) after the duration of the capture.
+    def start_capture(self):
+        selector = self.get_setting(SL.BUS_ADDR_MUX_SELECTORS)
+        N = self.LOGGER_BUFFER_SIZE
+        n_start = self.get_sample_index()
+        # the logger writes on data_in_clk_enable, at fs/2
+        duration = N / (self.fs/2)
+        number_of_samples = N
+        with self.model_lock:
+            if selector in (SL.LOGGER_MUX['ADC0'], SL.LOGGER_MUX['ADC1']):
+                samples = self.get_adc_samples(selector - SL.LOGGER_MUX['ADC0'], n_start, N)
+            elif selector in (SL.LOGGER_MUX['DDC0'], SL.LOGGER_MUX['DDC1']):
+                samples = self.get_ddc_samples(selector - SL.LOGGER_MUX['DDC0'], n_start, N)
+            elif selector in (SL.LOGGER_MUX['DAC0'], SL.LOGGER_MUX['DAC1'], SL.LOGGER_MUX['DAC2']):
+                samples = self.get_dac_values(selector - SL.LOGGER_MUX['DAC0'], n_start, N).astype(np.uint16).view(np.int16)
+            elif selector == SL.LOGGER_MUX['VNA']:
+                (records, duration) = self.get_vna_records()
+                samples = np.zeros(N, dtype=np.int16)
+                samples.view(np.uint8)[:len(records)] = np.frombuffer(records, np.uint8)
+                number_of_samples = len(records) // 2
+            else:
+                samples = np.zeros(N, dtype=np.int16)
+        self.capture = (time.perf_counter(), duration, number_of_samples, samples)
+
+    # Number of samples of the current capture which have been written so far
+    def get_samples_written(self):
+        if self.capture is None:
+            return 0
+        (trigger_time, duration, number_of_samples, samples) = self.capture
+        return min(number_of_samples, int(number_of_samples * (time.perf_counter() - trigger_time) / duration))
+
+    def get_logger_status(self):
+        if not self.bLoggerStatusWord:
+            return 0
+        if self.capture is None:
+            return SL.LOGGER_STATUS_SIGNATURE << 24
+        Num_samples_written = self.get_samples_written()
+        bWriting = int(Num_samples_written < self.capture[2])
+        return (SL.LOGGER_STATUS_SIGNATURE << 24) | (bWriting << 23) | Num_samples_written
+
+    # Waits until number_of_samples samples of the current capture are written, like acq_WaitForLogger() in monitor-tcp.c,
+    # or for the same fixed delay as acq_WaitForLogger() without the status word. Returns the status word.
+    def wait_for_capture(self, number_of_samples):
+        (trigger_time, duration, number_of_samples_in_capture, samples) = self.capture
+        if self.bLoggerStatusWord:
+            time.sleep(max(0., trigger_time + duration * min(number_of_samples, number_of_samples_in_capture) / number_of_samples_in_capture - time.perf_counter()))
+        else:
+            time.sleep(1e-6 * (1 + 1024*(number_of_samples//1024 + 1)*1.1/62.5))
+        return self.get_logger_status()
+
+    # Starts a new counter sample every 1/counter_rate seconds, and samples the DAC outputs.
+    def latch_counters(self):
+        samples_number = 1 + int((time.perf_counter() - self.start_time) * self.counter_rate)
+        # same scaling as SuperLaserLand_JD_RP.scaleCounterReadingsIntoHz()
+        N = SL.N_CYCLES_GATE_TIME
+        conversion_gain = N * (N + 1) if self.get_setting(SL.BUS_ADDR_triangular_averaging) & 1 else N
+        with self.model_lock:
+            if self.counter_sample is None or self.counter_sample[0] != samples_number:
+                counters = [int(round((self.get_beat_frequency(k) + self.counter_noise * self.random.randn()) * 2**10 * conversion_gain / self.fs)) for k in range(2)]
+                self.counter_sample = (samples_number, counters[0], counters[1])
+            n = self.get_sample_index()
+            latched_registers = {SL.BUS_ADDR_ZERO_DEADTIME_SAMPLES_NUMBER: samples_number & 0xFFFFFFFF}
+            for (k, bus_addr_lsbs) in enumerate((SL.BUS_ADDR_ZERO_DEADTIME_COUNTER0_LSBS, SL.BUS_ADDR_ZERO_DEADTIME_COUNTER1_LSBS)):
+                (lsbs, msbs) = struct.unpack('=II', struct.pack('=q', self.counter_sample[1+k]))
+                latched_registers[bus_addr_lsbs] = lsbs
+                latched_registers[bus_addr_lsbs+1] = msbs
+            for (k, bus_addr) in enumerate((SL.BUS_ADDR_DAC0_CURRENT, SL.BUS_ADDR_DAC1_CURRENT, SL.BUS_ADDR_DAC2_CURRENT)):
+                # sign-extended to 32 bits, like in dpll_wrapper.v
+                latched_registers[bus_addr] = int(self.get_dac_values(k, n, 1)[0]) & 0xFFFFFFFF
+            self.latched_registers = latched_registers
+
+    # Output of the dither lock-in k: sum of the DDC counts (fs/2**10 Hz units) demodulated over the integration time
+    def get_lockin_sample(self, k):
+        (bEnable, period, N_periods, amplitude) = self.get_dither_settings(k)
+        N_integration = period * N_periods
+        signal = self.plant_gains[k] * amplitude if bEnable else 0.
+        with self.model_lock:
+            noise = self.frequency_noise * np.sqrt(N_integration) * self.random.randn()
+        return int(round(signal * 2**10/self.fs * N_integration + noise * 2**10/self.fs))
+
+    #######################################################
+    # Protocol
+    #######################################################
+
+    def write_register(self, absolute_addr, value):
+        super(SimulatedMonitorTCPServer, self).write_register(absolute_addr, value)
+        if absolute_addr == self.LOGGER_TRIGGER_ADDR:
+            self.start_capture()
+
+    def read_register(self, absolute_addr):
+        if absolute_addr == reg(SL.BUS_ADDR_ZERO_DEADTIME_SAMPLES_NUMBER):
+            self.latch_counters()
+        if reg(SL.BUS_ADDR_ZERO_DEADTIME_SAMPLES_NUMBER) <= absolute_addr <= reg(SL.BUS_ADDR_DAC2_CURRENT):
+            if not self.latched_registers:
+                self.latch_counters()
+            return self.latched_registers[(absolute_addr - RP_PLL_device.FPGA_BASE_ADDR) // 4]
+        if absolute_addr == self.LOGGER_STATUS_ADDR:
+            return self.get_logger_status()
+        return super(SimulatedMonitorTCPServer, self).read_register(absolute_addr)
+
+    def read_register_64(self, absolute_addr):
+        for (k, bus_addr) in enumerate((SL.BUS_ADDR_DITHER0_LOCKIN_REAL_LSB, SL.BUS_ADDR_DITHER1_LOCKIN_REAL_LSB)):
+            if absolute_addr == reg(bus_addr):
+                return self.get_lockin_sample(k) & 0xFFFFFFFFFFFFFFFF
+        return super(SimulatedMonitorTCPServer, self).read_register_64(absolute_addr)
+
+    def read_logger_buffer(self, number_of_points):
+        number_of_points = min(number_of_points, self.LOGGER_BUFFER_SIZE)
+        if self.capture is None:
+            return bytes(2*number_of_points)
+        # the samples which are not written yet read as zeros
+        samples = self.capture[3][:min(number_of_points, self.get_samples_written())].tobytes()
+        return samples + bytes(2*number_of_points - len(samples))
+
+    def handle_other_packet(self, conn, magic_bytes, arg1, arg2):
+        if magic_bytes == RP_PLL_device.MAGIC_BYTES_SNAPSHOT:
+            number_of_sources = min(arg1, RP_PLL_device.MAX_SOURCES_SNAPSHOT)
+            samples_per_source = min(arg2, self.LOGGER_BUFFER_SIZE)
+            # like monitor-tcp, the selectors beyond MAX_SOURCES_SNAPSHOT are parsed as standalone packets
+            selectors = struct.unpack('=%dI' % number_of_sources, recvall(conn, 4*number_of_sources))
+            (status, samples) = ([], [])
+            for selector in selectors:
+                self.write_register(reg(SL.BUS_ADDR_MUX_SELECTORS), selector)
+                self.start_capture()
+                status.append(self.wait_for_capture(samples_per_source))
+                samples.append(self.read_logger_buffer(samples_per_source))
+            self.reply(conn, struct.pack('=III', magic_bytes, number_of_sources, samples_per_source) + struct.pack('=%dI' % number_of_sources, *status) + b''.join(samples))
+        elif magic_bytes == RP_PLL_device.MAGIC_BYTES_CAPTURE_STATS:
+            (number_of_samples, bUnsigned) = struct.unpack('=II', recvall(conn, 8))
+            first_sample = min(self.LOGGER_BUFFER_SIZE, arg2)
+            acq_size = min(self.LOGGER_BUFFER_SIZE, first_sample + number_of_samples)
+            self.write_register(reg(SL.BUS_ADDR_MUX_SELECTORS), arg1)
+            self.start_capture()
+            logger_status = self.wait_for_capture(acq_size)
+            samples = np.frombuffer(self.read_logger_buffer(acq_size), np.uint16 if bUnsigned else np.int16)[first_sample:].astype(np.int64)
+            if len(samples) == 0:
+                (min_value, max_value, max_abs) = (0x7FFFFFFF, -0x80000000, 0)
+            else:
+                (min_value, max_value, max_abs) = (int(samples.min()), int(samples.max()), int(np.abs(samples).max()))
+            self.reply(conn, struct.pack('=IIIiiIqQ', magic_bytes, logger_status, len(samples), min_value, max_value, max_abs, int(samples.sum()), int((samples**2).sum())))
+        elif magic_bytes == RP_PLL_device.MAGIC_BYTES_STREAM_FIFO:
+            self.stream_fifo(conn, arg1, arg2)
+        else:
+            return False
+        return True
+
+    # Streams a ramp (the index of each sample, as uint32) at fifo_rate samples per second, like stream_fifo() in monitor-tcp.c.
+    # The samples wait in a fifo of FIFO_DEPTH samples until the previous block has been sent: while it is full, the new samples are dropped.
+    def stream_fifo(self, conn, samples_per_block, number_of_blocks):
+        samples_per_block = min(RP_PLL_device.MAX_SAMPLES_STREAM_FIFO_BLOCK, samples_per_block)
+        samples_per_block = max(10, samples_per_block - samples_per_block % 10)
+        start_time = time.perf_counter()
+        get_samples_written = lambda: int((time.perf_counter() - start_time) * self.fifo_rate)
+        next_sample = 0             # index of the oldest sample in the fifo
+        max_fifo_count = 0
+        number_of_overflows = 0
+        sequence_number = 0
+        while number_of_blocks == 0 or sequence_number < number_of_blocks:
+            samples_written = get_samples_written()
+            fifo_count = samples_written - next_sample
+            if fifo_count > self.FIFO_DEPTH:
+                # the fifo holds the FIFO_DEPTH oldest samples, the next ones were dropped until now
+                samples_in_fifo = min(samples_per_block, self.FIFO_DEPTH)
+                indexes = np.concatenate((np.arange(next_sample, next_sample + samples_in_fifo),
+                                          np.arange(samples_written, samples_written + samples_per_block - samples_in_fifo)))
+                next_sample = samples_written + samples_per_block - samples_in_fifo
+                max_fifo_count = self.FIFO_DEPTH
+            else:
+                indexes = np.arange(next_sample, next_sample + samples_per_block)
+                next_sample += samples_per_block
+                max_fifo_count = max(max_fifo_count, fifo_count)
+            time.sleep(max(0., start_time + next_sample / self.fifo_rate - time.perf_counter()))
+            header = struct.pack('=IIII', RP_PLL_device.MAGIC_BYTES_STREAM_FIFO, sequence_number, samples_per_block, max_fifo_count)
+            if max_fifo_count >= self.FIFO_DEPTH - 1:
+                # like monitor-tcp, reset the fifo so that the next overflow can be detected too
+                number_of_overflows += 1
+                next_sample = get_samples_written()
+                max_fifo_count = 0
+            samples = indexes.astype(np.uint64).astype(np.uint32)
+            # raises OSError once the client closes the connection, which is how it normally stops the stream
+            self.reply(conn, header + struct.pack('=I', number_of_overflows) + samples.tobytes())
+            sequence_number += 1
+
+    # The replies go through a link of self.bandwidth bytes per second shared by all the connections, one reply after the other
+    def reply(self, conn, data):
+        if self.reply_delay:
+            time.sleep(self.reply_delay)
+        if not self.bandwidth:
+            conn.sendall(data)
+            return
+        with self.link_lock:
+            send_time = max(time.perf_counter(), self.link_busy_until)
+            self.link_busy_until = send_time + len(data) / self.bandwidth
+        view = memoryview(data)
+        for offset in range(0, len(view), self.BANDWIDTH_CHUNK_SIZE):
+            chunk = view[offset:offset+self.BANDWIDTH_CHUNK_SIZE]
+            time.sleep(max(0., send_time + (offset + len(chunk)) / self.bandwidth - time.perf_counter()))
+            conn.sendall(chunk)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Simulated Red Pitaya, which speaks the monitor-tcp protocol.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--latency', type=float, default=0., help='seconds before each reply')
+    parser.add_argument('--bandwidth', type=float, default=None, help='bytes per second (unlimited by default)')
+    parser.add_argument('--counter-rate', type=float, default=1., dest='counter_rate', help='counter samples per second')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    server = SimulatedMonitorTCPServer(args.host, args.port, reply_delay=args.latency, bandwidth=args.bandwidth,
+                                       counter_rate=args.counter_rate, seed=args.seed)
+    print('Simulated Red Pitaya listening on %s:%d, Ctrl-C to stop' % (server.HOST, server.PORT))
+    try:
+        while True:
+            time.sleep(1.)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+import time
+
+import numpy as np
+
+from SimulatedMonitorTCPServer import SimulatedMonitorTCPServer
+from SuperLaserLand_JD_RP import SuperLaserLand_JD_RP
+
+
+def open_simulator(**kwargs):
+    server = SimulatedMonitorTCPServer(**kwargs)
+    sl = SuperLaserLand_JD_RP()
+    sl.dev.OpenTCPConnection(server.HOST, server.PORT)
+    # like the GUI does when it connects
+    sl.getCounterMode()
+    return (server, sl)
+
+def test_logger_sources(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (server, sl) = open_simulator(frequency_offsets=(1e6, -2e5), frequency_noise=1e3, counter_rate=0.1)
+    try:
+        sl.set_ddc0_ref_freq(20e6)
+        sl.set_dac_offset(0, 1000)
+        sl.set_dac_offset(2, 3000)
+        # tone at 20 MHz + 1 MHz + 100 Hz/count * 1000 counts + 10 Hz/count * 3000 counts, with the side information in front:
+        (samples, ref_exp0) = sl.acquire_logger_samples('ADC0', 2**14)
+        assert len(samples) == 2**14 - sl.LOGGER_ADC_SIDE_INFORMATION_SAMPLES
+        spectrum = np.abs(np.fft.rfft(samples * np.hanning(len(samples))))
+        assert abs(np.argmax(spectrum) * sl.fs / len(samples) - 21.13e6) < 2*sl.fs / len(samples)
+        assert abs(abs(ref_exp0) - 0x7FFF) < 2
+        # the reference exponential lines up the DDC with the samples:
+        baseband = sl.frontend_DDC_processing(samples, ref_exp0, 0)
+        assert np.std(np.diff(np.unwrap(np.angle(baseband)))) < 0.1
+
+        inst_freq = sl.acquire_logger_samples('DDC0', 2**14, bReadAsDDC=True)
+        assert abs(np.mean(inst_freq) - 1.13e6) < 50e3
+
+        (samples, ref_exp0) = sl.acquire_logger_samples('DAC0', 1000)
+        assert np.all(samples == 1000) and ref_exp0 == 1
+        frames = sl.acquire_logger_snapshot(['DAC2', 'ADC1'], 1000)
+        assert np.all(frames['DAC2'][0] == 3000) and len(frames['ADC1'][0]) == 1000 - sl.LOGGER_ADC_SIDE_INFORMATION_SAMPLES
+        stats = sl.capture_stats('ADC0', 10000, ('mean', 'rms'))
+        assert abs(stats['mean']) < 100 and abs(stats['rms'] - 0.5*0x7FFF/np.sqrt(2)) < 500
+
+        # counters and DAC values, sampled together:
+        status = sl.read_counters_and_status()
+        assert abs(status['counter0'] - 21.13e6) < 10 and abs(status['counter1'] - 24.8e6) < 10
+        assert (status['dac0'], status['dac1'], status['dac2']) == (1000, 0, 3000)
+        assert sl.read_counters_and_status()['counter0'] is None
+    finally:
+        sl.dev.CloseTCPConnection()
+        server.close()
+
+def test_logger_without_status_word(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # older firmware: the server waits for a fixed delay before reading the buffer, which must cover a whole capture at fs/2
+    (server, sl) = open_simulator(bLoggerStatusWord=False, counter_rate=0.1)
+    try:
+        assert sl.readLoggerStatus() is None
+        sl.set_dac_offset(2, 3000)
+        frames = sl.acquire_logger_snapshot(['DAC2'], 30000)
+        assert np.all(frames['DAC2'][0] == 3000)
+        stats = sl.capture_stats('DAC2', 30000, ('mean',))
+        assert stats['mean'] == 3000
+    finally:
+        sl.dev.CloseTCPConnection()
+        server.close()
+
+def test_dither_and_vna(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (server, sl) = open_simulator(plant_gains=(50., 100., 10.), vna_corner_frequency=1e6, vna_delay=0., vna_noise=0.)
+    try:
+        sl.setupDitherLockIn(1, 1000, 100, 200, 0)
+        sl.setDitherLockInState(1, True)
+        results = sl.ditherRead(10, 1)
+        assert abs(np.mean(sl.scaleDitherResultsToHz(results.real, 1)) - 100.*200) < 100
+        # the dither shows up on the DAC output:
+        (samples, ref_exp0) = sl.acquire_logger_samples('DAC1', 2000)
+        assert set(samples) == {-200., 200.}
+
+        sl.setup_system_identification(0, 0, 100e3, 2e6, 32, 1e-5, 1000)
+        sl.trigger_system_identification()
+        sl.wait_for_system_identification()
+        (transfer_function, frequency_axis) = sl.read_VNA_samples_from_DDR2()
+        assert len(transfer_function) == sl.number_of_frequencies
+        assert np.allclose(transfer_function, 1. / (1. + 1j*frequency_axis/1e6), atol=1e-3)
+    finally:
+        sl.dev.CloseTCPConnection()
+        server.close()
+
+def test_latency_and_bandwidth(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (server, sl) = open_simulator(reply_delay=0.02, bandwidth=1e6, fifo_rate=1e5)
+    try:
+        start_time = time.perf_counter()
+        sl.dev.read_Zynq_register_uint32(0)
+        assert 0.02 <= time.perf_counter() - start_time < 0.1
+        start_time = time.perf_counter()
+        sl.dev.read_Zynq_buffer_int16_view(2**15)
+        assert 0.02 + 2**16/1e6 <= time.perf_counter() - start_time < 0.3
+
+        # the fifo samples are a ramp, and come in at fifo_rate:
+        server.reply_delay = 0.
+        start_time = time.perf_counter()
+        # like monitor-tcp, the server keeps the connection open after the last block, so exactly 5 blocks are read
+        stream = sl.stream_fifo_samples(1000, 5)
+        blocks = [next(stream) for k in range(5)]
+        stream.close()
+        assert time.perf_counter() - start_time >= 5000/1e5
+        assert [sequence_number for (sequence_number, samples, bDropped) in blocks] == list(range(5))
+        assert np.array_equal(np.concatenate([samples for (sequence_number, samples, bDropped) in blocks]), np.arange(5000))
+        assert not any(bDropped for (sequence_number, samples, bDropped) in blocks)
+
+        # the link can't keep up with the samples: the fifo overflows
+        server.fifo_rate = 1e6
+        with sl.dev.open_fifo_stream(1000) as stream:
+            blocks = [stream.read_block() for k in range(5)]
+        assert [bDropped for (sequence_number, samples, bDropped) in blocks] == [False] + [True]*4
+        assert stream.number_of_overflows >= 2
+        samples = np.concatenate([samples for (sequence_number, samples, bDropped) in blocks])
+        assert np.all(np.diff(samples.astype(np.int64)) >= 1) and samples[-1] > 2*len(samples)
+    finally:
+        sl.dev.CloseTCPConnection()
+        server.close()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Cold-start profiler of the GUI: times each phase of the startup of XEM_GUI3, headless, through controller(bManualStartupForTests=True):
+    import       importing XEM_GUI3 and everything it imports
+    ui_build     creating the controller and all its windows
+    connect      opening the connections to the box
+    state_fetch  reading the settings of the box and updating the windows (XEM_GUI3.controller.updateGUIFromFPGA())
+and compares them to regression thresholds. It also reports the slow modules which should only be imported when they are used
+(see LAZY_MODULES): importing one of them at startup again is a regression as well.
+
+The import phase only means something in a fresh process, so run this as a script:
+    python StartupProfiler.py --mock                     # against a local MonitorTCPMockServer
+    python StartupProfiler.py --host 192.168.0.150       # against a real box (its settings are only read)
+Without --host or --mock, only the import and ui_build phases are timed.
+Set QT_QPA_PLATFORM=offscreen to run it without a display. The exit code is 1 if a threshold is exceeded, or if a lazy module was imported.
+
+"""
+from __future__ import print_function
+import sys
+import os
+import time
+import glob
+import shutil
+import tempfile
+import collections
+import contextlib
+import argparse
+import json
+
+PHASES = ('import', 'ui_build', 'connect', 'state_fetch')
+
+# seconds, generous enough for a slow lab computer: these are meant to catch regressions, not to measure small changes
+DEFAULT_THRESHOLDS = {'import':         3.,
+                      'ui_build':       2.,
+                      'connect':        1.,
+                      'state_fetch':    2.}
+
+# modules which take long to import, and which the GUI only imports when they are used
+LAZY_MODULES = ('scipy', 'DisplayVNAWindow', 'DisplayTransferFunctionWindow', 'PythonSoup',
+                'DisplayDitherSettingsWindow', 'DisplayDividerAndResidualsStreamingSettingsWindow', 'ConfigurationRPSettingsUI')
+
+SOURCE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+# Runs the 'with' block in strWorkingDirectory, with a copy of the configuration and .ui files of the GUI,
+# so that the data logging files created by the windows don't end up next to the sources
+@contextlib.contextmanager
+def working_directory(strWorkingDirectory):
+    if strWorkingDirectory is None:
+        yield
+        return
+    for strFilename in glob.glob(os.path.join(SOURCE_DIRECTORY, '*.xml')) + glob.glob(os.path.join(SOURCE_DIRECTORY, '*.ui')):
+        shutil.copy(strFilename, strWorkingDirectory)
+    previous_directory = os.getcwd()
+    os.chdir(strWorkingDirectory)
+    try:
+        yield
+    finally:
+        os.chdir(previous_directory)
+
+# Returns the modules of LAZY_MODULES (or their submodules) which have been imported
+def get_lazy_modules_loaded():
+    return sorted(strName for strName in LAZY_MODULES if any(module == strName or module.startswith(strName + '.') for module in sys.modules))
+
+# Times the phases of the startup. HOST is the address of the box, or None to stop after building the UI.
+# With bMock, a MonitorTCPMockServer is started, and HOST/PORT are ignored.
+# Returns (timings, lazy modules loaded once the UI is built), where timings is an OrderedDict of phase -> seconds.
+def profile_startup(HOST=None, PORT=5000, bMock=False, strSelectedSerial='000000000000', strWorkingDirectory=None):
+    timings = collections.OrderedDict()
+    with working_directory(strWorkingDirectory):
+        start_time = time.perf_counter()
+        import XEM_GUI3
+        timings['import'] = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        controller = XEM_GUI3.controller(bManualStartupForTests=True)
+        timings['ui_build'] = time.perf_counter() - start_time
+        # (pushing the defaults to the mock below needs all the windows)
+        lazy_modules_loaded = get_lazy_modules_loaded()
+        # no discovery and no connection dialog here: we connect directly
+        controller.initial_config.discovery_cache.strFilename = None
+        controller.initial_config.cancelClicked()
+
+        server = None
+        try:
+            if bMock:
+                from MonitorTCPMockServer import MonitorTCPMockServer
+                server = MonitorTCPMockServer()
+                (HOST, PORT) = (server.HOST, server.PORT)
+                # the registers of a new mock are all zeros, which isn't a valid configuration: the defaults are pushed first (not timed)
+                controller.pushDefaultValues(strSelectedSerial, HOST, PORT)
+                controller.sl.dev.CloseTCPConnection()
+
+            if HOST is not None:
+                start_time = time.perf_counter()
+                controller.sl.dev.OpenTCPConnection(HOST, PORT)
+                timings['connect'] = time.perf_counter() - start_time
+                if not controller.sl.dev.valid_socket:
+                    raise RuntimeError('StartupProfiler: could not connect to %s:%d' % (HOST, PORT))
+
+                start_time = time.perf_counter()
+                controller.updateGUIFromFPGA(strSelectedSerial, HOST, PORT)
+                timings['state_fetch'] = time.perf_counter() - start_time
+        finally:
+            controller.acquisition_engine.stop()
+            controller.stopCommunication()
+            if server is not None:
+                server.close()
+
+    return (timings, lazy_modules_loaded)
+
+# Returns the list of (phase, seconds, threshold) of the phases which took longer than their threshold
+def check_thresholds(timings, thresholds=DEFAULT_THRESHOLDS):
+    return [(phase, duration, thresholds[phase]) for (phase, duration) in timings.items() if phase in thresholds and duration > thresholds[phase]]
+
+def format_report(timings, lazy_modules_loaded, thresholds=DEFAULT_THRESHOLDS):
+    lines = []
+    for (phase, duration) in timings.items():
+        strStatus = 'SLOW' if duration > thresholds.get(phase, float('inf')) else 'ok'
+        lines.append('%-12s %8.3f s  (threshold %.3f s)  %s' % (phase, duration, thresholds.get(phase, float('inf')), strStatus))
+    lines.append('%-12s %8.3f s' % ('total', sum(timings.values())))
+    if lazy_modules_loaded:
+        lines.append('Imported at startup, but should only be imported when used: %s' % ', '.join(lazy_modules_loaded))
+    return '\n'.join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Times the startup phases of the GUI (import, UI build, connect, state fetch).')
+    parser.add_argument('--host', help='IP address of the box, which is only read from')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--mock', action='store_true', help='connect to a local MonitorTCPMockServer instead of a box')
+    parser.add_argument('--serial', default='000000000000', help='serial number (MAC address) of the box, which selects its configuration file')
+    for phase in PHASES:
+        parser.add_argument('--max-' + phase.replace('_', '-'), type=float, default=DEFAULT_THRESHOLDS[phase], dest='max_' + phase,
+                            help='threshold of the %s phase, in seconds (default: %%(default)s)' % phase)
+    parser.add_argument('--json', action='store_true', help='print the results as json')
+    args = parser.parse_args(argv)
+
+    thresholds = {phase: getattr(args, 'max_' + phase) for phase in PHASES}
+    with tempfile.TemporaryDirectory() as strWorkingDirectory:
+        (timings, lazy_modules_loaded) = profile_startup(args.host, args.port, args.mock, args.serial, strWorkingDirectory)
+    regressions = check_thresholds(timings, thresholds)
+
+    if args.json:
+        print(json.dumps({'timings': timings, 'thresholds': thresholds, 'lazy_modules_loaded': lazy_modules_loaded,
+                          'regressions': [phase for (phase, duration, threshold) in regressions]}))
+    else:
+        print(format_report(timings, lazy_modules_loaded, thresholds))
+    return 1 if regressions or lazy_modules_loaded else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,26 @@
+import os
+import sys
+import json
+import subprocess
+
+import StartupProfiler
+
+
+def test_check_thresholds():
+    timings = {'import': 0.5, 'ui_build': 2.5}
+    assert StartupProfiler.check_thresholds(timings, {'import': 1., 'ui_build': 2.}) == [('ui_build', 2.5, 2.)]
+    assert 'SLOW' in StartupProfiler.format_report(timings, [], {'import': 1., 'ui_build': 2.})
+
+def test_startup_profile(tmp_path):
+    # in a fresh process, since the import phase is only meaningful there
+    env = dict(os.environ, QT_QPA_PLATFORM='offscreen')
+    result = subprocess.run([sys.executable, StartupProfiler.__file__, '--mock', '--json'], cwd=str(tmp_path), env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True, timeout=120)
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    assert list(report['timings']) == list(StartupProfiler.PHASES)
+    # the slow modules are only imported when they are used:
+    assert report['lazy_modules_loaded'] == []
+    assert report['regressions'] == []
+    assert result.returncode == 0
+    # and the windows didn't write their data files next to the sources or in the current directory:
+    assert os.listdir(str(tmp_path)) == []
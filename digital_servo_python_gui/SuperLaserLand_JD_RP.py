@@ -10,7 +10,7 @@ from __future__ import print_function
 # import ok       # used to talk to the FPGA board
 import time     # used for time.sleep()
 import numpy as np
-from scipy.signal import lfilter
+# scipy.signal is only imported where it is used (see frontend_DDC_processing()): it takes longer to import than everything else of the GUI
 
 import sys
 
@@ -21,6 +21,7 @@ import weakref
 
 from SuperLaserLand2_JD2_PLL import PLL0_module, PLL1_module, PLL2_module
 import RP_PLL
+from LoggerArbiter import LoggerArbiter
 
 import logging
 
@@ -29,8 +30,7 @@ class SuperLaserLand_JD_RP:
 	############################################################
 	# System parameters:
 	fs = 125e6  # adc sampling rate
-	bDDR2InUse = False  # Each function that uses the DDR2 logger module should make sure that this isn't set before changing any setting
-	bCommunicationLogging = False   # Turn On/Off logging of the USB communication with the FPGA box
+	bCommunicationLogging = False   # Turn On/Off the binary trace of the communication with the FPGA box (see CommsTrace.py)
 	bVerbose = False
 	
 	
@@ -79,6 +79,10 @@ class SuperLaserLand_JD_RP:
 	time_counter_fifo        = np.array([])
 	# this holds a sample number used to make sure that we don't grab the same counter samples twice
 	last_zdtc_samples_number_counter = [0, 0]
+	# see __init__()
+	PER_INSTANCE_LISTS = ('DACs_limit_low', 'DACs_limit_high', 'DACs_offset', 'output_vco',
+		'modulation_period_divided_by_4_minus_one', 'N_periods_integration_minus_one', 'dither_amplitude', 'dither_enable', 'dither_mode_auto', 'lock_read',
+		'last_zdtc_samples_number_counter')
 	
 	last_freq_update = 0
 	new_freq_setting_number = 0
@@ -162,6 +166,10 @@ class SuperLaserLand_JD_RP:
 	
 	DATA_LOGGER_ZYNQ_INDEX                              = 1  # taken from red_pitaya_top.v, from this line: .sys_wen              (  sys_wen[1]                 ),  // write enable
 	BUS_ADDR_TRIG_WRITE                                 = (DATA_LOGGER_ZYNQ_INDEX<<20) + 0x1004    # writing anything to this address triggers the write mode in ram_data_logger.vhd
+	BUS_ADDR_LOGGER_STATUS                              = (DATA_LOGGER_ZYNQ_INDEX<<20) + 0x1008    # status word of ram_data_logger.vhd: signature in bits 31..24, writing flag in bit 23, write address in bits 22..0
+	LOGGER_STATUS_SIGNATURE                             = 0xA5  # firmwares without the status word return ram contents at this address instead, which never have this signature
+	LOGGER_POLL_PERIOD                                  = 1e-3  # seconds between two reads of the logger status while waiting for an acquisition
+	LOGGER_TIMEOUT_MARGIN                               = 0.1   # seconds added to twice the expected duration of an acquisition before giving up on waiting
 	# NOTE THAT THIS MODULE (ram_data_logger.vhd) IS IMPLEMENTED OUTSIDE OF DPLL_WRAPPER.V AND THUS IT is part of a different address mapping: this is a direct address offset in the Zynq address space, contrary to most of the other addresses here, which are multiplied by 4 by the conversion layer to avoid breaking 32 bits boundaries
 	
 	# Addresses for the internal 'cmd' register bus:
@@ -246,6 +254,18 @@ class SuperLaserLand_JD_RP:
 	BUS_ADDR_delta_fr3                                  = 0x8024
 	BUS_ADDR_delta_fr4                                  = 0x8025
 	BUS_ADDR_ref1_state_control                         = 0x8026
+
+	# The wide registers (parallel_bus_register_64_bits_or_less.vhd, parallel_bus_register_128_bits_or_less.vhd) only update their output
+	# when their last word is written, so these addresses are always sent, even when the shadow register file says they already hold the value.
+	# All the other registers of the cmd bus are plain levels, and send_bus_cmd*() skips writes of unchanged values.
+	# Triggers are written directly with dev.write_Zynq_register_uint32(), which is never skipped.
+	# Each write to the gains of the loop filters pulses the update_flag of their register, which is the gain_changed input of the loop filter (dpll_wrapper.v)
+	# and clears its state: applying the same gains again resets the loop filter, so these are always sent too.
+	BUS_ADDRESSES_LOOP_FILTER_GAINS = frozenset(pll.bus_base_address + offset for pll in (PLL0_module, PLL1_module)
+	                                           for offset in (PLL0_module.BUS_OFFSET_gain_p, PLL0_module.BUS_OFFSET_gain_i, PLL0_module.BUS_OFFSET_gain_ii,
+	                                                          PLL0_module.BUS_OFFSET_gain_d, PLL0_module.BUS_OFFSET_coef_d_filt))
+	BUS_ADDRESSES_ALWAYS_WRITTEN = frozenset((BUS_ADDR_ref_freq0_msbs, BUS_ADDR_nominal_ref_freq1_msbs, BUS_ADDR_new_ref_freq1_msbs, BUS_ADDR_dfr_phase_modulus4,
+	                                        BUS_ADDR_dfr_phase_adjust4, BUS_ADDR_delta_fr4)) | BUS_ADDRESSES_LOOP_FILTER_GAINS
 	
 	
 	
@@ -273,6 +293,30 @@ class SuperLaserLand_JD_RP:
 
 	BUS_ADDR_openLoopGain 								= [0x9010, 0x9011, 0x9012]
 
+	# The "RAM" of dpll_wrapper (addr_packed.vhd, at (2 << 20)) holds a copy of the last value written at each address of the cmd bus,
+	# which the read_RAM_dpll_wrapper*() functions read back. Since these values are the ones that we wrote ourselves,
+	# they are served from the shadow register file of self.dev whenever it has them (see read_RAM_dpll_wrapper()).
+	# The addresses in volatile_bus_addresses always bypass this cache: by default, the triggers, whose copy in the RAM means nothing.
+	# (the status and counter registers are read directly from dpll_wrapper, not from its RAM, so they never go through the cache)
+	VOLATILE_BUS_ADDRESSES = frozenset((BUS_ADDR_TRIG_RESET, BUS_ADDR_TRIG_SYSTEM_IDENTIFICATION, BUS_ADDR_TRIG_RESET_FRONTEND))
+	# value returned by the RAM for addresses that were never written since the FPGA was programmed
+	RAM_DPLL_WRAPPER_DEFAULT_VALUE = 0xEFFFFFFF
+	# the cmd bus addresses of dpll_wrapper (the ones mirrored in its RAM) are below this, see take_state_snapshot()
+	NUMBER_OF_BUS_ADDRESSES_DPLL_WRAPPER = (1 << 20) // 4
+	# (first address, number of registers) of the settings which are read back by getValues(), see fill_settings_cache()
+	SETTINGS_CACHE_FILL_RANGES = ((0x0046, 4),      # test oscillator, clock select
+	                              (0x5000, 9),      # system identification VNA
+	                              (0x6000, 3),      # DAC offsets
+	                              (0x6100, 4),      # PGA gains, DAC limits
+	                              (0x7000, 0x25),   # loop filters, integrators, dac2 setpoint
+	                              (0x8000, 0x27),   # DDC settings
+	                              (0x8100, 5), (0x8200, 5), (0x8300, 5),   # dither and lock-in settings
+	                              (0x8400, 0x11),   # residuals thresholds
+	                              (0x8500, 4),      # clk divider
+	                              (0x8600, 2),      # PRBS generator
+	                              (0x9000, 1),      # mux pll2
+	                              (0x9010, 3))      # open loop gains
+
 
 
 	############################################################
@@ -288,6 +332,7 @@ class SuperLaserLand_JD_RP:
 	SELECT_DAC0          = 6
 	SELECT_DAC1          = 7
 	SELECT_DAC2          = 8
+	MAX_DDC_PHASOR_TABLES = 8   # the cache of get_DDC_phasor_table() is cleared when it reaches this size
 	SELECT_CRASH_MONITOR = 2**4
 	SELECT_IN10          = 2**4 + 2**3
 	LOGGER_MUX = {
@@ -303,6 +348,10 @@ class SuperLaserLand_JD_RP:
 		'CRASH_MONITOR': 2**4,
 		'IN10':          2**4 + 2**3,
 		}
+	# number of samples at the start of the ADC captures which carry side information (DDC reference exponential and magic bytes), see decode_adc_samples()
+	LOGGER_ADC_SIDE_INFORMATION_SAMPLES = 9
+	# statistics which can be computed by capture_stats()
+	LOGGER_STATS = ('mean', 'min', 'max', 'rms', 'std', 'max_abs')
 	############################################################
 	
 	def __init__(self, controller = None):
@@ -313,10 +362,6 @@ class SuperLaserLand_JD_RP:
 		# Create the subdirectory if it doesn't exist:
 		self.make_sure_path_exists('data_logging')
 		
-		if self.bCommunicationLogging == True:
-			strCurrentName = strNameTemplate + 'SuperLaserLand_log.txt'
-			self.log_file = open(strCurrentName, 'w')
-	
 		self.ddc0_filter_select = 0
 		self.ddc1_filter_select = 0
 		self.ddc0_angle_select = 0
@@ -329,15 +374,77 @@ class SuperLaserLand_JD_RP:
 			self.controller = None
 
 		self.dev = RP_PLL.RP_PLL_device(self.controller)
-
-	
+		if self.bCommunicationLogging == True:
+			# every packet and reply, replayable with 'python CommsTrace.py replay'
+			self.dev.start_trace(strNameTemplate + 'comms_trace.bin')
+
+		# Each function that uses the DDR2 logger module has to own this before changing any setting
+		self.ddr2_arbiter = LoggerArbiter()
+
+		# see use_acquisition_daemon()
+		self.acquisition_client = None
+		self.acquisition_daemon_messages = {}   # topic -> last message published by the daemon
+
+		# see get_DDC_phasor_table()
+		self.ddc_phasor_tables = {}
+
+		# see read_RAM_dpll_wrapper()
+		self.volatile_bus_addresses = set(self.VOLATILE_BUS_ADDRESSES)
+		self.settings_cache_hits = 0
+		self.settings_cache_misses = 0
+
+		# The lists above are class attributes which are modified in place, so each instance gets its own copy:
+		# otherwise several boxes driven from the same process (see DeviceManager.py) would share their settings and counter state
+		for strName in self.PER_INSTANCE_LISTS:
+			setattr(self, strName, list(getattr(self, strName)))
+
+	# Old flag-style access to self.ddr2_arbiter, kept for the scripts which still use it
+	@property
+	def bDDR2InUse(self):
+		return self.ddr2_arbiter.in_use()
+
+	@bDDR2InUse.setter
+	def bDDR2InUse(self, bInUse):
+		if bInUse:
+			self.ddr2_arbiter.acquire('bDDR2InUse')
+		elif self.ddr2_arbiter.owner == 'bDDR2InUse':
+			# only drops the ownership taken through this flag, not the one of another client
+			self.ddr2_arbiter.release('bDDR2InUse')
+
+	# Makes this instance one more subscriber of the AcquisitionDaemon at strDaemon ('HOST' or 'HOST:PORT'), which has to be connected to the same box:
+	# the logger captures of acquire_logger_samples(), and the counter and DAC reads of read_dual_mode_counter() and read_DAC_current_values(),
+	# then go through the daemon instead of through self.dev, so that they don't fight with the other subscribers over the logger.
+	# The settings are still read and written through self.dev. Raises OSError if the daemon can't be reached.
+	def use_acquisition_daemon(self, strDaemon):
+		from AcquisitionDaemon import AcquisitionClient, DEFAULT_PORT
+		(HOST, _, strPort) = strDaemon.partition(':')
+		self.stop_using_acquisition_daemon()
+		self.acquisition_daemon_messages = {}
+		self.acquisition_client = AcquisitionClient(HOST, int(strPort) if strPort else DEFAULT_PORT, callback=self.acquisitionDaemonMessage, timeout=2.)
+		self.acquisition_client.subscribe(['counters', 'dacs', 'status'])
+
+	def stop_using_acquisition_daemon(self):
+		client = self.acquisition_client
+		self.acquisition_client = None
+		if client is not None:
+			client.close()
+
+	# Called from the reader thread of self.acquisition_client
+	def acquisitionDaemonMessage(self, header):
+		self.acquisition_daemon_messages[header['topic']] = header
+
+	# Raises CommsError if the acquisition daemon went away, or if it lost its connection to the box
+	def check_acquisition_daemon(self):
+		if not self.acquisition_client.isConnected():
+			raise RP_PLL.CommsError('the acquisition daemon closed the connection')
+		status = self.acquisition_daemon_messages.get('status')
+		if status is not None and not status['bConnected']:
+			raise RP_PLL.CommsError('the acquisition daemon is not connected to the box: %s' % status['strError'])
 		
 	def openDevice(self, bConfigure=True, strSerial='', strFirmware='superlaserland.bit'):
 		if self.bVerbose == True:
 			print('OpenDevice')
 			
-		if self.bCommunicationLogging == True:
-			self.log_file.write('open()\n')
 
 		error_code = 0    
 
@@ -354,6 +461,7 @@ class SuperLaserLand_JD_RP:
 		print('Resetting FPGA (resetFrontend)...')
 		# self.dev.ActivateTriggerIn(self.ENDPOINT_CMD_TRIG, self.TRIG_RESET_FRONTEND)
 		self.dev.write_Zynq_register_uint32(self.BUS_ADDR_TRIG_RESET_FRONTEND*4, 0)
+		self.invalidate_settings_cache()
 		
 		# self.dev.ActivateTriggerIn(self.ENDPOINT_CMD_TRIG, self.TRIG_RESET)
 
@@ -374,8 +482,6 @@ class SuperLaserLand_JD_RP:
 		if self.bVerbose == True:
 			print('initSubModules')
 			
-		if self.bCommunicationLogging == True:
-			self.log_file.write('initSubModules()\n')
 		# self.pll will contain a list of references to the three PLL loop filters modules
 		#self.pll = (PLL0_module(self), PLL1_module(self), PLL2_module(self))
 		self.pll = (PLL0_module(self), PLL1_module(self))
@@ -389,18 +495,15 @@ class SuperLaserLand_JD_RP:
 		if self.bVerbose == True:
 			print('send_bus_cmd')
 			
-		if self.bCommunicationLogging == True:
-			self.log_file.write('send_bus_cmd(), address = 0x{:X}, data1 = {}, data2 = {}\n'.format(bus_address, data1, data2))
-			print('send_bus_cmd() %X' % bus_address)
 		
-		self.dev.write_Zynq_register_uint32(int(bus_address)*4, (int(data2)<<16) + int(data1))
+		self.write_bus_register(bus_address, (int(data2)<<16) + int(data1))
 
 		
 	def send_bus_cmd_32bits(self, bus_address, data_32bits):
 		if self.bVerbose == True:
 			print('send_bus_cmd_32bits')
 		#print(sys._getframe().f_back.f_code.co_name)
-		self.dev.write_Zynq_register_uint32(int(bus_address)*4, int(data_32bits))
+		self.write_bus_register(bus_address, int(data_32bits))
 			
 		# data_lsbs = int(data_32bits) & 0xFFFF
 		# data_msbs = (int(data_32bits) & 0xFFFF0000) >> 16
@@ -414,15 +517,21 @@ class SuperLaserLand_JD_RP:
 		data_lsbs = int(data_16bits) & 0xFFFF
 		# self.send_bus_cmd(bus_address, data_lsbs, 0)
 
-		self.dev.write_Zynq_register_uint32(int(bus_address)*4, data_lsbs)
+		self.write_bus_register(bus_address, data_lsbs)
+
+	# Writes a cmd bus register, unless it already holds this value (see BUS_ADDRESSES_ALWAYS_WRITTEN).
+	# This makes repeated writes of identical settings (slider drags, pushing the whole configuration again) free.
+	def write_bus_register(self, bus_address, data_32bits):
+		if int(bus_address) in self.BUS_ADDRESSES_ALWAYS_WRITTEN:
+			self.dev.write_Zynq_register_uint32(int(bus_address)*4, data_32bits)
+		else:
+			self.dev.write_Zynq_register_uint32_if_changed(int(bus_address)*4, data_32bits)
 		
 		
 	def setup_write(self, selector, Num_samples):
 		if self.bVerbose == True:
 			print('setup_write')
 			
-		if self.bCommunicationLogging == True:
-			self.log_file.write('setup_write(), selector = {}, Num_samples = {}\n'.format(selector, Num_samples))
 		
 		# Set the clk divider (not implemented)
 		self.clk_divider = 1
@@ -505,8 +614,6 @@ class SuperLaserLand_JD_RP:
 		if self.bVerbose == True:
 			print('setup_system_identification')
 			
-		if self.bCommunicationLogging == True:
-			self.log_file.write('setup_system_identification(), ...\n')
 		# This is slightly more involved, because we have a lot of other stuff to setup
 		# in addition to calling setup_write()
 		
@@ -547,27 +654,29 @@ class SuperLaserLand_JD_RP:
 		self.input_and_output_mux_selector = 1*2**2+ (1)   # LSB = '0' selects ADC 0, LSB = '1' selects ADC 1, bit 2 = '0' selects DAC0, bit 2 = '1' selects DAC1
 		self.input_and_output_mux_selector = output_select * 2**2 + input_select
 
-		self.send_bus_cmd(self.BUS_ADDR_number_of_cycles_integration, int((self.number_of_cycles_integration & 0xFFFF)), int((self.number_of_cycles_integration & 0xFFFF0000) >> 16))
-		self.send_bus_cmd(self.BUS_ADDR_first_modulation_frequency_lsbs, int((self.first_modulation_frequency & 0xFFFF)), int((self.first_modulation_frequency & 0xFFFF0000) >> 16))
-		self.send_bus_cmd(self.BUS_ADDR_first_modulation_frequency_msbs, int((self.first_modulation_frequency & 0xFFFF00000000) >> 32), 0)
-		self.send_bus_cmd(self.BUS_ADDR_modulation_frequency_step_lsbs, int((self.modulation_frequency_step & 0xFFFF)), int((self.modulation_frequency_step & 0xFFFF0000) >> 16))
-		self.send_bus_cmd(self.BUS_ADDR_modulation_frequency_step_msbs, int((self.modulation_frequency_step & 0xFFFF00000000) >> 32), 0)
-		self.send_bus_cmd(self.BUS_ADDR_number_of_frequencies, self.number_of_frequencies, 0)
-		self.send_bus_cmd(self.BUS_ADDR_output_gain, int((self.output_gain & 0xFFFF)), int((self.output_gain & 0xFFFF0000) >> 16))
-		self.send_bus_cmd(self.BUS_ADDR_input_and_output_mux_selector, self.input_and_output_mux_selector, 0)
-		# If we are setting up settings for a system identification, we need to stop the dither:
-		if bDither == False:
-			self.setVNA_mode_register(0, 1, 0)   # Set no dither, stop any dither, and sine wave output
-		# This makes sure that the output mode is 'sine wave' rather than 'square wave'
-		self.setVNA_mode_register(0, 0, 0)   # Set no dither, no stop, and sine wave output
-		
-		# Need to also setup the write for enough samples that the VNA will put out:
-		# This needs to be done last, so that the next call to trigger_write(self) works correctly.
-		Num_samples = self.number_of_frequencies*(2*64+32)/16
-		print('setup_system_identification(): Num_samples = %d' % Num_samples)
-		print('Num_samples = %d' % Num_samples)
-#        print('self.number_of_frequencies = %d' % self.number_of_frequencies)
-		self.setup_write(self.LOGGER_MUX['VNA'], Num_samples)
+		# All the registers are sent in a single packet to the server:
+		with self.dev.transaction():
+			self.send_bus_cmd(self.BUS_ADDR_number_of_cycles_integration, int((self.number_of_cycles_integration & 0xFFFF)), int((self.number_of_cycles_integration & 0xFFFF0000) >> 16))
+			self.send_bus_cmd(self.BUS_ADDR_first_modulation_frequency_lsbs, int((self.first_modulation_frequency & 0xFFFF)), int((self.first_modulation_frequency & 0xFFFF0000) >> 16))
+			self.send_bus_cmd(self.BUS_ADDR_first_modulation_frequency_msbs, int((self.first_modulation_frequency & 0xFFFF00000000) >> 32), 0)
+			self.send_bus_cmd(self.BUS_ADDR_modulation_frequency_step_lsbs, int((self.modulation_frequency_step & 0xFFFF)), int((self.modulation_frequency_step & 0xFFFF0000) >> 16))
+			self.send_bus_cmd(self.BUS_ADDR_modulation_frequency_step_msbs, int((self.modulation_frequency_step & 0xFFFF00000000) >> 32), 0)
+			self.send_bus_cmd(self.BUS_ADDR_number_of_frequencies, self.number_of_frequencies, 0)
+			self.send_bus_cmd(self.BUS_ADDR_output_gain, int((self.output_gain & 0xFFFF)), int((self.output_gain & 0xFFFF0000) >> 16))
+			self.send_bus_cmd(self.BUS_ADDR_input_and_output_mux_selector, self.input_and_output_mux_selector, 0)
+			# If we are setting up settings for a system identification, we need to stop the dither:
+			if bDither == False:
+				self.setVNA_mode_register(0, 1, 0)   # Set no dither, stop any dither, and sine wave output
+			# This makes sure that the output mode is 'sine wave' rather than 'square wave'
+			self.setVNA_mode_register(0, 0, 0)   # Set no dither, no stop, and sine wave output
+		
+			# Need to also setup the write for enough samples that the VNA will put out:
+			# This needs to be done last, so that the next call to trigger_write(self) works correctly.
+			Num_samples = self.number_of_frequencies*(2*64+32)/16
+			print('setup_system_identification(): Num_samples = %d' % Num_samples)
+			print('Num_samples = %d' % Num_samples)
+	#        print('self.number_of_frequencies = %d' % self.number_of_frequencies)
+			self.setup_write(self.LOGGER_MUX['VNA'], Num_samples)
 		
 	def setVNA_mode_register(self, trigger_dither, stop_flag, bSquareWave):
 		if self.bVerbose == True:
@@ -576,12 +685,122 @@ class SuperLaserLand_JD_RP:
 		register_value = stop_flag + 2*trigger_dither + 4*bSquareWave
 		self.send_bus_cmd(self.BUS_ADDR_VNA_mode_control, register_value, 0)
 		
+	# Runs a complete acquisition on the logger: setup, trigger, wait and read.
+	# Returns (samples_out, ref_exp0) for the ADC and DAC inputs, or inst_freq for the DDC inputs when bReadAsDDC is True.
+	# The returned samples are copies, so they stay valid after the next acquisition.
+	# The caller has to own self.ddr2_arbiter.
+	# With an acquisition daemon (see use_acquisition_daemon()), the daemon takes the capture, and the samples are decoded here.
+	def acquire_logger_samples(self, input_select, N_samples, bReadAsDDC=False):
+		if self.bVerbose == True:
+			print('acquire_logger_samples')
+			
+		if self.acquisition_client is not None:
+			self.check_acquisition_daemon()
+			(samples_out, header) = self.acquisition_client.capture(input_select, N_samples, bRaw=True)
+			return self.decode_logger_samples(samples_out, self.LOGGER_MUX[input_select], bReadAsDDC)
+
+		self.setup_write(self.LOGGER_MUX[input_select], N_samples)
+		self.trigger_write()
+		self.wait_for_write()
+		if bReadAsDDC:
+			return self.read_ddc_samples_from_DDR2()
+		(samples_out, ref_exp0) = self.read_adc_samples_from_DDR2()
+		return (samples_out.astype(dtype=float), ref_exp0)
+
+	# Same as acquire_logger_samples(), but returns the raw int16 samples, without decoding them (see decode_logger_samples()).
+	# They are only valid until the next read.
+	# The caller has to own self.ddr2_arbiter.
+	def acquire_logger_raw_samples(self, input_select, N_samples):
+		self.setup_write(self.LOGGER_MUX[input_select], N_samples)
+		self.trigger_write()
+		self.wait_for_write()
+		return self.read_raw_samples_from_DDR2()
+
+	# Decodes the raw samples of a capture from the logger input selector, like read_ddc_samples_from_DDR2() if bReadAsDDC is True,
+	# or like read_adc_samples_from_DDR2() otherwise, see acquire_logger_samples()
+	def decode_logger_samples(self, samples_out, selector, bReadAsDDC=False):
+		if bReadAsDDC:
+			return self.decode_ddc_samples(samples_out)
+		(samples_out, ref_exp0) = self.decode_adc_samples(samples_out, selector)
+		return (samples_out.astype(dtype=float), ref_exp0)
+
+	# Same as acquire_logger_samples(), for several inputs: the server captures N_samples from each input in input_selects, back-to-back,
+	# and sends all the buffers back in a single reply, instead of one setup/trigger/wait/read cycle per input.
+	# Returns a dict which maps each input select to what acquire_logger_samples() returns for it (inst_freq for the DDC inputs).
+	# The caller has to own self.ddr2_arbiter.
+	def acquire_logger_snapshot(self, input_selects, N_samples):
+		if self.bVerbose == True:
+			print('acquire_logger_snapshot')
+			
+		if len(input_selects) == 0:
+			return {}
+
+		selectors = [self.LOGGER_MUX[input_select] for input_select in input_selects]
+		(status, samples) = self.dev.read_logger_snapshot(selectors, N_samples)
+		# the server leaves the mux on the last input, without going through the shadow register file:
+		self.last_selector = selectors[-1]
+		self.dev.forget_shadow_registers([self.dev.FPGA_BASE_ADDR + self.BUS_ADDR_MUX_SELECTORS*4])
+
+		frames = {}
+		for (k, input_select) in enumerate(input_selects):
+			self.checkLoggerStatusAfterCapture(int(status[k]), samples.shape[1], input_select)
+			if input_select in ('DDC0', 'DDC1'):
+				frames[input_select] = self.decode_ddc_samples(samples[k])
+			else:
+				(samples_out, ref_exp0) = self.decode_adc_samples(samples[k], selectors[k])
+				frames[input_select] = (samples_out.astype(dtype=float), ref_exp0)
+		return frames
+
+	# Captures N_samples from the logger input input_select, and returns only the statistics listed in stats (see LOGGER_STATS),
+	# computed by the server, as a dict. The values are in counts, like the samples returned by acquire_logger_samples().
+	# The side information at the start of the ADC captures is not included in the statistics.
+	# The caller has to own self.ddr2_arbiter.
+	def capture_stats(self, input_select, N_samples, stats=('mean',)):
+		if self.bVerbose == True:
+			print('capture_stats')
+			
+		for stat in stats:
+			if stat not in self.LOGGER_STATS:
+				raise ValueError('capture_stats(): unknown statistic %s, must be one of %s' % (stat, self.LOGGER_STATS))
+
+		selector = self.LOGGER_MUX[input_select]
+		if selector == self.LOGGER_MUX['ADC0'] or selector == self.LOGGER_MUX['ADC1']:
+			first_sample = self.LOGGER_ADC_SIDE_INFORMATION_SAMPLES
+		else:
+			first_sample = 0
+		sums = self.dev.read_logger_stats(selector, first_sample, N_samples, bUnsigned=(selector == self.LOGGER_MUX['DAC2']))
+		# the server leaves the mux on this input, without going through the shadow register file:
+		self.last_selector = selector
+		self.dev.forget_shadow_registers([self.dev.FPGA_BASE_ADDR + self.BUS_ADDR_MUX_SELECTORS*4])
+		self.checkLoggerStatusAfterCapture(sums['logger_status'], first_sample + sums['number_of_samples'], input_select)
+		return self.reduce_logger_stats(sums, stats)
+
+	# Computes the statistics listed in stats from the sums returned by RP_PLL_device.read_logger_stats()
+	def reduce_logger_stats(self, sums, stats):
+		N = sums['number_of_samples']
+		if N == 0:
+			return dict((stat, np.nan) for stat in stats)
+		mean = float(sums['sum'])/N
+		mean_square = float(sums['sum_of_squares'])/N
+		all_stats = {'mean':    mean,
+		             'min':     sums['min'],
+		             'max':     sums['max'],
+		             'rms':     np.sqrt(mean_square),
+		             'std':     np.sqrt(max(0., mean_square - mean**2)),
+		             'max_abs': sums['max_abs']}
+		return dict((stat, all_stats[stat]) for stat in stats)
+
+	# Warns if the logger status word read at the end of a capture done by the server shows that the capture timed out
+	def checkLoggerStatusAfterCapture(self, status, Num_samples, input_select):
+		bWriting = self.extractBit(status, 23)
+		Num_samples_written = status & ((1<<23)-1)
+		if (status >> 24) == self.LOGGER_STATUS_SIGNATURE and bWriting and Num_samples_written < Num_samples:
+			self.logger.warning('Red_Pitaya_GUI{}: timed out waiting for the logger on {}: {} of {} samples written'.format(self.logger_name, input_select, Num_samples_written, Num_samples))
+
 	def trigger_write(self):
 		if self.bVerbose == True:
 			print('trigger_write')
 			
-		if self.bCommunicationLogging == True:
-			self.log_file.write('trigger_write()\n')
 		# Start writing data to the BRAM:
 		self.dev.write_Zynq_register_uint32(self.BUS_ADDR_TRIG_WRITE, 0)
 		#self.dev.ActivateTriggerIn(self.ENDPOINT_CMD_TRIG, self.TRIG_CMD_STROBE)
@@ -590,8 +809,6 @@ class SuperLaserLand_JD_RP:
 		if self.bVerbose == True:
 			print('trigger_system_identification')
 			
-		if self.bCommunicationLogging == True:
-			self.log_file.write('trigger_system_identification()\n')
 		# Start writing data to the DDR2 RAM:
 		# self.dev.ActivateTriggerIn(self.ENDPOINT_CMD_TRIG, self.TRIG_CMD_STROBE)
 		self.dev.write_Zynq_register_uint32(self.BUS_ADDR_TRIG_WRITE, 0)
@@ -605,7 +822,7 @@ class SuperLaserLand_JD_RP:
 			
 		# Wait, seems necessary because setting the DDR2Logger to 'read' mode overrides the 'write' mode
 		write_delay = 1.1*1024*(int(self.Num_samples_write/1024) + 1)/(self.fs/(2*self.clk_divider))
-		time.sleep(write_delay)
+		self.wait_for_logger(write_delay)
 		
 	def get_system_identification_wait_time(self):
 		if self.bVerbose == True:
@@ -618,29 +835,85 @@ class SuperLaserLand_JD_RP:
 			print('wait_for_system_identification')
 			
 #        print(1.1*2*self.number_of_cycles_integration*self.number_of_frequencies/self.fs)
-		time.sleep(self.get_system_identification_wait_time())
+		# the VNA writes its results into the logger, so we can poll the logger for the end of the measurement:
+		self.wait_for_logger(self.get_system_identification_wait_time())
+		
+	# Returns (bWriting, Num_samples_written) from the status word of ram_data_logger.vhd,
+	# or None if the firmware does not provide this status word.
+	def readLoggerStatus(self):
+		if self.bVerbose == True:
+			print('readLoggerStatus')
+			
+		status = self.dev.read_Zynq_register_uint32(self.BUS_ADDR_LOGGER_STATUS)
+		if (status >> 24) != self.LOGGER_STATUS_SIGNATURE:
+			return None
+		bWriting            = self.extractBit(status, 23)
+		Num_samples_written = status & ((1<<23)-1)
+		return (bWriting, Num_samples_written)
+		
+	# Waits until the logger has written self.Num_samples_write samples, or stopped writing.
+	# expected_time is the worst-case duration of the acquisition, in seconds: we give up after about twice that time,
+	# and we simply sleep for expected_time if the firmware cannot report the logger status.
+	# Returns True if the acquisition is finished (or assumed to be), False on a timeout.
+	def wait_for_logger(self, expected_time):
+		if self.bVerbose == True:
+			print('wait_for_logger')
+			
+		time_start = time.perf_counter()
+		timeout = 2*expected_time + self.LOGGER_TIMEOUT_MARGIN
+		while True:
+			status = self.readLoggerStatus()
+			if status is None:
+				# older firmware: fall back on the fixed wait
+				time.sleep(max(0., expected_time - (time.perf_counter()-time_start)))
+				return True
+			(bWriting, Num_samples_written) = status
+			if bWriting == 0 or Num_samples_written >= self.Num_samples_write:
+				return True
+			if time.perf_counter()-time_start > timeout:
+				self.logger.warning('Red_Pitaya_GUI{}: timed out waiting for the logger: {} of {} samples written after {:.3f} s'.format(self.logger_name, Num_samples_written, self.Num_samples_write, timeout))
+				return False
+			time.sleep(self.LOGGER_POLL_PERIOD)
 		
 		
 
-	def read_raw_bytes_from_DDR2(self):
+	# Returns the samples as a numpy int16 array.
+	# This is a view into the receive buffer of self.dev, so it is overwritten by the next read: copy it (for example with astype()) if it needs to be kept.
+	def read_raw_samples_from_DDR2(self):
 		if self.bVerbose == True:
-			print('read_raw_bytes_from_DDR2')
+			print('read_raw_samples_from_DDR2')
 
-		if self.bCommunicationLogging == True:
-			self.log_file.write('read_raw_bytes_from_DDR2()\n')
 
-		bytes_per_sample = 2
-		Num_bytes_read = self.Num_samples_read*bytes_per_sample
+		samples = self.dev.read_Zynq_buffer_int16_view(self.Num_samples_read)
+
+		if self.Num_samples_read != len(samples):
+			print('Error: did not receive the expected number of samples. expected: %d, Received: %d' % (self.Num_samples_read, len(samples)))
 
-		data_buffer = self.dev.read_Zynq_buffer_int16(self.Num_samples_read)
+		return samples
+
+	# Same as read_raw_samples_from_DDR2(), but viewed as bytes
+	def read_raw_bytes_from_DDR2(self):
+		if self.bVerbose == True:
+			print('read_raw_bytes_from_DDR2')
 
-		if Num_bytes_read != len(data_buffer):
-			print('Error: did not receive the expected number of bytes. expected: %d, Received: %d' % (Num_bytes_read, len(data_buffer)))
+		return self.read_raw_samples_from_DDR2().view(np.uint8)
+
+	# Gapless acquisition from the FIFO logger, as opposed to the one-shot setup_write()/trigger_write()/read_*_from_DDR2() sequence,
+	# which is limited to RP_PLL_device.MAX_SAMPLES_READ_BUFFER samples.
+	# This is a generator which yields (sequence_number, samples, bDropped) tuples, where samples is a numpy uint32 array of samples_per_block samples,
+	# and bDropped is True if samples were lost between this block and the previous one, or within this block (see RP_PLL_fifo_stream).
+	# Streaming stops after number_of_blocks blocks (never if number_of_blocks is 0), or when the generator is closed.
+	def stream_fifo_samples(self, samples_per_block, number_of_blocks=0):
+		if self.bVerbose == True:
+			print('stream_fifo_samples')
 
-		# convert to numpy array
-		data_buffer = np.fromstring(data_buffer, dtype=np.uint8)
 
-		return data_buffer
+		with self.dev.open_fifo_stream(samples_per_block, number_of_blocks) as stream:
+			for (sequence_number, samples, bDropped) in stream:
+				if bDropped:
+					print('Warning: samples dropped up to block #%d of the fifo stream' % sequence_number)
+					self.logger.warning('Red_Pitaya_GUI{}: samples dropped up to block #{} of the fifo stream'.format(self.logger_name, sequence_number))
+				yield (sequence_number, samples, bDropped)
 
 		
 	def extractBit(self, value, N_bit):
@@ -764,8 +1037,6 @@ class SuperLaserLand_JD_RP:
 		if self.bVerbose == True:
 			print('read_raw_bytes_from_pipe')
 			
-		if self.bCommunicationLogging == True:
-			self.log_file.write('read_raw_bytes_from_pipe()\n')
 
 		print("read_raw_bytes_from_pipe: currently unimplemented (needs to switch to memory-mapped registers)")
 		return None
@@ -840,16 +1111,16 @@ class SuperLaserLand_JD_RP:
 		if self.bVerbose == True:
 			print('read_adc_samples_from_DDR2')
 			
-		if self.bCommunicationLogging == True:
-			self.log_file.write('read_adc_samples_from_DDR2()\n')
 
-		data_buffer = self.read_raw_bytes_from_DDR2()
-		if self.last_selector == self.LOGGER_MUX['DAC2']:
+		samples_out = self.read_raw_samples_from_DDR2()
+		return self.decode_adc_samples(samples_out, self.last_selector)
+
+	# Extracts the side information (DDC reference exponential and magic bytes) from the raw logger samples of the ADC and DAC inputs,
+	# selector is the value of the mux selector used for the acquisition. Returns (samples_out, ref_exp).
+	def decode_adc_samples(self, samples_out, selector):
+		if selector == self.LOGGER_MUX['DAC2']:
 			# DAC 2 samples are unsigned 16-bits
-			samples_out = np.frombuffer(data_buffer, dtype=np.uint16)
-		else:
-			# All the other data sources are signed 16-bits
-			samples_out = np.frombuffer(data_buffer, dtype=np.int16)
+			samples_out = samples_out.view(np.uint16)
 
 		if len(samples_out) == 0:
 			ref_exp = np.array([1.0,])
@@ -860,12 +1131,12 @@ class SuperLaserLand_JD_RP:
 		# There is one additional thing we need to take care:
 		# Samples #4 and 5 (counting from 0) contain the DDC reference exponential for this data packet:
 		ref_exp_expected_position = 6
-		magic_bytes_expected_position = ref_exp_expected_position+2
-		ref_exp = samples_out[ref_exp_expected_position].astype(np.float) + 1j * samples_out[ref_exp_expected_position+1].astype(np.float)
+		magic_bytes_expected_position = ref_exp_expected_position+2	# the samples up to this one are the LOGGER_ADC_SIDE_INFORMATION_SAMPLES
+		ref_exp = samples_out[ref_exp_expected_position].astype(np.float64) + 1j * samples_out[ref_exp_expected_position+1].astype(np.float64)
 		# ref_exp is the reference phasor at sample #4, we need to extrapolate it to the first correct output sample (#6, or two samples later)
 
 		
-		if self.last_selector ==  0 or self.last_selector == 1:
+		if selector ==  0 or selector == 1:
 			# We have placed two magic bytes in sample 7, so that we can detect loss of synchronization on that data stream:
 			magic_bytes = int('1010100010001111', 2) # from aux_data_mux.vhd: 1010_1000_1000_1111
 			# magic_bytes is interpreted by python as an unsigned uint16, while samples_out[7] is interpreted as a signed int16
@@ -879,7 +1150,7 @@ class SuperLaserLand_JD_RP:
 			if samples_out[magic_bytes_expected_position] != magic_bytes:
 				print('Comms bug! Sorry about that.')
 				print('Loss of synchronization detected on Pipe 0xA1:')
-				print('Original read length: %d' % self.Num_samples_read)
+				print('Original read length: %d' % len(samples_out))
 				self.logger.warning('Red_Pitaya_GUI{}: Comms bug. Loss of synchronization detected on Pipe 0xA1'.format(self.logger_name))
 				
 				
@@ -896,7 +1167,7 @@ class SuperLaserLand_JD_RP:
 		
 		# Here we need to know if this was ADC 0 or 1, so that we use the correct DDC reference frequency to extrapolate the phase:
 		N_delay_between_ref_exp_and_datastream = 4
-		if self.last_selector == 0:
+		if selector == 0:
 			# ADC 0
 			ref_exp = ref_exp * np.exp(-1j*2*np.pi*N_delay_between_ref_exp_and_datastream*(float(self.ddc0_frequency_in_int)/float(2**48)))
 			
@@ -904,7 +1175,7 @@ class SuperLaserLand_JD_RP:
 			samples_out = samples_out[magic_bytes_expected_position+1:]
 			
 
-		elif self.last_selector == 1:
+		elif selector == 1:
 			# ADC 1
 			ref_exp = ref_exp * np.exp(-1j*2*np.pi*N_delay_between_ref_exp_and_datastream*(float(self.ddc1_frequency_in_int)/float(2**48)))
 			
@@ -922,10 +1193,7 @@ class SuperLaserLand_JD_RP:
 		if self.bVerbose == True:
 			print('read_ddc_samples_from_DDR2')
 			
-		if self.bCommunicationLogging == True:
-			self.log_file.write('read_ddc_samples_from_DDR2()\n')
-		data_buffer = self.read_raw_bytes_from_DDR2()
-		samples_out = np.frombuffer(data_buffer, dtype=np.int16)
+		samples_out = self.read_raw_samples_from_DDR2()
 			
 		
 		# bytes_per_sample = 2
@@ -933,6 +1201,9 @@ class SuperLaserLand_JD_RP:
 		# convert_2bytes_signed = np.array((2**(0*8), 2**(1*8)), dtype=np.int16)
 		# samples_out         = np.dot(data_buffer_reshaped[:, :].astype(np.int16), convert_2bytes_signed)
 
+		return self.decode_ddc_samples(samples_out)
+
+	def decode_ddc_samples(self, samples_out):
 		# The samples represent instantaneous frequency as: samples_out = diff(phi)/(2*pi*fs) * 2**12, where phi is the phase in radians
 		inst_freq = (samples_out.astype(dtype=float))/2**10 * self.fs/4
 		# print('Mean frequency error = %f Hz' % np.mean(inst_freq))
@@ -944,8 +1215,6 @@ class SuperLaserLand_JD_RP:
 		if self.bVerbose == True:
 			print('read_counter_samples_from_DDR2')
 			
-		if self.bCommunicationLogging == True:
-			self.log_file.write('read_counter_samples_from_DDR2()\n')
 		data_buffer = self.read_raw_bytes_from_DDR2()
 			
 		bytes_per_sample = 2
@@ -962,8 +1231,6 @@ class SuperLaserLand_JD_RP:
 		if self.bVerbose == True:
 			print('read_VNA_samples_from_DDR2')
 			
-		if self.bCommunicationLogging == True:
-			self.log_file.write('read_VNA_samples_from_DDR2()\n')
 		data_buffer = self.read_raw_bytes_from_DDR2()
 		
 		# Interpret the samples as coming form the system identification VNA:
@@ -1030,13 +1297,13 @@ class SuperLaserLand_JD_RP:
 		# While the overall gain is:
 		# That is, a pure loop-back system from the output of the VNA to the input will
 		#  give a modulus equal to overall_gain.
-		overall_gain = np.array(2.**(15-1) * self.output_gain * float((self.number_of_cycles_integration)), dtype=np.float) # the additionnal divide by two is because cos(x) = 1/2*exp(jx)+1/2*exp(-jx)
-		overall_gain = 2.**(15-1) * self.output_gain * integration_time.astype(np.float) # the additionnal divide by two is because cos(x) = 1/2*exp(jx)+1/2*exp(-jx)
+		overall_gain = np.array(2.**(15-1) * self.output_gain * float((self.number_of_cycles_integration)), dtype=np.float64) # the additionnal divide by two is because cos(x) = 1/2*exp(jx)+1/2*exp(-jx)
+		overall_gain = 2.**(15-1) * self.output_gain * integration_time.astype(np.float64) # the additionnal divide by two is because cos(x) = 1/2*exp(jx)+1/2*exp(-jx)
 #        print(self.number_of_cycles_integration)
 #        overall_gain = 1
 #        print('TODO: Remove this line! overallgain = 1')
-		transfer_function_real = (integrator_real.astype(np.float)) / (overall_gain)
-		transfer_function_imag = (integrator_imag.astype(np.float)) / (overall_gain)
+		transfer_function_real = (integrator_real.astype(np.float64)) / (overall_gain)
+		transfer_function_imag = (integrator_imag.astype(np.float64)) / (overall_gain)
 		transfer_function_complex = transfer_function_real + 1j * transfer_function_imag
 #        phi = np.angle(transfer_function_real + 1j*transfer_function_imag)
 #        group_delay = ((-np.diff(phi)+np.pi) % (2*np.pi))-np.pi
@@ -1049,8 +1316,6 @@ class SuperLaserLand_JD_RP:
 		if self.bVerbose == True:
 			print('set_dac_offset')
 			
-		if self.bCommunicationLogging == True:
-			self.log_file.write('set_dac_offset()\n')
 		#print('set_dac_offset(): dac #%d, offset = %d' % (dac_number, offset))
 		self.DACs_offset[dac_number] = offset
 		self.send_bus_cmd_32bits(self.BUS_ADDR_DAC_offset[dac_number], offset)
@@ -1091,8 +1356,6 @@ class SuperLaserLand_JD_RP:
 		if self.bVerbose == True:
 			print('set_dac_limits')
 			
-		if self.bCommunicationLogging == True:
-			self.log_file.write('set_dac_limits()\n')
 		limit_low = int(limit_low)
 		limit_high = int(limit_high)
 		
@@ -1118,8 +1381,6 @@ class SuperLaserLand_JD_RP:
 	def get_dac_limits(self, dac_number):
 		if self.bVerbose == True:
 			print('get_dac_limits')
-		if self.bCommunicationLogging == True:
-			self.log_file.write('get_dac_limits()\n')
 
 		# a few helper functions:
 		split_32bits_to_2x16bits   = lambda x: ((x & 0xFFFF0000)>>16, (x & 0x0000FFFF))
@@ -1163,8 +1424,6 @@ class SuperLaserLand_JD_RP:
 		if self.bVerbose == True:
 			print('set_ddc0_ref_freq')
 			
-		if self.bCommunicationLogging == True:
-			self.log_file.write('set_ddc0_ref_freq()\n')
 		
 		self.ddc0_frequency_in_int = int(round(2**48 * frequency_in_hz/self.fs))
 		self.ddc0_frequency_in_int = self.ddc0_frequency_in_int % (1 << 48) # modulo 2**48
@@ -1205,8 +1464,6 @@ class SuperLaserLand_JD_RP:
 		if self.bVerbose == True:
 			print('set_ddc1_ref_freq')
 			
-		if self.bCommunicationLogging == True:
-			self.log_file.write('set_ddc1_ref_freq()\n')
 
 		self.ddc1_frequency_in_int = int(round(2**48 * frequency_in_hz/self.fs))
 		self.ddc1_frequency_in_int = self.ddc1_frequency_in_int % (1 << 48) # modulo 2**48
@@ -1230,9 +1487,9 @@ class SuperLaserLand_JD_RP:
 	## HB, 4/27/2015, Added PWM support on DOUT0
 	##
 	def convertPWMCountsToVolts(self, standard, levels, counts):
-		return np.float(standard)*np.float(counts)/np.float(levels)
+		return np.float64(standard)*np.float64(counts)/np.float64(levels)
 	def convertPWMVoltsToCounts(self, standard, levels, volts):
-		return int(np.round(np.float(levels)*np.float(volts)/np.float(standard)))
+		return int(np.round(np.float64(levels)*np.float64(volts)/np.float64(standard)))
 			
 	def convertDACCountsToVolts(self, DAC_number, counts):
 		if self.bVerbose == True:
@@ -1241,12 +1498,12 @@ class SuperLaserLand_JD_RP:
 		# Make sure that the counts get treated as floats instead of integers
 		# handle both Python scalar and numpy array input:
 		if type(counts) is np.ndarray:
-			counts = counts.astype(np.float)
+			counts = counts.astype(np.float64)
 		else:
-			counts = np.float(counts)
+			counts = np.float64(counts)
 		
 		if DAC_number == 0:
-			# print('counts = %d, volts = %f, gain = %f' % (counts, np.float(counts)/2.**15. * 1 * self.DAC0_gain, self.DAC0_gain))
+			# print('counts = %d, volts = %f, gain = %f' % (counts, np.float64(counts)/2.**15. * 1 * self.DAC0_gain, self.DAC0_gain))
 			return counts/(2.**15.-1) * 1 * self.DAC0_gain            
 		elif DAC_number == 1:
 			return counts/(2.**15.-1) * 1 * self.DAC1_gain
@@ -1318,17 +1575,17 @@ class SuperLaserLand_JD_RP:
 		Volts_max_for_unit_gain = 1. # Nominal value is 1 Volts peak-to-peak (+/- 1 Volts input range)
 		
 		if ADC_number == 0:
-#            print('counts = %d, volts = %f, gain = %f' % (counts, np.float(counts)/2.**15. * 1 * self.DAC0_gain, self.DAC0_gain))
+#            print('counts = %d, volts = %f, gain = %f' % (counts, np.float64(counts)/2.**15. * 1 * self.DAC0_gain, self.DAC0_gain))
 			ADC_gain = float(self.ADC0_gain)
 		elif ADC_number == 1:
 			ADC_gain = float(self.ADC1_gain)
 		
 		if type(counts) is np.ndarray:
 			# Numpy array:
-			return counts.astype(np.float)  /  (2. **(ADC_bits-1)) * Volts_max_for_unit_gain / ADC_gain
+			return counts.astype(np.float64)  /  (2. **(ADC_bits-1)) * Volts_max_for_unit_gain / ADC_gain
 		else:
 			# Scalar case:
-			return np.float(counts)  /  (2. **(ADC_bits-1)) * Volts_max_for_unit_gain / ADC_gain
+			return np.float64(counts)  /  (2. **(ADC_bits-1)) * Volts_max_for_unit_gain / ADC_gain
 		
 	def convertDDCCountsToHz(self, counts):
 		if self.bVerbose == True:
@@ -1336,7 +1593,7 @@ class SuperLaserLand_JD_RP:
 			
 		DDC_bits = 10.
 		
-		return counts.astype(dtype=np.float)  /  (2. **(DDC_bits)) * self.fs
+		return counts.astype(dtype=np.float64)  /  (2. **(DDC_bits)) * self.fs
 		
 	def setDitherLockInState(self, dac_number, bEnable):
 		if self.bVerbose == True:
@@ -1382,11 +1639,12 @@ class SuperLaserLand_JD_RP:
 
 
 	def get_Dither_Settings(self, dac_number):
-		self.modulation_period_divided_by_4_minus_one[dac_number] 	= self.read_RAM_dpll_wrapper(self.BUS_ADDR_dither_period_divided_by_4_minus_one[dac_number])
-		self.N_periods_integration_minus_one[dac_number] 			= self.read_RAM_dpll_wrapper(self.BUS_ADDR_dither_N_periods_minus_one[dac_number])
-		self.dither_amplitude[dac_number] 							= self.read_RAM_dpll_wrapper(self.BUS_ADDR_dither_amplitude[dac_number])
-		self.dither_enable[dac_number] 								= self.read_RAM_dpll_wrapper(self.BUS_ADDR_dither_enable[dac_number])
-		self.dither_mode_auto[dac_number] 							= self.read_RAM_dpll_wrapper(self.BUS_ADDR_dither_mode_auto[dac_number])
+		# the five dither registers are consecutive, starting with BUS_ADDR_dither_enable, so we read them all in a single request
+		(self.dither_enable[dac_number],
+		 self.modulation_period_divided_by_4_minus_one[dac_number],
+		 self.N_periods_integration_minus_one[dac_number],
+		 self.dither_amplitude[dac_number],
+		 self.dither_mode_auto[dac_number]) = self.read_RAM_dpll_wrapper_block(self.BUS_ADDR_dither_enable[dac_number], 5)
 
 		modulation_period = int((self.modulation_period_divided_by_4_minus_one[dac_number]+1)*4)
 		N_periods = int(self.N_periods_integration_minus_one[dac_number]+1)
@@ -1399,7 +1657,7 @@ class SuperLaserLand_JD_RP:
 		# print('ditherRead')
 			
 		# Read N samples from the dither lock-in
-		samples = np.zeros(N_samples, dtype=np.complexfloating)
+		samples = np.zeros(N_samples, dtype=np.complex128)
 
 		if dac_number == 0:
 			BASE_ADDR_REAL_LSB = self.BUS_ADDR_DITHER0_LOCKIN_REAL_LSB
@@ -1412,16 +1670,12 @@ class SuperLaserLand_JD_RP:
 			return samples
 		
 		# print 'ditherRead------------'
-		for k in range(N_samples):
-
-			# results_lsb = self.dev.read_Zynq_register_uint32(BASE_ADDR_REAL_LSB*4)
-			# results_msb = self.dev.read_Zynq_register_uint32(BASE_ADDR_REAL_MSB*4)
-			# # print 'results_lsb = %d' % results_lsb
-			# # print 'results_msb = %d' % results_msb
-
-			# results = np.array((results_lsb, results_msb), np.dtype(np.uint32))
-			# results = np.frombuffer(results, np.dtype(np.int64) )
-			samples[k] = self.dev.read_Zynq_register_int64(BASE_ADDR_REAL_LSB*4, BASE_ADDR_REAL_MSB*4)
+		if BASE_ADDR_REAL_MSB == BASE_ADDR_REAL_LSB+1:
+			# all the samples are read by the server in a single request
+			samples[:] = self.dev.read_Zynq_register_int64_samples(BASE_ADDR_REAL_LSB*4, N_samples)
+		else:
+			for k in range(N_samples):
+				samples[k] = self.dev.read_Zynq_register_int64(BASE_ADDR_REAL_LSB*4, BASE_ADDR_REAL_MSB*4)
 
 			
 		return samples
@@ -1508,19 +1762,50 @@ class SuperLaserLand_JD_RP:
 		return (hold, flip_sign, lock, gain_in_bits)
 
 
-	def frontend_DDC_processing(self, samples, ref_exp0, input_number):
+	# Complex exponentials used by frontend_DDC_processing(). They only depend on the DDC frequency and the number of samples,
+	# which rarely change between two calls, so they are computed once and reused.
+	def get_DDC_phasor_table(self, ddc_frequency_in_int, N, dtype=np.complex128):
+		key = (int(ddc_frequency_in_int), int(N), np.dtype(dtype).str)
+		table = self.ddc_phasor_tables.get(key)
+		if table is None:
+			if len(self.ddc_phasor_tables) >= self.MAX_DDC_PHASOR_TABLES:
+				self.ddc_phasor_tables.clear()
+			f_reference = float(ddc_frequency_in_int) / 2**48
+			table = np.exp(-1j*2*np.pi*f_reference*np.arange(N)).astype(dtype)
+			table.flags.writeable = False   # shared between calls
+			self.ddc_phasor_tables[key] = table
+		return table
+
+	# Same as lfilter() with a cascade of boxcar (moving average) filters, starting from zero initial conditions,
+	# but each boxcar is computed as the difference of a cumulative sum, which is much faster than lfilter() on complex data.
+	# The cumulative sums are accumulated in double precision even for single precision inputs, to avoid drifting over long records.
+	def boxcar_filter_cascade(self, x, boxcar_lengths):
+		y = x
+		for N_boxcar in boxcar_lengths:
+			cumulative_sum = np.cumsum(y, dtype=np.complex128)
+			cumulative_sum[N_boxcar:] -= cumulative_sum[:-N_boxcar].copy()
+			y = cumulative_sum
+			y *= 1./N_boxcar
+		return y.astype(x.dtype, copy=False)
+
+	def frontend_DDC_processing(self, samples, ref_exp0, input_number, bFloat32=False):
 		if self.bVerbose == True:
 			print('frontend_DDC_processing, len(samples) = %d, samples[0] = %d' % (len(samples), samples[0]))
 			
 		# The signal is from ADC0 or ADC1
 		if input_number == 0:
-			f_reference = float(self.ddc0_frequency_in_int) / 2**48
+			ddc_frequency_in_int = self.ddc0_frequency_in_int
 		elif input_number == 1:
-			f_reference = float(self.ddc1_frequency_in_int) / 2**48
-		
+			ddc_frequency_in_int = self.ddc1_frequency_in_int
 		
-		ref_exp = (ref_exp0)/np.abs(ref_exp0) * np.exp(-1j*2*np.pi*f_reference*np.array(range(len(samples))))
+		if bFloat32:
+			samples = np.asarray(samples, dtype=np.float32)
+			complex_dtype = np.complex64
+		else:
+			complex_dtype = np.complex128
+		ref_exp = self.get_DDC_phasor_table(ddc_frequency_in_int, len(samples), complex_dtype)
 		complex_baseband = (samples-np.mean(samples)) * ref_exp
+		complex_baseband *= (ref_exp0)/np.abs(ref_exp0)
 		
 		# There are two versions of the firmware in use: one uses a 20points boxcar filter,
 		# the other one uses a wider bandwidth filter, consisting of a cascade of a 2-pts boxcar, another 2-pts boxcar, and finally a 4-points boxcar.
@@ -1534,19 +1819,19 @@ class SuperLaserLand_JD_RP:
 		
 		if filter_select == 0:
 			N_filter = 16
-			lpf = np.convolve(np.ones(2, dtype=float)/2., np.ones(2, dtype=float)/2.)
-			lpf = np.convolve(np.ones(4, dtype=float)/4., lpf)
+			complex_baseband = self.boxcar_filter_cascade(complex_baseband, (2, 2, 4))
 			
 		elif filter_select == 1:
 			N_filter = 20
-			lpf = np.convolve(np.ones(4, dtype=float)/4., np.ones(16, dtype=float)/16.)
+			complex_baseband = self.boxcar_filter_cascade(complex_baseband, (4, 16))
 		elif filter_select == 2:
 			N_filter = 16+2
 			lpf = np.array([4533, 11833, 14589, 7610, -2628, -5400, -350, 3293, 1086, -1867, -1080, 956, 800, -462, -650, 338])/(2.**15-1)
 			lpf = np.convolve(np.ones(2, dtype=float)/2., lpf)
 #            print(lpf)
-		complex_baseband = lfilter(lpf, 1, complex_baseband)[N_filter:]
-		return complex_baseband
+			from scipy.signal import lfilter
+			complex_baseband = lfilter(lpf, 1, complex_baseband).astype(complex_dtype, copy=False)
+		return complex_baseband[N_filter:]
 		
 
 		
@@ -1637,7 +1922,7 @@ class SuperLaserLand_JD_RP:
 			# Rectangular averaging:
 			conversion_gain = N_cycles_gate_time
 		try:
-			freq_counter_samples = freq_counter_samples.astype(np.float)
+			freq_counter_samples = freq_counter_samples.astype(np.float64)
 		except AttributeError:
 			# if freq_counter_samples is not a numpy type, we might get this exception
 			freq_counter_samples = float(freq_counter_samples)
@@ -1679,10 +1964,40 @@ class SuperLaserLand_JD_RP:
 		self.setVNA_mode_register(trigger_dither, stop_flag, bSquareWave)
 		print('(trigger_dither, stop_flag, bSquareWave) = %d, %d, %d' % (trigger_dither, stop_flag, bSquareWave))
 
+	# Returns the current output values of DAC 0, 1 and 2 in counts, with a single block read and without using the logger.
+	# registers_read.vhd only samples the DAC outputs into the BUS_ADDR_DACx_CURRENT registers when BUS_ADDR_ZERO_DEADTIME_SAMPLES_NUMBER is read,
+	# so the block starts there, like in read_dual_mode_counter().
+	def read_DAC_current_values(self):
+		if self.bVerbose == True:
+			print('read_DAC_current_values')
+			
+		if self.acquisition_client is not None:
+			self.check_acquisition_daemon()
+			dacs = self.acquisition_daemon_messages.get('dacs')
+			if dacs is None:
+				raise RP_PLL.CommsError('no DAC values from the acquisition daemon yet')
+			return (dacs['dac0'], dacs['dac1'], dacs['dac2'])
+
+		regs = self.dev.read_Zynq_registers_block(self.BUS_ADDR_ZERO_DEADTIME_SAMPLES_NUMBER*4, self.BUS_ADDR_DAC2_CURRENT-self.BUS_ADDR_ZERO_DEADTIME_SAMPLES_NUMBER+1)
+		# the 16 bits DAC values are sign-extended to 32 bits in dpll_wrapper.v,
+		# DAC 0 and 1 are signed while DAC 2 is unsigned, like in the logger samples:
+		dac_counts = regs[self.BUS_ADDR_DAC0_CURRENT-self.BUS_ADDR_ZERO_DEADTIME_SAMPLES_NUMBER:].astype(np.uint16)
+		dac_counts_signed = dac_counts.view(np.int16)
+		return (int(dac_counts_signed[0]), int(dac_counts_signed[1]), int(dac_counts[2]))
+
 	def read_dual_mode_counter(self, output_number):
+		if self.acquisition_client is not None:
+			return self.read_dual_mode_counter_from_daemon(output_number)
+
 		# fetch data
 		# reading at this address samples all frequency counter data at the same time (see registers_read.vhd for details)
-		zdtc_samples_number_counter = self.dev.read_Zynq_register_uint32(self.BUS_ADDR_ZERO_DEADTIME_SAMPLES_NUMBER*4)
+		# All the registers from BUS_ADDR_ZERO_DEADTIME_SAMPLES_NUMBER to BUS_ADDR_DAC2_CURRENT are consecutive, so they are read with a single block request,
+		# which reads them in increasing address order, as required.
+		# The counter values are read even if there is no new sample, since it is cheaper than waiting for the samples number first.
+		regs = self.dev.read_Zynq_registers_block(self.BUS_ADDR_ZERO_DEADTIME_SAMPLES_NUMBER*4, self.BUS_ADDR_DAC2_CURRENT-self.BUS_ADDR_ZERO_DEADTIME_SAMPLES_NUMBER+1)
+		reg_at_addr = lambda bus_addr: regs[bus_addr-self.BUS_ADDR_ZERO_DEADTIME_SAMPLES_NUMBER]
+
+		zdtc_samples_number_counter = int(reg_at_addr(self.BUS_ADDR_ZERO_DEADTIME_SAMPLES_NUMBER))
 		increments = zdtc_samples_number_counter - self.last_zdtc_samples_number_counter[output_number]
 		if increments != 0:
 
@@ -1694,8 +2009,9 @@ class SuperLaserLand_JD_RP:
 
 
 			# we have new unread samples
-			freq_counter0_sample = self.dev.read_Zynq_register_int64(self.BUS_ADDR_ZERO_DEADTIME_COUNTER0_LSBS*4, self.BUS_ADDR_ZERO_DEADTIME_COUNTER0_MSBS*4)
-			freq_counter1_sample = self.dev.read_Zynq_register_int64(self.BUS_ADDR_ZERO_DEADTIME_COUNTER1_LSBS*4, self.BUS_ADDR_ZERO_DEADTIME_COUNTER1_MSBS*4)
+			# convert to 64 bits using numpy's casts
+			freq_counter0_sample = np.frombuffer(np.array([reg_at_addr(self.BUS_ADDR_ZERO_DEADTIME_COUNTER0_LSBS), reg_at_addr(self.BUS_ADDR_ZERO_DEADTIME_COUNTER0_MSBS)], np.dtype(np.uint32)), np.dtype(np.int64))
+			freq_counter1_sample = np.frombuffer(np.array([reg_at_addr(self.BUS_ADDR_ZERO_DEADTIME_COUNTER1_LSBS), reg_at_addr(self.BUS_ADDR_ZERO_DEADTIME_COUNTER1_MSBS)], np.dtype(np.uint32)), np.dtype(np.int64))
 			# print("zdtc_samples_number_counter = %d, was %d, read new values" % (zdtc_samples_number_counter, self.last_zdtc_samples_number_counter[output_number]))
 			if increments>1 and self.last_zdtc_samples_number_counter[output_number] != 0:
 				print("Warning, %d counter sample(s) dropped on counter #%d" % (zdtc_samples_number_counter-self.last_zdtc_samples_number_counter[output_number]-1, output_number))
@@ -1709,9 +2025,9 @@ class SuperLaserLand_JD_RP:
 
 
 
-		dac0_samples = self.dev.read_Zynq_register_int32(self.BUS_ADDR_DAC0_CURRENT*4)
-		dac1_samples = self.dev.read_Zynq_register_int32(self.BUS_ADDR_DAC1_CURRENT*4)
-		dac2_samples = self.dev.read_Zynq_register_uint32(self.BUS_ADDR_DAC2_CURRENT*4) #this doesn't seems to work
+		dac0_samples = int(regs.view(np.int32)[self.BUS_ADDR_DAC0_CURRENT-self.BUS_ADDR_ZERO_DEADTIME_SAMPLES_NUMBER])
+		dac1_samples = int(regs.view(np.int32)[self.BUS_ADDR_DAC1_CURRENT-self.BUS_ADDR_ZERO_DEADTIME_SAMPLES_NUMBER])
+		dac2_samples = int(reg_at_addr(self.BUS_ADDR_DAC2_CURRENT)) #this doesn't seems to work
 		if dac2_samples>0xFFFF0000: #greather than 16 bits
 			dac2_samples = dac2_samples-0xFFFF0000
 		# convert to numpy format:
@@ -1732,6 +2048,61 @@ class SuperLaserLand_JD_RP:
 		elif output_number == 1:
 			return (freq_counter1_sample, time_axis, dac0_samples, dac1_samples, dac2_samples)
 		
+	# Same as read_dual_mode_counter(), from the last counter sample and DAC values published by the acquisition daemon, see use_acquisition_daemon().
+	# Returns only None until the daemon has published its first values.
+	def read_dual_mode_counter_from_daemon(self, output_number):
+		self.check_acquisition_daemon()
+		counters = self.acquisition_daemon_messages.get('counters')
+		dacs = self.acquisition_daemon_messages.get('dacs')
+		if dacs is None:
+			return (None, None, None, None, None)
+
+		freq_counter_sample = None
+		if counters is not None and counters['samples_number'] != self.last_zdtc_samples_number_counter[output_number]:
+			increments = counters['samples_number'] - self.last_zdtc_samples_number_counter[output_number]
+			if increments>1 and self.last_zdtc_samples_number_counter[output_number] != 0:
+				self.logger.warning('Red_Pitaya_GUI{}: {} counter sample(s) dropped on counter #{}'.format(self.logger_name, increments-1, output_number))
+			self.last_zdtc_samples_number_counter[output_number] = counters['samples_number']
+			freq_counter_sample = np.array((counters['counter%d' % output_number],))
+
+		time_axis = None # not currently used anymore
+		return (freq_counter_sample, time_axis, np.array((dacs['dac0'],)), np.array((dacs['dac1'],)), np.array((dacs['dac2'],)))
+
+	# Reads the zero-deadtime counters, the current DAC values and the status flags in a single round trip (multi-op packet),
+	# for the monitoring of several boxes at once (see DeviceManager.py).
+	# Returns a dict with the counter samples number, counter0 and counter1 in Hz (None if there is no new counter sample since the last call),
+	# dac0, dac1 and dac2 in counts, the raw status_flags and the lock LEDs, in the same order as readLEDs().
+	def read_counters_and_status(self):
+		with self.dev.transaction() as t:
+			indices = [t.queue_read(self.dev.FPGA_BASE_ADDR + bus_addr*4) for bus_addr in range(self.BUS_ADDR_ZERO_DEADTIME_SAMPLES_NUMBER, self.BUS_ADDR_DAC2_CURRENT+1)]
+			index_status_flags = t.queue_read(self.dev.FPGA_BASE_ADDR + self.BUS_ADDR_STATUS_FLAGS*4)
+		regs = np.array([t.get_uint32(index) for index in indices], np.uint32)
+		reg_at_addr = lambda bus_addr: regs[bus_addr-self.BUS_ADDR_ZERO_DEADTIME_SAMPLES_NUMBER]
+		status_flags = t.get_uint32(index_status_flags)
+
+		samples_number = int(reg_at_addr(self.BUS_ADDR_ZERO_DEADTIME_SAMPLES_NUMBER))
+		# both outputs share the same samples, so the state of output 0 is used (this is not meant to run alongside read_dual_mode_counter())
+		if samples_number != self.last_zdtc_samples_number_counter[0]:
+			counters = np.frombuffer(np.array([reg_at_addr(self.BUS_ADDR_ZERO_DEADTIME_COUNTER0_LSBS), reg_at_addr(self.BUS_ADDR_ZERO_DEADTIME_COUNTER0_MSBS),
+			                                   reg_at_addr(self.BUS_ADDR_ZERO_DEADTIME_COUNTER1_LSBS), reg_at_addr(self.BUS_ADDR_ZERO_DEADTIME_COUNTER1_MSBS)], np.dtype(np.uint32)), np.dtype(np.int64))
+			(counter0, counter1) = [float(value) for value in self.scaleCounterReadingsIntoHz(counters)]
+		else:
+			(counter0, counter1) = (None, None)
+		self.last_zdtc_samples_number_counter[0] = samples_number
+
+		# same conversion as read_DAC_current_values()
+		dac_counts = regs[self.BUS_ADDR_DAC0_CURRENT-self.BUS_ADDR_ZERO_DEADTIME_SAMPLES_NUMBER:].astype(np.uint16)
+		dac_counts_signed = dac_counts.view(np.int16)
+
+		return {'samples_number':   samples_number,
+		        'counter0':         counter0,
+		        'counter1':         counter1,
+		        'dac0':             int(dac_counts_signed[0]),
+		        'dac1':             int(dac_counts_signed[1]),
+		        'dac2':             int(dac_counts[2]),
+		        'status_flags':     status_flags,
+		        'leds':             tuple(self.extractBit(status_flags, N_bit) for N_bit in range(4, 10))}
+
 	def set_ddc_filter(self, adc_number, filter_select, angle_select = 0):
 		if self.bVerbose == True:
 			print('set_ddc_filter')
@@ -1865,21 +2236,129 @@ class SuperLaserLand_JD_RP:
 			self.output_vco = [0, 1, 0]
 		return mux_value
 
+	# Read-through cache of the settings read back from the RAM of dpll_wrapper, keyed by bus address.
+	# The values that we wrote come from the shadow register file of self.dev (see RP_PLL_device.write_Zynq_register_32bits_if_changed()),
+	# which is updated by every write, so the cache is always coherent with what we wrote.
+	# The values that were only read back go in self.dev.readback_registers instead, which the skipping of unchanged writes doesn't trust.
+	# Both are emptied when the connection is opened, when a shell command is sent (the FPGA might have been reprogrammed), and by resetFrontend().
+	def get_cached_bus_register(self, addr):
+		if addr in self.volatile_bus_addresses:
+			return None
+		absolute_addr = self.dev.FPGA_BASE_ADDR + int(addr)*4
+		value = self.dev.shadow_registers.get(absolute_addr)
+		if value is None:
+			value = self.dev.readback_registers.get(absolute_addr)
+		return value
+
+	def set_cached_bus_register(self, addr, value):
+		if addr in self.volatile_bus_addresses or value == self.RAM_DPLL_WRAPPER_DEFAULT_VALUE:
+			# the register still has its default value from the firmware, which the RAM doesn't know
+			return
+		self.dev.readback_registers[self.dev.FPGA_BASE_ADDR + int(addr)*4] = int(value)
+
+	# Marks a register as volatile (always read from the FPGA) or not
+	def set_bus_register_volatile(self, addr, bVolatile=True):
+		if bVolatile:
+			self.volatile_bus_addresses.add(addr)
+		else:
+			self.volatile_bus_addresses.discard(addr)
+
+	def invalidate_settings_cache(self):
+		self.dev.invalidate_shadow_registers()
+
+	# Reads all the settings in SETTINGS_CACHE_FILL_RANGES with one request per range, so that the getValues() of the windows
+	# are served from the cache instead of doing one round trip per register
+	def fill_settings_cache(self):
+		for (addr, number_of_registers) in self.SETTINGS_CACHE_FILL_RANGES:
+			# the device lock makes sure that no write from another thread falls between the read and the update of the cache
+			with self.dev.lock:
+				values = self.dev.read_Zynq_registers_block((2 << 20) + addr*4, number_of_registers)
+				for k, value in enumerate(values):
+					self.set_cached_bus_register(addr+k, int(value))
+
+	# Local copy of the settings of dpll_wrapper, taken when the connection is lost, so that the reconnection doesn't need to read them all back
+	# (see restore_state_snapshot()). Returns {bus address: value} of the cmd bus registers in the settings cache, except the volatile ones.
+	def take_state_snapshot(self):
+		snapshot = {}
+		with self.dev.lock:
+			registers = dict(self.dev.readback_registers)
+			registers.update(self.dev.shadow_registers)
+			for (absolute_addr, value) in registers.items():
+				(addr, remainder) = divmod(absolute_addr - self.dev.FPGA_BASE_ADDR, 4)
+				if remainder == 0 and 0 <= addr < self.NUMBER_OF_BUS_ADDRESSES_DPLL_WRAPPER and addr not in self.volatile_bus_addresses:
+					snapshot[addr] = value
+		return snapshot
+
+	# Resumes from a snapshot of take_state_snapshot() once the connection has been opened again (which emptied the shadow register file).
+	# The RAM copies of all the registers of the snapshot are read with a single multi-op request, then for each register:
+	#  - if it still holds the snapshot value, the value goes back into the settings cache, and nothing is written,
+	#  - if it holds the default value of the RAM, the setting was lost (the box was power-cycled or the FPGA reprogrammed) and is written back,
+	#  - if it holds another value, someone else changed it while we were away: the new value is kept, and goes into the settings cache.
+	# The values which are only read back don't go into the shadow register file, so the next push of the settings still sends everything.
+	# When anything is written back, the whole snapshot is written, in address order, so that the wide registers are committed by their last word.
+	# Returns (number of registers unchanged, number of registers written back, number of registers changed by someone else).
+	def restore_state_snapshot(self, snapshot):
+		addresses = sorted(snapshot)
+		with self.dev.lock:
+			with self.dev.transaction() as t:
+				indices = [t.queue_read(self.dev.FPGA_BASE_ADDR + (2 << 20) + addr*4) for addr in addresses]
+			values = [t.get_uint32(index) for index in indices]
+
+			unchanged = set(addr for (addr, value) in zip(addresses, values) if value == snapshot[addr])
+			lost = set(addr for (addr, value) in zip(addresses, values) if value == self.RAM_DPLL_WRAPPER_DEFAULT_VALUE and value != snapshot[addr])
+			changed = set(addresses) - unchanged - lost
+			for (addr, value) in zip(addresses, values):
+				if addr not in lost:
+					self.set_cached_bus_register(addr, value)
+			if len(lost) > 0:
+				with self.dev.transaction():
+					for addr in addresses:
+						if addr not in changed:
+							self.dev.write_Zynq_register_uint32(addr*4, snapshot[addr])
+		if len(lost) > 0 or len(changed) > 0:
+			self.logger.info('Red_Pitaya_GUI{}: restore_state_snapshot(): {} register(s) unchanged, {} written back, {} changed by another client'.format(self.logger_name, len(unchanged), len(lost), len(changed)))
+		return (len(unchanged), len(lost), len(changed))
+
 	def read_RAM_dpll_wrapper(self,addr):
+		value = self.get_cached_bus_register(addr)
+		if value is not None:
+			self.settings_cache_hits += 1
+			return value
+		self.settings_cache_misses += 1
 		bus_address = (2 << 20) + addr*4
-		value = self.dev.read_Zynq_register_uint32(bus_address)
-		if value == 4026531839:
+		with self.dev.lock:
+			value = self.dev.read_Zynq_register_uint32(bus_address)
+			self.set_cached_bus_register(addr, value)
+		if value == self.RAM_DPLL_WRAPPER_DEFAULT_VALUE:
 			print('Warning! You received the default value when asking for data at address {}.'.format(hex(int(addr))))
 			self.logger.warning('Red_Pitaya_GUI{}: Warning! You received the default value when asking for data at address {}"'.format(self.logger_name, hex(int(addr))))
 		return value
 
 	def read_RAM_dpll_wrapper_signed(self,addr):
+		value = self.read_RAM_dpll_wrapper(addr)
+		return int(np.array(value, np.dtype(np.uint32)).view(np.int32))
+
+	# reads number_of_registers consecutive addresses with a single request (or none at all if they are all cached). Returns a list of python ints
+	def read_RAM_dpll_wrapper_block(self, addr, number_of_registers):
+		values = [self.get_cached_bus_register(addr+k) for k in range(number_of_registers)]
+		if None not in values:
+			self.settings_cache_hits += number_of_registers
+			return values
+		self.settings_cache_misses += number_of_registers
 		bus_address = (2 << 20) + addr*4
-		value = self.dev.read_Zynq_register_int32(bus_address)
-		if value == 4026531839 - 2**32:
-			print('Warning! You received the default value when asking for data at address {}.'.format(hex(int(addr))))
-			self.logger.warning('Red_Pitaya_GUI{}: Warning! You received the default value when asking for data at address {}"'.format(self.logger_name, hex(int(addr))))
-		return value
+		with self.dev.lock:
+			values = self.dev.read_Zynq_registers_block(bus_address, number_of_registers)
+			values = [int(value) for value in values]
+			for k, value in enumerate(values):
+				self.set_cached_bus_register(addr+k, value)
+		for k in np.flatnonzero(np.array(values) == self.RAM_DPLL_WRAPPER_DEFAULT_VALUE):
+			print('Warning! You received the default value when asking for data at address {}.'.format(hex(int(addr+k))))
+			self.logger.warning('Red_Pitaya_GUI{}: Warning! You received the default value when asking for data at address {}"'.format(self.logger_name, hex(int(addr+k))))
+		return values
+
+	def read_RAM_dpll_wrapper_block_signed(self, addr, number_of_registers):
+		values = np.array(self.read_RAM_dpll_wrapper_block(addr, number_of_registers), np.dtype(np.uint32))
+		return [int(value) for value in values.view(np.int32)]
 
 
 
@@ -2013,9 +2492,11 @@ class SuperLaserLand_JD_RP:
 		# See Xilinx document UG480 chapter 2 for conversion factors
 		# we use 2**16 instead of 2**12 for the denominator because the codes are "MSB-aligned" in the register (equivalent to a multiplication by 2**4)
 		xadc_powersupply_code_to_voltage = lambda x: x*3./2.**16
-		Vccint = xadc_powersupply_code_to_voltage(self.dev.read_Zynq_AXI_register_uint32(self.xadc_base_addr+0x204)   )
-		Vccaux = xadc_powersupply_code_to_voltage(self.dev.read_Zynq_AXI_register_uint32(self.xadc_base_addr+0x208)   )
-		Vbram  = xadc_powersupply_code_to_voltage(self.dev.read_Zynq_AXI_register_uint32(self.xadc_base_addr+0x218)   )
+		# read 0x204 to 0x218 in a single request, we only need three of these six registers
+		regs = self.dev.read_Zynq_AXI_registers_block(self.xadc_base_addr+0x204, 6)
+		Vccint = xadc_powersupply_code_to_voltage(int(regs[(0x204-0x204)//4]))
+		Vccaux = xadc_powersupply_code_to_voltage(int(regs[(0x208-0x204)//4]))
+		Vbram  = xadc_powersupply_code_to_voltage(int(regs[(0x218-0x204)//4]))
 		return (Vccint, Vccaux, Vbram)
 
 	# read the Zynq's current temperature:
@@ -2030,9 +2511,10 @@ class SuperLaserLand_JD_RP:
 		# this reading loop takes just 2 ms for 10 readings at the moment so there is no real cost
 		N_average = 10.
 		reg_avg = 0.
-		for k in range(int(N_average)):
-			reg = self.dev.read_Zynq_AXI_register_uint32(self.xadc_base_addr+0x200)
-			reg_avg += float(reg)
+		# the readings are pipelined so that they share a single round trip
+		pending_reads = [self.dev.read_Zynq_register_32bits_async(self.dev.FPGA_BASE_ADDR_XADC+self.xadc_base_addr+0x200) for k in range(int(N_average))]
+		for pending_read in pending_reads:
+			reg_avg += float(pending_read.result_uint32())
 			
 		reg_avg = float(reg_avg)/N_average
 		# print("elapsed = %f" % (time.perf_counter()-time_start))
@@ -2041,9 +2523,8 @@ class SuperLaserLand_JD_RP:
 		
 	def getExtClockFreq(self):
 		# see "digital_clock_freq_counter.vhd" for the meaning of each of these registers.
-		read_all_regs = lambda : (self.dev.read_Zynq_AXI_register_uint32(self.clk_freq_reg1),
-		                          self.dev.read_Zynq_AXI_register_uint32(self.clk_freq_reg2),
-		                          self.dev.read_Zynq_AXI_register_uint32(self.clk_freq_reg3))
+		# the three registers are not contiguous, so they are pipelined instead of read as a block
+		read_all_regs = lambda : tuple(x.result_uint32() for x in [self.dev.read_Zynq_register_32bits_async(self.dev.FPGA_BASE_ADDR_XADC+addr) for addr in (self.clk_freq_reg1, self.clk_freq_reg2, self.clk_freq_reg3)])
 		data_index = lambda x: (x >> 24)
 		iAttempts = 0;
 		bSuccess = False
@@ -1,7 +1,14 @@
 
 import pytest
+import time
+import struct
+import numpy as np
+from scipy.signal import lfilter
 
 from SuperLaserLand_mock import SuperLaserLand_mock
+from SuperLaserLand_JD_RP import SuperLaserLand_JD_RP
+from SuperLaserLand2_JD2_PLL import PLL0_module
+import RP_PLL
 
 
 
@@ -32,3 +39,358 @@ def test_setup_writes_various():
 
         Num_samples = Num_samples + 1
 
+
+class logger_status_dev():
+    # returns the successive values of status_list on each read, then keeps returning the last one
+    def __init__(self, status_list):
+        self.status_list = list(status_list)
+        self.number_of_reads = 0
+
+    def read_Zynq_register_uint32(self, address_uint32):
+        assert(address_uint32 == SuperLaserLand_mock.BUS_ADDR_LOGGER_STATUS)
+        status = self.status_list[min(self.number_of_reads, len(self.status_list)-1)]
+        self.number_of_reads = self.number_of_reads + 1
+        return status
+
+def test_wait_for_logger():
+    sl = SuperLaserLand_mock()
+    sl.Num_samples_write = 100
+    writing = lambda n: (0xA5 << 24) | (1 << 23) | n
+
+    # returns as soon as enough samples have been written
+    sl.dev = logger_status_dev([writing(0), writing(50), writing(100)])
+    assert(sl.wait_for_logger(10.) == True)
+    assert(sl.dev.number_of_reads == 3)
+
+    # or when the logger has stopped writing
+    sl.dev = logger_status_dev([writing(10), (0xA5 << 24) | 0x7FFF])
+    assert(sl.wait_for_logger(10.) == True)
+    assert(sl.dev.number_of_reads == 2)
+
+    # times out if the logger never finishes
+    sl.dev = logger_status_dev([writing(10)])
+    assert(sl.wait_for_logger(0.) == False)
+
+    # falls back on a fixed wait with firmwares that don't have the status word
+    sl.dev = logger_status_dev([0xFFFFFFFF])
+    assert(sl.wait_for_logger(0.) == True)
+    assert(sl.dev.number_of_reads == 1)
+
+def test_ddr2_arbiter():
+    sl = SuperLaserLand_mock()
+
+    assert(sl.ddr2_arbiter.acquire('client 1'))
+    assert(sl.bDDR2InUse == True)
+    # a second client can't get the logger while the first one owns it:
+    assert(sl.ddr2_arbiter.acquire('client 2') == False)
+    assert(sl.ddr2_arbiter.acquire('client 2', timeout=0.01) == False)
+    # only the owner can release it:
+    with pytest.raises(RuntimeError):
+        sl.ddr2_arbiter.release('client 2')
+    assert(sl.ddr2_arbiter.owner == 'client 1')
+    sl.ddr2_arbiter.release('client 1')
+    assert(sl.bDDR2InUse == False)
+    with pytest.raises(RuntimeError):
+        sl.ddr2_arbiter.release('client 1')
+
+    with sl.ddr2_arbiter.use('client 2') as bAcquired:
+        assert(bAcquired)
+        assert(sl.ddr2_arbiter.owner == 'client 2')
+    assert(sl.bDDR2InUse == False)
+
+    stats = sl.ddr2_arbiter.get_stats()
+    assert(stats['acquisitions'] == 2)
+    assert(stats['contentions'] == 2)
+    assert(stats['failures'] == 2)
+    assert(stats['contentions_per_client'] == {'client 2': 2})
+
+class ram_mirror_dev(RP_PLL.RP_PLL_device):
+    # every write is copied to the "RAM" of dpll_wrapper (at (2 << 20)), like addr_packed.vhd does
+    def __init__(self):
+        super(ram_mirror_dev, self).__init__()
+        self.ram = {}
+        self.number_of_requests = 0
+
+    def send(self, packet_to_send):
+        (magic_bytes, absolute_addr, data) = struct.unpack('=III', packet_to_send[:12])
+        assert(magic_bytes == self.MAGIC_BYTES_WRITE_REG)
+        self.ram[(2 << 20) + absolute_addr - self.FPGA_BASE_ADDR] = data
+
+    def read_Zynq_register_uint32(self, address_uint32):
+        self.number_of_requests += 1
+        return self.ram.get(address_uint32, SuperLaserLand_mock.RAM_DPLL_WRAPPER_DEFAULT_VALUE)
+
+    def read_Zynq_registers_block(self, address_uint32, number_of_registers):
+        self.number_of_requests += 1
+        return np.array([self.ram.get(address_uint32+4*k, SuperLaserLand_mock.RAM_DPLL_WRAPPER_DEFAULT_VALUE) for k in range(number_of_registers)], np.uint32)
+
+def test_settings_cache():
+    sl = SuperLaserLand_mock()
+    sl.dev = ram_mirror_dev()
+
+    # values that we wrote ourselves are never read back:
+    sl.send_bus_cmd_32bits(sl.BUS_ADDR_mux_pll2, 2)
+    assert(sl.read_pll2_mux() == 2)
+    assert(sl.dev.number_of_requests == 0)
+
+    # values written before we connected are read once, then cached:
+    sl.invalidate_settings_cache()
+    assert(sl.read_pll2_mux() == 2)
+    assert(sl.read_pll2_mux() == 2)
+    assert(sl.dev.number_of_requests == 1)
+    # except for the volatile registers:
+    sl.set_bus_register_volatile(sl.BUS_ADDR_mux_pll2)
+    assert(sl.read_pll2_mux() == 2)
+    assert(sl.dev.number_of_requests == 2)
+    sl.set_bus_register_volatile(sl.BUS_ADDR_mux_pll2, False)
+
+    # registers that were never written keep being read, since the RAM doesn't know their value:
+    sl.dev.number_of_requests = 0
+    sl.read_RAM_dpll_wrapper(sl.BUS_ADDR_openLoopGain[0])
+    sl.read_RAM_dpll_wrapper(sl.BUS_ADDR_openLoopGain[0])
+    assert(sl.dev.number_of_requests == 2)
+
+    # a single request per range fills the cache for all the settings:
+    sl.send_bus_cmd_32bits(sl.BUS_ADDR_openLoopGain[1], 1234)
+    sl.send_bus_cmd_32bits(sl.BUS_ADDR_ddc_filter_select, 1 + (2<<2))
+    sl.invalidate_settings_cache()
+    sl.dev.number_of_requests = 0
+    sl.fill_settings_cache()
+    assert(sl.dev.number_of_requests == len(sl.SETTINGS_CACHE_FILL_RANGES))
+    sl.dev.number_of_requests = 0
+    assert(sl.read_RAM_dpll_wrapper(sl.BUS_ADDR_openLoopGain[1]) == 1234)
+    assert(sl.get_ddc_filter_select() == (2, 1))
+    assert(sl.read_RAM_dpll_wrapper_block(sl.BUS_ADDR_openLoopGain[1], 1) == [1234])
+    assert(sl.dev.number_of_requests == 0)
+    # but the values read back don't make the writes skipped, so the first push after connecting still sends everything:
+    sl.dev.number_of_writes_skipped = 0
+    sl.send_bus_cmd_32bits(sl.BUS_ADDR_openLoopGain[1], 1234)
+    assert(sl.dev.number_of_writes_skipped == 0)
+    sl.send_bus_cmd_32bits(sl.BUS_ADDR_openLoopGain[1], 1234)
+    assert(sl.dev.number_of_writes_skipped == 1)
+
+class multi_op_ram_dev(ram_mirror_dev):
+    # also handles the multi-op packets of the transactions
+    def __init__(self):
+        super(multi_op_ram_dev, self).__init__()
+        self.replies = b''
+        self.number_of_writes = 0
+
+    def send(self, packet_to_send):
+        (magic_bytes, number_of_ops, _) = struct.unpack('=III', packet_to_send[:12])
+        if magic_bytes != self.MAGIC_BYTES_MULTI_OP:
+            self.number_of_writes += 1
+            return super(multi_op_ram_dev, self).send(packet_to_send)
+        self.number_of_requests += 1
+        for k in range(number_of_ops):
+            (magic_bytes, absolute_addr, data) = struct.unpack('=III', packet_to_send[12*(k+1):12*(k+2)])
+            if magic_bytes == self.MAGIC_BYTES_WRITE_REG:
+                self.number_of_writes += 1
+                self.ram[(2 << 20) + absolute_addr - self.FPGA_BASE_ADDR] = data
+            else:
+                self.replies += struct.pack('=I', self.ram.get(absolute_addr - self.FPGA_BASE_ADDR, SuperLaserLand_mock.RAM_DPLL_WRAPPER_DEFAULT_VALUE))
+
+    def read(self, bytes_to_read):
+        (data, self.replies) = (self.replies[:bytes_to_read], self.replies[bytes_to_read:])
+        return data
+
+def test_loop_filter_gains_always_written():
+    sl = SuperLaserLand_mock()
+    sl.dev = multi_op_ram_dev()
+    pll = PLL0_module(sl)
+    pll.set_pll_settings(sl, 10., 10., 0., 0., 0., 1)
+    assert sl.dev.ram[(2 << 20) + 4*(pll.bus_base_address + pll.BUS_OFFSET_gain_i)] == 10*2**pll.N_DIVIDE_I
+    # applying the same gains again writes the 5 gain registers again, which resets the loop filter like it always did,
+    # while the unchanged lock setting is skipped:
+    sl.dev.number_of_writes = 0
+    pll.set_pll_settings(sl, 10., 10., 0., 0., 0., 1)
+    assert sl.dev.number_of_writes == 5
+
+def test_state_snapshot():
+    sl = SuperLaserLand_mock()
+    sl.dev = multi_op_ram_dev()
+    sl.send_bus_cmd_32bits(sl.BUS_ADDR_openLoopGain[0], 1234)
+    sl.send_bus_cmd_32bits(sl.BUS_ADDR_ref_freq0_lsbs, 5)
+    sl.send_bus_cmd_32bits(sl.BUS_ADDR_ref_freq0_msbs, 6)
+    sl.dev.write_Zynq_register_uint32(sl.BUS_ADDR_TRIG_RESET*4, 1)
+    sl.dev.write_Zynq_register_uint32((5 << 20)*4, 7)     # not a register of dpll_wrapper
+    snapshot = sl.take_state_snapshot()
+    assert snapshot == {sl.BUS_ADDR_openLoopGain[0]: 1234, sl.BUS_ADDR_ref_freq0_lsbs: 5, sl.BUS_ADDR_ref_freq0_msbs: 6}
+
+    # reconnecting to a box which kept its settings costs a single request, and nothing is written:
+    sl.invalidate_settings_cache()
+    sl.dev.number_of_requests = 0
+    sl.dev.number_of_writes = 0
+    assert sl.restore_state_snapshot(snapshot) == (3, 0, 0)
+    assert sl.dev.number_of_requests == 1 and sl.dev.number_of_writes == 0
+    assert sl.read_RAM_dpll_wrapper(sl.BUS_ADDR_openLoopGain[0]) == 1234
+    assert sl.dev.number_of_requests == 1
+
+    # after a power cycle, the settings are written back, the wide registers by their last word:
+    sl.dev.ram = {}
+    sl.invalidate_settings_cache()
+    sl.dev.number_of_writes = 0
+    assert sl.restore_state_snapshot(snapshot) == (0, 3, 0)
+    assert sl.dev.number_of_writes == 3
+    assert sl.dev.ram[(2 << 20) + sl.BUS_ADDR_ref_freq0_msbs*4] == 6
+    assert sl.read_RAM_dpll_wrapper(sl.BUS_ADDR_openLoopGain[0]) == 1234
+
+    # a setting changed by someone else while we were away is kept:
+    sl.dev.ram[(2 << 20) + sl.BUS_ADDR_openLoopGain[0]*4] = 42
+    sl.invalidate_settings_cache()
+    sl.dev.number_of_writes = 0
+    assert sl.restore_state_snapshot(snapshot) == (2, 0, 1)
+    assert sl.dev.number_of_writes == 0
+    assert sl.read_RAM_dpll_wrapper(sl.BUS_ADDR_openLoopGain[0]) == 42
+
+class snapshot_dev(RP_PLL.RP_PLL_device):
+    # replies to the snapshot requests with the samples of self.samples_per_selector, and to the block reads with self.regs
+    def __init__(self, samples_per_selector, regs=None):
+        super(snapshot_dev, self).__init__()
+        self.samples_per_selector = samples_per_selector
+        self.regs = regs
+        self.requests = []
+
+    def read_logger_snapshot(self, selectors, number_of_points):
+        self.requests.append((list(selectors), number_of_points))
+        status = np.array(len(selectors)*[(0xA5 << 24) | number_of_points], np.uint32)
+        samples = np.array([self.samples_per_selector[selector][:number_of_points] for selector in selectors], np.int16)
+        return (status, samples)
+
+    # the server's statistics, computed from the same samples
+    def read_logger_stats(self, selector, first_sample, number_of_points, bUnsigned=False):
+        self.requests.append((selector, first_sample, number_of_points, bUnsigned))
+        samples = np.array(self.samples_per_selector[selector][first_sample:first_sample+number_of_points], np.int64)
+        return {'logger_status': (0xA5 << 24) | (first_sample+number_of_points), 'number_of_samples': len(samples),
+                'min': np.min(samples), 'max': np.max(samples), 'max_abs': np.max(np.abs(samples)),
+                'sum': np.sum(samples), 'sum_of_squares': np.sum(samples**2)}
+
+    def read_Zynq_registers_block(self, address_uint32, number_of_registers):
+        self.requests.append((address_uint32, number_of_registers))
+        return np.array(self.regs[:number_of_registers], np.uint32)
+
+def test_acquire_logger_snapshot():
+    sl = SuperLaserLand_JD_RP()
+    samples_per_selector = {
+        sl.LOGGER_MUX['DAC0']: np.arange(256) - 128,
+        sl.LOGGER_MUX['DAC2']: (np.arange(256) + 40000).astype(np.uint16).view(np.int16),
+        sl.LOGGER_MUX['DDC1']: 4*np.ones(256),
+    }
+    sl.dev = snapshot_dev(samples_per_selector)
+    mux_addr = sl.dev.FPGA_BASE_ADDR + sl.BUS_ADDR_MUX_SELECTORS*4
+    sl.dev.shadow_registers[mux_addr] = sl.LOGGER_MUX['ADC0']
+
+    frames = sl.acquire_logger_snapshot(['DAC0', 'DAC2', 'DDC1'], 256)
+    assert(sl.dev.requests == [([6, 8, 3], 256)])
+    assert(set(frames.keys()) == set(['DAC0', 'DAC2', 'DDC1']))
+    (samples_out, ref_exp0) = frames['DAC0']
+    assert(np.array_equal(samples_out, np.arange(256) - 128))
+    assert(ref_exp0 == 1)
+    # DAC 2 is unsigned:
+    (samples_out, ref_exp0) = frames['DAC2']
+    assert(np.array_equal(samples_out, np.arange(256) + 40000))
+    assert(np.allclose(frames['DDC1'], 4./2**10 * sl.fs/4))
+    # the mux was left on the last input by the server:
+    assert(sl.last_selector == sl.LOGGER_MUX['DDC1'])
+    assert(mux_addr not in sl.dev.shadow_registers)
+
+def test_capture_stats():
+    sl = SuperLaserLand_JD_RP()
+    samples = np.concatenate((np.zeros(sl.LOGGER_ADC_SIDE_INFORMATION_SAMPLES), 100*np.sin(np.arange(1000)) + 20))
+    sl.dev = snapshot_dev({sl.LOGGER_MUX['ADC1']: samples, sl.LOGGER_MUX['DAC2']: samples})
+
+    stats = sl.capture_stats('ADC1', 1000, sl.LOGGER_STATS)
+    # the side information isn't part of the statistics:
+    assert(sl.dev.requests == [(sl.LOGGER_MUX['ADC1'], sl.LOGGER_ADC_SIDE_INFORMATION_SAMPLES, 1000, False)])
+    samples_expected = np.array(samples[sl.LOGGER_ADC_SIDE_INFORMATION_SAMPLES:], np.int64)
+    assert(np.isclose(stats['mean'], np.mean(samples_expected)))
+    assert(np.isclose(stats['rms'], np.sqrt(np.mean(samples_expected**2.))))
+    assert(np.isclose(stats['std'], np.std(samples_expected)))
+    assert((stats['min'], stats['max'], stats['max_abs']) == (np.min(samples_expected), np.max(samples_expected), np.max(np.abs(samples_expected))))
+    assert(sl.last_selector == sl.LOGGER_MUX['ADC1'])
+
+    # only the requested statistics are returned, and DAC 2 is unsigned:
+    assert(list(sl.capture_stats('DAC2', 10).keys()) == ['mean'])
+    assert(sl.dev.requests[-1] == (sl.LOGGER_MUX['DAC2'], 0, 10, True))
+    with pytest.raises(ValueError):
+        sl.capture_stats('DAC0', 10, ('median',))
+
+def test_read_DAC_current_values():
+    sl = SuperLaserLand_JD_RP()
+    regs = [0]*(sl.BUS_ADDR_DAC0_CURRENT - sl.BUS_ADDR_ZERO_DEADTIME_SAMPLES_NUMBER) + [0xFFFF8001, 1234, 0xFFFFFFFF]
+    sl.dev = snapshot_dev({}, regs)
+    # DAC 0 and 1 are signed, DAC 2 unsigned:
+    assert(sl.read_DAC_current_values() == (-32767, 1234, 0xFFFF))
+    # a single request, starting at the register which samples the DAC values:
+    assert(sl.dev.requests == [(sl.BUS_ADDR_ZERO_DEADTIME_SAMPLES_NUMBER*4, len(regs))])
+
+# the straightforward version of SuperLaserLand_JD_RP.frontend_DDC_processing(), used as a reference
+def frontend_DDC_processing_reference(sl, samples, ref_exp0, input_number):
+    ddc_frequency_in_int = [sl.ddc0_frequency_in_int, sl.ddc1_frequency_in_int][input_number]
+    filter_select = [sl.ddc0_filter_select, sl.ddc1_filter_select][input_number]
+    f_reference = float(ddc_frequency_in_int) / 2**48
+    ref_exp = (ref_exp0)/np.abs(ref_exp0) * np.exp(-1j*2*np.pi*f_reference*np.array(range(len(samples))))
+    complex_baseband = (samples-np.mean(samples)) * ref_exp
+    if filter_select == 0:
+        N_filter = 16
+        lpf = np.convolve(np.ones(2, dtype=float)/2., np.ones(2, dtype=float)/2.)
+        lpf = np.convolve(np.ones(4, dtype=float)/4., lpf)
+    elif filter_select == 1:
+        N_filter = 20
+        lpf = np.convolve(np.ones(4, dtype=float)/4., np.ones(16, dtype=float)/16.)
+    elif filter_select == 2:
+        N_filter = 16+2
+        lpf = np.array([4533, 11833, 14589, 7610, -2628, -5400, -350, 3293, 1086, -1867, -1080, 956, 800, -462, -650, 338])/(2.**15-1)
+        lpf = np.convolve(np.ones(2, dtype=float)/2., lpf)
+    return lfilter(lpf, 1, complex_baseband)[N_filter:]
+
+def get_test_adc_samples(sl, N_samples):
+    np.random.seed(0)
+    samples = 0.3*np.cos(2*np.pi*(25e6+12.3e3)/sl.fs*np.arange(N_samples) + 0.1) + 1e-3*np.random.randn(N_samples)
+    return np.round(2.**15 * samples)
+
+def test_frontend_DDC_processing():
+    sl = SuperLaserLand_mock()
+    N_samples = 2**15
+    samples = get_test_adc_samples(sl, N_samples)
+    ref_exp0 = 3.-4.j
+
+    for filter_select in [0, 1, 2]:
+        for input_number in [0, 1]:
+            sl.ddc0_filter_select = filter_select
+            sl.ddc1_filter_select = filter_select
+            expected = frontend_DDC_processing_reference(sl, samples, ref_exp0, input_number)
+            scale = np.max(np.abs(expected))
+
+            complex_baseband = sl.frontend_DDC_processing(samples, ref_exp0, input_number)
+            assert(complex_baseband.dtype == np.complex128)
+            assert(len(complex_baseband) == len(expected))
+            assert(np.max(np.abs(complex_baseband-expected)) < 1e-9*scale)
+
+            complex_baseband = sl.frontend_DDC_processing(samples, ref_exp0, input_number, bFloat32=True)
+            assert(complex_baseband.dtype == np.complex64)
+            assert(np.max(np.abs(complex_baseband-expected)) < 1e-4*scale)
+
+    # the phasor tables are computed only once per (frequency, length):
+    assert(len(sl.ddc_phasor_tables) == 2)
+
+def benchmark_frontend_DDC_processing(N_samples=2**15, N_repeats=50):
+    sl = SuperLaserLand_mock()
+    samples = get_test_adc_samples(sl, N_samples)
+    ref_exp0 = 3.-4.j
+    for filter_select in [0, 1]:
+        sl.ddc0_filter_select = filter_select
+        results = []
+        for (name, function) in [('reference', lambda: frontend_DDC_processing_reference(sl, samples, ref_exp0, 0)),
+                                 ('frontend_DDC_processing', lambda: sl.frontend_DDC_processing(samples, ref_exp0, 0)),
+                                 ('frontend_DDC_processing, float32', lambda: sl.frontend_DDC_processing(samples, ref_exp0, 0, bFloat32=True))]:
+            function()  # warm-up, also fills the phasor tables cache
+            time_start = time.perf_counter()
+            for k in range(N_repeats):
+                function()
+            results.append((name, (time.perf_counter()-time_start)/N_repeats))
+        for (name, elapsed_time) in results:
+            print('filter_select = %d, %d samples: %s: %.3f ms (x%.1f)' % (filter_select, N_samples, name, 1e3*elapsed_time, results[0][1]/elapsed_time))
+
+if __name__ == '__main__':
+    benchmark_frontend_DDC_processing()
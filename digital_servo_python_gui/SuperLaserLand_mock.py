@@ -75,6 +75,37 @@ class SuperLaserLand_mock(SuperLaserLand_JD_RP):
 
 		return samples_out
 
+	# there is no server to capture all the inputs at once, so we simply run one acquisition per input
+	def acquire_logger_snapshot(self, input_selects, N_samples):
+		frames = {}
+		for input_select in input_selects:
+			frames[input_select] = self.acquire_logger_samples(input_select, N_samples, bReadAsDDC=(input_select in ('DDC0', 'DDC1')))
+		return frames
+
+	# the statistics are computed from the simulated samples, instead of by the server
+	def capture_stats(self, input_select, N_samples, stats=('mean',)):
+		self.setup_write(self.LOGGER_MUX[input_select], N_samples)
+		self.trigger_write()
+		self.wait_for_write()
+		(samples_out, ref_exp0) = self.read_adc_samples_from_DDR2()
+		sums = {'logger_status': 0,
+		        'number_of_samples': len(samples_out),
+		        'min': np.min(samples_out),
+		        'max': np.max(samples_out),
+		        'max_abs': np.max(np.abs(samples_out)),
+		        'sum': np.sum(samples_out),
+		        'sum_of_squares': np.sum(samples_out**2)}
+		return self.reduce_logger_stats(sums, stats)
+
+	# the current DAC values are the average of the simulated DAC samples, like the logger-based display used to compute them
+	def read_DAC_current_values(self):
+		dac_counts = []
+		for k in range(3):
+			self.setup_write(self.LOGGER_MUX['DAC%d' % k], 256)
+			(samples_out, ref_exp0) = self.read_adc_samples_from_DDR2()
+			dac_counts.append(np.mean(samples_out[128:256]))
+		return tuple(dac_counts)
+
 	# these don't need to do anything at the level of simulation we are choosing
 	def trigger_write(self):
 		if self.bIntroduceCommsException['trigger_write']:
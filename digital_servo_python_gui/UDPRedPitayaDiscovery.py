@@ -48,6 +48,10 @@ class UDPRedPitayaDiscovery():
         self.sock_server.bind((HOST_LOCALHOST, self.port_number+1))
         # no need to call listen() since this is UDP
         
+    def close(self):
+        self.sock_client.close()
+        self.sock_server.close()
+        
     def connectClientSocket(self):
         self.sock_client.connect((self.broadcast_address, self.port_number))
 
@@ -56,10 +60,11 @@ class UDPRedPitayaDiscovery():
         self.sock_client.send(b"")
         pass
         
-    def check_answers(self):
+    # timeout is the maximum time to wait for an answer, 0 returns right away
+    def check_answers(self, timeout=0):
         # is there any data ?
         # note the [0] at the end which selects only the first output of the select()
-        ready_to_read = select.select([self.sock_server], [], [], 0)[0]
+        ready_to_read = select.select([self.sock_server], [], [], timeout)[0]
         
         if ready_to_read:
             (mac_address_data, host_info) = self.sock_server.recvfrom(4096)
@@ -83,11 +88,11 @@ class UDPRedPitayaDiscovery():
         ElapsedTime = 0
         while ElapsedTime < Timeout:
             
-            (host, mac_address) = self.check_answers()
-#            if not host is None:
-            print((host, mac_address))
+            # wait for the next answer instead of polling
+            (host, mac_address) = self.check_answers(Timeout - ElapsedTime)
+            if not host is None:
+                print((host, mac_address))
             
-            time.sleep(0.1)
             ElapsedTime = time.perf_counter() - start_time
             
             
@@ -20,15 +20,15 @@ from FreqErrorWindowWithTempControlV2 import FreqErrorWindowWithTempControlV2
 from initialConfiguration_RP import initialConfiguration
 from SLLSystemParameters import SLLSystemParameters
 
-from DisplayDitherSettingsWindow import DisplayDitherSettingsWindow
-
-from DisplayDividerAndResidualsStreamingSettingsWindow import DisplayDividerAndResidualsStreamingSettingsWindow
-
-from ConfigurationRPSettingsUI import ConfigRPSettingsUI
+# the windows of the settings tab are imported when they are built, see createSettingsWindows()
+from DeferredWidget import DeferredWidget
 
 from devicesData import devicesData
+from AcquisitionEngine import AcquisitionEngine
+from ConnectionManager import ConnectionManager
 
 import time
+import threading
 
 import pdb
 import traceback
@@ -54,6 +54,12 @@ logging.basicConfig(level=logging.INFO)
 
 class controller(object):
 	"""Main class of the GUI. It contains most of the elements of the GUI, the main_window and the communication class"""
+
+	# 'HOST:PORT' of an AcquisitionDaemon connected to the same box, or None.
+	# When set, the GUI is one more subscriber of the daemon: the logger captures and the counter reads of the windows go through it,
+	# so that the analysis scripts can use the logger while the GUI runs (see SuperLaserLand_JD_RP.use_acquisition_daemon())
+	strAcquisitionDaemon = None
+
 	def __init__(self, bManualStartupForTests=False):
 		self.logger = logging.getLogger()
 		self.logger.addHandler(logging.handlers.SysLogHandler(address = (SYSLOG_IP,SYSLOG_PORT)))
@@ -61,13 +67,18 @@ class controller(object):
 
 		# Create the object that handles the communication with the FPGA board:
 		self.sl = SuperLaserLand_JD_RP(self)
+		if self.strAcquisitionDaemon is not None:
+			try:
+				self.sl.use_acquisition_daemon(self.strAcquisitionDaemon)
+			except OSError as e:
+				self.logger.warning('Red_Pitaya_GUI{}: could not connect to the acquisition daemon at {}, using the logger directly: {}'.format(self.logger_name, self.strAcquisitionDaemon, e))
 		self.updateDeviceData()
 
 		self.sp = SLLSystemParameters()
 
 
-		self.reconnection_attempts = 0
-		self.timerReconnect = None
+		# settings of the box when the connection was lost, see socketErrorEvent() and reconnected()
+		self.state_snapshot = None
 
 		# Start Qt:
 		self.app = QtCore.QCoreApplication.instance()
@@ -79,6 +90,11 @@ class controller(object):
 			self.bEventLoopWasRunningAlready = True
 			print("QCoreApplication already running.")
 
+		# non-blocking reconnection after the connection was lost: 0.5 s, 1 s, 2 s, ... up to 10 s between the attempts
+		self.connection_manager = ConnectionManager(min_delay=0.5, max_delay=10.)
+		self.connection_manager.stateChanged.connect(self.connectionStateChanged)
+		self.connection_manager.connected.connect(self.reconnected)
+
 		self.initUI()
 
 		if bManualStartupForTests==False:
@@ -162,15 +178,22 @@ class controller(object):
 			custom_shorthand = self.devices_data[self.strSelectedSerial]['shorthand']
 		except KeyError:
 			custom_shorthand = ''
+		self.custom_style_sheet = custom_style_sheet
+		self.custom_shorthand = custom_shorthand
 
-		self.divider_settings_window = DisplayDividerAndResidualsStreamingSettingsWindow(self.sl, self.sp, clk_divider_modulus=67e3, bDividerOn=0, bPulses=0, custom_style_sheet=custom_style_sheet, custom_shorthand=custom_shorthand)    
-		
 		# Optical lock window
 		self.xem_gui_mainwindow2 = XEM_GUI_MainWindow(self.sl, custom_shorthand + ': Optical lock', 1, (False, True, True), self.sp, custom_style_sheet, self.strSelectedSerial)
 		
 		# CEO Lock window
 		self.xem_gui_mainwindow = XEM_GUI_MainWindow(self.sl, custom_shorthand + ': CEO lock', 0, (True, False, False), self.sp, custom_style_sheet, self.strSelectedSerial)
 
+		# Both windows do their logger acquisitions on a worker thread:
+		self.acquisition_engine = AcquisitionEngine(self.sl)
+		self.acquisition_engine.commsError.connect(self.acquisitionCommsError)
+		self.xem_gui_mainwindow.setAcquisitionEngine(self.acquisition_engine)
+		self.xem_gui_mainwindow2.setAcquisitionEngine(self.acquisition_engine)
+		self.acquisition_engine.start()
+
 		
 		#########################################################  
 		# The two frequency counter:
@@ -195,29 +218,15 @@ class controller(object):
 		self.counters_window.setLayout(vbox)
 		self.counters_window.setWindowTitle(custom_shorthand + ': Frequency counters')
 		
-		# Dither windows, this code could be moved to another class/file to help with clutter:
-		self.dither_widget0 = DisplayDitherSettingsWindow(self.sl, self.sp, 0, modulation_frequency_in_hz='1e3', output_amplitude='1e-3', integration_time_in_seconds='0.1', bEnableDither=True, custom_style_sheet=custom_style_sheet)
-		self.dither_widget1 = DisplayDitherSettingsWindow(self.sl, self.sp, 1, modulation_frequency_in_hz='5.1e3' , output_amplitude='1e-3', integration_time_in_seconds='0.1', bEnableDither=True, custom_style_sheet=custom_style_sheet)
-		#dither_widget2 = DisplayDitherSettingsWindow(self.sl, self.sp, 2, modulation_frequency_in_hz='110' , output_amplitude='1e-4', integration_time_in_seconds='0.1', bEnableDither=True, custom_style_sheet=custom_style_sheet)
-
-		self.RP_Settings = ConfigRPSettingsUI(self.sl, self.sp, self, custom_style_sheet=custom_style_sheet, custom_shorthand=custom_shorthand)
-		
-		self.settings_window = Qt.QWidget()
+		# The settings tab (dither, Red Pitaya and divider settings) is rarely used:
+		# its windows are only built the first time the tab is shown, or when they are needed (see createSettingsWindows())
+		self.dither_widget0 = None
+		self.dither_widget1 = None
+		self.RP_Settings = None
+		self.divider_settings_window = None
+		self.settings_window = DeferredWidget(self.createSettingsWindows)
 		self.settings_window.setObjectName('MainWindow')
 		self.settings_window.setStyleSheet(custom_style_sheet)
-		vbox1 = Qt.QVBoxLayout()
-		vbox1.addWidget(self.dither_widget0)
-		vbox1.addWidget(self.dither_widget1)
-		#vbox1.addWidget(dither_widget2)
-		vbox1.addStretch(1)
-		vbox2 = Qt.QVBoxLayout()
-		vbox2.addWidget(self.RP_Settings)
-		vbox2.addWidget(self.divider_settings_window)
-		hbox = Qt.QHBoxLayout()
-		hbox.addLayout(vbox1)
-		hbox.addLayout(vbox2)
-		hbox.addStretch(1)
-		self.settings_window.setLayout(hbox)
 		self.settings_window.setWindowTitle(custom_shorthand + ': Dither controls')
 		#self.settings_window.show()
 		
@@ -242,7 +251,8 @@ class controller(object):
 		
 		
 		APPID = u'TITLE'
-		ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(APPID)
+		if sys.platform == 'win32':
+			ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(APPID)
 
 		app_icon = QtGui.QIcon()
 		app_icon.addFile('icons/red_pitaya.png', QtCore.QSize(32,32))
@@ -252,6 +262,50 @@ class controller(object):
 
 		self.connectionGUI()
 
+	# Builds the windows of the settings tab, see initUI(). If we are already connected, they are filled from the settings cache.
+	def createSettingsWindows(self):
+		from DisplayDitherSettingsWindow import DisplayDitherSettingsWindow
+		from DisplayDividerAndResidualsStreamingSettingsWindow import DisplayDividerAndResidualsStreamingSettingsWindow
+		from ConfigurationRPSettingsUI import ConfigRPSettingsUI
+
+		custom_style_sheet = self.custom_style_sheet
+		custom_shorthand = self.custom_shorthand
+
+		self.divider_settings_window = DisplayDividerAndResidualsStreamingSettingsWindow(self.sl, self.sp, clk_divider_modulus=67e3, bDividerOn=0, bPulses=0, custom_style_sheet=custom_style_sheet, custom_shorthand=custom_shorthand)    
+
+		# Dither windows, this code could be moved to another class/file to help with clutter:
+		self.dither_widget0 = DisplayDitherSettingsWindow(self.sl, self.sp, 0, modulation_frequency_in_hz='1e3', output_amplitude='1e-3', integration_time_in_seconds='0.1', bEnableDither=True, custom_style_sheet=custom_style_sheet)
+		self.dither_widget1 = DisplayDitherSettingsWindow(self.sl, self.sp, 1, modulation_frequency_in_hz='5.1e3' , output_amplitude='1e-3', integration_time_in_seconds='0.1', bEnableDither=True, custom_style_sheet=custom_style_sheet)
+		#dither_widget2 = DisplayDitherSettingsWindow(self.sl, self.sp, 2, modulation_frequency_in_hz='110' , output_amplitude='1e-4', integration_time_in_seconds='0.1', bEnableDither=True, custom_style_sheet=custom_style_sheet)
+
+		self.RP_Settings = ConfigRPSettingsUI(self.sl, self.sp, self, custom_style_sheet=custom_style_sheet, custom_shorthand=custom_shorthand)
+
+		settings_widget = Qt.QWidget()
+		vbox1 = Qt.QVBoxLayout()
+		vbox1.addWidget(self.dither_widget0)
+		vbox1.addWidget(self.dither_widget1)
+		#vbox1.addWidget(dither_widget2)
+		vbox1.addStretch(1)
+		vbox2 = Qt.QVBoxLayout()
+		vbox2.addWidget(self.RP_Settings)
+		vbox2.addWidget(self.divider_settings_window)
+		hbox = Qt.QHBoxLayout()
+		hbox.addLayout(vbox1)
+		hbox.addLayout(vbox2)
+		hbox.addStretch(1)
+		settings_widget.setLayout(hbox)
+
+		if self.sl.dev.valid_socket:
+			for window in self.getSettingsWindows():
+				window.getValues()
+		return settings_widget
+
+	# Windows of the settings tab, or an empty list if they haven't been built yet
+	def getSettingsWindows(self):
+		if not self.settings_window.isBuilt():
+			return []
+		return [self.RP_Settings, self.divider_settings_window, self.dither_widget0, self.dither_widget1]
+
 	def runEventLoop(self):
 		# Main event loop
 		try:
@@ -313,20 +367,17 @@ class controller(object):
 			custom_style_sheet = ('#MainWindow {color: white; background-color: %s;}' % self.devices_data[strSelectedSerial]['color'])
 		except KeyError:
 			custom_style_sheet = ''
+		self.custom_style_sheet = custom_style_sheet
 
 		target_windows = [
-			self.divider_settings_window,
 			self.freq_error_window1,
 			self.freq_error_window2,
 			self.xem_gui_mainwindow2,
 			self.xem_gui_mainwindow,
 			self.counters_window,
-			self.dither_widget0,
-			self.dither_widget1,
-			self.RP_Settings,
 			self.settings_window,
 			self.main_windows
-			]
+			] + self.getSettingsWindows()
 
 		for window in target_windows:
 			window.setStyleSheet(custom_style_sheet)
@@ -351,8 +402,13 @@ class controller(object):
 		self.logger.info('Red_Pitaya_GUI{}: Pushing default values from xml file'.format(self.logger_name))
 		if self.sl.dev.valid_socket:
 			self.sl.dev.CloseTCPConnection()
+		# the settings windows push their defaults too, so they are needed now (built before connecting, so that they don't read anything)
+		self.settings_window.build()
 			
 		self.sl.dev.OpenTCPConnection(ip_addr, port)
+		# an explicit connection replaces any reconnection in progress
+		self.connection_manager.cancel()
+		self.state_snapshot = None
 		if not self.sl.dev.valid_socket:
 			self.logger.error('Connection to host %s, port %s failed.' % (ip_addr, port))
 			return
@@ -366,11 +422,7 @@ class controller(object):
 			self.xem_gui_mainwindow,
 			self.freq_error_window1,
 			self.freq_error_window2,
-			self.RP_Settings,
-			self.divider_settings_window,
-			self.dither_widget0,
-			self.dither_widget1,
-		]
+		] + self.getSettingsWindows()
 
 		for window in target_windows:
 			window.pushDefaultValues()
@@ -384,10 +436,17 @@ class controller(object):
 			self.sl.dev.CloseTCPConnection()
 
 		self.sl.dev.OpenTCPConnection(ip_addr, port)
+		# an explicit connection replaces any reconnection in progress
+		self.connection_manager.cancel()
+		self.state_snapshot = None
 		if self.sl.dev.valid_socket == False:
 			logging.error('Connection failed.')
 			return
 
+		self.updateGUIFromFPGA(strSelectedSerial, ip_addr, port)
+
+	# Reads the settings of the box which we are connected to, and updates all the windows with them
+	def updateGUIFromFPGA(self, strSelectedSerial, ip_addr, port):
 		self.logger.info('Red_Pitaya_GUI{}: Updating GUI from FPGA'.format(self.logger_name))
 
 		self.strSelectedSerial = strSelectedSerial
@@ -401,16 +460,15 @@ class controller(object):
 
 		self.loadDefaultValueFromConfigFile(strSelectedSerial, False) #read xml file to update some values. False means not updating the FPGA
 
+		# read all the settings with a few block requests, so that the getValues() below are served from the cache
+		self.sl.fill_settings_cache()
+
 		target_windows = [
 			self.xem_gui_mainwindow2,
 			self.xem_gui_mainwindow,
 			self.freq_error_window1,
 			self.freq_error_window2,
-			self.RP_Settings,
-			self.divider_settings_window,
-			self.dither_widget0,
-			self.dither_widget1,
-		]
+		] + self.getSettingsWindows()    # (the settings windows which haven't been built yet read their values when they are)
 
 		for window in target_windows:
 			window.getValues()
@@ -430,6 +488,9 @@ class controller(object):
 		if self.sl.dev.valid_socket:
 			self.sl.dev.CloseTCPConnection()
 		self.sl.dev.OpenTCPConnection(ip_addr, port)
+		# an explicit connection replaces any reconnection in progress
+		self.connection_manager.cancel()
+		self.state_snapshot = None
 
 		target_windows = [
 			self.xem_gui_mainwindow2,
@@ -448,40 +509,49 @@ class controller(object):
 
 		self.logger.info('Red_Pitaya_GUI{}: Closing connection'.format(self.logger_name))
 
-		if self.timerReconnect is not None:
-			self.timerReconnect = None
+		self.connection_manager.cancel()
 
 		self.sl.dev.CloseTCPConnection()
+		# the trace goes on across reconnections, but everything up to the disconnection is on disk now (it is closed at exit)
+		self.sl.dev.flush_trace()
 
 		try:
 			self.xem_gui_mainwindow2.killTimers()
 			self.xem_gui_mainwindow.killTimers()
 			self.freq_error_window1.killTimers()
 			self.freq_error_window2.killTimers()
-			self.RP_Settings.killTimers()
+			if self.RP_Settings is not None:
+				self.RP_Settings.killTimers()
 		except Exception as e:
 			print("Error while killing the timers:")
 			print(e)
 
 	def socketErrorEvent(self, e):
 		print("XEM_GUI3.py:Controller::socketErrorEvent()")
+		if threading.current_thread() is not threading.main_thread():
+			# called from the acquisition engine's worker thread, which can't touch the timers:
+			# we only drop the socket, and the engine signals the error to the GUI thread, see acquisitionCommsError()
+			self.sl.dev.CloseTCPConnection()
+			raise CommsLoggeableError(e)
+
 		# this gets called by the socket-using functions in RP_PLL
 		# in the event of a socket exception, while we thought we had a valid connection
 		# The right things to do in this case is to:
+		# -remember the settings that we wrote, so that the reconnection doesn't have to read them all back
 		# -drop the current socket (because the data stream is left in an uncertain state)
-		# -start a reconnection timer that will attempt to reconnect automatically
+		# -start reconnecting automatically, without blocking the GUI (see ConnectionManager)
 		# -raise a CommsLoggeableError
 
-		# check if we need to start the reconnection attempt timer:
-		if self.timerReconnect is None:
-			# disconnect from socket, and start reconnection timer:
+		# check if we need to start reconnecting:
+		if not self.connection_manager.isActive():
+			if self.state_snapshot is None:
+				# (if the connection was lost again while restoring a snapshot, the shadow register file is incomplete: keep the first snapshot)
+				self.state_snapshot = self.sl.take_state_snapshot()
+			# disconnect from socket, and start reconnecting:
 			self.stopCommunication()
 
-			print("TCP connection lost. Starting reconnection timer")
-			self.timerReconnect = QtCore.QTimer()
-			self.reconnection_attempts = 0
-			self.timerReconnect.timeout.connect(self.reconnectionAttempt)
-			self.timerReconnect.start(3000) # 3000 ms update period (needs to be longer than the delay...)
+			print("TCP connection lost. Reconnecting")
+			self.connection_manager.start(self.ip_addr, self.port)
 
 			raise CommsLoggeableError
 
@@ -494,27 +564,46 @@ class controller(object):
 		# ]
 		# print("startCommunication")
 
-	def reconnectionAttempt(self):
-		self.reconnection_attempts += 1
-		# print("TCP connection lost. Attempting to reconnect %d." % (self.reconnection_attempts))
-
+	# Runs on the GUI thread when the acquisition engine lost the connection
+	def acquisitionCommsError(self, e):
 		try:
-			self.getActualValues(self.strSelectedSerial, self.ip_addr, self.port)
-		except:
-			print("Reconnection attempt #%d failed." % self.reconnection_attempts)
-			self.logger.error(traceback.format_exc())
+			self.socketErrorEvent(e)
+		except CommsLoggeableError:
+			pass
 
-		if self.sl.dev.valid_socket:
-			# success!
-			self.timerReconnect.stop()
-			self.timerReconnect = None
+	def connectionStateChanged(self, state):
+		print("Connection to %s:%d: %s" % (self.ip_addr, self.port, state))
+		self.logger.info('Red_Pitaya_GUI{}: connection state: {}'.format(self.logger_name, state))
+
+	# Called by the connection manager once it has connected again after the connection was lost
+	def reconnected(self, sock):
+		self.sl.dev.OpenTCPConnection(self.ip_addr, self.port, sock=sock)
+		if self.sl.dev.valid_socket == False:
+			self.connection_manager.start(self.ip_addr, self.port)
 			return
 
-		if self.reconnection_attempts == 10:
-			# switch to a longer timer between reconnection attempt:
-			print("%d failed reconnection attempts. Switching to 10 secs between attempts." % self.reconnection_attempts)
-			self.timerReconnect.stop()
-			self.timerReconnect.start(10000) # 10 seconds update period
+		try:
+			if self.state_snapshot:
+				# only the registers which changed while we were away are written back or read
+				(number_unchanged, number_restored, number_changed) = self.sl.restore_state_snapshot(self.state_snapshot)
+				print("Reconnected: %d settings unchanged, %d restored, %d changed by another client" % (number_unchanged, number_restored, number_changed))
+			else:
+				self.sl.fill_settings_cache()
+			self.state_snapshot = None
+
+			# served from the settings cache, so this doesn't read everything back
+			target_windows = [
+				self.xem_gui_mainwindow2,
+				self.xem_gui_mainwindow,
+				self.freq_error_window1,
+				self.freq_error_window2,
+			] + self.getSettingsWindows()
+			for window in target_windows:
+				window.getValues()
+		except CommsLoggeableError:
+			# lost again: socketErrorEvent() has already restarted the connection manager, with the same snapshot
+			print("Connection lost again while restoring the settings.")
+			self.logger.error(traceback.format_exc())
 
 if __name__ == '__main__':
 	# pbd.run('controller()')
@@ -526,6 +615,8 @@ if __name__ == '__main__':
 	# for example to enable re-using the same console to run another instance afterwards,
 	# is different.
 	if controller_obj.bEventLoopWasRunningAlready == False:
+		controller_obj.acquisition_engine.stop()
 		controller_obj.stopCommunication()
+		controller_obj.sl.stop_using_acquisition_daemon()
 		del controller_obj
 	
\ No newline at end of file
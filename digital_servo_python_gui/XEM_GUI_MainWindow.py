@@ -9,9 +9,7 @@ from PyQt5 import QtGui, Qt
 #import PyQt5.Qwt5 as Qwt
 import numpy as np
 import math
-from scipy.signal import lfilter
-from scipy.signal import decimate
-from scipy.signal import detrend
+# scipy.signal is imported where it is used (see displayDDCdata()), so that it doesn't slow down the startup of the GUI
 
 # For make_sure_path_exists() and os.rename()
 import os
@@ -19,9 +17,7 @@ import errno
 
 #from SuperLaserLand_JD2 import SuperLaserLand_JD2
 from LoopFiltersUI import LoopFiltersUI
-from DisplayVNAWindow import DisplayVNAWindow
 from LoopFiltersUI_DAC1_and_DAC2 import LoopFiltersUI_DAC1_and_DAC2
-from DisplayDitherSettingsWindow import DisplayDitherSettingsWindow
 #from DisplayCrashMonitorWindow import DisplayCrashMonitorWindow
 #from ILX_laser_control import ILX_laser_control
 #from PyDAQmx_single_1 import NIDAQ_USB
@@ -29,6 +25,7 @@ from DisplayDitherSettingsWindow import DisplayDitherSettingsWindow
 from user_friendly_QLineEdit import user_friendly_QLineEdit
 
 import SpectrumWidget
+from PSDEngine import PSDEngine
 
 #import matplotlib.pyplot as plt
 
@@ -139,6 +136,9 @@ class XEM_GUI_MainWindow(QtGui.QWidget):
 		self.timerIDDither = None
 		self.timerID = 0
 
+		# When set, timerEvent() queues the logger acquisitions in this AcquisitionEngine instead of doing them itself, see setAcquisitionEngine()
+		self.acquisition_engine = None
+
 		# For the crash monitor
 		self.crash_number = 0
 		self.crash_windows = []
@@ -148,6 +148,7 @@ class XEM_GUI_MainWindow(QtGui.QWidget):
 		self.bAveragePhaseNoise = True
 		self.bAveragePhaseNoiseLast = False
 		self.N_spc_average = 10.
+		self.psd_engine = PSDEngine()
 		
 		# For the residuals streaming:
 		# Only one window takes care of reading both the CEO and optical residuals
@@ -437,6 +438,8 @@ class XEM_GUI_MainWindow(QtGui.QWidget):
 
 		
 	def showVNA(self):
+		# imported here since the VNA (and its transfer function windows) is rarely used
+		from DisplayVNAWindow import DisplayVNAWindow
 		self.vna = DisplayVNAWindow(self.sl)
 		
 
@@ -446,7 +449,7 @@ class XEM_GUI_MainWindow(QtGui.QWidget):
 		start_time = time.perf_counter()
 		print('Grabbing and exporting data')
 		# Check if another function is currently using the DDR2 logger:
-		if self.sl.bDDR2InUse:
+		if self.sl.ddr2_arbiter.in_use():
 			print('grabAndExportData(): DDR2 logger in use, cannot get data from adc')
 			return
 			
@@ -464,7 +467,9 @@ class XEM_GUI_MainWindow(QtGui.QWidget):
 			return
 			
 		# Block access to the DDR2 Logger to any other function until we are done:
-		self.sl.bDDR2InUse = True
+		if not self.sl.ddr2_arbiter.acquire(self.strTitle):
+			print('grabAndExportData(): DDR2 logger in use, cannot get data from adc')
+			return
 
 		try:
 			N_points = int(float(N_points_str))
@@ -504,7 +509,7 @@ class XEM_GUI_MainWindow(QtGui.QWidget):
 #            raise
 			
 		# Signal to other functions that they can use the DDR2 logger
-		self.sl.bDDR2InUse = False
+		self.sl.ddr2_arbiter.release(self.strTitle)
 		
 		print('Elapsed time (Comm) = %f' % (time.perf_counter()-start_time))
 		start_time = time.perf_counter()
@@ -635,42 +640,35 @@ class XEM_GUI_MainWindow(QtGui.QWidget):
 					# This is to prevent any violent step on the actuator when we turn off the lock:
 					# It also prevents mode changes (the laser should stay fairly close to when it was locked.
 					if self.selected_ADC == 0:
-						# Go and measure the current DAC DC value:
-						N_points = 10e3
-						self.sl.setup_DAC0_write(N_points)
-						self.sl.trigger_write()
-						self.sl.wait_for_write()
-						(samples_out, ref_exp0) = self.sl.read_adc_samples_from_DDR2()
-	#                    print(np.mean(samples_out))
-						current_dac_offset_in_counts = np.mean(samples_out)
 						kDAC = 0
-						
-						
 					elif self.selected_ADC == 1:
-						N_points = 10e3
-						self.sl.setup_DAC1_write(N_points)
-						self.sl.trigger_write()
-						self.sl.wait_for_write()
-						(samples_out, ref_exp0) = self.sl.read_adc_samples_from_DDR2()
-	#                    print(np.mean(samples_out))
-						current_dac_offset_in_counts = np.mean(samples_out)
 						kDAC = 1
+					# Go and measure the current DAC DC value (only the mean is sent back by the server, not the samples):
+					N_points = 10e3
+					current_dac_offset_in_counts = None
+					with self.sl.ddr2_arbiter.use(self.strTitle, timeout=1.) as bAcquired:
+						if bAcquired:
+							current_dac_offset_in_counts = self.sl.capture_stats('DAC%d' % kDAC, N_points, ('mean',))['mean']
+
+					if current_dac_offset_in_counts is None:
+						# without the current DAC value, the lock is turned off without the ramp:
+						print('chkLockClickedEvent(): DDR2 logger in use, cannot measure the DAC offset, skipping the ramp')
+					else:
+						# Read the current manual offset value:
+						current_manual_offset_in_slider_units = float(self.spectrum.q_dac_offset[kDAC].value())
+						# Convert the DAC DC offset to the slider units:
+						current_dac_offset_in_slider_units = float(current_dac_offset_in_counts - self.sl.DACs_limit_low[kDAC])/float(self.sl.DACs_limit_high[kDAC] - self.sl.DACs_limit_low[kDAC])*1e6
 						
-					# Read the current manual offset value:
-					current_manual_offset_in_slider_units = float(self.spectrum.q_dac_offset[kDAC].value())
-					# Convert the DAC DC offset to the slider units:
-					current_dac_offset_in_slider_units = float(current_dac_offset_in_counts - self.sl.DACs_limit_low[kDAC])/float(self.sl.DACs_limit_high[kDAC] - self.sl.DACs_limit_low[kDAC])*1e6
-					
-					# Set up a ramp with 20 steps:
-					desired_ramp = np.linspace(current_manual_offset_in_slider_units, current_dac_offset_in_slider_units, 20)
-					# print('ramping from %d to %d in slider units' % (current_manual_offset_in_slider_units, current_dac_offset_in_slider_units))
-					
-					Total_ramp_time = 0.1
-					for k2 in range(len(desired_ramp)):
-	#                    print('set slider to %d' % desired_ramp[k2])
-						self.spectrum.q_dac_offset[kDAC].setValue(desired_ramp[k2])
-						self.spectrum.setDACOffset_event()
-						time.sleep(float(Total_ramp_time)/len(desired_ramp))
+						# Set up a ramp with 20 steps:
+						desired_ramp = np.linspace(current_manual_offset_in_slider_units, current_dac_offset_in_slider_units, 20)
+						# print('ramping from %d to %d in slider units' % (current_manual_offset_in_slider_units, current_dac_offset_in_slider_units))
+						
+						Total_ramp_time = 0.1
+						for k2 in range(len(desired_ramp)):
+	#                        print('set slider to %d' % desired_ramp[k2])
+							self.spectrum.q_dac_offset[kDAC].setValue(desired_ramp[k2])
+							self.spectrum.setDACOffset_event()
+							time.sleep(float(Total_ramp_time)/len(desired_ramp))
 				
 					# 2. turn the lock off
 					if self.selected_ADC == 0:
@@ -1387,11 +1385,15 @@ class XEM_GUI_MainWindow(QtGui.QWidget):
 			# 		self.qlbl_status2.setStyleSheet('')
 		
 			if self.qchk_refresh.isChecked():
-				self.grabAndDisplayADC()
-				self.displayDAC()
-				
-				if self.display_phase == 0 or self.qchk_phase_noise_fast_updates.isChecked():
-					self.displayDDC()
+				bDisplayDDC = (self.display_phase == 0 or self.qchk_phase_noise_fast_updates.isChecked())
+				if self.acquisition_engine is not None:
+					self.queueAcquisitions(bDisplayDDC)
+				else:
+					self.grabAndDisplayADC()
+					self.displayDAC()
+					
+					if bDisplayDDC:
+						self.displayDDC()
 			
 			self.display_phase = self.display_phase + 1
 			if self.display_phase > 5:
@@ -1409,39 +1411,34 @@ class XEM_GUI_MainWindow(QtGui.QWidget):
 
 	# timerEvent()
 	def displayDAC(self):
-		
-		# Check if another function is currently using the DDR2 logger:
-		if self.sl.bDDR2InUse:
-			print('displayDAC(): DDR2 logger in use, cannot get data from dac')
-			return  
-		
-		# For now: we grab the smallest chunk of points from the output (so as to not use too much time to refresh)
-		# and display the current average:
+		# The thermometers only need the current value of each output: it is read from the BUS_ADDR_DACx_CURRENT registers with a single request,
+		# instead of running one logger acquisition per DAC
+		start_time = time.perf_counter()
+		try:
+			dac_counts = self.sl.read_DAC_current_values()
+		except RP_PLL.CommsLoggeableError as e:
+			# log exception
+			logging.error("Exception occurred", exc_info=True)
+			return
+		except RP_PLL.CommsError as e:
+			# do not log exception (because it's simply an obvious follow-up to a previous one)
+			return
+		if self.bDisplayTiming == True:
+			print('Elapsed time (read dac values) = %f ms' % (1000*(time.perf_counter() - start_time)))
+
 		for k in range(3):
 			if self.output_controls[k]:
-				# Read from DAC #k
-				start_time = time.perf_counter()
-			
-				(samples_out, ref_exp0) = self.getADCdata(input_select="DAC%d" % k, N_samples=256)
-				if samples_out is None:
-					return
-				elapsed_time = time.perf_counter() - start_time
-				if self.bDisplayTiming == True:
-					print('Elapsed time (read dac values) = %f ms' % (1000*elapsed_time))
-				samples_out = samples_out.astype(dtype=np.float)
+				self.displayDACcurrentValue(k, dac_counts[k])
 
-				VCO_gain_in_Hz_per_Volts = self.getVCOGainFromUI(k)
-					
-				# Update the display:           
-				# For the USB bug, compute the mean from the last points     
-				current_output_in_volts = self.sl.convertDACCountsToVolts(k, np.mean(samples_out[128:256]))
-				current_output_in_hz = current_output_in_volts * VCO_gain_in_Hz_per_Volts
-				self.spectrum.qthermo_dac_current[k].setValue(current_output_in_volts)
-				self.spectrum.qlabel_dac_current_value[k].setText('{:.4f} V\n{:.0f} MHz'.format(current_output_in_volts, current_output_in_hz/1e6))
-				
-				elapsed_time = time.perf_counter() - start_time
-				if self.bDisplayTiming == True:
-					print('Elapsed time (displayDAC total) = %f ms' % (1000*elapsed_time))
+		if self.bDisplayTiming == True:
+			print('Elapsed time (displayDAC total) = %f ms' % (1000*(time.perf_counter() - start_time)))
+
+	def displayDACcurrentValue(self, k, counts):
+		VCO_gain_in_Hz_per_Volts = self.getVCOGainFromUI(k)
+		current_output_in_volts = self.sl.convertDACCountsToVolts(k, counts)
+		current_output_in_hz = current_output_in_volts * VCO_gain_in_Hz_per_Volts
+		self.spectrum.qthermo_dac_current[k].setValue(current_output_in_volts)
+		self.spectrum.qlabel_dac_current_value[k].setText('{:.4f} V\n{:.0f} MHz'.format(current_output_in_volts, current_output_in_hz/1e6))
 			
 
 	def displayDDC(self):
@@ -1449,12 +1446,7 @@ class XEM_GUI_MainWindow(QtGui.QWidget):
 		
 		# Read from DDC0
 		try:
-			try:
-				N_points = int(float(self.qedit_ddc_length.text()))
-			except:
-				N_points = 100e3
-			if N_points < 64:
-				N_points = 64
+			N_points = self.getDDCNumberOfPoints()
 				
 			start_time = time.perf_counter()
 
@@ -1474,215 +1466,222 @@ class XEM_GUI_MainWindow(QtGui.QWidget):
 			if inst_freq is None:
 				return
 
-			self.inst_freq = inst_freq
-			
 			if self.bDisplayTiming == True:
 				print('Elapsed time (communication) = %f' % (time.perf_counter()-start_time))
 
+			self.displayDDCdata(inst_freq)
 			
+		except:
+
+			del self.sl
+			print('Unhandled exception')
+			raise
+#        pause(1/10.)
+
+		self.bDisplayTiming = False
+
+	def getDDCNumberOfPoints(self):
+		try:
+			N_points = int(float(self.qedit_ddc_length.text()))
+		except:
+			N_points = 100e3
+		if N_points < 64:
+			N_points = 64
+		return N_points
+
+	# Processes and plots the DDC samples (instantaneous frequency) read by displayDDC() or by the acquisition engine
+	def displayDDCdata(self, inst_freq):
+		self.inst_freq = inst_freq
+		
 #            print('mean freq error = %f MHz, raw code = %f' % (np.mean(inst_freq)/1e6, np.mean(inst_freq)*2**10 / self.sl.fs*4))
-			self.qlbl_mean_freq_error.setText('Freq error: %.2f MHz' % (np.mean(inst_freq)/1e6))
-			
-			# Compute the spectrum:
-			# We first perform decimation on the data since we don't have useful information above the cut-off frequency anyway:
-			start_time = time.perf_counter()
-			N_decimation = 10
-			fs_new = self.sl.fs/N_decimation
-			#inst_freq_decimated = decimate(inst_freq, N_decimation, zero_phase=False)
-			inst_freq_decimated = decimate(detrend(inst_freq), N_decimation, zero_phase=False)
-			
+		self.qlbl_mean_freq_error.setText('Freq error: %.2f MHz' % (np.mean(inst_freq)/1e6))
+		
+		# Compute the spectrum:
+		# We first perform decimation on the data since we don't have useful information above the cut-off frequency anyway:
+		start_time = time.perf_counter()
+		N_decimation = 10
+		fs_new = self.sl.fs/N_decimation
+		from scipy.signal import decimate, detrend
+		#inst_freq_decimated = decimate(inst_freq, N_decimation, zero_phase=False)
+		inst_freq_decimated = decimate(detrend(inst_freq), N_decimation, zero_phase=False)
+		
 #            inst_freq_decimated = inst_freq
 #            fs_new = self.sl.fs
-			
-			# For debugging: we want to check
+		
+		# For debugging: we want to check
 #            inst_freq_decimated = np.random.randn(100e3)
 #            print('Data std dev = %f Hz' % np.std(inst_freq_decimated))
 #            print('Data variance = %f Hz^2' % np.var(inst_freq_decimated))
-			if self.bDisplayTiming == True:
-				print('Elapsed time (decimation) = %f' % (time.perf_counter()-start_time))
-			start_time = time.perf_counter()
-			
-			# Compute the spectrum of the decimated signal:
-			start_time = time.perf_counter()
-			N_fft = 2**(int(np.ceil(np.log2(len(inst_freq_decimated)))))
-			frequency_axis = np.linspace(0, (N_fft-1)/float(N_fft)*fs_new, N_fft)
-			last_index_shown = int(np.round(len(frequency_axis)/2))
-			window_function = np.blackman(len(inst_freq_decimated))
-			window_NEB = np.sum((window_function/np.sum(window_function))**2) * fs_new;
+		if self.bDisplayTiming == True:
+			print('Elapsed time (decimation) = %f' % (time.perf_counter()-start_time))
+		start_time = time.perf_counter()
+		
+		# Compute the spectrum of the decimated signal, as a single-sided power spectral density in Hz^2/Hz:
+		start_time = time.perf_counter()
+		(frequency_axis, spc, window_NEB, N_fft) = self.psd_engine.psd(inst_freq_decimated, fs_new)
+		last_index_shown = N_fft//2
 #            print('window_NEB = %f Hz' % window_NEB)
-			
-			spc = np.fft.fft(inst_freq_decimated * window_function, N_fft)
-			spc = np.real(spc*np.conj(spc))/(sum(window_function)**2) # Spectrum is now scaled in power (Hz^2 per bin)
-			# Scale the spectrum to be a single-sided power spectral density in Hz^2/Hz:
-			spc[1:last_index_shown] = 2*spc[1:last_index_shown] / window_NEB
 
 #            # Compute the running average:
-			# Compute spectrum averaging with exponential smoothing (simple first-order IIR filter)
-			try:
-				n_spc_avg = int(round(float(self.qedit_spc_averaging.text())))
-				if n_spc_avg > 1.:
-					self.bAveragePhaseNoise = True
-					self.N_spc_average = n_spc_avg
-				else:
-					self.bAveragePhaseNoise = False
-					self.N_spc_average = 1.
-			except:
-				n_spc_avg = 1.
+		# Compute spectrum averaging with exponential smoothing (simple first-order IIR filter)
+		try:
+			n_spc_avg = int(round(float(self.qedit_spc_averaging.text())))
+			if n_spc_avg > 1.:
+				self.bAveragePhaseNoise = True
+				self.N_spc_average = n_spc_avg
+			else:
 				self.bAveragePhaseNoise = False
-				
-			if self.bAveragePhaseNoise:
+				self.N_spc_average = 1.
+		except:
+			n_spc_avg = 1.
+			self.bAveragePhaseNoise = False
+			
+		if self.bAveragePhaseNoise:
 #                print('self.N_spc_average = %d' % self.N_spc_average)
-				filter_alpha = np.exp(-1./self.N_spc_average)
-				try:
-					# if this is not the first time we are called with averaging enabled, we run the filter:
-					if self.bAveragePhaseNoiseLast:
-						self.spc_running_sum = filter_alpha * self.spc_running_sum +  + (1-filter_alpha)*spc
-					else:
-						# this is the first time that we are called with averaging enabled, so we reset the current state
-						self.spc_running_sum = spc
-				except:
-					# This is the first time that we are called:
-					self.spc_running_sum = spc
+			if not self.bAveragePhaseNoiseLast:
+				# this is the first time that we are called with averaging enabled, so we reset the current state
+				self.psd_engine.reset()
+			self.spc_running_sum = self.psd_engine.accumulate(spc, self.N_spc_average)
 
-				
-			self.bAveragePhaseNoiseLast = self.bAveragePhaseNoise
 			
+		self.bAveragePhaseNoiseLast = self.bAveragePhaseNoise
+		
 #            print('Freq noise PSD: %e Hz^2/Hz' % (np.mean(spc[1:last_index_shown])))
-			self.freq_noise_psd = spc[1:last_index_shown]
-			self.freq_noise_axis = frequency_axis[1:last_index_shown]
-			
+		self.freq_noise_psd = spc[1:last_index_shown]
+		self.freq_noise_axis = frequency_axis[1:last_index_shown]
+		
 #            spc = np.abs(spc)
+		
+		if self.bDisplayTiming == True:
+			print('Elapsed time (FFT) = %f' % (time.perf_counter()-start_time))
 			
-			if self.bDisplayTiming == True:
-				print('Elapsed time (FFT) = %f' % (time.perf_counter()-start_time))
-				
-				
-			try:
-				f_limits = self.qedit_xlims.text()
-				f_limits = f_limits.split(',')
-				f_limits = (float(f_limits[0]), float(f_limits[1]))
-			except:
-				f_limits = (frequency_axis[1], frequency_axis[last_index_shown])
-				
-			try:
-				y_limits = self.qedit_ylims.text()
-				y_limits = y_limits.split(',')
-				y_limits = (float(y_limits[0]), float(y_limits[1]))
-			except:
-				y_limits = (-140, 60)
 			
-			# Update the graph
-			if self.qcombo_ddc_plot.currentIndex() == 0:
-				# Display the frequency noise
-				spc = 10*np.log10(spc + 1e-20)
-				self.curve_DDC0_spc.setData(frequency_axis[1:last_index_shown], spc[1:last_index_shown])
-				if self.bAveragePhaseNoise:
-					self.curve_DDC0_spc_avg.setData(frequency_axis[1:last_index_shown], 10*np.log10(self.spc_running_sum[1:last_index_shown] + 1e-20))
-					self.curve_DDC0_spc_avg.setVisible(True)
-				else:
-					self.curve_DDC0_spc_avg.setVisible(False)
-				self.qplt_DDC0_spc.setTitle('Freq noise PSD')
-				self.qplt_DDC0_spc.setLabel('left', 'PSD [dB Hz^2/Hz]')
-				self.qplt_DDC0_spc.setYRange(y_limits[0], y_limits[1])
+		try:
+			f_limits = self.qedit_xlims.text()
+			f_limits = f_limits.split(',')
+			f_limits = (float(f_limits[0]), float(f_limits[1]))
+		except:
+			f_limits = (frequency_axis[1], frequency_axis[last_index_shown])
+			
+		try:
+			y_limits = self.qedit_ylims.text()
+			y_limits = y_limits.split(',')
+			y_limits = (float(y_limits[0]), float(y_limits[1]))
+		except:
+			y_limits = (-140, 60)
+		
+		# Update the graph
+		if self.qcombo_ddc_plot.currentIndex() == 0:
+			# Display the frequency noise
+			spc = 10*np.log10(spc + 1e-20)
+			self.curve_DDC0_spc.setData(frequency_axis[1:last_index_shown], spc[1:last_index_shown])
+			if self.bAveragePhaseNoise:
+				self.curve_DDC0_spc_avg.setData(frequency_axis[1:last_index_shown], 10*np.log10(self.spc_running_sum[1:last_index_shown] + 1e-20))
+				self.curve_DDC0_spc_avg.setVisible(True)
+			else:
+				self.curve_DDC0_spc_avg.setVisible(False)
+			self.qplt_DDC0_spc.setTitle('Freq noise PSD')
+			self.qplt_DDC0_spc.setLabel('left', 'PSD [dB Hz^2/Hz]')
+			self.qplt_DDC0_spc.setYRange(y_limits[0], y_limits[1])
 #                self.qplt_DDC0_spc.setAxisScale(Qwt.QwtPlot.xBottom, frequency_axis[1], frequency_axis[last_index_shown])
-				self.qplt_DDC0_spc.getPlotItem().setLogMode(x=True)
-				self.qplt_DDC0_spc.setXRange(np.log10(f_limits[0]), np.log10(f_limits[1]))
-				# self.qplt_DDC0_spc.setAxisScaleEngine(Qwt.QwtPlot.xBottom, Qwt.QwtLog10ScaleEngine())
-				self.qplt_DDC0_spc.setLabel('bottom', 'Frequency [Hz]')
-				self.curve_DDC0_cumul_phase.setVisible(False)
-			elif self.qcombo_ddc_plot.currentIndex() == 1:
-				# Compute the phase noise time-domain standard deviation:
-				phasenoise_stddev = np.std(np.cumsum(inst_freq*2*np.pi/self.sl.fs))
-				# Display the phase noise (equal to 1/f^2 times the frequency noise PSD)
-				self.curve_DDC0_spc.setData(frequency_axis[1:last_index_shown], 10*np.log10(spc[1:last_index_shown] + 1e-20) - 20*np.log10(frequency_axis[1:last_index_shown]))
-				if self.bAveragePhaseNoise:
-					self.curve_DDC0_spc_avg.setData(frequency_axis[1:last_index_shown], 10*np.log10(self.spc_running_sum[1:last_index_shown] + 1e-20) - 20*np.log10(frequency_axis[1:last_index_shown]))
-					self.curve_DDC0_spc_avg.setVisible(True)
-				else:
-					self.curve_DDC0_spc_avg.setVisible(False)
-				self.qplt_DDC0_spc.setXRange(f_limits[0], f_limits[1])
-				self.qplt_DDC0_spc.setTitle('Phase noise PSD, std dev = %.2f radrms' % phasenoise_stddev)
-				self.qplt_DDC0_spc.setLabel('left', 'PSD [dBc/Hz]')
-				self.qplt_DDC0_spc.setYRange(y_limits[0], y_limits[1])
-				#self.qplt_DDC0_spc.setAxisScaleEngine(Qwt.QwtPlot.xBottom, Qwt.QwtLog10ScaleEngine())
-				self.qplt_DDC0_spc.getPlotItem().setLogMode(x=True)
-				
-				self.qplt_DDC0_spc.setXRange(np.log10(f_limits[0]), np.log10(f_limits[1]*5./6.0))   # the scaling is because the widget doesn't seem to use the exact values that we pass...
-				self.qplt_DDC0_spc.setLabel('bottom', 'Frequency [Hz]')
+			self.qplt_DDC0_spc.getPlotItem().setLogMode(x=True)
+			self.qplt_DDC0_spc.setXRange(np.log10(f_limits[0]), np.log10(f_limits[1]))
+			# self.qplt_DDC0_spc.setAxisScaleEngine(Qwt.QwtPlot.xBottom, Qwt.QwtLog10ScaleEngine())
+			self.qplt_DDC0_spc.setLabel('bottom', 'Frequency [Hz]')
+			self.curve_DDC0_cumul_phase.setVisible(False)
+		elif self.qcombo_ddc_plot.currentIndex() == 1:
+			# Compute the phase noise time-domain standard deviation:
+			phasenoise_stddev = np.std(np.cumsum(inst_freq*2*np.pi/self.sl.fs))
+			# Display the phase noise (equal to 1/f^2 times the frequency noise PSD)
+			self.curve_DDC0_spc.setData(frequency_axis[1:last_index_shown], 10*np.log10(spc[1:last_index_shown] + 1e-20) - 20*np.log10(frequency_axis[1:last_index_shown]))
+			if self.bAveragePhaseNoise:
+				self.curve_DDC0_spc_avg.setData(frequency_axis[1:last_index_shown], 10*np.log10(self.spc_running_sum[1:last_index_shown] + 1e-20) - 20*np.log10(frequency_axis[1:last_index_shown]))
+				self.curve_DDC0_spc_avg.setVisible(True)
+			else:
+				self.curve_DDC0_spc_avg.setVisible(False)
+			self.qplt_DDC0_spc.setXRange(f_limits[0], f_limits[1])
+			self.qplt_DDC0_spc.setTitle('Phase noise PSD, std dev = %.2f radrms' % phasenoise_stddev)
+			self.qplt_DDC0_spc.setLabel('left', 'PSD [dBc/Hz]')
+			self.qplt_DDC0_spc.setYRange(y_limits[0], y_limits[1])
+			#self.qplt_DDC0_spc.setAxisScaleEngine(Qwt.QwtPlot.xBottom, Qwt.QwtLog10ScaleEngine())
+			self.qplt_DDC0_spc.getPlotItem().setLogMode(x=True)
+			
+			self.qplt_DDC0_spc.setXRange(np.log10(f_limits[0]), np.log10(f_limits[1]*5./6.0))   # the scaling is because the widget doesn't seem to use the exact values that we pass...
+			self.qplt_DDC0_spc.setLabel('bottom', 'Frequency [Hz]')
 
-				# Display the cumulative integral of the phase noise:
-				# Select desired frequency range:
-				try:
-					integration_higher_bound = float(self.qedit_cumul_integral.text())
-				except:
-					integration_higher_bound = 1e6
-				if integration_higher_bound > fs_new/2:
-					integration_higher_bound = fs_new/2
-				if integration_higher_bound <= 2/len(spc)*fs_new:
-					integration_higher_bound = 2/len(spc)*fs_new
-				integration_higher_index = int(round(integration_higher_bound/fs_new*len(spc)))
+			# Display the cumulative integral of the phase noise:
+			# Select desired frequency range:
+			try:
+				integration_higher_bound = float(self.qedit_cumul_integral.text())
+			except:
+				integration_higher_bound = 1e6
+			if integration_higher_bound > fs_new/2:
+				integration_higher_bound = fs_new/2
+			if integration_higher_bound <= 2/N_fft*fs_new:
+				integration_higher_bound = 2/N_fft*fs_new
+			integration_higher_index = int(round(integration_higher_bound/fs_new*N_fft))
 #                print('integration up to %d out of %d' % (integration_higher_index, len(spc)))
-				frequency_axis_integral = frequency_axis[1:integration_higher_index]
-				
-				# Integrate the phase noise PSD, from the highest frequency to the lowest
-				phase_psd = spc[1:integration_higher_index] / frequency_axis_integral**2
-				cumul_int = np.flipud(np.cumsum(np.flipud(phase_psd))) * np.mean(np.diff(frequency_axis_integral))
+			frequency_axis_integral = frequency_axis[1:integration_higher_index]
+			
+			# Integrate the phase noise PSD, from the highest frequency to the lowest
+			phase_psd = spc[1:integration_higher_index] / frequency_axis_integral**2
+			cumul_int = np.flipud(np.cumsum(np.flipud(phase_psd))) * np.mean(np.diff(frequency_axis_integral))
 #                print((cumul_int).shape)
 #                cumul_int = 0*cumul_int + 10
 #                print((cumul_int).shape)
-				
-				# Show results
-				self.curve_DDC0_cumul_phase.setData(frequency_axis_integral, np.sqrt(cumul_int))
-				self.curve_DDC0_cumul_phase.setVisible(True)
-				#self.qplt_DDC0_spc_right_viewbox.setYRange(0, 2*2*np.pi)
-				#self.qplt_DDC0_spc_right_viewbox.setXRange(0, 2*2*np.pi)
+			
+			# Show results
+			self.curve_DDC0_cumul_phase.setData(frequency_axis_integral, np.sqrt(cumul_int))
+			self.curve_DDC0_cumul_phase.setVisible(True)
+			#self.qplt_DDC0_spc_right_viewbox.setYRange(0, 2*2*np.pi)
+			#self.qplt_DDC0_spc_right_viewbox.setXRange(0, 2*2*np.pi)
 #                self.qplt_DDC0_spc.setAxisScale(Qwt.QwtPlot.xBottom, frequency_axis[1], frequency_axis[last_index_shown])
 
 #                self.qplt_DDC0_spc.setAxisScale(Qwt.QwtPlot.yRight, 0, 2*2*np.pi)
-				
-			 
-			elif self.qcombo_ddc_plot.currentIndex() == 2:
-				# Display the raw, time-domain instantaneous frequency output by the DDC block, mostly for debugging:
-				
-				time_axis = np.arange(0, len(inst_freq))/self.sl.fs
-				
-				self.curve_DDC0_spc.setData(time_axis, inst_freq)
-				self.curve_DDC0_spc_avg.setVisible(False)
-				self.curve_DDC0_cumul_phase.setVisible(False)
-				self.qplt_DDC0_spc.setTitle('Instantaneous frequency error, std dev = %.1f kHz' % (np.std(inst_freq_decimated)/1e3))
-				self.qplt_DDC0_spc.setLabel('left', 'Freq [Hz]')
-				self.qplt_DDC0_spc.setLabel('bottom', 'Time [s]')
+			
+		 
+		elif self.qcombo_ddc_plot.currentIndex() == 2:
+			# Display the raw, time-domain instantaneous frequency output by the DDC block, mostly for debugging:
+			
+			time_axis = np.arange(0, len(inst_freq))/self.sl.fs
+			
+			self.curve_DDC0_spc.setData(time_axis, inst_freq)
+			self.curve_DDC0_spc_avg.setVisible(False)
+			self.curve_DDC0_cumul_phase.setVisible(False)
+			self.qplt_DDC0_spc.setTitle('Instantaneous frequency error, std dev = %.1f kHz' % (np.std(inst_freq_decimated)/1e3))
+			self.qplt_DDC0_spc.setLabel('left', 'Freq [Hz]')
+			self.qplt_DDC0_spc.setLabel('bottom', 'Time [s]')
 #                self.qplt_DDC0_spc.setAxisScale(Qwt.QwtPlot.yLeft, -self.sl.fs/2, self.sl.fs/2)
-				self.qplt_DDC0_spc.setYRange(np.min(inst_freq), np.max(inst_freq))
-				#self.qplt_DDC0_spc.setAxisScaleEngine(Qwt.QwtPlot.xBottom, Qwt.QwtLinearScaleEngine())
-				self.qplt_DDC0_spc.getPlotItem().setLogMode(x=False)
-				self.qplt_DDC0_spc.setXRange(time_axis[0], time_axis[-1])
-				 
-			elif self.qcombo_ddc_plot.currentIndex() == 3:
-				# Display the time-domain instantaneous phase output by the DDC block (computed by integrating the frequency), mostly for debugging:
-				
-				time_axis = np.arange(0, len(inst_freq))/self.sl.fs
-				inst_phase = np.cumsum(inst_freq*2*np.pi/self.sl.fs)
-				
-				
-				
-				# Compute the phase noise time-domain standard deviation:
-				phasenoise_stddev = np.std(inst_phase)
-				
-				self.curve_DDC0_spc.setData(time_axis, inst_phase)
-				self.curve_DDC0_spc_avg.setVisible(False)
-				self.curve_DDC0_cumul_phase.setVisible(False)
-				self.qplt_DDC0_spc.setTitle('Instantaneous phase error, std dev = %.2f radrms' % phasenoise_stddev)
-				self.qplt_DDC0_spc.setLabel('left', 'Phase [rad]')
-				self.qplt_DDC0_spc.setLabel('bottom', 'Time [s]')
+			self.qplt_DDC0_spc.setYRange(np.min(inst_freq), np.max(inst_freq))
+			#self.qplt_DDC0_spc.setAxisScaleEngine(Qwt.QwtPlot.xBottom, Qwt.QwtLinearScaleEngine())
+			self.qplt_DDC0_spc.getPlotItem().setLogMode(x=False)
+			self.qplt_DDC0_spc.setXRange(time_axis[0], time_axis[-1])
+			 
+		elif self.qcombo_ddc_plot.currentIndex() == 3:
+			# Display the time-domain instantaneous phase output by the DDC block (computed by integrating the frequency), mostly for debugging:
+			
+			time_axis = np.arange(0, len(inst_freq))/self.sl.fs
+			inst_phase = np.cumsum(inst_freq*2*np.pi/self.sl.fs)
+			
+			
+			
+			# Compute the phase noise time-domain standard deviation:
+			phasenoise_stddev = np.std(inst_phase)
+			
+			self.curve_DDC0_spc.setData(time_axis, inst_phase)
+			self.curve_DDC0_spc_avg.setVisible(False)
+			self.curve_DDC0_cumul_phase.setVisible(False)
+			self.qplt_DDC0_spc.setTitle('Instantaneous phase error, std dev = %.2f radrms' % phasenoise_stddev)
+			self.qplt_DDC0_spc.setLabel('left', 'Phase [rad]')
+			self.qplt_DDC0_spc.setLabel('bottom', 'Time [s]')
 #                self.qplt_DDC0_spc.setAxisScale(Qwt.QwtPlot.yLeft, -self.sl.fs/2, self.sl.fs/2)
-				self.qplt_DDC0_spc.setYRange(np.min(inst_phase), np.max(inst_phase))
-				#self.qplt_DDC0_spc.setAxisScaleEngine(Qwt.QwtPlot.xBottom, Qwt.QwtLinearScaleEngine())
-				self.qplt_DDC0_spc.getPlotItem().setLogMode(x=False)
-				self.qplt_DDC0_spc.setXRange(time_axis[0], time_axis[-1])
+			self.qplt_DDC0_spc.setYRange(np.min(inst_phase), np.max(inst_phase))
+			#self.qplt_DDC0_spc.setAxisScaleEngine(Qwt.QwtPlot.xBottom, Qwt.QwtLinearScaleEngine())
+			self.qplt_DDC0_spc.getPlotItem().setLogMode(x=False)
+			self.qplt_DDC0_spc.setXRange(time_axis[0], time_axis[-1])
 #                self.qplt_DDC0_spc.setAxisScale(Qwt.QwtPlot.yLeft, -3.14, 3.14)
 #                print "debug warning: phase noise plot scaled to +/- pi"
-			 
+		 
 #            # Display the un-decimated spectrum:
 #            frequency_axis = np.linspace(0, (len(inst_freq)-1)/float(len(inst_freq))*(self.sl.fs), len(inst_freq))
 #            last_index_shown = np.round(len(frequency_axis)/2)
@@ -1691,29 +1690,57 @@ class XEM_GUI_MainWindow(QtGui.QWidget):
 #            spc = 20*np.log10(np.abs(spc) + 1e-7)
 #            self.curve_DDC0_spc.setData(frequency_axis[1:last_index_shown], spc[1:last_index_shown])
 
-			# Refresh the display:
-			
-			self.qplt_DDC0_spc.replot()
-			
-
-			if window_NEB > 1e6:
-				self.qlabel_ddc_rbw.setText('RBW: %.1f MHz; Points:' % (round(window_NEB*1e5)/1e5/1e6))
-			elif window_NEB > 1e3:
-				self.qlabel_ddc_rbw.setText('RBW: %.1f kHz; Points:' % (round(window_NEB*1e2)/1e2/1e3))
-			else:
-				self.qlabel_ddc_rbw.setText('RBW: %.0f Hz; Points:' % (round(window_NEB)))
+		# Refresh the display:
+		
+		self.qplt_DDC0_spc.replot()
 		
-			
-			
-		except:
 
-			del self.sl
-			print('Unhandled exception')
-			raise
-#        pause(1/10.)
+		if window_NEB > 1e6:
+			self.qlabel_ddc_rbw.setText('RBW: %.1f MHz; Points:' % (round(window_NEB*1e5)/1e5/1e6))
+		elif window_NEB > 1e3:
+			self.qlabel_ddc_rbw.setText('RBW: %.1f kHz; Points:' % (round(window_NEB*1e2)/1e2/1e3))
+		else:
+			self.qlabel_ddc_rbw.setText('RBW: %.0f Hz; Points:' % (round(window_NEB)))
 
-		self.bDisplayTiming = False
 
+	# Moves the logger acquisitions of timerEvent() to the background acquisition engine: the frames are then displayed by acquisitionFrameReady()
+	def setAcquisitionEngine(self, acquisition_engine):
+		if self.acquisition_engine is not None:
+			self.acquisition_engine.frameReady.disconnect(self.acquisitionFrameReady)
+		self.acquisition_engine = acquisition_engine
+		if acquisition_engine is not None:
+			acquisition_engine.frameReady.connect(self.acquisitionFrameReady)
+
+	# Background version of grabAndDisplayADC(), displayDAC() and displayDDC()
+	def queueAcquisitions(self, bDisplayDDC):
+		(input_select, plot_type, N_samples) = self.spectrum.getGUIsettingsForADCdata()
+		self.acquisition_engine.queue_logger_acquisition(self, 'ADC', input_select, N_samples)
+		# the DAC values are read from registers, like in displayDAC(), so this job doesn't wait for the logger:
+		if any(self.output_controls):
+			self.acquisition_engine.queue_DAC_values_read(self, 'DAC')
+		if bDisplayDDC:
+			self.acquisition_engine.queue_logger_acquisition(self, 'DDC', 'DDC%d' % self.selected_ADC, self.getDDCNumberOfPoints(), bReadAsDDC=True)
+
+	# Runs on the GUI thread, for every frame produced by the acquisition engine
+	def acquisitionFrameReady(self, job, frame):
+		if job.owner is not self:
+			return
+		if job.name == 'DAC':
+			for k in range(3):
+				if self.output_controls[k]:
+					self.displayDACcurrentValue(k, frame[k])
+			return
+		input_select = job.parameters['input_select']
+		if job.name == 'DDC':
+			self.displayDDCdata(frame)
+			return
+
+		(samples_out, ref_exp0) = self.validateADCdata(input_select, *frame)
+		if (samples_out is None) or (ref_exp0 is None):
+			return
+		# the plot type might have been changed while the job was running:
+		plot_type = self.spectrum.getGUIsettingsForADCdata()[1]
+		self.displayADCdata(input_select, plot_type, samples_out, ref_exp0)
 
 	def grabAndDisplayADC(self):
 		(input_select, plot_type, N_samples) = self.spectrum.getGUIsettingsForADCdata()
@@ -1723,6 +1750,9 @@ class XEM_GUI_MainWindow(QtGui.QWidget):
 		(samples_out, ref_exp0) = self.getADCdata(input_select, N_samples)
 		if (samples_out is None) or (ref_exp0 is None):
 			return
+		self.displayADCdata(input_select, plot_type, samples_out, ref_exp0)
+
+	def displayADCdata(self, input_select, plot_type, samples_out, ref_exp0):
 		self.raw_adc_samples = samples_out.astype(dtype=np.float)
 
 		self.spectrum.plotADCdata(input_select, plot_type, samples_out, ref_exp0)
@@ -1738,30 +1768,20 @@ class XEM_GUI_MainWindow(QtGui.QWidget):
 			empty_return_value = (None, None)
 		start_time = time.perf_counter()
 		
-		# Check if another function is currently using the DDR2 logger:
-		if self.sl.bDDR2InUse:
+		# Block access to the DDR2 Logger to any other function until we are done, unless another function is currently using it:
+		if not self.sl.ddr2_arbiter.acquire(self.strTitle):
 			print('grabAndDisplayADC(): DDR2 logger in use, cannot get data from adc')
 			return empty_return_value
-		# Block access to the DDR2 Logger to any other function until we are done:
-		self.sl.bDDR2InUse = True
 
 		time_start = time.perf_counter()
 		try:
 			# Read from selected source
-			self.sl.setup_write(self.sl.LOGGER_MUX[input_select], N_samples)
-			self.sl.trigger_write()
-			self.sl.wait_for_write()
-			if bReadAsDDC == False:
-				# read from ADC:
-				(samples_out, ref_exp0) = self.sl.read_adc_samples_from_DDR2()
-			else:
+			if bReadAsDDC == True:
 				# read from DDC:
-				samples_out = self.sl.read_ddc_samples_from_DDR2()
-				return samples_out
+				return self.sl.acquire_logger_samples(input_select, N_samples, bReadAsDDC=True)
 
-			max_abs = np.max(np.abs(samples_out))
-
-			samples_out = samples_out.astype(dtype=np.float)
+			# read from ADC:
+			(samples_out, ref_exp0) = self.sl.acquire_logger_samples(input_select, N_samples)
 			self.raw_adc_samples = samples_out
 				
 
@@ -1776,16 +1796,19 @@ class XEM_GUI_MainWindow(QtGui.QWidget):
 
 		finally:
 			# Tear-down, whether or not an exception occured: Signal to other functions that they can use the DDR2 logger
-			self.sl.bDDR2InUse = False
+			self.sl.ddr2_arbiter.release(self.strTitle)
 		
 		if self.bDisplayTiming == True:
 			print('Elapsed time (Comm) = %f' % (time.perf_counter()-start_time))
 
+		return self.validateADCdata(input_select, samples_out, ref_exp0)
+
+	def validateADCdata(self, input_select, samples_out, ref_exp0):
 		# A little bit of data validation:
 		if input_select in ['ADC0', 'ADC1']:
 			if np.real(ref_exp0) == 0 and np.imag(ref_exp0) == 0:
 				print('getADCdata(): Invalid complex exponential. Probably because of a version mismatch between the RP firmware and Python GUI.')
-				return empty_return_value
+				return (None, None)
 		else:
 			ref_exp0 = 1.0
 		return (samples_out, ref_exp0)
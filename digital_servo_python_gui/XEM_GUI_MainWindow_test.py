@@ -492,7 +492,7 @@ def test_timerDitherEvent():
 # timerDitherEvent:
 # need to check: self.VCO_detected_gain_in_Hz_per_Volts[k]
 # need to mock: 
-# samples[k] = self.dev.read_Zynq_register_int64(BASE_ADDR_REAL_LSB*4, BASE_ADDR_REAL_MSB*4)
+# samples[:] = self.dev.read_Zynq_register_int64_samples(BASE_ADDR_REAL_LSB*4, N_samples)
 
     class SuperLaserLand_JD_RP_mock(SuperLaserLand_JD_RP):
         def __init__(self):
@@ -514,6 +514,8 @@ def test_timerDitherEvent():
             else:
                 print(address_uint32_lsb)
                 raise Exception
+        def read_Zynq_register_int64_samples(self, address_uint32_lsb, number_of_samples):
+            return np.concatenate([self.read_Zynq_register_int64(address_uint32_lsb, address_uint32_lsb+4) for k in range(number_of_samples)])
 
     xem_gui_mainwindow = XEM_GUI_MainWindow(sl, 'Testing window', 0, (True, False, False), sp, '', '')
     sl.dev = mock_dev()
@@ -561,6 +563,8 @@ def test_timerDitherEvent_with_exception():
     class mock_dev():
         def read_Zynq_register_int64(self, address_uint32_lsb, address_uint32_msb):
             raise RP_PLL.CommsError()
+        def read_Zynq_register_int64_samples(self, address_uint32_lsb, number_of_samples):
+            raise RP_PLL.CommsError()
 
     xem_gui_mainwindow = XEM_GUI_MainWindow(sl, 'Testing window', 0, (True, False, False), sp, '', '')
     sl.dev = mock_dev()
@@ -16,6 +16,7 @@ import pdb
 from SLLSystemParameters import SLLSystemParameters
 from SuperLaserLand_mock import SuperLaserLand_mock
 from XEM_GUI_MainWindow import XEM_GUI_MainWindow
+from AcquisitionEngine import AcquisitionEngine, LoggerBusyError
 
 from TestHelpers import *
 
@@ -505,6 +506,14 @@ def test_chkLockClickedEvent():
     inner_test_chkLockClickedEvent(sl, sp, selected_ADC=1, checked=False, bCheckValues=True)
     inner_test_chkLockClickedEvent(sl, sp, selected_ADC=1, checked=True, bCheckValues=True)
 
+    # the lock is still turned off (without the ramp) while somebody else keeps the logger:
+    assert(sl.ddr2_arbiter.acquire('test'))
+    try:
+        inner_test_chkLockClickedEvent(sl, sp, selected_ADC=0, checked=False, bCheckValues=True)
+        assert(sl.ddr2_arbiter.owner == 'test')
+    finally:
+        sl.ddr2_arbiter.release('test')
+
 
     # # TODO: need a test case with exceptions being thrown. There are a few places that can throw:
     # # these four fit in our previous pattern
@@ -575,6 +584,63 @@ def test_timerEvent():
 
     # assert(0)
 
+def wait_for_acquisition_engine(app, engine, number_of_jobs, timeout=10.):
+    # the frames are delivered through queued signals, so we have to process the events while we wait
+    time_start = time.perf_counter()
+    while engine.number_of_jobs_run + engine.number_of_jobs_failed < number_of_jobs and time.perf_counter()-time_start < timeout:
+        app.processEvents()
+        time.sleep(1e-3)
+    app.processEvents()
+
+def test_timerEvent_with_acquisition_engine():
+    (app, sp, sl) = initGuiObjects()
+    gui_mainwindow = XEM_GUI_MainWindow(sl, 'Testing window', 0, (True, False, False), sp, '', '')
+
+    # shorthand:
+    g = gui_mainwindow
+
+    engine = AcquisitionEngine(sl)
+    g.setAcquisitionEngine(engine)
+
+    g.qedit_ddc_length.setText('1000')
+    g.qcombo_ddc_plot.setCurrentIndex(g.qcombo_ddc_plot.findText('Phase'))
+    g.qplt_DDC0_spc = PlotWidgetIntercept(g.qplt_DDC0_spc)
+    g.sl.random_seed = g.selected_ADC
+
+    # identical jobs are coalesced while they wait in the queue:
+    g.queueAcquisitions(bDisplayDDC=True)
+    g.queueAcquisitions(bDisplayDDC=True)
+    assert(engine.number_of_jobs_coalesced == 3)
+
+    engine.start()
+    try:
+        # ADC, DAC0 and DDC:
+        wait_for_acquisition_engine(app, engine, 3)
+        assert(engine.number_of_jobs_run == 3)
+        assert(engine.number_of_jobs_failed == 0)
+
+        # same results as the synchronous version (see inner_test_displayDDC()):
+        assert(g.qlbl_mean_freq_error.text() == "Freq error: 0.10 MHz")
+        assert(g.qplt_DDC0_spc.strTitle == "Phase noise PSD, std dev = 1.45 radrms")
+        assert(sl.bDDR2InUse == False)
+
+        # a job gives up if somebody else keeps the logger for too long, and the contention is counted:
+        engine.LOGGER_TIMEOUT = 0.05
+        failures = []
+        engine.acquisitionFailed.connect(lambda job, e: failures.append(e))
+        assert(sl.ddr2_arbiter.acquire('test'))
+        g.queueAcquisitions(bDisplayDDC=False)
+        wait_for_acquisition_engine(app, engine, 5)
+        sl.ddr2_arbiter.release('test')
+        # the DAC values don't need the logger, only the ADC job fails:
+        assert(len(failures) == 1)
+        assert(isinstance(failures[0], LoggerBusyError))
+        stats = engine.get_stats()
+        assert(stats['logger']['contentions'] == 1)
+        assert(stats['logger']['contentions_per_client'] == {'AcquisitionEngine': 1})
+    finally:
+        engine.stop()
+
 def inner_test_displayDDC(sl, gui_mainwindow, bCheckValues=True):
     # shorthand:
     g = gui_mainwindow
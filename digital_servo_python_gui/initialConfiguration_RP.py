@@ -9,11 +9,12 @@ from __future__ import print_function
 import sys
 from PyQt5 import QtGui, Qt, QtCore, QtWidgets
 #import numpy as np
-import UDPRedPitayaDiscovery
+import DiscoveryEngine
 
 import time
 
 from RP_PLL import RP_PLL_device # needed to update FPGA firmware and CPU (Zynq) software
+import FleetDeployment
 import socket
 import weakref
 
@@ -50,15 +51,14 @@ class initialConfiguration(QtWidgets.QDialog):
 		if controller is not None:
 			self.controller = weakref.proxy(controller)
 
-		# create the UDP discovery object:
-		self.udp_discovery = UDPRedPitayaDiscovery.UDPRedPitayaDiscovery(self.strBroadcastAddress)
-		self.reset_list_and_send_broadcast()
+		# create the UDP discovery object, which broadcasts on all the local networks in addition to strBroadcastAddress.
+		# The devices found in the previous sessions are listed right away from the cache.
+		self.discovery_cache = DiscoveryEngine.DiscoveryCache()
+		self.udp_discovery = DiscoveryEngine.DiscoveryEngine([self.strBroadcastAddress], cache=self.discovery_cache)
 		self.timerID = self.startTimer(int(100))
 		
-#        print 'before check_answers'
-#        (strIP, strMAC) = self.udp_discovery.check_answers()
-#        print 'after check_answers'
 		self.initUI()
+		self.reset_list_and_send_broadcast()
 		
 		
 
@@ -207,20 +207,14 @@ class initialConfiguration(QtWidgets.QDialog):
 		
 	def reset_list_and_send_broadcast(self):
 
-		# clear the list if it exists
-		self.strSerialList
-		try:
-			self.qcombo_serial.clear()
-			pass
-		except AttributeError:
-			pass
+		# clear the list, then fill it with the cached devices, which get updated as they answer
+		self.strSerialList = []
+		self.qcombo_serial.clear()
+		for device in self.discovery_cache.known_devices(self.devices_data):
+			self.strSerialList.append((device['IP'], device['MAC']))
+			self.qcombo_serial.addItem(self.MAC_to_display_string(device['MAC'], device['IP'], bCached=True))
 		
-		# we need to reconnect the UDP discovery socket everytime we change our broadcast address
-		try:
-			self.udp_discovery.broadcast_address = self.qedit_broadcast.text()
-			self.udp_discovery.connectClientSocket()
-		except AttributeError:
-			pass
+		self.udp_discovery.broadcast_addresses = [self.qedit_broadcast.text()]
 		# send a broadcast packet to start building the list:
 		try:
 			self.udp_discovery.send_broadcast()
@@ -229,7 +223,7 @@ class initialConfiguration(QtWidgets.QDialog):
 			print(e)
 
 		
-	def MAC_to_display_string(self, strMAC, strIP):
+	def MAC_to_display_string(self, strMAC, strIP, bCached=False):
 		# build the string that we will display to the user in the combo box:
 		strDisplay = ''
 		#print('MAC_to_display_string: %s, %s' % (strMAC, strIP))
@@ -248,12 +242,14 @@ class initialConfiguration(QtWidgets.QDialog):
 			pass
 		
 		strDisplay = 'Name = %s, IP = %s, MAC = %s, Color = %s' % (box_name, strIP, strMAC, box_color)
+		if bCached:
+			strDisplay += ' (cached, no answer yet)'
 		return strDisplay
 		
 	def timerEvent(self, e):
 		# check if there are any answers to the broadcast packet
 		try:
-			(strIP, strMAC) = self.udp_discovery.check_answers()
+			answers = self.udp_discovery.poll()
 		except AttributeError:
 			return
 		except Exception as e:
@@ -261,23 +257,26 @@ class initialConfiguration(QtWidgets.QDialog):
 			print(e)
 			return
 
-
 		# iterate over answers
-		while (strIP is not None):
+		for (strIP, strMAC) in answers:
 			
 			# build the string that we will display to the user in the combo box:
 			strDisplay = self.MAC_to_display_string(strMAC, strIP)
 			
-			self.strSerialList.append((strIP, strMAC))
-			self.qcombo_serial.addItem(strDisplay)
-#            print self.qcombo_serial.sizeAdjustPolicy()
-#            print self.qcombo_serial.minimumSizeHint()
-			
-			# for the next iteration:
-			# check if there are any answers to the broadcast packet
-			(strIP, strMAC) = self.udp_discovery.check_answers()
-			
-			time.sleep(0.1)
+			# a cached device which answered replaces its cached entry:
+			index = self.findSerialListIndex(strMAC)
+			if index is None:
+				self.strSerialList.append((strIP, strMAC))
+				self.qcombo_serial.addItem(strDisplay)
+			else:
+				self.strSerialList[index] = (strIP, strMAC)
+				self.qcombo_serial.setItemText(index, strDisplay)
+
+	def findSerialListIndex(self, strMAC):
+		for (index, (strIP, strListMAC)) in enumerate(self.strSerialList):
+			if strListMAC == strMAC:
+				return index
+		return None
 
 	def readSelectedFPGA(self):
 		self.strSelectedIP = ''
@@ -290,6 +289,8 @@ class initialConfiguration(QtWidgets.QDialog):
 			# use IP from list
 			try:
 				(strIP, strMAC) = self.strSerialList[self.qcombo_serial.currentIndex()]
+				# the cache has the latest address of this box, in case it answered from a new one since the list was filled
+				strIP = self.discovery_cache.lookup(strMAC) or strIP
 				self.strSelectedSerial = strMAC.replace(':', '') # this is just for legacy compatibility, when we had actual serial numbers
 				self.strSelectedMAC = strMAC
 				self.strSelectedIP = strIP
@@ -355,7 +356,7 @@ class initialConfiguration(QtWidgets.QDialog):
 
 		# close UDP discovery server:
 		self.killTimer(self.timerID)    # is it guaranteed that no timerEvent will be called after this line? because we delete our reference to udp_discovery, which is used in the timer event
-		del self.udp_discovery
+		self.closeDiscovery()
 
 		#print("initialConfiguration.py::okClicked():close")
 		self.close()
@@ -371,13 +372,9 @@ class initialConfiguration(QtWidgets.QDialog):
 
 		self.logger.info('Red_Pitaya_GUI{}: Programming FPGA ({}) with new bitfile'.format(self.logger_name, self.strSelectedPort))
 
-		# connect to the selected RedPitaya, send new bitfile, then send programming command to the shell:
-		self.dev.OpenTCPConnection(self.strSelectedIP, self.strSelectedPort)
-		self.dev.write_file_on_remote(strFilenameLocal=str(self.qedit_firmware.text()), strFilenameRemote='/opt/red_pitaya_top.bit')
-		time.sleep(2) # to handle slow SD cards
-		print("File written to remote host at /opt/red_pitaya_top.bit.")
-
-		self.dev.send_shell_command('cat /opt/red_pitaya_top.bit > /dev/xdevcfg')
+		# connect to the selected RedPitaya, send new bitfile (unless it is already there), then send programming command to the shell:
+		self.dev.OpenTCPConnection(self.strSelectedIP, self.strSelectedPort, number_of_bulk_connections=0)
+		FleetDeployment.program_FPGA(self.dev, str(self.qedit_firmware.text()), self.uploadProgress)
 		print("Program FPGA firmware command sent.")
 		
 		# disconnect:
@@ -395,40 +392,49 @@ class initialConfiguration(QtWidgets.QDialog):
 		self.logger.info('Red_Pitaya_GUI{}: Programming CPU ({}) with new file'.format(self.logger_name, self.strSelectedPort))
 
 		# connect to the selected RedPitaya
-		self.dev.OpenTCPConnection(self.strSelectedIP, self.strSelectedPort)
-		# send new monitor-tcp version
-		self.dev.write_file_on_remote(strFilenameLocal=self.qedit_software.text(), strFilenameRemote='/opt/monitor-tcp-new')
-		print("CPU software update sent. Rebooting server using new version")
-		
-		# set executable permissions
-		self.dev.send_shell_command('chmod +x /opt/monitor-tcp-new')
-		# copy over old file
-		self.dev.send_shell_command('mv /opt/monitor-tcp-new /opt/monitor-tcp')
-		
-		# send "reboot monitor-tcp" command
-		self.dev.send_reboot_command()
+		self.dev.OpenTCPConnection(self.strSelectedIP, self.strSelectedPort, number_of_bulk_connections=0)
+		# send new monitor-tcp version, and reboot the server with it
+		bSent = FleetDeployment.update_CPU_software(self.dev, self.qedit_software.text(), self.uploadProgress)
 		self.dev.sock.shutdown(socket.SHUT_RDWR)
 		self.dev.sock.close()
+		if bSent is False:
+			print("CPU software is already up to date.")
+			return
+		print("CPU software update sent. Rebooting server using new version")
 		
 		time.sleep(1) # give some time for tcp server to come back up
 		print("CPU software update complete.")
 		pass
 
+	def uploadProgress(self, bytes_sent, file_size):
+		if file_size == 0:
+			print("Sending file: empty file")
+			return
+		# print every 10%
+		if bytes_sent == file_size or (10*bytes_sent)//file_size != (10*(bytes_sent-self.dev.FILE_CHUNK_SIZE))//file_size:
+			print("Sending file: %d%% (%d/%d bytes)" % (100*bytes_sent//file_size, bytes_sent, file_size))
+
 	def cancelClicked(self):
 		self.bOk = False
 		# close UDP discovery server:
 		self.killTimer(self.timerID)    # is it guaranteed that no timerEvent will be called after this line? because we delete our reference to udp_discovery, which is used in the timer event
-		del self.udp_discovery
+		self.closeDiscovery()
 
 		self.close()
 		
 	def closeEvent(self, e):
+		self.closeDiscovery()
+		return
+
+	# closes the discovery sockets and saves the devices which answered in the cache
+	def closeDiscovery(self):
 		try:
+			self.udp_discovery.close()
 			del self.udp_discovery
 		except AttributeError:
 			# Means that we deleted the object already
-			pass
-		return
+			return
+		self.discovery_cache.save()
 
 def main():
 